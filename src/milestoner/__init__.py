@@ -2,6 +2,40 @@
 Milestoner package for handling bitemporal data tracking in Snowflake.
 """
 
+from .audit import QueryAuditLog
+from .backfill import BackfillRunner
+from .batch_sizing import AdaptiveBatchSizer
 from .bitemporal_milestoner import BitemporalMilestoner
+from .checksum import RowChecksum
+from .coalescing import VersionCoalescer
+from .compaction import StagingCompactor
+from .emulator import SnowflakeEmulator
+from .executor import QueryExecutor, QueryResult, SnowflakeExecutor, SQLiteExecutor
+from .in_memory import InMemoryMilestoner
+from .loader import StagingLoader
+from .metrics import BatchMetrics, MetricsRegistry
+from .point_in_time import PointInTimeReader
+from .seen_filter import SeenChecksumFilter
+from .temporal_join import TemporalJoin
 
-__all__ = ['BitemporalMilestoner'] 
\ No newline at end of file
+__all__ = [
+    'AdaptiveBatchSizer',
+    'BackfillRunner',
+    'BatchMetrics',
+    'BitemporalMilestoner',
+    'InMemoryMilestoner',
+    'MetricsRegistry',
+    'PointInTimeReader',
+    'QueryAuditLog',
+    'QueryExecutor',
+    'QueryResult',
+    'RowChecksum',
+    'SeenChecksumFilter',
+    'SnowflakeEmulator',
+    'SnowflakeExecutor',
+    'StagingCompactor',
+    'SQLiteExecutor',
+    'StagingLoader',
+    'TemporalJoin',
+    'VersionCoalescer'
+]
@@ -0,0 +1,239 @@
+import atexit
+import hashlib
+import logging
+import queue
+import random
+import re
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .templates import QueryTemplate
+
+logger = logging.getLogger(__name__)
+
+# Patterns replaced by a placeholder when a statement is reduced to its template
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_HEX_SUFFIX = re.compile(r"_[0-9a-fA-F]{32}\b")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+# Placeholder of literal values in query templates
+PLACEHOLDER = '?'
+
+
+def get_template(sql: str) -> str:
+    """
+    Reduce a statement that was not rendered from a QueryTemplate to its template.
+
+    String and numeric literals and generated temporary table suffixes are
+    replaced by placeholders and whitespace is collapsed, so every batch run
+    of the same generated query yields the same template.
+
+    Args:
+        sql: Statement text
+
+    Returns:
+        Normalized template text
+    """
+    template = _STRING_LITERAL.sub(PLACEHOLDER, sql)
+    template = _HEX_SUFFIX.sub(f"_{PLACEHOLDER}", template)
+    template = _NUMBER.sub(PLACEHOLDER, template)
+    return _WHITESPACE.sub(' ', template).strip()
+
+
+def fingerprint(sql: str) -> str:
+    """
+    Compute a stable fingerprint of the template of a statement.
+
+    Args:
+        sql: Statement text
+
+    Returns:
+        16 hex character fingerprint
+    """
+    return _hash_template(get_template(sql))
+
+
+def _hash_template(template: str) -> str:
+    return hashlib.sha1(template.encode('utf-8')).hexdigest()[:16]
+
+
+class QueryAuditLog:
+    """
+    Compact audit trail of the statements run for each batch.
+
+    Every executed statement is recorded as one short line with its template
+    fingerprint, the batch ID, timing, affected rows and warehouse query IDs.
+    The normalized template is written once per fingerprint; full statement
+    text is written only for a sampled fraction of statements and for
+    statements that failed. Statements rendered from a QueryTemplate are keyed
+    by that template's fingerprint; others are normalized with get_template.
+    Records are only queued when the audit logger is enabled for their level
+    and are formatted and written from a background thread, so the batch
+    loop never waits on normalization or log I/O.
+    """
+
+    def __init__(
+        self,
+        handlers: Optional[Sequence[logging.Handler]] = None,
+        sample_rate: float = 0.0,
+        audit_logger: Optional[logging.Logger] = None,
+        seed: Optional[int] = None
+    ):
+        """
+        Initialize the QueryAuditLog.
+
+        Args:
+            handlers: Handlers added to the audit logger while the writer
+                runs. Without handlers, records are handled by the
+                application's logging configuration.
+            sample_rate: Fraction of statements (0-1) whose full text is recorded
+            audit_logger: Logger audit records are emitted on
+            seed: Seed of the sampling random generator
+        """
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be in [0, 1]")
+        self.handlers = list(handlers or [])
+        self.sample_rate = sample_rate
+        self.logger = audit_logger or logger
+        self._random = random.Random(seed)
+        self._templates: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._records: queue.Queue = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+
+    def start(self) -> 'QueryAuditLog':
+        """
+        Start the background writer; record() starts it on first use.
+
+        Returns:
+            The audit log itself
+        """
+        with self._lock:
+            if self._writer is not None:
+                return self
+            for handler in self.handlers:
+                self.logger.addHandler(handler)
+            self._writer = threading.Thread(target=self._write_records, name='milestoner-audit', daemon=True)
+            self._writer.start()
+        atexit.register(self.stop)
+        return self
+
+    def flush(self) -> None:
+        """
+        Wait until every queued record has been written.
+        """
+        self._records.join()
+
+    def stop(self) -> None:
+        """
+        Write pending records and stop the background writer.
+        """
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is None:
+            return
+        self._records.put(None)
+        writer.join()
+        for handler in self.handlers:
+            self.logger.removeHandler(handler)
+        atexit.unregister(self.stop)
+
+    def __enter__(self) -> 'QueryAuditLog':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def record(
+        self,
+        stage: str,
+        sql: str,
+        batch_id: str,
+        seconds: Optional[float] = None,
+        rows: Optional[int] = None,
+        query_ids: Optional[List[str]] = None,
+        error: Optional[BaseException] = None,
+        template: Optional[QueryTemplate] = None
+    ) -> None:
+        """
+        Record one executed statement.
+
+        Args:
+            stage: Batch stage the statement belongs to
+            sql: Statement text
+            batch_id: ID of the batch
+            seconds: Wall-clock seconds the statement took
+            rows: Rows affected
+            query_ids: Warehouse query IDs
+            error: Exception raised by the statement, if it failed
+            template: Template the statement was rendered from
+        """
+        level = logging.ERROR if error is not None else logging.INFO
+        if not self.logger.isEnabledFor(level):
+            return
+        if self._writer is None:
+            self.start()
+        self._records.put((stage, sql, batch_id, seconds, rows, query_ids, error, template))
+
+    def _write_records(self) -> None:
+        """
+        Write queued records until stopped.
+        """
+        while True:
+            item = self._records.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            finally:
+                self._records.task_done()
+
+    def _write(
+        self,
+        stage: str,
+        sql: str,
+        batch_id: str,
+        seconds: Optional[float],
+        rows: Optional[int],
+        query_ids: Optional[List[str]],
+        error: Optional[BaseException],
+        template: Optional[QueryTemplate]
+    ) -> None:
+        """
+        Emit the log lines of one queued record; the arguments are those of record.
+        """
+        query_fingerprint, text = self._get_template_key(sql, template)
+        if query_fingerprint not in self._templates:
+            self._templates[query_fingerprint] = text
+            self.logger.info('template %s stage=%s: %s', query_fingerprint, stage, text)
+
+        if error is not None:
+            self.logger.error(
+                'query %s stage=%s batch=%s failed: %s\n%s',
+                query_fingerprint, stage, batch_id, error, sql
+            )
+            return
+
+        self.logger.info(
+            'query %s stage=%s batch=%s seconds=%.3f rows=%s query_ids=%s',
+            query_fingerprint, stage, batch_id, seconds or 0.0, rows, ','.join(query_ids or [])
+        )
+        if self.sample_rate and self._random.random() < self.sample_rate:
+            self.logger.info('query %s batch=%s text:\n%s', query_fingerprint, batch_id, sql)
+
+    def _get_template_key(self, sql: str, template: Optional[QueryTemplate]) -> Tuple[str, str]:
+        """
+        Get the fingerprint and template text a statement is recorded under.
+
+        Args:
+            sql: Statement text
+            template: Template the statement was rendered from
+
+        Returns:
+            Tuple of (fingerprint, template text)
+        """
+        if template is not None:
+            return template.fingerprint, template.text
+        text = get_template(sql)
+        return _hash_template(text), text
@@ -0,0 +1,584 @@
+import json
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .bitemporal_milestoner import (
+    BATCH_ID_COL,
+    BitemporalMilestoner,
+    LOCKED_COL,
+    MILESTONING_FLAG_COL,
+    NEXT_VALID_FROM_COL,
+    PROCESSED_DATETIME_COL,
+    ROW_ADDED_DATETIME_COL,
+    ROW_CHECKSUM_COL,
+    STAGING_GUID_COL,
+    STAGING_SCHEMA,
+    SYSTEM_FROM_COL,
+    SYSTEM_TO_COL,
+    VALID_FROM_COL,
+    VALID_TO_COL
+)
+from .executor import QueryExecutor, name_result, named_results, split_statements
+
+logger = logging.getLogger(__name__)
+
+# Columns of the stitch table
+IS_REDUNDANT_COL = 'IS_REDUNDANT'
+ISLAND_COL = 'ISLAND'
+STITCHED_VALID_TO_COL = 'STITCHED_VALID_TO'
+
+# Temporal window as (inclusive lower bound, exclusive upper bound); None is unbounded
+Window = Tuple[Optional[str], Optional[str]]
+
+
+def _quote(value: str) -> str:
+    """
+    Quote a value as a SQL string literal.
+
+    Args:
+        value: Value to quote
+
+    Returns:
+        Single-quoted literal with embedded quotes doubled
+    """
+    return "'" + value.replace("'", "''") + "'"
+
+
+class BackfillRunner:
+    """
+    Loads the history waiting in staging into an empty conformed table in parallel.
+
+    The unprocessed staging records are split into windows of the temporal
+    column. Every window is milestoned independently, in its own transaction,
+    as a plain INSERT of its version chain: no MERGE and no lookup of the
+    conformed table. Windows run in parallel on the executor's pool.
+
+    Each window ends with an open version per key, so one final stitch pass
+    over the first and last version of every window closes those versions
+    at the start of the key's next window. A window whose first version
+    repeats the previous window's last version is folded into it. The result
+    is the history a single process_batch over all records would have built,
+    with SYSTEM_FROM set to the backfill's start time.
+
+    Progress is written to a JSON checkpoint after every window, so an
+    interrupted backfill resumes with the windows it had not finished. The
+    backfill only accepts keys that have no versions in the conformed table
+    yet, and must not run alongside process_batch on the same staging table.
+    """
+
+    def __init__(
+        self,
+        milestoner: BitemporalMilestoner,
+        staging_table: str,
+        conformed_table: str,
+        executor: Optional[QueryExecutor] = None,
+        workers: int = 4,
+        checkpoint_path: Optional[str] = None
+    ):
+        """
+        Initialize the BackfillRunner.
+
+        Args:
+            milestoner: Milestoner whose configuration describes the tables
+            staging_table: Name of the staging table
+            conformed_table: Name of the conformed table
+            executor: Executor used to run the backfill, defaults to the milestoner's
+            workers: Number of windows milestoned in parallel. The executor's
+                pool should hold at least one connection per worker.
+            checkpoint_path: JSON file recording the plan and finished windows
+        """
+        executor = executor or milestoner.executor
+        if executor is None:
+            raise ValueError("BackfillRunner requires an executor")
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+
+        self.milestoner = milestoner
+        self.staging_table = staging_table
+        self.conformed_table = conformed_table
+        self.executor = executor
+        self.workers = workers
+        self.checkpoint_path = checkpoint_path
+        self._checkpoint_lock = threading.Lock()
+
+    def plan_windows(self, window_count: int) -> List[str]:
+        """
+        Choose window boundaries that split the pending records evenly.
+
+        Args:
+            window_count: Number of windows to aim for
+
+        Returns:
+            Sorted, distinct lower bounds of every window but the first.
+            Heavily repeated temporal values can yield fewer windows.
+        """
+        if window_count < 1:
+            raise ValueError("window_count must be at least 1")
+        temporal = self.milestoner.get_data_field(self.milestoner.temporal_column)
+        result = self.executor.execute(f"""
+        SELECT MIN(TEMPORAL_VALUE)
+        FROM (
+            SELECT
+                {temporal} AS TEMPORAL_VALUE,
+                NTILE({window_count}) OVER (ORDER BY {temporal}) AS WINDOW_INDEX
+            FROM {STAGING_SCHEMA}.{self.staging_table}
+            WHERE {PROCESSED_DATETIME_COL} IS NULL
+            AND {LOCKED_COL} IS NULL
+            AND {temporal} IS NOT NULL
+        )
+        GROUP BY WINDOW_INDEX
+        ORDER BY 1""")
+        starts = [str(row[0]) for row in result.rows]
+        return sorted(set(starts[1:]))
+
+    def run(
+        self,
+        boundaries: Optional[Sequence[str]] = None,
+        window_count: Optional[int] = None,
+        current_time: Optional[datetime] = None
+    ) -> Dict[str, Any]:
+        """
+        Run the backfill, or resume it from the checkpoint.
+
+        When the checkpoint holds a backfill of the same tables, its windows,
+        ID and system time are reused and the arguments are ignored.
+
+        Args:
+            boundaries: Sorted lower bounds of every window but the first
+            window_count: Number of windows to plan when no boundaries are
+                given, defaults to four per worker
+            current_time: System time of the backfilled versions, defaults to now
+
+        Returns:
+            Dictionary containing:
+                - backfill_id: ID of the backfill; window batch IDs start with it
+                - windows: Number of windows
+                - windows_run: Number of windows milestoned by this call
+                - records_locked: Staging records milestoned by this call
+                - records_inserted: Versions inserted by this call
+                - records_removed: Versions folded into the previous window's
+                - records_stitched: Versions closed at a window boundary
+        """
+        checkpoint = self._load_checkpoint()
+        if checkpoint is None:
+            self._check_conformed_keys()
+            if boundaries is None:
+                boundaries = self.plan_windows(window_count or self.workers * 4)
+            checkpoint = {
+                'backfill_id': str(uuid.uuid4()),
+                'staging_table': self.staging_table,
+                'conformed_table': self.conformed_table,
+                'current_time': str(current_time or datetime.now()),
+                'boundaries': list(boundaries),
+                'completed': [],
+                'stitched': False
+            }
+            self._save_checkpoint(checkpoint)
+        else:
+            logger.info(
+                'Resuming backfill %s with %d of %d windows done',
+                checkpoint['backfill_id'],
+                len(checkpoint['completed']),
+                len(checkpoint['boundaries']) + 1
+            )
+
+        windows = self.get_windows(checkpoint['boundaries'])
+        result = {
+            'backfill_id': checkpoint['backfill_id'],
+            'windows': len(windows),
+            'windows_run': 0,
+            'records_locked': 0,
+            'records_inserted': 0,
+            'records_removed': 0,
+            'records_stitched': 0
+        }
+        pending = [index for index in range(len(windows)) if index not in checkpoint['completed']]
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='backfill') as pool:
+            futures = {
+                pool.submit(self._run_window, checkpoint, index, windows[index]): index
+                for index in pending
+            }
+            for future in as_completed(futures):
+                locked, inserted = future.result()
+                result['windows_run'] += 1
+                result['records_locked'] += locked
+                result['records_inserted'] += inserted
+                with self._checkpoint_lock:
+                    checkpoint['completed'].append(futures[future])
+                    self._save_checkpoint(checkpoint)
+
+        if not checkpoint['stitched']:
+            result['records_removed'], result['records_stitched'] = self._stitch(checkpoint)
+            checkpoint['stitched'] = True
+            self._save_checkpoint(checkpoint)
+
+        logger.info(
+            'Backfill %s of %s: %d windows run, %d versions inserted, %d stitched, %d removed',
+            checkpoint['backfill_id'],
+            self.conformed_table,
+            result['windows_run'],
+            result['records_inserted'],
+            result['records_stitched'],
+            result['records_removed']
+        )
+        return result
+
+    def _check_conformed_keys(self) -> None:
+        """
+        Refuse to start a backfill of keys that already have versions in the conformed table.
+
+        Raises:
+            ValueError: If a pending staging record's key is in the conformed table
+        """
+        match = ' AND '.join(
+            f"t.{key} = {self.milestoner.get_data_field(key)}" for key in self.milestoner.business_keys
+        )
+        result = self.executor.execute(f"""
+        SELECT COUNT(*)
+        FROM {self.conformed_table} t
+        WHERE EXISTS (
+            SELECT 1
+            FROM {STAGING_SCHEMA}.{self.staging_table}
+            WHERE {PROCESSED_DATETIME_COL} IS NULL
+            AND {LOCKED_COL} IS NULL
+            AND {match}
+        )""")
+        versions = int(result.rows[0][0])
+        if versions:
+            raise ValueError(
+                f"{self.conformed_table} already has {versions} versions of the backfilled keys; "
+                "milestone them with process_batch instead"
+            )
+
+    @staticmethod
+    def get_windows(boundaries: Sequence[str]) -> List[Window]:
+        """
+        Turn window boundaries into consecutive windows covering every temporal value.
+
+        Args:
+            boundaries: Sorted lower bounds of every window but the first
+
+        Returns:
+            List of (lower bound, upper bound) windows
+        """
+        edges: List[Optional[str]] = [None, *boundaries, None]
+        return list(zip(edges[:-1], edges[1:]))
+
+    def _get_window_batch_id(self, backfill_id: str, index: int) -> str:
+        """
+        Get the batch ID a window's versions are written with.
+
+        Args:
+            backfill_id: ID of the backfill
+            index: Position of the window
+
+        Returns:
+            Batch ID of the window
+        """
+        return f"{backfill_id}-w{index:05d}"
+
+    def _get_window_predicate(self, window: Window) -> str:
+        """
+        Generate the predicate selecting the staging records of a window.
+
+        Args:
+            window: (lower bound, upper bound) of the window
+
+        Returns:
+            SQL predicate on the temporal field of the variant column
+        """
+        temporal = self.milestoner.get_data_field(self.milestoner.temporal_column)
+        predicates = [f"{temporal} IS NOT NULL"]
+        if window[0] is not None:
+            predicates.append(f"{temporal} >= {_quote(window[0])}")
+        if window[1] is not None:
+            predicates.append(f"{temporal} < {_quote(window[1])}")
+        return ' AND '.join(predicates)
+
+    def _get_window_lock_query(self, batch_id: str, window: Window) -> str:
+        """
+        Generate SQL query locking the pending records of a window.
+
+        Args:
+            batch_id: Batch ID of the window
+            window: (lower bound, upper bound) of the window
+
+        Returns:
+            SQL query to lock records
+        """
+        return f"""
+        UPDATE {STAGING_SCHEMA}.{self.staging_table}
+        SET {LOCKED_COL} = '{batch_id}',
+            {MILESTONING_FLAG_COL} = NULL
+        WHERE {PROCESSED_DATETIME_COL} IS NULL
+        AND {LOCKED_COL} IS NULL
+        AND {self._get_window_predicate(window)}"""
+
+    def _get_window_insert_query(self, batch_id: str, current_time: str) -> str:
+        """
+        Generate SQL query inserting the version chain of a window.
+
+        Records repeating a checksum are dropped like duplicates in a batch,
+        the rest are ordered per key by the temporal column and a record is
+        kept only if it differs from the one before it. Every version but the
+        last of each key is inserted closed at the start of the next.
+
+        Args:
+            batch_id: Batch ID of the window
+            current_time: System time of the backfilled versions
+
+        Returns:
+            SQL INSERT statement
+        """
+        milestoner = self.milestoner
+        keys = ', '.join(milestoner.business_keys)
+        order = f"{milestoner.temporal_column}, {ROW_ADDED_DATETIME_COL}"
+        return f"""
+        INSERT INTO {self.conformed_table} (
+            {', '.join(milestoner.data_columns + [
+                VALID_FROM_COL,
+                VALID_TO_COL,
+                SYSTEM_FROM_COL,
+                SYSTEM_TO_COL,
+                ROW_CHECKSUM_COL,
+                STAGING_GUID_COL,
+                BATCH_ID_COL
+            ])}
+        )
+        SELECT
+            {', '.join(milestoner.data_columns)},
+            {milestoner.temporal_column},
+            {NEXT_VALID_FROM_COL},
+            '{current_time}',
+            IFF({NEXT_VALID_FROM_COL} IS NULL, NULL, '{current_time}'),
+            {ROW_CHECKSUM_COL},
+            {STAGING_GUID_COL},
+            '{batch_id}'
+        FROM (
+            SELECT
+                changes.*,
+                LEAD({milestoner.temporal_column}) OVER (
+                    PARTITION BY {keys}
+                    ORDER BY {order}
+                ) AS {NEXT_VALID_FROM_COL}
+            FROM (
+                SELECT unique_records.*
+                FROM (
+                    {milestoner.get_unique_staging_query(self.staging_table, batch_id)}
+                    QUALIFY ROW_NUMBER() OVER (
+                        PARTITION BY {ROW_CHECKSUM_COL}
+                        ORDER BY {ROW_ADDED_DATETIME_COL} ASC
+                    ) = 1
+                ) unique_records
+                QUALIFY {ROW_CHECKSUM_COL} IS DISTINCT FROM LAG({ROW_CHECKSUM_COL}) OVER (
+                    PARTITION BY {keys}
+                    ORDER BY {order}
+                )
+            ) changes
+        )"""
+
+    def _get_window_statements(self, batch_id: str, window: Window, current_time: str) -> List[str]:
+        """
+        Generate the statements milestoning one window in a single transaction.
+
+        Args:
+            batch_id: Batch ID of the window
+            window: (lower bound, upper bound) of the window
+            current_time: System time of the backfilled versions
+
+        Returns:
+            List of SQL statements; the lock and insert are named records_locked and records_inserted
+        """
+        mark_processed = self.milestoner.get_mark_processed_query(self.staging_table, batch_id, current_time)
+        return [
+            'BEGIN',
+            name_result('records_locked', self._get_window_lock_query(batch_id, window)),
+            name_result('records_inserted', self._get_window_insert_query(batch_id, current_time)),
+            *split_statements(mark_processed),
+            'COMMIT'
+        ]
+
+    def _run_window(self, checkpoint: Dict[str, Any], index: int, window: Window) -> Tuple[int, int]:
+        """
+        Milestone one window.
+
+        Args:
+            checkpoint: Checkpoint of the backfill
+            index: Position of the window
+            window: (lower bound, upper bound) of the window
+
+        Returns:
+            Tuple of (records locked, versions inserted)
+        """
+        batch_id = self._get_window_batch_id(checkpoint['backfill_id'], index)
+        statements = self._get_window_statements(batch_id, window, checkpoint['current_time'])
+        results = named_results(
+            statements,
+            self.executor.execute_statements([(statement, None) for statement in statements])
+        )
+        locked = results['records_locked'].rowcount
+        inserted = results['records_inserted'].rowcount
+        logger.debug('Backfill window %s %s: %d records, %d versions', batch_id, window, locked, inserted)
+        return locked, inserted
+
+    def _get_stitch_setup_query(self, backfill_id: str, stitch_table: str) -> str:
+        """
+        Generate SQL query that finds the versions to fix at window boundaries.
+
+        Only the first and the last version of every window and key are read.
+        A first version is redundant when the version before it is the open
+        last version of an earlier window with the same checksum. Each
+        remaining version starts an island that absorbs the redundant
+        versions after it, and is closed where its island ends: at the
+        VALID_TO of the island's last version or, if that one is open, at
+        the start of the next island.
+
+        Args:
+            backfill_id: ID of the backfill
+            stitch_table: Name of the temporary table to create
+
+        Returns:
+            SQL query creating the stitch table
+        """
+        keys = ', '.join(self.milestoner.business_keys)
+        order = f"{VALID_FROM_COL}, {VALID_TO_COL}"
+        return f"""
+        CREATE TEMPORARY TABLE {stitch_table} AS
+        WITH edges AS (
+            SELECT {keys}, {VALID_FROM_COL}, {VALID_TO_COL}, {ROW_CHECKSUM_COL}, {STAGING_GUID_COL}
+            FROM {self.conformed_table}
+            WHERE {BATCH_ID_COL} LIKE '{backfill_id}-w%'
+            QUALIFY {VALID_TO_COL} IS NULL
+            OR ROW_NUMBER() OVER (
+                PARTITION BY {keys}, {BATCH_ID_COL}
+                ORDER BY {order}
+            ) = 1
+        ),
+        flagged AS (
+            SELECT
+                edges.*,
+                COALESCE(
+                    LAG({VALID_TO_COL} IS NULL) OVER (PARTITION BY {keys} ORDER BY {order})
+                    AND LAG({ROW_CHECKSUM_COL}) OVER (PARTITION BY {keys} ORDER BY {order}) = {ROW_CHECKSUM_COL},
+                    FALSE
+                ) AS {IS_REDUNDANT_COL}
+            FROM edges
+        ),
+        islands AS (
+            SELECT
+                flagged.*,
+                SUM(IFF({IS_REDUNDANT_COL}, 0, 1)) OVER (
+                    PARTITION BY {keys}
+                    ORDER BY {order}
+                    ROWS UNBOUNDED PRECEDING
+                ) AS {ISLAND_COL}
+            FROM flagged
+        )
+        SELECT
+            islands.*,
+            COALESCE(
+                LAST_VALUE({VALID_TO_COL}) OVER (
+                    PARTITION BY {keys}, {ISLAND_COL}
+                    ORDER BY {order}
+                    ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+                ),
+                MIN(IFF({IS_REDUNDANT_COL}, NULL, {VALID_FROM_COL})) OVER (
+                    PARTITION BY {keys}
+                    ORDER BY {order}
+                    ROWS BETWEEN 1 FOLLOWING AND UNBOUNDED FOLLOWING
+                )
+            ) AS {STITCHED_VALID_TO_COL}
+        FROM islands
+        """
+
+    def _get_stitch_statements(self, backfill_id: str, current_time: str) -> List[str]:
+        """
+        Generate the statements of the stitch pass.
+
+        Args:
+            backfill_id: ID of the backfill
+            current_time: System time of the backfilled versions
+
+        Returns:
+            List of SQL statements; the stitch table is created before the transaction,
+            the delete and close are named versions_deleted and versions_closed
+        """
+        stitch_table = f"{STAGING_SCHEMA}.MILESTONE_STITCH_{backfill_id.replace('-', '')}"
+        match = ' AND '.join(f"t.{key} = s.{key}" for key in self.milestoner.business_keys)
+        match += f"""
+            AND t.{STAGING_GUID_COL} = s.{STAGING_GUID_COL}
+            AND t.{VALID_FROM_COL} = s.{VALID_FROM_COL}"""
+        return [
+            self._get_stitch_setup_query(backfill_id, stitch_table),
+            'BEGIN',
+            name_result('versions_deleted', f"""
+        DELETE FROM {self.conformed_table} t
+        USING {stitch_table} s
+        WHERE s.{IS_REDUNDANT_COL}
+        AND {match}"""),
+            name_result('versions_closed', f"""
+        UPDATE {self.conformed_table} t
+        SET {VALID_TO_COL} = s.{STITCHED_VALID_TO_COL},
+            {SYSTEM_TO_COL} = '{current_time}'
+        FROM {stitch_table} s
+        WHERE NOT s.{IS_REDUNDANT_COL}
+        AND s.{VALID_TO_COL} IS NULL
+        AND s.{STITCHED_VALID_TO_COL} IS NOT NULL
+        AND {match}"""),
+            'COMMIT',
+            f"DROP TABLE IF EXISTS {stitch_table}"
+        ]
+
+    def _stitch(self, checkpoint: Dict[str, Any]) -> Tuple[int, int]:
+        """
+        Fix the versions at the window boundaries.
+
+        Args:
+            checkpoint: Checkpoint of the backfill
+
+        Returns:
+            Tuple of (versions removed, versions closed)
+        """
+        statements = self._get_stitch_statements(checkpoint['backfill_id'], checkpoint['current_time'])
+        results = named_results(
+            statements,
+            self.executor.execute_statements([(statement, None) for statement in statements])
+        )
+        return results['versions_deleted'].rowcount, results['versions_closed'].rowcount
+
+    def _load_checkpoint(self) -> Optional[Dict[str, Any]]:
+        """
+        Load the checkpoint of an unfinished backfill of the same tables.
+
+        Returns:
+            The checkpoint, or None to start a new backfill
+        """
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        tables = (checkpoint['staging_table'], checkpoint['conformed_table'])
+        if tables != (self.staging_table, self.conformed_table):
+            raise ValueError(f"Checkpoint {self.checkpoint_path} belongs to a backfill of {tables}")
+        if checkpoint['stitched']:
+            return None
+        return checkpoint
+
+    def _save_checkpoint(self, checkpoint: Dict[str, Any]) -> None:
+        """
+        Atomically replace the checkpoint file.
+
+        Args:
+            checkpoint: Checkpoint of the backfill
+        """
+        if self.checkpoint_path is None:
+            return
+        temporary_path = f"{self.checkpoint_path}.tmp"
+        with open(temporary_path, 'w') as f:
+            json.dump(checkpoint, f, indent=2)
+        os.replace(temporary_path, self.checkpoint_path)
@@ -0,0 +1,99 @@
+import logging
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveBatchSizer:
+    """
+    Picks the size of the next batch from the measured latency of previous ones.
+
+    After every batch the stage timings reported by process_batch update a
+    moving average per stage. The averages of the stages the batch ran are
+    summed and the batch size is scaled by the ratio between the goal and that
+    latency: towards target_latency seconds per batch, or up to
+    target_rows_per_second throughput. Throughput at or above
+    target_rows_per_second keeps the size, so that goal is a floor to reach and
+    not a rate cap. A single step never changes the size by more than max_step,
+    and the size always stays within min_size and max_size.
+    """
+
+    def __init__(
+        self,
+        initial_size: int = 1000,
+        min_size: int = 100,
+        max_size: int = 100000,
+        target_latency: Optional[float] = None,
+        target_rows_per_second: Optional[float] = None,
+        max_step: float = 2.0,
+        smoothing: float = 0.5
+    ):
+        """
+        Initialize the AdaptiveBatchSizer.
+
+        Args:
+            initial_size: Size of the first batch
+            min_size: Floor for the batch size
+            max_size: Ceiling for the batch size
+            target_latency: Desired wall-clock seconds per batch
+            target_rows_per_second: Throughput in rows per second to grow the size towards
+            max_step: Maximum factor by which one step may grow or shrink the size
+            smoothing: Weight of the newest measurement in the per-stage moving averages (0-1]
+        """
+        if (target_latency is None) == (target_rows_per_second is None):
+            raise ValueError("Exactly one of target_latency or target_rows_per_second must be set")
+        if not 0 < min_size <= max_size:
+            raise ValueError("Batch size limits must satisfy 0 < min_size <= max_size")
+        if max_step <= 1:
+            raise ValueError("max_step must be greater than 1")
+        if not 0 < smoothing <= 1:
+            raise ValueError("smoothing must be in (0, 1]")
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.target_rows_per_second = target_rows_per_second
+        self.max_step = max_step
+        self.smoothing = smoothing
+        self.batch_size = self._clamp(initial_size)
+        self.stage_seconds: Dict[str, float] = {}
+
+    def observe(self, requested_size: int, result: Dict[str, Any]) -> int:
+        """
+        Record the outcome of a batch and compute the size of the next one.
+
+        Args:
+            requested_size: Batch size the batch was run with
+            result: Dictionary returned by process_batch
+
+        Returns:
+            Size to use for the next batch
+        """
+        rows = result['records_processed']
+        stages = result.get('stages', {})
+        for stage, timing in stages.items():
+            previous = self.stage_seconds.get(stage, timing['seconds'])
+            self.stage_seconds[stage] = previous + self.smoothing * (timing['seconds'] - previous)
+        latency = sum(self.stage_seconds[stage] for stage in stages)
+        if rows == 0 or latency <= 0:
+            return self.batch_size
+
+        if self.target_latency is not None:
+            ratio = self.target_latency / latency
+        else:
+            ratio = max(self.target_rows_per_second / (rows / latency), 1.0)
+
+        # A short batch says nothing about how a full batch would perform, so
+        # it may only shrink the size, never grow it.
+        if rows < requested_size and ratio > 1:
+            return self.batch_size
+
+        ratio = min(max(ratio, 1 / self.max_step), self.max_step)
+        self.batch_size = self._clamp(requested_size * ratio)
+        logger.debug(
+            'Batch of %d rows averages %.3fs, next batch size %d', rows, latency, self.batch_size
+        )
+        return self.batch_size
+
+    def _clamp(self, size: float) -> int:
+        return int(min(max(round(size), self.min_size), self.max_size))
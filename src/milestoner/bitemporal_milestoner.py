@@ -1,48 +1,98 @@
+import copy
+import json
 import logging
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import TYPE_CHECKING, List, Dict, Any, Iterator, Optional, Sequence, Tuple, Union
 import uuid
 
-# Configure logging
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-
-# Create console handler
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
-
-# Create formatter
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
-# Add formatter to console handler
-console_handler.setFormatter(formatter)
+from .audit import QueryAuditLog
+from .batch_sizing import AdaptiveBatchSizer
+from .columns import (
+    BATCH_ID_COL,
+    CONFORMED_SCHEMA,
+    DATA_COL,
+    LOCKED_COL,
+    MILESTONING_FLAG_COL,
+    NEXT_VALID_FROM_COL,
+    PROCESSED_DATETIME_COL,
+    ROW_ADDED_DATETIME_COL,
+    ROW_CHECKSUM_COL,
+    STAGING_GUID_COL,
+    STAGING_SCHEMA,
+    SYSTEM_FROM_COL,
+    SYSTEM_TO_COL,
+    VALID_FROM_COL,
+    VALID_TO_COL
+)
+from .executor import QueryExecutor, QueryResult, name_result, named_results, result_name
+from .history_splitting import HistorySplitter
+from .leases import BatchLeases, check_lease
+from .pending_queue import QUEUE_STREAM, QUEUE_WATERMARK, QUEUE_WATERMARK_LAG_SECONDS, PendingQueue
+from .seen_filter import SeenChecksumFilter
+from .templates import (
+    BoundStatements,
+    QueryTemplate,
+    as_identifier,
+    bind_all,
+    bind_constant,
+    bind_parameter,
+    compile_templates,
+    render_all
+)
 
-# Add console handler to logger
-logger.addHandler(console_handler)
+if TYPE_CHECKING:
+    from .metrics import BatchMetrics
 
-STAGING_SCHEMA = 'STAGING'
-CONFORMED_SCHEMA = 'CONFORMED'
-
-# Global column names for temporal tracking
-VALID_FROM_COL = 'VALID_FROM'
-VALID_TO_COL = 'VALID_TO'
-SYSTEM_FROM_COL = 'SYSTEM_FROM'
-SYSTEM_TO_COL = 'SYSTEM_TO'
-ROW_CHECKSUM_COL = 'ROW_CHECKSUM'
-STAGING_GUID_COL = 'STAGING_GUID'
-BATCH_ID_COL = 'BATCH_ID'
-PROCESSED_DATETIME_COL = 'PROCESSED_DATETIME'
-ROW_ADDED_DATETIME_COL = 'ROW_ADDED_DATETIME'
-DATA_COL = 'DATA'
-LOCKED_COL = 'LOCKED'
-MILESTONING_FLAG_COL = 'MILESTONING_FLAG'
+logger = logging.getLogger(__name__)
 
 # Milestoning flag values
 FLAG_DUPLICATE = 'DUPLICATE'
 FLAG_INVALID_DATA = 'INVALID_DATA'
 FLAG_MISSING_REQUIRED = 'MISSING_REQUIRED'
+FLAG_UNCHANGED = 'UNCHANGED'
 FLAG_PROCESSED = 'null'
 
+# Pipeline modes for process_batch
+PIPELINE_STANDARD = 'standard'
+PIPELINE_FUSED = 'fused'
+
+# Name of the MERGE result reporting the inserted and updated rows of a batch
+MERGE_RESULT = 'records_merged'
+
+# Type used to extract data columns without a configured type
+DEFAULT_COLUMN_TYPE = 'STRING'
+
+# Session variables holding the batch's range of the leading business key
+KEY_MIN_VARIABLE = 'MILESTONE_KEY_MIN'
+KEY_MAX_VARIABLE = 'MILESTONE_KEY_MAX'
+
+# Counters reported for every batch
+BATCH_COUNT_KEYS = (
+    'records_processed',
+    'duplicates_found',
+    'unchanged_found',
+    'records_inserted',
+    'records_closed'
+)
+
+# Default minimum seconds between two queue statistics queries of a staging table
+QUEUE_STATS_INTERVAL_SECONDS = 60
+
+# Column ranking the recorded rows of a version, latest first
+VERSION_RANK_COL = 'VERSION_RANK'
+
+# Column holding the per-checksum rank of a record in a fused batch table
+DUPLICATE_RANK_COL = 'DUPLICATE_RANK'
+
+# Result columns reported by a Snowflake MERGE statement
+MERGE_INSERTED_COL = 'number of rows inserted'
+MERGE_UPDATED_COL = 'number of rows updated'
+
 class BitemporalMilestoner:
     """
     Handles the milestoning process for moving data from staging to conformed layer.
@@ -55,7 +105,26 @@ class BitemporalMilestoner:
         self,
         business_keys: List[str],
         temporal_column: str,
-        data_columns: List[str]
+        data_columns: List[str],
+        executor: Optional[QueryExecutor] = None,
+        pipeline_mode: str = PIPELINE_STANDARD,
+        version_chaining: bool = False,
+        skip_unchanged: bool = False,
+        current_table_suffix: Optional[str] = None,
+        prune_merge: bool = False,
+        column_types: Optional[Dict[str, str]] = None,
+        materialize_batch: bool = False,
+        seen_filter: Optional[SeenChecksumFilter] = None,
+        metrics: Optional['BatchMetrics'] = None,
+        collect_queue_stats: bool = False,
+        queue_stats_interval: float = QUEUE_STATS_INTERVAL_SECONDS,
+        audit_log: Optional[QueryAuditLog] = None,
+        prepared_statements: bool = False,
+        pending_queue: Optional[str] = None,
+        lease_seconds: Optional[float] = None,
+        heartbeat_interval: Optional[float] = None,
+        split_history: bool = False,
+        queue_lag_seconds: float = QUEUE_WATERMARK_LAG_SECONDS
     ):
         """
         Initialize the BitemporalMilestoner.
@@ -64,18 +133,113 @@ class BitemporalMilestoner:
             business_keys: List of columns that uniquely identify a record
             temporal_column: Name of the column containing the temporal value
             data_columns: List of columns that contain the data
+            executor: Executor used to run the generated queries. When omitted,
+                process_batch only generates the queries.
+            pipeline_mode: PIPELINE_STANDARD to run the lock, duplicate and merge
+                queries as separate statements, or PIPELINE_FUSED to run the whole
+                batch as a single scripting block in one round trip
+            version_chaining: Apply several versions of the same business key
+                within one batch. The batch is ordered per key by the temporal
+                column and every change becomes its own version, closed at the
+                start of the next one.
+            skip_unchanged: Flag batch records whose checksum equals the open
+                conformed version as FLAG_UNCHANGED before merging, so only
+                real changes reach the merge
+            current_table_suffix: Maintain a current-state table named
+                <conformed_table><suffix> holding one open row per business key.
+                Change detection runs against it and the conformed history only
+                receives inserts and targeted closes. Implies version_chaining.
+            prune_merge: Push the open-version predicate and the batch's range of
+                the leading business key into the merge target, so the warehouse
+                can prune micro-partitions of the conformed table
+            column_types: Snowflake type per data column (e.g. {'EFFECTIVE_DATE':
+                'DATE'}) used to extract fields from the DATA variant. Columns
+                without an entry are extracted as STRING. See load_column_types.
+            materialize_batch: Parse the variant fields of a batch once into a
+                temporary table that the merge statements read from
+            seen_filter: Filter of recently merged checksums. After every
+                merge the checksums of the batch are added to it, so loaders
+                sharing the filter can skip resent rows.
+            metrics: Metrics updated with the result of every batch
+            collect_queue_stats: Report queue_depth and oldest_pending_seconds
+                after a batch, at the cost of one extra query over staging
+                (over the queue table with pending_queue)
+            queue_stats_interval: Minimum seconds between two statistics
+                queries of the same staging table; batches in between report
+                no statistics
+            audit_log: Audit log recording the statements of every batch.
+                Defaults to one that writes compact records (without
+                statement text unless a statement fails) to the
+                milestoner.audit logger.
+            prepared_statements: Run the statements of a batch with bind
+                parameters instead of inlined batch IDs and timestamps, so
+                statements without per-batch temporary tables send the same
+                text for every batch and the warehouse can reuse compiled
+                plans. The fused scripting block cannot take bind parameters
+                and keeps inlined values.
+            pending_queue: Claim work from a queue table holding only pending
+                records instead of scanning staging for unprocessed rows.
+                QUEUE_STREAM feeds it from an append-only stream on the
+                staging table; QUEUE_WATERMARK from the rows added after a
+                high-water mark of ROW_ADDED_DATETIME. See PendingQueue and
+                create_pending_queue.
+            lease_seconds: Treat batch locks as leases that expire when their
+                heartbeat is older than this many seconds. Every batch first
+                releases the records of expired leases back to the queue.
+                See BatchLeases and create_lease_table.
+            heartbeat_interval: Seconds between lease heartbeats while a batch
+                runs, defaults to a third of lease_seconds
+            split_history: Backfill mode for late-arriving and out-of-order
+                records. A record is inserted into the history of its key at
+                its temporal value, splitting the version that covers it, and
+                the versions around it are re-closed as a system-time
+                correction. Only the keys of the batch are read. Implies
+                version_chaining. See HistorySplitter.
+            queue_lag_seconds: With QUEUE_WATERMARK, rows added up to this
+                many seconds before the high-water mark are scanned again,
+                so loads that commit late with an older ROW_ADDED_DATETIME
+                are still queued. Must exceed the longest load transaction.
         """
+        if pipeline_mode not in (PIPELINE_STANDARD, PIPELINE_FUSED):
+            raise ValueError(f"Unknown pipeline mode: {pipeline_mode}")
+        if split_history and skip_unchanged:
+            raise ValueError("split_history detects unchanged records itself and cannot use skip_unchanged")
+        
         self.business_keys = business_keys
         self.temporal_column = temporal_column
         self.data_columns = data_columns
+        self.executor = executor
+        self.pipeline_mode = pipeline_mode
+        self.version_chaining = version_chaining or current_table_suffix is not None or split_history
+        self.skip_unchanged = skip_unchanged
+        self.current_table_suffix = current_table_suffix
+        self.prune_merge = prune_merge
+        self.column_types = dict(column_types or {})
+        self.materialize_batch = materialize_batch
+        self.seen_filter = seen_filter
+        self.metrics = metrics
+        self.collect_queue_stats = collect_queue_stats
+        self.queue_stats_interval = queue_stats_interval
+        self.audit_log = audit_log or QueryAuditLog()
+        self.prepared_statements = prepared_statements
+        self.pending_queue = (
+            PendingQueue(self, pending_queue, queue_lag_seconds) if pending_queue is not None else None
+        )
+        self.history_splitter = HistorySplitter(self) if split_history else None
+        self.leases = BatchLeases(self, lease_seconds, heartbeat_interval) if lease_seconds is not None else None
+        self._templates: Dict[Tuple, Dict[str, QueryTemplate]] = {}
+        self._stop_event = threading.Event()
+        self._queue_stats_times: Dict[str, float] = {}
         
-        logger.info(f"Initialized BitemporalMilestoner with business keys: {business_keys}")
+        logger.debug('Initialized BitemporalMilestoner with business keys: %s', business_keys)
     
     def _get_lock_batch_query(
         self,
         staging_table: str,
         batch_id: str,
-        batch_size: int
+        batch_size: int,
+        partition: Optional[Tuple[int, int]] = None,
+        current_time: Optional[datetime] = None
     ) -> str:
         """
         Generate SQL query to lock records for processing.
@@ -84,11 +248,25 @@ class BitemporalMilestoner:
             staging_table: Name of the staging table
             batch_id: ID of the current batch
             batch_size: Maximum number of records to process
+            partition: Optional (index, count) pair restricting the lock to the
+                records whose business keys hash into the given partition
+            current_time: Current timestamp, required with lease_seconds
             
         Returns:
-            SQL query to lock records
+            SQL query to lock records (preceded by acquiring the lease, if
+            leases are used); the staging lock is named records_processed
         """
-        return f"""
+        lease = ''
+        if self.leases is not None:
+            lease = f"{self.leases.get_acquire_query(staging_table, batch_id, current_time)};"
+        
+        if self.pending_queue is not None:
+            return lease + self.pending_queue.get_lock_query(staging_table, batch_id, batch_size, partition)
+        
+        partition_filter = ''
+        if partition is not None:
+            partition_filter = f"AND {self.get_partition_predicate(partition)}"
+        return lease + name_result('records_processed', f"""
         UPDATE {STAGING_SCHEMA}.{staging_table}
         SET {LOCKED_COL} = '{batch_id}',
             {MILESTONING_FLAG_COL} = NULL
@@ -97,10 +275,106 @@ class BitemporalMilestoner:
             FROM {STAGING_SCHEMA}.{staging_table}
             WHERE {PROCESSED_DATETIME_COL} IS NULL
             AND {LOCKED_COL} IS NULL
+            {partition_filter}
             ORDER BY {ROW_ADDED_DATETIME_COL} ASC
             LIMIT {batch_size}
         )
+        """)
+    
+    def get_partition_predicate(
+        self,
+        partition: Tuple[int, int],
+        key_hash: Optional[str] = None
+    ) -> str:
+        """
+        Generate a predicate selecting the staging records of one key partition.
+        
+        Every business key hashes into exactly one partition, so workers that
+        lock disjoint partitions never merge the same key concurrently.
+        
+        Args:
+            partition: (index, count) pair with 0 <= index < count
+            key_hash: Expression holding the business key hash (by default
+                computed from the staging DATA column)
+            
+        Returns:
+            SQL predicate over the key hash
+        """
+        index, count = partition
+        if not 0 <= index < count:
+            raise ValueError(f"Invalid partition {index} of {count}")
+        return f"MOD(ABS({key_hash or self.get_key_hash()}), {count}) = {index}"
+    
+    def get_key_hash(self) -> str:
+        """
+        Generate the hash of the business keys of a staging record.
+        
+        Returns:
+            SQL expression over the staging DATA column
+        """
+        keys = ', '.join(self.get_data_field(key) for key in self.business_keys)
+        return f"HASH({keys})"
+    
+    def create_pending_queue(self, staging_table: str) -> List[str]:
+        """
+        Create the pending-work queue of a staging table.
+        
+        Args:
+            staging_table: Name of the staging table
+            
+        Returns:
+            The executed statements (see PendingQueue.create)
+        """
+        if self.pending_queue is None:
+            raise ValueError("No pending_queue configured")
+        return self.pending_queue.create(staging_table)
+    
+    def create_lease_table(self, staging_table: str) -> List[str]:
+        """
+        Create the lease table of a staging table.
+        
+        Args:
+            staging_table: Name of the staging table
+            
+        Returns:
+            The executed statements (see BatchLeases.create_table)
+        """
+        if self.leases is None:
+            raise ValueError("No lease_seconds configured")
+        return self.leases.create_table(staging_table)
+    
+    def _get_lease_fence(self, staging_table: str, batch_id: str) -> str:
+        """
+        Get the fence statement opening the transaction of a batch, if leases are used.
+        
+        Args:
+            staging_table: Name of the staging table
+            batch_id: ID of the current batch
+            
+        Returns:
+            Fence statement with its terminating semicolon, or an empty string
+        """
+        if self.leases is None:
+            return ''
+        return f"{self.leases.get_fence_query(staging_table, batch_id)};"
+    
+    @contextmanager
+    def _lease_heartbeat(self, staging_table: str, batch_id: str) -> Iterator[threading.Event]:
+        """
+        Renew the lease of a batch for the duration of the block, if leases are used.
+        
+        Args:
+            staging_table: Name of the staging table
+            batch_id: ID of the current batch
+            
+        Yields:
+            Event set once the lease can no longer be renewed
         """
+        if self.leases is None:
+            yield threading.Event()
+            return
+        with self.leases.heartbeat(staging_table, batch_id) as lost:
+            yield lost
     
     def _get_duplicate_detection_query(
         self,
@@ -135,7 +409,7 @@ class BitemporalMilestoner:
         );
         """
     
-    def _snake_to_camel(self, snake_str: str) -> str:
+    def snake_to_camel(self, snake_str: str) -> str:
         """
         Convert snake_case string to camelCase.
         
@@ -148,6 +422,30 @@ class BitemporalMilestoner:
         components = snake_str.lower().split('_')
         return components[0] + ''.join(x.title() for x in components[1:])
     
+    def _get_column_type(self, column: str) -> str:
+        """
+        Get the type a data column is extracted as.
+        
+        Args:
+            column: Name of the data column
+            
+        Returns:
+            Snowflake type name, STRING unless configured otherwise
+        """
+        return self.column_types.get(column, DEFAULT_COLUMN_TYPE)
+    
+    def get_data_field(self, column: str) -> str:
+        """
+        Generate the typed extract of one field from the variant column.
+        
+        Args:
+            column: Name of the data column
+            
+        Returns:
+            SQL expression extracting the field
+        """
+        return f"{DATA_COL}:{self.snake_to_camel(column)}::{self._get_column_type(column)}"
+    
     def _get_data_fields_select(self) -> str:
         """
         Generate the SELECT clause for extracting data fields from the variant column.
@@ -156,10 +454,233 @@ class BitemporalMilestoner:
             String containing the SELECT clause for data fields
         """
         return ', '.join(
-            f"DATA:{self._snake_to_camel(col)}::STRING as {col}"
+            f"{self.get_data_field(col)} as {col}"
             for col in self.data_columns
         )
     
+    def load_column_types(self, conformed_table: str) -> Dict[str, str]:
+        """
+        Infer the data column types from the conformed table's metadata.
+        
+        Types found in INFORMATION_SCHEMA replace the configured column_types;
+        data columns missing from the table keep their current type.
+        
+        Args:
+            conformed_table: Name of the conformed table, optionally schema-qualified
+            
+        Returns:
+            Dictionary of column name to Snowflake type
+        """
+        if self.executor is None:
+            raise ValueError("load_column_types requires an executor")
+        
+        *schema, table = conformed_table.upper().split('.')
+        query = f"""
+        SELECT COLUMN_NAME, DATA_TYPE, NUMERIC_PRECISION, NUMERIC_SCALE
+        FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_NAME = ?
+        {'AND TABLE_SCHEMA = ?' if schema else ''}
+        """
+        result = self.executor.execute(query, [table] + schema[-1:])
+        
+        for column, data_type, precision, scale in result.rows:
+            if column not in self.data_columns:
+                continue
+            if data_type == 'TEXT':
+                data_type = DEFAULT_COLUMN_TYPE
+            elif data_type == 'NUMBER' and precision is not None:
+                data_type = f"NUMBER({precision}, {scale or 0})"
+            self.column_types[column] = data_type
+        
+        logger.info('Loaded column types for %s: %s', conformed_table, self.column_types)
+        return self.column_types
+    
+    def _get_current_table(self, conformed_table: str) -> Optional[str]:
+        """
+        Get the name of the current-state table of a conformed table.
+        
+        Args:
+            conformed_table: Name of the conformed table
+            
+        Returns:
+            Name of the current-state table, or None if none is maintained
+        """
+        if self.current_table_suffix is None:
+            return None
+        return f"{conformed_table}{self.current_table_suffix}"
+    
+    def get_open_versions_table(self, conformed_table: str) -> str:
+        """
+        Get the table that open versions are compared against.
+        
+        Args:
+            conformed_table: Name of the conformed table
+            
+        Returns:
+            The current-state table if one is maintained, else the conformed table
+        """
+        return self._get_current_table(conformed_table) or conformed_table
+    
+    def get_latest_versions_query(
+        self,
+        table: str,
+        predicates: Sequence[str] = (),
+        join: str = ''
+    ) -> str:
+        """
+        Generate SQL query selecting the latest recorded row of every version.
+        
+        A version is identified by its business keys and VALID_FROM. History
+        splitting never rewrites a closed version: it records a corrected
+        copy, and a late record with the same temporal value records a new
+        version, each superseding the earlier rows of that version from its
+        SYSTEM_FROM on. Readers therefore rank the rows of a version by
+        SYSTEM_FROM before applying their VALID_TO and SYSTEM_TO predicates.
+        
+        Args:
+            table: Name of the conformed table, aliased v
+            predicates: SQL predicates combined with AND before ranking; they
+                may only restrict the business keys, VALID_FROM and SYSTEM_FROM
+            join: Optional JOIN clause restricting the business keys
+            
+        Returns:
+            SQL query selecting the table's columns and VERSION_RANK
+        """
+        keys = ', '.join(f"v.{key}" for key in self.business_keys)
+        where = ''
+        if predicates:
+            where = 'WHERE ' + '\n            AND '.join(predicates)
+        return f"""SELECT *
+        FROM (
+            SELECT
+                v.*,
+                RANK() OVER (
+                    PARTITION BY {keys}, v.{VALID_FROM_COL}
+                    ORDER BY v.{SYSTEM_FROM_COL} DESC
+                ) AS {VERSION_RANK_COL}
+            FROM {table} v{join}
+            {where}
+        ) versions
+        WHERE {VERSION_RANK_COL} = 1"""
+    
+    def create_current_table(self, conformed_table: str) -> List[str]:
+        """
+        Create and populate the current-state table of a conformed table.
+        
+        The table has the same columns as the conformed table and is seeded
+        with its open versions. Existing current-state tables are left alone.
+        
+        Args:
+            conformed_table: Name of the conformed table
+            
+        Returns:
+            The executed statements (only generated when no executor is set)
+        """
+        current_table = self._get_current_table(conformed_table)
+        if current_table is None:
+            raise ValueError("No current_table_suffix configured")
+        statements = [
+            f"CREATE TABLE IF NOT EXISTS {current_table} LIKE {conformed_table}",
+            f"""
+            INSERT INTO {current_table}
+            SELECT * FROM {conformed_table}
+            WHERE {VALID_TO_COL} IS NULL
+            AND NOT EXISTS (SELECT 1 FROM {current_table})
+            """
+        ]
+        if self.executor is not None:
+            for statement in statements:
+                self.executor.execute(statement)
+        return statements
+    
+    def get_unique_staging_query(self, staging_table: str, batch_id: str) -> str:
+        """
+        Generate SQL query selecting the unflagged records of a batch.
+        
+        Args:
+            staging_table: Name of the staging table
+            batch_id: ID of the current batch
+            
+        Returns:
+            SQL query with the data fields extracted from the variant column
+        """
+        return f"""
+        SELECT
+            {self._get_data_fields_select()},
+            {ROW_CHECKSUM_COL},
+            {STAGING_GUID_COL}, 
+            {ROW_ADDED_DATETIME_COL}
+        FROM {STAGING_SCHEMA}.{staging_table}
+        WHERE {LOCKED_COL} = '{batch_id}'
+        AND {MILESTONING_FLAG_COL} IS NULL
+        """
+    
+    def _get_unchanged_guids_query(self, conformed_table: str, source_query: str) -> str:
+        """
+        Generate SQL query finding batch records identical to the open version.
+        
+        A record is unchanged when its checksum equals the checksum of the open
+        conformed version of its business key. With version chaining only the
+        first record of a key is compared, since later records follow other
+        versions of the same batch.
+        
+        Args:
+            conformed_table: Name of the conformed table
+            source_query: Query producing the unique staging records of the batch
+            
+        Returns:
+            SQL query returning the STAGING_GUID of every unchanged record
+        """
+        first_of_key = ''
+        if self.version_chaining:
+            first_of_key = "WHERE b.KEY_RANK = 1"
+        return f"""
+            SELECT b.{STAGING_GUID_COL}
+            FROM (
+                SELECT
+                    source.*,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY {', '.join(self.business_keys)}
+                        ORDER BY {self.temporal_column}, {ROW_ADDED_DATETIME_COL}
+                    ) AS KEY_RANK
+                FROM (
+                    {source_query}
+                ) source
+            ) b
+            JOIN {self.get_open_versions_table(conformed_table)} c
+                ON {' AND '.join(f"c.{key} = b.{key}" for key in self.business_keys)}
+                AND c.{VALID_TO_COL} IS NULL
+                AND c.{ROW_CHECKSUM_COL} = b.{ROW_CHECKSUM_COL}
+            {first_of_key}
+        """
+    
+    def _get_unchanged_detection_query(
+        self,
+        staging_table: str,
+        conformed_table: str,
+        batch_id: str
+    ) -> str:
+        """
+        Generate SQL query to flag batch records that would not change the conformed table.
+        
+        Args:
+            staging_table: Name of the staging table
+            conformed_table: Name of the conformed table
+            batch_id: ID of the current batch
+            
+        Returns:
+            SQL query marking unchanged records with FLAG_UNCHANGED
+        """
+        unique_staging = self.get_unique_staging_query(staging_table, batch_id)
+        return f"""
+        UPDATE {STAGING_SCHEMA}.{staging_table}
+        SET {MILESTONING_FLAG_COL} = '{FLAG_UNCHANGED}'
+        WHERE {LOCKED_COL} = '{batch_id}'
+        AND {STAGING_GUID_COL} IN (
+            {self._get_unchanged_guids_query(conformed_table, unique_staging)}
+        )
+        """
+    
     def _get_merge_query(
         self,
         staging_table: str,
@@ -179,29 +700,144 @@ class BitemporalMilestoner:
         Returns:
             SQL query to merge records
         """
-        # Extract data fields from variant column
-        # Create unique staging records CTE
-        unique_staging = f"""
-        SELECT
-            {self._get_data_fields_select()},
-            {ROW_CHECKSUM_COL},
-            {STAGING_GUID_COL}, 
-            {ROW_ADDED_DATETIME_COL}
-        FROM {STAGING_SCHEMA}.{staging_table}
-        WHERE {LOCKED_COL} = '{batch_id}'
-        AND {MILESTONING_FLAG_COL} IS NULL
+        unique_staging = self.get_unique_staging_query(staging_table, batch_id)
+        
+        materialize = ''
+        cleanup = ''
+        if self.materialize_batch:
+            parsed_table = f"{STAGING_SCHEMA}.MILESTONE_PARSED_{as_identifier(batch_id)}"
+            materialize = f"CREATE TEMPORARY TABLE {parsed_table} AS {unique_staging};"
+            cleanup = f"DROP TABLE IF EXISTS {parsed_table};"
+            unique_staging = f"SELECT * FROM {parsed_table}"
+        
+        key_bounds = None
+        key_range = ''
+        if self.prune_merge:
+            key_bounds = (f"${KEY_MIN_VARIABLE}", f"${KEY_MAX_VARIABLE}")
+            key_range = f"{self._get_key_range_query(unique_staging)};"
+        
+        if self.version_chaining:
+            chained_query = self._get_chained_merge_query(
+                staging_table,
+                conformed_table,
+                unique_staging,
+                batch_id,
+                current_time,
+                key_bounds
+            )
+            return f"""
+        {materialize}
+        {chained_query}
+        {cleanup}
         """
         
         # Use MERGE command for atomic updates
         return f"""
+        {materialize}
+        {key_range}
+        
         BEGIN;
+        {self._get_lease_fence(staging_table, batch_id)}
+        {name_result(MERGE_RESULT, self._get_merge_statement(
+            conformed_table, unique_staging, batch_id, current_time, key_bounds
+        ))};
+        
+        {self.get_mark_processed_query(staging_table, batch_id, current_time)};  
+        
+        COMMIT;
+        {cleanup}
+        """
+    
+    def _get_key_range_query(self, source_query: str) -> str:
+        """
+        Generate SQL query storing the batch's range of the leading business key
+        in session variables.
+        
+        Args:
+            source_query: Query producing the unique staging records of the batch
+            
+        Returns:
+            SQL SET statement
+        """
+        key = self.business_keys[0]
+        return f"""
+        SET ({KEY_MIN_VARIABLE}, {KEY_MAX_VARIABLE}) = (
+            SELECT MIN({key}), MAX({key})
+            FROM ({source_query})
+        )"""
+    
+    def _get_prune_predicate(
+        self,
+        alias: str,
+        key_bounds: Optional[Tuple[str, str]]
+    ) -> str:
+        """
+        Generate the predicates that let the warehouse prune the merge target.
+        
+        Args:
+            alias: Alias of the conformed (or current-state) table
+            key_bounds: SQL expressions for the lowest and highest leading
+                business key of the batch, or None when pruning is disabled
+            
+        Returns:
+            SQL predicates starting with AND, or an empty string
+        """
+        if key_bounds is None:
+            return ''
+        return f"AND {alias}.{VALID_TO_COL} IS NULL {self.get_key_range_predicate(alias, key_bounds)}"
+    
+    def get_key_range_predicate(
+        self,
+        alias: str,
+        key_bounds: Optional[Tuple[str, str]]
+    ) -> str:
+        """
+        Generate the predicate restricting a table to the batch's range of the leading business key.
+        
+        Args:
+            alias: Alias of the conformed table
+            key_bounds: SQL expressions for the lowest and highest leading
+                business key of the batch, or None when pruning is disabled
+            
+        Returns:
+            SQL predicate starting with AND, or an empty string
+        """
+        if key_bounds is None:
+            return ''
+        return f"AND {alias}.{self.business_keys[0]} BETWEEN {key_bounds[0]} AND {key_bounds[1]}"
+    
+    def _get_merge_statement(
+        self,
+        conformed_table: str,
+        source_query: str,
+        batch_id: str,
+        current_time: datetime,
+        key_bounds: Optional[Tuple[str, str]] = None
+    ) -> str:
+        """
+        Generate the MERGE statement that closes changed and inserts new records.
+        
+        With pruning enabled the open-version predicate moves into the ON
+        clause, so keys without an open version are inserted as new.
         
+        Args:
+            conformed_table: Name of the conformed table
+            source_query: Query producing the unique staging records of the batch
+            batch_id: ID of the current batch
+            current_time: Current timestamp for system time
+            key_bounds: Optional bounds of the leading business key for pruning
+            
+        Returns:
+            SQL MERGE statement
+        """
+        return f"""
         -- Merge new/changed records
         MERGE INTO {conformed_table} t
         USING (
-            {unique_staging}
+            {source_query}
         ) s
         ON {' AND '.join(f"t.{key} = s.{key}" for key in self.business_keys)}
+        {self._get_prune_predicate('t', key_bounds)}
         WHEN MATCHED AND t.{VALID_TO_COL} IS NULL AND t.{ROW_CHECKSUM_COL} != s.{ROW_CHECKSUM_COL} THEN
             UPDATE SET
                 {VALID_TO_COL} = s.{self.temporal_column},
@@ -227,24 +863,493 @@ class BitemporalMilestoner:
                 s.{ROW_CHECKSUM_COL},
                 s.{STAGING_GUID_COL},
                 '{batch_id}'
-            );
+            )"""
+    
+    def get_mark_processed_query(
+        self,
+        staging_table: str,
+        batch_id: str,
+        current_time: datetime
+    ) -> str:
+        """
+        Generate SQL query to mark the locked records of a batch as processed.
         
+        Args:
+            staging_table: Name of the staging table
+            batch_id: ID of the current batch
+            current_time: Current timestamp for system time
+            
+        Returns:
+            SQL query to mark processed records (followed by removing them from
+            the pending-work queue, if one is used)
+        """
+        query = f"""
         -- Mark processed records
         UPDATE {STAGING_SCHEMA}.{staging_table}
         SET {PROCESSED_DATETIME_COL} = '{current_time}',
             {MILESTONING_FLAG_COL} = {FLAG_PROCESSED},
             {LOCKED_COL} = NULL,
             {BATCH_ID_COL} = '{batch_id}'
-        WHERE {LOCKED_COL} = '{batch_id}';  
-        
-        COMMIT;
-        """
+        WHERE {LOCKED_COL} = '{batch_id}'"""
+        if self.pending_queue is not None:
+            query += f";\n{self.pending_queue.get_remove_query(staging_table, batch_id)}"
+        return query
+    
+    def _get_fused_batch_query(
+        self,
+        staging_table: str,
+        conformed_table: str,
+        batch_id: str,
+        batch_size: int,
+        current_time: datetime,
+        partition: Optional[Tuple[int, int]] = None
+    ) -> str:
+        """
+        Generate a single Snowflake Scripting block that locks, deduplicates and
+        merges a batch in one round trip.
+        
+        The locked records are parsed once into a temporary table. Duplicate
+        detection and the MERGE read that table instead of re-scanning staging.
+        The block returns an object with the batch counts.
+        
+        Args:
+            staging_table: Name of the staging table
+            conformed_table: Name of the conformed table
+            batch_id: ID of the current batch
+            batch_size: Maximum number of records to process
+            current_time: Current timestamp for system time
+            partition: Optional (index, count) key partition to lock records from
+            
+        Returns:
+            SQL anonymous block for the whole batch
+        """
+        batch_table = f"{STAGING_SCHEMA}.{staging_table}_BATCH_{as_identifier(batch_id)}"
+        unique_batch = f"""
+            SELECT *
+            FROM {batch_table}
+            WHERE {DUPLICATE_RANK_COL} = 1
+        """
+        counts = ', '.join(f"'{name}', {name}" for name in BATCH_COUNT_KEYS)
+        key_bounds = None
+        key_range = ''
+        if self.prune_merge:
+            key_bounds = (':key_min', ':key_max')
+            key_range = f"""
+            SELECT MIN({self.business_keys[0]}), MAX({self.business_keys[0]})
+            INTO :key_min, :key_max
+            FROM ({unique_batch});"""
+        if self.version_chaining:
+            chain_table = self._get_chain_table(batch_id)
+            setup = f"{self._get_chain_setup_query(conformed_table, unique_batch, chain_table, key_bounds)};"
+            apply = f"""{self._get_chain_close_query(conformed_table, chain_table, batch_id, current_time, key_bounds)};
+            records_closed := SQLROWCOUNT;
+            
+            {self._get_chain_insert_query(conformed_table, chain_table, batch_id, current_time)};
+            records_inserted := SQLROWCOUNT;"""
+            if self.current_table_suffix is not None:
+                apply += f"""
+            
+            {self._get_current_upsert_query(conformed_table, chain_table, batch_id, current_time, key_bounds)};"""
+            cleanup = f"DROP TABLE IF EXISTS {chain_table};"
+        else:
+            setup = ''
+            apply = f"""{self._get_merge_statement(conformed_table, unique_batch, batch_id, current_time, key_bounds)};
+            SELECT "{MERGE_INSERTED_COL}", "{MERGE_UPDATED_COL}"
+            INTO :records_inserted, :records_closed
+            FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()));"""
+            cleanup = ''
+        
+        unchanged = ''
+        if self.skip_unchanged:
+            unchanged = f"""
+            DELETE FROM {batch_table}
+            WHERE {STAGING_GUID_COL} IN (
+                {self._get_unchanged_guids_query(conformed_table, unique_batch)}
+            );
+            unchanged_found := SQLROWCOUNT;"""
+        
+        reclaim = ''
+        release = ''
+        fence = ''
+        if self.leases is not None:
+            counts += ", 'records_reclaimed', records_reclaimed"
+            for statement in self.leases.get_reclaim_statements(staging_table, current_time):
+                reclaim += f"{statement};"
+                if result_name(statement) == 'records_reclaimed':
+                    reclaim += """
+            records_reclaimed := SQLROWCOUNT;"""
+            release = f"{self.leases.get_release_query(staging_table, batch_id)};"
+            fence = f"""{self.leases.get_fence_query(staging_table, batch_id)};
+            IF (SQLROWCOUNT = 0) THEN
+                ROLLBACK;
+                RAISE lease_lost;
+            END IF;"""
+        
+        # DDL commits implicitly in Snowflake, so temporary tables are created
+        # before the transaction that applies the batch is opened.
+        return f"""
+        EXECUTE IMMEDIATE $$
+        DECLARE
+            records_processed INTEGER DEFAULT 0;
+            duplicates_found INTEGER DEFAULT 0;
+            unchanged_found INTEGER DEFAULT 0;
+            records_inserted INTEGER DEFAULT 0;
+            records_closed INTEGER DEFAULT 0;
+            records_reclaimed INTEGER DEFAULT 0;
+            lease_lost EXCEPTION (-20001, 'The batch no longer holds its lease');
+            key_min {self._get_column_type(self.business_keys[0])};
+            key_max {self._get_column_type(self.business_keys[0])};
+        BEGIN
+            {reclaim}
+            {self._get_lock_batch_query(staging_table, batch_id, batch_size, partition, current_time)};
+            records_processed := SQLROWCOUNT;
+            IF (records_processed = 0) THEN
+                {release}
+                RETURN OBJECT_CONSTRUCT({counts});
+            END IF;
+            
+            -- Parse the locked records once and rank duplicates by checksum
+            CREATE TEMPORARY TABLE {batch_table} AS
+            SELECT
+                {self._get_data_fields_select()},
+                {ROW_CHECKSUM_COL},
+                {STAGING_GUID_COL},
+                {ROW_ADDED_DATETIME_COL},
+                ROW_NUMBER() OVER (
+                    PARTITION BY {ROW_CHECKSUM_COL}
+                    ORDER BY {ROW_ADDED_DATETIME_COL} ASC
+                ) AS {DUPLICATE_RANK_COL}
+            FROM {STAGING_SCHEMA}.{staging_table}
+            WHERE {LOCKED_COL} = '{batch_id}';
+            
+            SELECT COUNT(*) INTO :duplicates_found
+            FROM {batch_table}
+            WHERE {DUPLICATE_RANK_COL} > 1;
+            {unchanged}
+            {key_range}
+            {setup}
+            
+            BEGIN TRANSACTION;
+            {fence}
+            {apply}
+            
+            {self.get_mark_processed_query(staging_table, batch_id, current_time)};
+            
+            COMMIT;
+            DROP TABLE IF EXISTS {batch_table};
+            {cleanup}
+            RETURN OBJECT_CONSTRUCT({counts});
+        END;
+        $$
+        """
+    
+    def _get_chain_table(self, batch_id: str) -> str:
+        """
+        Get the name of the temporary table holding the version chain of a batch.
+        
+        Args:
+            batch_id: ID of the current batch
+            
+        Returns:
+            Qualified temporary table name
+        """
+        return f"{STAGING_SCHEMA}.MILESTONE_CHAIN_{as_identifier(batch_id)}"
+    
+    def _get_chain_setup_query(
+        self,
+        conformed_table: str,
+        source_query: str,
+        chain_table: str,
+        key_bounds: Optional[Tuple[str, str]] = None
+    ) -> str:
+        """
+        Generate SQL query that builds the version chain of a batch.
+        
+        The batch records are ordered per business key by the temporal column.
+        A record is kept only if its checksum differs from the version before
+        it, which is the previous record of the batch or, for the first record
+        of a key, the open version in the conformed table. LEAD then gives each
+        kept record the VALID_TO at which the next version takes over.
+        
+        Args:
+            conformed_table: Name of the conformed table
+            source_query: Query producing the unique staging records of the batch
+            chain_table: Name of the temporary table to create
+            key_bounds: Optional bounds of the leading business key for pruning
+            
+        Returns:
+            SQL query creating the chain table
+        """
+        if self.history_splitter is not None:
+            return self.history_splitter.get_setup_query(conformed_table, source_query, chain_table, key_bounds)
+        
+        keys = ', '.join(self.business_keys)
+        order = f"{self.temporal_column}, {ROW_ADDED_DATETIME_COL}"
+        return f"""
+        CREATE TEMPORARY TABLE {chain_table} AS
+        WITH batch_records AS (
+            {source_query}
+        ),
+        sequenced AS (
+            SELECT
+                batch_records.*,
+                LAG({ROW_CHECKSUM_COL}) OVER (
+                    PARTITION BY {keys}
+                    ORDER BY {order}
+                ) AS PREVIOUS_CHECKSUM
+            FROM batch_records
+        ),
+        changes AS (
+            SELECT sequenced.*
+            FROM sequenced
+            LEFT JOIN {self.get_open_versions_table(conformed_table)} c
+                ON {' AND '.join(f"c.{key} = sequenced.{key}" for key in self.business_keys)}
+                AND c.{VALID_TO_COL} IS NULL
+                {self._get_prune_predicate('c', key_bounds)}
+            WHERE sequenced.{ROW_CHECKSUM_COL} IS DISTINCT FROM
+                COALESCE(sequenced.PREVIOUS_CHECKSUM, c.{ROW_CHECKSUM_COL})
+        )
+        SELECT
+            changes.*,
+            LEAD({self.temporal_column}) OVER (
+                PARTITION BY {keys}
+                ORDER BY {order}
+            ) AS {NEXT_VALID_FROM_COL}
+        FROM changes
+        """
+    
+    def _get_chain_close_query(
+        self,
+        conformed_table: str,
+        chain_table: str,
+        batch_id: str,
+        current_time: datetime,
+        key_bounds: Optional[Tuple[str, str]] = None
+    ) -> str:
+        """
+        Generate SQL query that closes the open versions superseded by a chain.
+        
+        Args:
+            conformed_table: Name of the conformed table
+            chain_table: Name of the chain table
+            batch_id: ID of the current batch
+            current_time: Current timestamp for system time
+            key_bounds: Optional bounds of the leading business key for pruning
+            
+        Returns:
+            SQL query closing open versions
+        """
+        if self.history_splitter is not None:
+            return self.history_splitter.get_close_query(
+                conformed_table, chain_table, batch_id, current_time, key_bounds
+            )
+        
+        keys = ', '.join(self.business_keys)
+        first_versions = f"""
+            SELECT {keys}, MIN({self.temporal_column}) AS FIRST_VALID_FROM
+            FROM {chain_table}
+            GROUP BY {keys}
+        """
+        current_table = self._get_current_table(conformed_table)
+        if current_table is not None:
+            # Close exactly the history rows the current-state table points at
+            first_versions = f"""
+            SELECT {', '.join(f"cur.{key}" for key in self.business_keys)},
+                cur.{STAGING_GUID_COL},
+                first_versions.FIRST_VALID_FROM
+            FROM {current_table} cur
+            JOIN ({first_versions}) first_versions
+                ON {' AND '.join(f"first_versions.{key} = cur.{key}" for key in self.business_keys)}
+                {self.get_key_range_predicate('cur', key_bounds)}
+            """
+        target_filter = ''
+        if current_table is not None:
+            target_filter = f"AND t.{STAGING_GUID_COL} = f.{STAGING_GUID_COL}"
+        return f"""
+        UPDATE {conformed_table} t
+        SET {VALID_TO_COL} = f.FIRST_VALID_FROM,
+            {SYSTEM_TO_COL} = '{current_time}'
+        FROM ({first_versions}) f
+        WHERE {' AND '.join(f"t.{key} = f.{key}" for key in self.business_keys)}
+        {target_filter}
+        AND t.{VALID_TO_COL} IS NULL
+        {self._get_prune_predicate('t', key_bounds)}"""
+    
+    def _get_current_upsert_query(
+        self,
+        conformed_table: str,
+        chain_table: str,
+        batch_id: str,
+        current_time: datetime,
+        key_bounds: Optional[Tuple[str, str]] = None
+    ) -> str:
+        """
+        Generate SQL query that moves the current-state table to the last version of each chain.
+        
+        Args:
+            conformed_table: Name of the conformed table
+            chain_table: Name of the chain table
+            batch_id: ID of the current batch
+            current_time: Current timestamp for system time
+            key_bounds: Optional bounds of the leading business key for pruning
+            
+        Returns:
+            SQL MERGE statement into the current-state table
+        """
+        columns = self.data_columns + [
+            VALID_FROM_COL,
+            VALID_TO_COL,
+            SYSTEM_FROM_COL,
+            SYSTEM_TO_COL,
+            ROW_CHECKSUM_COL,
+            STAGING_GUID_COL,
+            BATCH_ID_COL
+        ]
+        return f"""
+        MERGE INTO {self._get_current_table(conformed_table)} t
+        USING (
+            SELECT
+                {', '.join(self.data_columns)},
+                {self.temporal_column} AS {VALID_FROM_COL},
+                NULL AS {VALID_TO_COL},
+                '{current_time}' AS {SYSTEM_FROM_COL},
+                NULL AS {SYSTEM_TO_COL},
+                {ROW_CHECKSUM_COL},
+                {STAGING_GUID_COL},
+                '{batch_id}' AS {BATCH_ID_COL}
+            FROM {self._get_new_versions(chain_table)}
+            WHERE {NEXT_VALID_FROM_COL} IS NULL
+        ) s
+        ON {' AND '.join(f"t.{key} = s.{key}" for key in self.business_keys)}
+        {self.get_key_range_predicate('t', key_bounds)}
+        WHEN MATCHED THEN
+            UPDATE SET
+                {', '.join(f"{col} = s.{col}" for col in columns if col not in self.business_keys)}
+        WHEN NOT MATCHED THEN
+            INSERT ({', '.join(columns)})
+            VALUES ({', '.join(f"s.{col}" for col in columns)})"""
+    
+    def _get_chain_insert_query(
+        self,
+        conformed_table: str,
+        chain_table: str,
+        batch_id: str,
+        current_time: datetime
+    ) -> str:
+        """
+        Generate SQL query that inserts every version of a chain.
+        
+        Versions followed by a later version of the same batch are inserted
+        already closed; the last version of each key is inserted open.
+        
+        Args:
+            conformed_table: Name of the conformed table
+            chain_table: Name of the chain table
+            batch_id: ID of the current batch
+            current_time: Current timestamp for system time
+            
+        Returns:
+            SQL query inserting the chain
+        """
+        return f"""
+        INSERT INTO {conformed_table} (
+            {', '.join(self.data_columns + [
+                VALID_FROM_COL,
+                VALID_TO_COL,
+                SYSTEM_FROM_COL,
+                SYSTEM_TO_COL,
+                ROW_CHECKSUM_COL,
+                STAGING_GUID_COL,
+                BATCH_ID_COL
+            ])}
+        )
+        SELECT
+            {', '.join(self.data_columns)},
+            {self.temporal_column},
+            {NEXT_VALID_FROM_COL},
+            '{current_time}',
+            IFF({NEXT_VALID_FROM_COL} IS NULL, NULL, '{current_time}'),
+            {ROW_CHECKSUM_COL},
+            {STAGING_GUID_COL},
+            '{batch_id}'
+        FROM {self._get_new_versions(chain_table)}"""
+    
+    def _get_new_versions(self, chain_table: str) -> str:
+        """
+        Get the source of the versions a chain inserts.
+        
+        Args:
+            chain_table: Name of the chain table
+            
+        Returns:
+            The chain table, or a subquery over its new versions when the
+            chain is a timeline that also holds existing versions
+        """
+        if self.history_splitter is not None:
+            return self.history_splitter.get_new_versions(chain_table)
+        return chain_table
+    
+    def _get_chained_merge_query(
+        self,
+        staging_table: str,
+        conformed_table: str,
+        source_query: str,
+        batch_id: str,
+        current_time: datetime,
+        key_bounds: Optional[Tuple[str, str]] = None
+    ) -> str:
+        """
+        Generate SQL script that applies a batch as version chains.
+        
+        Args:
+            staging_table: Name of the staging table
+            conformed_table: Name of the conformed table
+            source_query: Query producing the unique staging records of the batch
+            batch_id: ID of the current batch
+            current_time: Current timestamp for system time
+            key_bounds: Optional bounds of the leading business key for pruning
+            
+        Returns:
+            SQL script building the chain, then closing, inserting and marking
+            records processed in one transaction
+        """
+        chain_table = self._get_chain_table(batch_id)
+        current_upsert = ''
+        if self.current_table_suffix is not None:
+            current_upsert = f"""
+        {self._get_current_upsert_query(conformed_table, chain_table, batch_id, current_time, key_bounds)};
+        """
+        key_range = ''
+        if key_bounds is not None:
+            key_range = f"{self._get_key_range_query(source_query)};"
+        return f"""
+        {key_range}
+        
+        {self._get_chain_setup_query(conformed_table, source_query, chain_table, key_bounds)};
+        
+        BEGIN;
+        {self._get_lease_fence(staging_table, batch_id)}
+        {name_result('records_closed', self._get_chain_close_query(
+            conformed_table, chain_table, batch_id, current_time, key_bounds
+        ))};
+        
+        {name_result('records_inserted', self._get_chain_insert_query(
+            conformed_table, chain_table, batch_id, current_time
+        ))};
+        {current_upsert}
+        {self.get_mark_processed_query(staging_table, batch_id, current_time)};
+        
+        COMMIT;
+        
+        DROP TABLE IF EXISTS {chain_table};
+        """
     
     def process_batch(
         self,
         staging_table: str,
         conformed_table: str,
-        batch_size: int = 1000
+        batch_size: int = 1000,
+        partition: Optional[Tuple[int, int]] = None
     ) -> Dict[str, Any]:
         """
         Process a batch of staging records.
@@ -253,51 +1358,694 @@ class BitemporalMilestoner:
             staging_table: Name of the staging table
             conformed_table: Name of the conformed table
             batch_size: Maximum number of records to process
+            partition: Optional (index, count) pair; only records whose business
+                keys hash into this partition are locked
             
         Returns:
             Dictionary containing:
                 - batch_id: ID of the processed batch
                 - records_processed: Number of records processed
                 - duplicates_found: Number of duplicates found
+                - unchanged_found: Number of records identical to the open version
+                  (only counted with skip_unchanged)
                 - records_inserted: Number of records inserted
                 - records_closed: Number of records closed
+                - records_reclaimed: Number of records of expired leases released
+                  before the lock (only with lease_seconds)
+                - queue_depth: Unprocessed, unlocked staging rows after the batch
+                  (only with collect_queue_stats)
+                - oldest_pending_seconds: Seconds the oldest unprocessed, unlocked
+                  record has been waiting (only with collect_queue_stats)
+                - queries: Generated SQL keyed by stage name
+                - stages: Wall-clock seconds, affected rows and warehouse query IDs
+                  keyed by stage name
         """
         current_time = datetime.now()
         batch_id = str(uuid.uuid4())
+    
+        logger.debug('Starting batch %s with size %d', batch_id, batch_size)
+    
+        templates = self._get_batch_templates(staging_table, conformed_table, partition)
+        values = {'batch_id': batch_id, 'current_time': str(current_time), 'batch_size': batch_size}
+        result = self._new_batch_result(batch_id, render_all(templates, values))
+        if self.executor is None:
+            return result
+    
+        bound = bind_all(templates, values) if self.prepared_statements else {}
+        if self.pipeline_mode == PIPELINE_FUSED:
+            return self._process_fused_batch(staging_table, result, bound, templates)
+    
+        queries = result['queries']
+        if self.leases is not None:
+            reclaim_results = self._run_stage(
+                result,
+                'reclaim',
+                queries['reclaim'],
+                script=True,
+                statements=bound.get('reclaim'),
+                template=templates.get('reclaim')
+            )
+            result['records_reclaimed'] = named_results(
+                queries['reclaim'],
+                reclaim_results
+            )['records_reclaimed'].rowcount
+    
+        lock_result = self._run_stage(
+            result,
+            'lock',
+            queries['lock'],
+            script=self.pending_queue is not None or self.leases is not None,
+            statements=bound.get('lock'),
+            template=templates.get('lock')
+        )
+        if isinstance(lock_result, list):
+            lock_result = named_results(queries['lock'], lock_result)['records_processed']
+        result['records_processed'] = lock_result.rowcount
+        if result['records_processed'] == 0:
+            logger.debug('No unprocessed records found for batch %s', batch_id)
+            if self.leases is not None:
+                self._run_stage(
+                    result,
+                    'release',
+                    queries['release'],
+                    statements=bound.get('release'),
+                    template=templates.get('release')
+                )
+            if self.metrics is not None:
+                self.metrics.observe(staging_table, result)
+            return result
+    
+        with self._lease_heartbeat(staging_table, batch_id) as lease_lost:
+            duplicate_result = self._run_stage(
+                result,
+                'dedupe',
+                queries['duplicates'],
+                statements=bound.get('duplicates'),
+                template=templates.get('duplicates')
+            )
+            result['duplicates_found'] = duplicate_result.rowcount
+    
+            if self.skip_unchanged:
+                check_lease(lease_lost, batch_id)
+                unchanged_result = self._run_stage(
+                    result,
+                    'unchanged',
+                    queries['unchanged'],
+                    statements=bound.get('unchanged'),
+                    template=templates.get('unchanged')
+                )
+                result['unchanged_found'] = unchanged_result.rowcount
+    
+            check_lease(lease_lost, batch_id)
+            merge_results = self._run_stage(
+                result,
+                'merge',
+                queries['merge'],
+                script=True,
+                statements=bound.get('merge'),
+                template=templates.get('merge')
+            )
+        inserted, closed = self._get_merge_counts(queries['merge'], merge_results)
+        result['records_inserted'] = inserted
+        result['records_closed'] = closed
+    
+        if self.seen_filter is not None:
+            self._update_seen_filter(result, bound, templates)
+    
+        self._finish_batch(staging_table, result, bound, templates)
+        return result
+    
+    def _get_batch_templates(
+        self,
+        staging_table: str,
+        conformed_table: str,
+        partition: Optional[Tuple[int, int]] = None
+    ) -> Dict[str, QueryTemplate]:
+        """
+        Get the query templates of a batch, generating them on first use.
+    
+        Templates are generated with bind markers in place of the batch ID,
+        timestamp and batch size and cached per staging and conformed table,
+        partition and configuration, so later batches only substitute values.
+    
+        Args:
+            staging_table: Name of the staging table
+            conformed_table: Name of the conformed table
+            partition: Optional (index, count) key partition to lock records from
+    
+        Returns:
+            QueryTemplate per query name
+        """
+        cache_key = (staging_table, conformed_table, partition, self._get_config_key())
+        templates = self._templates.get(cache_key)
+        if templates is not None:
+            return templates
+    
+        batch_id = bind_parameter('batch_id')
+        current_time = bind_parameter('current_time')
+        batch_size = bind_constant('batch_size')
+        if self.pipeline_mode == PIPELINE_FUSED:
+            queries = {
+                'fused': self._get_fused_batch_query(
+                    staging_table,
+                    conformed_table,
+                    batch_id,
+                    batch_size,
+                    current_time,
+                    partition
+                )
+            }
+        else:
+            queries = {}
+            if self.leases is not None:
+                queries['reclaim'] = self.leases.get_reclaim_query(staging_table, current_time)
+                queries['release'] = self.leases.get_release_query(staging_table, batch_id)
+            queries['lock'] = self._get_lock_batch_query(
+                staging_table,
+                batch_id,
+                batch_size,
+                partition,
+                current_time
+            )
+            queries['duplicates'] = self._get_duplicate_detection_query(staging_table, batch_id)
+            if self.skip_unchanged:
+                queries['unchanged'] = self._get_unchanged_detection_query(
+                    staging_table,
+                    conformed_table,
+                    batch_id
+                )
+            queries['merge'] = self._get_merge_query(
+                staging_table,
+                conformed_table,
+                batch_id,
+                current_time
+            )
+    
+        if self.seen_filter is not None:
+            queries['seen'] = self._get_batch_checksums_query(staging_table, batch_id)
+        if self.collect_queue_stats:
+            queries['stats'] = self._get_queue_stats_query(staging_table, current_time)
+    
+        templates = compile_templates(queries)
+        self._templates[cache_key] = templates
+        return templates
+    
+    def _get_config_key(self) -> Tuple:
+        """
+        Get the configuration the generated queries depend on.
+    
+        Returns:
+            Hashable tuple of the query-shaping settings
+        """
+        return (
+            tuple(self.business_keys),
+            self.temporal_column,
+            tuple(self.data_columns),
+            self.pipeline_mode,
+            self.version_chaining,
+            self.skip_unchanged,
+            self.current_table_suffix,
+            self.prune_merge,
+            tuple(sorted(self.column_types.items())),
+            self.materialize_batch,
+            self.seen_filter is not None,
+            self.collect_queue_stats,
+            (self.pending_queue.source, self.pending_queue.lag_seconds) if self.pending_queue is not None else None,
+            self.leases.lease_seconds if self.leases is not None else None,
+            self.history_splitter is not None
+        )
+    
+    def drain(
+        self,
+        staging_table: str,
+        conformed_table: str,
+        batch_size: Union[int, AdaptiveBatchSizer] = 1000,
+        stop_when_empty: bool = True,
+        poll_interval: float = 1.0,
+        max_poll_interval: float = 60.0,
+        handle_signals: bool = True,
+        partition: Optional[Tuple[int, int]] = None
+    ) -> Dict[str, Any]:
+        """
+        Process batches back to back until staging is drained or stop() is called.
         
-        logger.info(f"Starting batch {batch_id} with size {batch_size}")
+        When stop_when_empty is False the milestoner runs as a daemon: once no
+        unprocessed records remain it polls again, doubling the wait after every
+        idle poll up to max_poll_interval, and resets it as soon as work arrives.
         
-        # Step 1: Get unprocessed records and lock them
-        lock_query = self._get_lock_batch_query(
-            staging_table,
-            batch_id,
-            batch_size
-        )
-        logger.info(f"Lock query: {lock_query}")
+        Args:
+            staging_table: Name of the staging table
+            conformed_table: Name of the conformed table
+            batch_size: Maximum number of records to process per batch, or an
+                AdaptiveBatchSizer that picks the size of every batch from the
+                latency of the previous ones
+            stop_when_empty: Return as soon as a batch finds no more records
+            poll_interval: Initial wait in seconds after an idle poll
+            max_poll_interval: Maximum wait in seconds between idle polls
+            handle_signals: Stop cleanly on SIGINT/SIGTERM (main thread only)
+            partition: Optional (index, count) key partition this worker owns,
+                for running one worker per process or host
+            
+        Returns:
+            Dictionary containing:
+                - batches: Number of batches that processed records
+                - records_processed: Total number of records processed
+                - duplicates_found: Total number of duplicates found
+                - unchanged_found: Total number of unchanged records skipped
+                - records_inserted: Total number of records inserted
+                - records_closed: Total number of records closed
+                - stopped: True if the loop ended because stop() was called
+        """
+        if self.executor is None:
+            raise ValueError("drain requires an executor")
         
-        # Step 2: Identify duplicates
-        duplicate_query = self._get_duplicate_detection_query(
-            staging_table,
-            batch_id
-        )
-        logger.info(f"Duplicate detection query: {duplicate_query}")
-        
-        # Step 3: Merge records
-        merge_query = self._get_merge_query(
-            staging_table,
-            conformed_table,
-            batch_id,
-            current_time
+        self._stop_event.clear()
+        with self._stop_on_signals(handle_signals):
+            totals = self._drain_loop(
+                staging_table,
+                conformed_table,
+                batch_size,
+                stop_when_empty,
+                poll_interval,
+                max_poll_interval,
+                partition
+            )
+        logger.info('Drain of %s finished after %d batches', staging_table, totals['batches'])
+        return totals
+    
+    def run_partitioned(
+        self,
+        staging_table: str,
+        conformed_table: str,
+        workers: int,
+        batch_size: Union[int, AdaptiveBatchSizer] = 1000,
+        stop_when_empty: bool = True,
+        poll_interval: float = 1.0,
+        max_poll_interval: float = 60.0,
+        handle_signals: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Drain staging with one thread per hash partition of the business keys.
+        
+        Each worker only locks records whose business keys fall into its own
+        partition, so no two workers ever merge the same key. The executor's
+        pool should hold at least one connection per worker.
+        
+        Args:
+            staging_table: Name of the staging table
+            conformed_table: Name of the conformed table
+            workers: Number of partitions and worker threads
+            batch_size: Batch size per worker, or an AdaptiveBatchSizer that is
+                copied so every worker adapts independently
+            stop_when_empty: Return once every partition is drained
+            poll_interval: Initial wait in seconds after an idle poll
+            max_poll_interval: Maximum wait in seconds between idle polls
+            handle_signals: Stop all workers cleanly on SIGINT/SIGTERM
+            
+        Returns:
+            Dictionary with the same totals as drain() summed over all workers,
+            plus workers: the list of per-worker totals
+        """
+        if self.executor is None:
+            raise ValueError("run_partitioned requires an executor")
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        
+        self._stop_event.clear()
+        with self._stop_on_signals(handle_signals):
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='milestoner') as pool:
+                futures = [
+                    pool.submit(
+                        self._drain_loop,
+                        staging_table,
+                        conformed_table,
+                        copy.deepcopy(batch_size),
+                        stop_when_empty,
+                        poll_interval,
+                        max_poll_interval,
+                        (index, workers)
+                    )
+                    for index in range(workers)
+                ]
+                try:
+                    worker_totals = [future.result() for future in futures]
+                except Exception:
+                    self.stop()
+                    raise
+        
+        totals = {key: sum(t[key] for t in worker_totals) for key in BATCH_COUNT_KEYS + ('batches',)}
+        totals['stopped'] = self._stop_event.is_set()
+        totals['workers'] = worker_totals
+        logger.info('Partitioned drain of %s finished after %d batches', staging_table, totals['batches'])
+        return totals
+    
+    def stop(self) -> None:
+        """
+        Ask a running drain() or run_partitioned() to stop after the batches in progress.
+        """
+        self._stop_event.set()
+    
+    @contextmanager
+    def _stop_on_signals(self, handle_signals: bool) -> Iterator[None]:
+        """
+        Route SIGINT and SIGTERM to stop() for the duration of the block.
+        
+        Args:
+            handle_signals: Install the handlers (only possible on the main thread)
+        """
+        previous_handlers = {}
+        if handle_signals and threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                previous_handlers[signum] = signal.signal(signum, lambda *_: self.stop())
+        try:
+            yield
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+    
+    def _drain_loop(
+        self,
+        staging_table: str,
+        conformed_table: str,
+        batch_size: Union[int, AdaptiveBatchSizer],
+        stop_when_empty: bool,
+        poll_interval: float,
+        max_poll_interval: float,
+        partition: Optional[Tuple[int, int]]
+    ) -> Dict[str, Any]:
+        """
+        Run batches until staging is drained or the stop event is set.
+        
+        Args:
+            staging_table: Name of the staging table
+            conformed_table: Name of the conformed table
+            batch_size: Fixed batch size or AdaptiveBatchSizer
+            stop_when_empty: Return as soon as a batch finds no more records
+            poll_interval: Initial wait in seconds after an idle poll
+            max_poll_interval: Maximum wait in seconds between idle polls
+            partition: Optional (index, count) key partition to process
+            
+        Returns:
+            Dictionary of totals as described in drain()
+        """
+        totals = {key: 0 for key in ('batches',) + BATCH_COUNT_KEYS}
+        wait = poll_interval
+        while not self._stop_event.is_set():
+            if isinstance(batch_size, AdaptiveBatchSizer):
+                size = batch_size.batch_size
+            else:
+                size = batch_size
+            result = self.process_batch(staging_table, conformed_table, size, partition)
+            if isinstance(batch_size, AdaptiveBatchSizer):
+                batch_size.observe(size, result)
+            if result['records_processed'] > 0:
+                totals['batches'] += 1
+                for key in BATCH_COUNT_KEYS:
+                    totals[key] += result[key]
+                wait = poll_interval
+                if result['records_processed'] >= size:
+                    continue
+            
+            # A short or empty batch means the queue was drained at lock time
+            if stop_when_empty:
+                break
+            logger.debug('Staging table %s is idle, polling again in %.1fs', staging_table, wait)
+            self._stop_event.wait(wait)
+            wait = min(wait * 2, max_poll_interval)
+        
+        totals['stopped'] = self._stop_event.is_set()
+        return totals
+    
+    def _process_fused_batch(
+        self,
+        staging_table: str,
+        result: Dict[str, Any],
+        bound: Dict[str, BoundStatements],
+        templates: Dict[str, QueryTemplate]
+    ) -> Dict[str, Any]:
+        """
+        Process a batch with a single fused scripting block.
+    
+        Args:
+            staging_table: Name of the staging table
+            result: Batch result dictionary holding the generated queries
+            bound: Bound statements keyed by query name
+            templates: Templates the queries were rendered from, keyed by query name
+    
+        Returns:
+            Dictionary with the same keys as process_batch
+        """
+        with self._lease_heartbeat(staging_table, result['batch_id']):
+            fused_result = self._run_stage(
+                result,
+                'fused',
+                result['queries']['fused'],
+                template=templates.get('fused')
+            )
+        counts = fused_result.rows[0][0]
+        if isinstance(counts, str):
+            counts = json.loads(counts)
+        for key in BATCH_COUNT_KEYS + ('records_reclaimed',):
+            result[key] = int(counts.get(key) or 0)
+        result['stages']['fused']['rows'] = result['records_processed']
+    
+        if self.seen_filter is not None and result['records_processed'] > 0:
+            self._update_seen_filter(result, bound, templates)
+    
+        self._finish_batch(staging_table, result, bound, templates)
+        return result
+    
+    def _get_batch_checksums_query(self, staging_table: str, batch_id: str) -> str:
+        """
+        Generate SQL query returning the checksums of a processed batch.
+        
+        Args:
+            staging_table: Name of the staging table
+            batch_id: ID of the processed batch
+            
+        Returns:
+            SQL query selecting ROW_CHECKSUM of every record of the batch
+        """
+        return f"""
+        SELECT DISTINCT {ROW_CHECKSUM_COL}
+        FROM {STAGING_SCHEMA}.{staging_table}
+        WHERE {BATCH_ID_COL} = '{batch_id}'"""
+    
+    def _update_seen_filter(
+        self,
+        result: Dict[str, Any],
+        bound: Optional[Dict[str, BoundStatements]] = None,
+        templates: Optional[Dict[str, QueryTemplate]] = None
+    ) -> None:
+        """
+        Add the checksums of a merged batch to the seen-checksum filter.
+        
+        Args:
+            result: Batch result dictionary of the merged batch
+            bound: Bound statements keyed by query name
+            templates: Templates the queries were rendered from, keyed by query name
+        """
+        seen_result = self._run_stage(
+            result,
+            'seen',
+            result['queries']['seen'],
+            statements=(bound or {}).get('seen'),
+            template=(templates or {}).get('seen')
         )
-        logger.info(f"Merge query: {merge_query}")
+        self.seen_filter.add([row[0] for row in seen_result.rows])
+    
+    def _get_queue_stats_query(self, staging_table: str, current_time: datetime) -> str:
+        """
+        Generate SQL query measuring the pending records after a batch.
         
-        # TODO: Execute queries in Snowflake and get results
+        With a pending-work queue only the queue table is read.
         
+        Args:
+            staging_table: Name of the staging table
+            current_time: Time the batch started
+            
+        Returns:
+            SQL query returning QUEUE_DEPTH (unprocessed, unlocked records) and
+            OLDEST_PENDING_SECONDS (how long the oldest of them has been waiting)
+        """
+        if self.pending_queue is not None:
+            source = self.pending_queue.get_table(staging_table)
+            pending = f"{LOCKED_COL} IS NULL"
+        else:
+            source = f"{STAGING_SCHEMA}.{staging_table}"
+            pending = f"{PROCESSED_DATETIME_COL} IS NULL AND {LOCKED_COL} IS NULL"
+        return f"""
+        SELECT
+            COUNT(*) AS QUEUE_DEPTH,
+            DATEDIFF(
+                'millisecond',
+                MIN({ROW_ADDED_DATETIME_COL}),
+                '{current_time}'::TIMESTAMP
+            ) / 1000 AS OLDEST_PENDING_SECONDS
+        FROM {source}
+        WHERE {pending}"""
+    
+    def _queue_stats_due(self, staging_table: str) -> bool:
+        """
+        Check whether the queue statistics of a staging table should be collected now.
+        
+        Args:
+            staging_table: Name of the staging table
+            
+        Returns:
+            True when statistics are enabled and the last collection is at
+            least queue_stats_interval seconds ago (the time is then recorded)
+        """
+        if not self.collect_queue_stats:
+            return False
+        now = time.monotonic()
+        last = self._queue_stats_times.get(staging_table)
+        if last is not None and now - last < self.queue_stats_interval:
+            return False
+        self._queue_stats_times[staging_table] = now
+        return True
+    
+    def _finish_batch(
+        self,
+        staging_table: str,
+        result: Dict[str, Any],
+        bound: Optional[Dict[str, BoundStatements]] = None,
+        templates: Optional[Dict[str, QueryTemplate]] = None
+    ) -> None:
+        """
+        Collect queue statistics, log the batch and update metrics.
+        
+        Args:
+            staging_table: Name of the staging table
+            result: Batch result dictionary
+            bound: Bound statements keyed by query name
+            templates: Templates the queries were rendered from, keyed by query name
+        """
+        if self._queue_stats_due(staging_table):
+            stats_result = self._run_stage(
+                result,
+                'stats',
+                result['queries']['stats'],
+                statements=(bound or {}).get('stats'),
+                template=(templates or {}).get('stats')
+            )
+            queue_depth = stats_result.first('QUEUE_DEPTH')
+            oldest_pending = stats_result.first('OLDEST_PENDING_SECONDS')
+            result['queue_depth'] = int(queue_depth) if queue_depth is not None else None
+            result['oldest_pending_seconds'] = float(oldest_pending) if oldest_pending is not None else None
+        
+        self._log_batch_result(result)
+        if self.metrics is not None:
+            self.metrics.observe(staging_table, result)
+    
+    def _new_batch_result(self, batch_id: str, queries: Dict[str, str]) -> Dict[str, Any]:
+        """
+        Create an empty batch result.
+        
+        Args:
+            batch_id: ID of the current batch
+            queries: Generated queries keyed by stage name
+            
+        Returns:
+            Batch result dictionary with zeroed counts
+        """
         return {
             'batch_id': batch_id,
-            'queries': {
-                'lock': lock_query,
-                'duplicates': duplicate_query,
-                'merge': merge_query
-            }
-        }
\ No newline at end of file
+            **{key: 0 for key in BATCH_COUNT_KEYS},
+            'records_reclaimed': 0,
+            'queue_depth': None,
+            'oldest_pending_seconds': None,
+            'queries': queries,
+            'stages': {}
+        }
+    
+    def _run_stage(
+        self,
+        result: Dict[str, Any],
+        stage: str,
+        query: str,
+        script: bool = False,
+        statements: Optional[BoundStatements] = None,
+        template: Optional[QueryTemplate] = None
+    ) -> Any:
+        """
+        Run one stage of a batch, record its wall-clock time and row count and audit it.
+        
+        Args:
+            result: Batch result dictionary the timing is recorded in
+            stage: Name of the stage (e.g. lock, dedupe, merge or fused)
+            query: Statement, or script of statements, executed by the stage
+            script: Run the query with execute_script instead of execute
+            statements: Prepared statements with bind parameters executed
+                instead of the query text
+            template: Template the query was rendered from, which keys
+                the query in the audit log
+            
+        Returns:
+            QueryResult of the statement, or a list of them for a script
+        """
+        started = time.perf_counter()
+        try:
+            if statements is None:
+                output = self.executor.execute_script(query) if script else self.executor.execute(query)
+            elif script:
+                output = self.executor.execute_statements(statements)
+            else:
+                output = self.executor.execute(*statements[0])
+        except Exception as e:
+            self.audit_log.record(stage, query, result['batch_id'], error=e, template=template)
+            raise
+        statement_results = output if isinstance(output, list) else [output]
+        timing = {
+            'seconds': time.perf_counter() - started,
+            'rows': sum(r.rowcount for r in statement_results),
+            'query_ids': [r.query_id for r in statement_results if r.query_id]
+        }
+        result['stages'][stage] = timing
+        self.audit_log.record(
+            stage,
+            query,
+            result['batch_id'],
+            timing['seconds'],
+            timing['rows'],
+            timing['query_ids'],
+            template=template
+        )
+        return output
+    
+    def _log_batch_result(self, result: Dict[str, Any]) -> None:
+        """
+        Log the counts of a finished batch.
+        
+        Args:
+            result: Batch result dictionary
+        """
+        logger.info(
+            'Finished batch %s: %d processed, %d duplicates, %d unchanged, %d inserted, %d closed',
+            result['batch_id'],
+            result['records_processed'],
+            result['duplicates_found'],
+            result['unchanged_found'],
+            result['records_inserted'],
+            result['records_closed']
+        )
+    
+    def _get_merge_counts(self, script: str, results: List[QueryResult]) -> Tuple[int, int]:
+        """
+        Extract inserted and closed row counts from the merge script results.
+        
+        Args:
+            script: Merge script that was run
+            results: Results of the statements in the merge script
+            
+        Returns:
+            Tuple of (records_inserted, records_closed)
+        """
+        named = named_results(script, results)
+        if self.version_chaining:
+            return named['records_inserted'].rowcount, named['records_closed'].rowcount
+        merge_result = named[MERGE_RESULT]
+        return (
+            int(merge_result.first(MERGE_INSERTED_COL, 0)),
+            int(merge_result.first(MERGE_UPDATED_COL, 0))
+        )
@@ -0,0 +1,124 @@
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from .bitemporal_milestoner import BitemporalMilestoner, VALID_FROM_COL, VALID_TO_COL
+from .executor import QueryExecutor
+
+logger = logging.getLogger(__name__)
+
+# Average clustering depth above which a table is reported as poorly clustered
+MAX_AVERAGE_DEPTH = 4.0
+
+
+def recommend_clustering_key(milestoner: BitemporalMilestoner) -> List[str]:
+    """
+    Recommend a clustering key for a conformed table.
+
+    Expressions are ordered from lowest to highest cardinality: whether the
+    version is open, the leading business key and the start of validity. Open
+    versions end up in few micro-partitions and the key range filter of a
+    pruned merge can skip the rest.
+
+    Args:
+        milestoner: Milestoner whose configuration describes the conformed table
+
+    Returns:
+        List of clustering key expressions
+    """
+    return [
+        f"IFF({VALID_TO_COL} IS NULL, 0, 1)",
+        milestoner.business_keys[0],
+        VALID_FROM_COL
+    ]
+
+
+def get_clustering_ddl(milestoner: BitemporalMilestoner, conformed_table: str) -> str:
+    """
+    Generate the statement that applies the recommended clustering key.
+
+    Args:
+        milestoner: Milestoner whose configuration describes the conformed table
+        conformed_table: Name of the conformed table
+
+    Returns:
+        SQL ALTER TABLE statement
+    """
+    return f"ALTER TABLE {conformed_table} CLUSTER BY ({', '.join(recommend_clustering_key(milestoner))})"
+
+
+def check_clustering(
+    executor: QueryExecutor,
+    milestoner: BitemporalMilestoner,
+    conformed_table: str,
+    max_average_depth: float = MAX_AVERAGE_DEPTH
+) -> Dict[str, Any]:
+    """
+    Check how well a conformed table is clustered for the recommended key.
+
+    Args:
+        executor: Executor used to query the clustering information
+        milestoner: Milestoner whose configuration describes the conformed table
+        conformed_table: Name of the conformed table
+        max_average_depth: Highest average depth still considered well clustered
+
+    Returns:
+        Dictionary containing:
+            - recommended_key: Recommended clustering key expressions
+            - current_key: Clustering key currently defined on the table, if any
+            - average_depth: Average overlap depth of micro-partitions
+            - total_partition_count: Number of micro-partitions
+            - well_clustered: True if the key is in place and the depth is acceptable
+            - ddl: Statement applying the recommended key
+    """
+    recommended = recommend_clustering_key(milestoner)
+    expression = f"({', '.join(recommended)})"
+    result = executor.execute(
+        f"SELECT SYSTEM$CLUSTERING_INFORMATION('{conformed_table}', '{expression}')"
+    )
+    info = json.loads(result.rows[0][0])
+    current_key = _get_current_clustering_key(executor, conformed_table)
+
+    average_depth = float(info.get('average_depth', 0))
+    report = {
+        'recommended_key': recommended,
+        'current_key': current_key,
+        'average_depth': average_depth,
+        'total_partition_count': int(info.get('total_partition_count', 0)),
+        'well_clustered': (
+            current_key is not None
+            and _normalize(current_key) == _normalize(expression)
+            and average_depth <= max_average_depth
+        ),
+        'ddl': get_clustering_ddl(milestoner, conformed_table)
+    }
+    if not report['well_clustered']:
+        logger.info(
+            'Table %s is not clustered for milestoning (key %s, average depth %.2f)',
+            conformed_table, current_key, average_depth
+        )
+    return report
+
+
+def _get_current_clustering_key(executor: QueryExecutor, conformed_table: str) -> Optional[str]:
+    *schema, table_name = conformed_table.upper().split('.')
+    result = executor.execute(
+        f"""
+    SELECT CLUSTERING_KEY
+    FROM INFORMATION_SCHEMA.TABLES
+    WHERE TABLE_NAME = ?
+    {'AND TABLE_SCHEMA = ?' if schema else ''}
+    """,
+        [table_name] + schema[-1:]
+    )
+    if not result.rows or result.rows[0][0] is None:
+        return None
+    key = result.rows[0][0]
+    # Snowflake reports keys as LINEAR(<expressions>)
+    if key.upper().startswith('LINEAR(') and key.endswith(')'):
+        key = f"({key[len('LINEAR('):-1]})"
+    return key
+
+
+def _normalize(expression: str) -> str:
+    return ''.join(expression.split()).upper()
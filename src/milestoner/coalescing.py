@@ -0,0 +1,352 @@
+import logging
+import uuid
+from typing import Any, Dict, Optional
+
+from .bitemporal_milestoner import (
+    BitemporalMilestoner,
+    STAGING_GUID_COL,
+    STAGING_SCHEMA,
+    SYSTEM_FROM_COL,
+    SYSTEM_TO_COL,
+    VALID_FROM_COL,
+    VALID_TO_COL,
+    VERSION_RANK_COL
+)
+from .executor import QueryExecutor, name_result, named_results
+
+logger = logging.getLogger(__name__)
+
+# Columns of the coalescing table
+CONTINUES_PREVIOUS_COL = 'CONTINUES_PREVIOUS'
+ISLAND_COL = 'ISLAND'
+HEAD_GUID_COL = 'HEAD_GUID'
+HEAD_VALID_FROM_COL = 'HEAD_VALID_FROM'
+HEAD_SYSTEM_FROM_COL = 'HEAD_SYSTEM_FROM'
+LAST_GUID_COL = 'LAST_GUID'
+LAST_VALID_FROM_COL = 'LAST_VALID_FROM'
+LAST_SYSTEM_FROM_COL = 'LAST_SYSTEM_FROM'
+VERSION_ROWS_COL = 'VERSION_ROWS'
+COALESCED_VALID_TO_COL = 'COALESCED_VALID_TO'
+COALESCED_SYSTEM_TO_COL = 'COALESCED_SYSTEM_TO'
+ISLAND_SIZE_COL = 'ISLAND_SIZE'
+KEY_SYSTEM_FROM_COL = 'KEY_SYSTEM_FROM'
+ANALYSED_SYSTEM_FROM_COL = 'ANALYSED_SYSTEM_FROM'
+
+
+class VersionCoalescer:
+    """
+    Merges consecutive versions that carry the same data into one version.
+
+    A version continues the version before it when it starts where that one
+    ends in valid time, was recorded by the batch that closed it, and has
+    equal data columns (the temporal column aside). Every run of continuing
+    versions is replaced by its first version, widened to the run's VALID_TO
+    and SYSTEM_TO. Because each version was recorded exactly when its
+    predecessor was closed, every point-in-time read returns the same data
+    before and after coalescing. Empty versions are left alone.
+
+    Only the latest row of every version is read. A version whose earlier
+    rows were superseded by a history-splitting correction is never absorbed
+    into its predecessor, since deleting its latest row would bring the
+    superseded one back; it can still head a run.
+
+    Runs can be incremental: only keys with versions recorded after the
+    previous run's watermark are read. The watermark is the latest
+    SYSTEM_FROM of the analysed versions, captured in the coalescing table
+    by the same statement that finds the runs and read back inside the
+    transaction. The statements are guarded so a batch merged between the
+    analysis and the transaction makes the runs of its keys wait for the
+    next pass instead of being coalesced from stale data.
+    """
+
+    def __init__(
+        self,
+        milestoner: BitemporalMilestoner,
+        conformed_table: str,
+        executor: Optional[QueryExecutor] = None
+    ):
+        """
+        Initialize the VersionCoalescer.
+
+        Args:
+            milestoner: Milestoner whose configuration describes the conformed table
+            conformed_table: Name of the conformed table, optionally schema-qualified
+            executor: Executor used to run the job, defaults to the milestoner's
+        """
+        executor = executor or milestoner.executor
+        if executor is None:
+            raise ValueError("VersionCoalescer requires an executor")
+
+        self.milestoner = milestoner
+        self.conformed_table = conformed_table
+        self.executor = executor
+        self.compared_columns = [
+            col for col in milestoner.data_columns
+            if col != milestoner.temporal_column and col not in milestoner.business_keys
+        ]
+
+    def coalesce(self, since: Any = None) -> Dict[str, Any]:
+        """
+        Coalesce the redundant versions of the conformed table.
+
+        Args:
+            since: Watermark returned by the previous run; only keys with a
+                version whose SYSTEM_FROM is later are coalesced. None reads
+                every key.
+
+        Returns:
+            Dictionary containing:
+                - since: Watermark the run started from
+                - watermark: Latest SYSTEM_FROM seen, to pass as since next time
+                - versions_coalesced: Number of versions widened over their successors
+                - versions_removed: Number of redundant versions deleted
+                - bytes_reclaimed: Estimated table bytes freed by the deletes
+                  (released once Time Travel retention has passed)
+        """
+        row_bytes = self._get_average_row_bytes()
+
+        coalesce_table = f"{STAGING_SCHEMA}.MILESTONE_COALESCE_{uuid.uuid4().hex}"
+        params = [since] if since is not None else None
+        statements = [
+            (self._get_coalesce_setup_query(coalesce_table, since is not None), params),
+            ('BEGIN', None),
+            (name_result('versions_coalesced', self._get_coalesce_update_query(coalesce_table)), None),
+            (name_result('versions_removed', self._get_coalesce_delete_query(coalesce_table)), None),
+            (name_result('watermark', f"SELECT MAX({ANALYSED_SYSTEM_FROM_COL}) FROM {coalesce_table}"), None),
+            ('COMMIT', None),
+            (f"DROP TABLE IF EXISTS {coalesce_table}", None)
+        ]
+        results = named_results([sql for sql, _ in statements], self.executor.execute_statements(statements))
+        removed = results['versions_removed'].rowcount
+        watermark = results['watermark'].rows[0][0]
+        result = {
+            'since': since,
+            'watermark': watermark if watermark is not None else since,
+            'versions_coalesced': results['versions_coalesced'].rowcount,
+            'versions_removed': removed,
+            'bytes_reclaimed': int(removed * row_bytes)
+        }
+
+        logger.info(
+            'Coalesced %s since %s: %d versions widened, %d removed (~%d bytes)',
+            self.conformed_table,
+            since,
+            result['versions_coalesced'],
+            removed,
+            result['bytes_reclaimed']
+        )
+        return result
+
+    def _get_average_row_bytes(self) -> float:
+        """
+        Estimate the stored size of one row of the conformed table.
+
+        Returns:
+            Average bytes per row from the table's metadata, 0 if unknown
+        """
+        *schema, table = self.conformed_table.upper().split('.')
+        result = self.executor.execute(
+            f"""
+        SELECT BYTES, ROW_COUNT
+        FROM INFORMATION_SCHEMA.TABLES
+        WHERE TABLE_NAME = ?
+        {'AND TABLE_SCHEMA = ?' if schema else ''}
+        """,
+            [table] + schema[-1:]
+        )
+        if not result.rows or not result.rows[0][1]:
+            return 0.0
+        table_bytes, row_count = result.rows[0]
+        return (table_bytes or 0) / row_count
+
+    def _get_coalesce_setup_query(self, coalesce_table: str, incremental: bool) -> str:
+        """
+        Generate SQL query that finds the runs of continuing versions.
+
+        Args:
+            coalesce_table: Name of the temporary table to create
+            incremental: Restrict the scan to keys with versions recorded
+                after a bound watermark
+
+        Returns:
+            SQL query creating a table with one row per version of every run
+            of at least two versions. Every row carries the latest SYSTEM_FROM
+            of its key and of all analysed versions; the versions recorded at
+            the latter are kept as well, so the watermark survives a pass
+            without runs.
+        """
+        keys = ', '.join(self.milestoner.business_keys)
+        order = f"PARTITION BY {keys} ORDER BY {VALID_FROM_COL}"
+        island = f"PARTITION BY {keys}, {ISLAND_COL} ORDER BY {VALID_FROM_COL}"
+        whole_island = f"{island} ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING"
+
+        version = f"PARTITION BY {keys}, {VALID_FROM_COL}"
+
+        touched = ''
+        source = f"{self.conformed_table} c"
+        if incremental:
+            touched = f"""touched AS (
+            SELECT DISTINCT {keys}
+            FROM {self.conformed_table}
+            WHERE {SYSTEM_FROM_COL} > ?
+        ),
+        """
+            source = f"""{self.conformed_table} c
+            JOIN touched USING ({keys})"""
+
+        columns = self.milestoner.business_keys + self.compared_columns + [
+            VALID_FROM_COL,
+            VALID_TO_COL,
+            SYSTEM_FROM_COL,
+            SYSTEM_TO_COL,
+            STAGING_GUID_COL
+        ]
+        lags = ''.join(
+            f"\n                LAG({col}) OVER ({order}) AS PREVIOUS_{col},"
+            for col in self.compared_columns
+        )
+        equal_data = ''.join(
+            f"\n                    AND PREVIOUS_{col} IS NOT DISTINCT FROM {col}"
+            for col in self.compared_columns
+        )
+        return f"""
+        CREATE TEMPORARY TABLE {coalesce_table} AS
+        WITH {touched}ranked AS (
+            SELECT
+                c.*,
+                RANK() OVER ({version} ORDER BY {SYSTEM_FROM_COL} DESC) AS {VERSION_RANK_COL},
+                COUNT(*) OVER ({version}) AS {VERSION_ROWS_COL}
+            FROM {source}
+        ),
+        versions AS (
+            SELECT
+                {', '.join(columns)}, {VERSION_ROWS_COL},
+                MAX({SYSTEM_FROM_COL}) OVER (PARTITION BY {keys}) AS {KEY_SYSTEM_FROM_COL},
+                MAX({SYSTEM_FROM_COL}) OVER () AS {ANALYSED_SYSTEM_FROM_COL},{lags}
+                LAG({VALID_TO_COL}) OVER ({order}) AS PREVIOUS_VALID_TO,
+                LAG({SYSTEM_TO_COL}) OVER ({order}) AS PREVIOUS_SYSTEM_TO
+            FROM ranked
+            WHERE {VERSION_RANK_COL} = 1
+            AND ({VALID_TO_COL} IS NULL OR {VALID_FROM_COL} < {VALID_TO_COL})
+        ),
+        flagged AS (
+            SELECT
+                versions.*,
+                COALESCE(
+                    {VERSION_ROWS_COL} = 1
+                    AND PREVIOUS_VALID_TO = {VALID_FROM_COL}
+                    AND PREVIOUS_SYSTEM_TO = {SYSTEM_FROM_COL}{equal_data},
+                    FALSE
+                ) AS {CONTINUES_PREVIOUS_COL}
+            FROM versions
+        ),
+        islands AS (
+            SELECT
+                flagged.*,
+                SUM(IFF({CONTINUES_PREVIOUS_COL}, 0, 1)) OVER ({order} ROWS UNBOUNDED PRECEDING) AS {ISLAND_COL}
+            FROM flagged
+        )
+        SELECT
+            {keys}, {VALID_FROM_COL}, {VALID_TO_COL}, {SYSTEM_FROM_COL}, {STAGING_GUID_COL}, {CONTINUES_PREVIOUS_COL},
+            FIRST_VALUE({STAGING_GUID_COL}) OVER ({whole_island}) AS {HEAD_GUID_COL},
+            FIRST_VALUE({VALID_FROM_COL}) OVER ({whole_island}) AS {HEAD_VALID_FROM_COL},
+            FIRST_VALUE({SYSTEM_FROM_COL}) OVER ({whole_island}) AS {HEAD_SYSTEM_FROM_COL},
+            LAST_VALUE({STAGING_GUID_COL}) OVER ({whole_island}) AS {LAST_GUID_COL},
+            LAST_VALUE({VALID_FROM_COL}) OVER ({whole_island}) AS {LAST_VALID_FROM_COL},
+            LAST_VALUE({SYSTEM_FROM_COL}) OVER ({whole_island}) AS {LAST_SYSTEM_FROM_COL},
+            LAST_VALUE({VALID_TO_COL}) OVER ({whole_island}) AS {COALESCED_VALID_TO_COL},
+            LAST_VALUE({SYSTEM_TO_COL}) OVER ({whole_island}) AS {COALESCED_SYSTEM_TO_COL},
+            COUNT(*) OVER (PARTITION BY {keys}, {ISLAND_COL}) AS {ISLAND_SIZE_COL},
+            {KEY_SYSTEM_FROM_COL},
+            {ANALYSED_SYSTEM_FROM_COL}
+        FROM islands
+        QUALIFY COUNT(*) OVER (PARTITION BY {keys}, {ISLAND_COL}) > 1
+        OR {SYSTEM_FROM_COL} = {ANALYSED_SYSTEM_FROM_COL}
+        """
+
+    def _get_version_match(self, alias: str, guid_col: str, valid_from_col: str, system_from_col: str) -> str:
+        """
+        Generate the predicate matching a conformed row to a coalescing row.
+
+        Args:
+            alias: Alias of the conformed table
+            guid_col: Column of the coalescing table holding the version's STAGING_GUID
+            valid_from_col: Column of the coalescing table holding the version's VALID_FROM
+            system_from_col: Column of the coalescing table holding the SYSTEM_FROM
+                of the version's latest row
+
+        Returns:
+            SQL predicate
+        """
+        keys = ' AND '.join(f"{alias}.{key} = s.{key}" for key in self.milestoner.business_keys)
+        return f"""{keys}
+            AND {alias}.{STAGING_GUID_COL} = s.{guid_col}
+            AND {alias}.{VALID_FROM_COL} = s.{valid_from_col}
+            AND {alias}.{SYSTEM_FROM_COL} = s.{system_from_col}"""
+
+    def _get_unchanged_key(self) -> str:
+        """
+        Generate the predicate requiring a key to have no version recorded after the analysis.
+
+        Returns:
+            SQL predicate over the coalescing row s
+        """
+        keys = ' AND '.join(f"newer.{key} = s.{key}" for key in self.milestoner.business_keys)
+        return f"""NOT EXISTS (
+            SELECT 1
+            FROM {self.conformed_table} newer
+            WHERE {keys}
+            AND newer.{SYSTEM_FROM_COL} > s.{KEY_SYSTEM_FROM_COL}
+        )"""
+
+    def _get_coalesce_update_query(self, coalesce_table: str) -> str:
+        """
+        Generate SQL query widening the first version of every run.
+
+        A run is only widened while its last version still ends where it
+        did during the analysis and no version of its key was recorded since.
+
+        Args:
+            coalesce_table: Name of the coalescing table
+
+        Returns:
+            SQL UPDATE statement
+        """
+        return f"""
+        UPDATE {self.conformed_table} t
+        SET {VALID_TO_COL} = s.{COALESCED_VALID_TO_COL},
+            {SYSTEM_TO_COL} = s.{COALESCED_SYSTEM_TO_COL}
+        FROM {coalesce_table} s
+        WHERE NOT s.{CONTINUES_PREVIOUS_COL}
+        AND s.{ISLAND_SIZE_COL} > 1
+        AND {self._get_version_match('t', STAGING_GUID_COL, VALID_FROM_COL, SYSTEM_FROM_COL)}
+        AND {self._get_unchanged_key()}
+        AND EXISTS (
+            SELECT 1
+            FROM {self.conformed_table} last_version
+            WHERE {self._get_version_match('last_version', LAST_GUID_COL, LAST_VALID_FROM_COL, LAST_SYSTEM_FROM_COL)}
+            AND last_version.{VALID_TO_COL} IS NOT DISTINCT FROM s.{COALESCED_VALID_TO_COL}
+        )"""
+
+    def _get_coalesce_delete_query(self, coalesce_table: str) -> str:
+        """
+        Generate SQL query deleting the versions absorbed by a widened first version.
+
+        Args:
+            coalesce_table: Name of the coalescing table
+
+        Returns:
+            SQL DELETE statement
+        """
+        return f"""
+        DELETE FROM {self.conformed_table} t
+        USING {coalesce_table} s
+        WHERE s.{CONTINUES_PREVIOUS_COL}
+        AND {self._get_version_match('t', STAGING_GUID_COL, VALID_FROM_COL, SYSTEM_FROM_COL)}
+        AND {self._get_unchanged_key()}
+        AND EXISTS (
+            SELECT 1
+            FROM {self.conformed_table} head
+            WHERE {self._get_version_match('head', HEAD_GUID_COL, HEAD_VALID_FROM_COL, HEAD_SYSTEM_FROM_COL)}
+            AND head.{VALID_TO_COL} IS NOT DISTINCT FROM s.{COALESCED_VALID_TO_COL}
+        )"""
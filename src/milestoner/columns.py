@@ -0,0 +1,19 @@
+STAGING_SCHEMA = 'STAGING'
+CONFORMED_SCHEMA = 'CONFORMED'
+
+# Global column names for temporal tracking
+VALID_FROM_COL = 'VALID_FROM'
+VALID_TO_COL = 'VALID_TO'
+SYSTEM_FROM_COL = 'SYSTEM_FROM'
+SYSTEM_TO_COL = 'SYSTEM_TO'
+ROW_CHECKSUM_COL = 'ROW_CHECKSUM'
+STAGING_GUID_COL = 'STAGING_GUID'
+BATCH_ID_COL = 'BATCH_ID'
+PROCESSED_DATETIME_COL = 'PROCESSED_DATETIME'
+ROW_ADDED_DATETIME_COL = 'ROW_ADDED_DATETIME'
+DATA_COL = 'DATA'
+LOCKED_COL = 'LOCKED'
+MILESTONING_FLAG_COL = 'MILESTONING_FLAG'
+
+# Column holding the start of the next version in a version chain
+NEXT_VALID_FROM_COL = 'NEXT_VALID_FROM'
@@ -0,0 +1,274 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .bitemporal_milestoner import (
+    BATCH_ID_COL,
+    LOCKED_COL,
+    MILESTONING_FLAG_COL,
+    PROCESSED_DATETIME_COL,
+    STAGING_SCHEMA,
+    BitemporalMilestoner
+)
+from .executor import QueryExecutor, name_result, named_results
+
+logger = logging.getLogger(__name__)
+
+# Suffix of the default archive table of a staging table
+ARCHIVE_TABLE_SUFFIX = '_ARCHIVE'
+
+# Result column of the candidate batch query holding the rows per batch
+ROW_COUNT_COL = 'ROW_COUNT'
+
+
+class StagingCompactor:
+    """
+    Archives processed staging rows and removes them from the staging table.
+
+    Rows whose batch was marked processed longer than retention_days ago are
+    copied into an archive table clustered by BATCH_ID (or unloaded to
+    compressed Parquet files partitioned by BATCH_ID) and deleted from staging,
+    a few batches per transaction. Duplicate and unchanged records are
+    archived with the batch that marked them processed. Rows without
+    PROCESSED_DATETIME are pending work and are never touched, and processed
+    rows are never locked again, so compaction does not conflict with running
+    batches. Archived batches can be restored into staging for replay.
+    """
+
+    def __init__(
+        self,
+        executor: QueryExecutor,
+        staging_table: str,
+        retention_days: float = 7.0,
+        chunk_rows: int = 100000,
+        archive_table: Optional[str] = None,
+        archive_stage: Optional[str] = None
+    ):
+        """
+        Initialize the StagingCompactor.
+
+        Args:
+            executor: Executor used to run the archive and delete statements
+            staging_table: Name of the staging table
+            retention_days: Days processed rows stay in staging
+            chunk_rows: Approximate number of rows archived per transaction;
+                a batch is never split across chunks
+            archive_table: Name of the archive table in the staging schema,
+                defaults to <staging_table>_ARCHIVE
+            archive_stage: Stage location (e.g. '@ARCHIVE/users') to unload
+                archived rows to as Parquet files instead of an archive table
+        """
+        if chunk_rows <= 0:
+            raise ValueError("chunk_rows must be positive")
+        if retention_days < 0:
+            raise ValueError("retention_days must not be negative")
+
+        self.executor = executor
+        self.staging_table = staging_table
+        self.retention_days = retention_days
+        self.chunk_rows = chunk_rows
+        self.archive_table = archive_table or f"{staging_table}{ARCHIVE_TABLE_SUFFIX}"
+        self.archive_stage = archive_stage.rstrip('/') if archive_stage else None
+
+    def create_archive_table(self) -> List[str]:
+        """
+        Create the archive table with the staging table's columns, clustered by BATCH_ID.
+
+        Returns:
+            The executed statements
+        """
+        archive = f"{STAGING_SCHEMA}.{self.archive_table}"
+        statements = [
+            f"CREATE TABLE IF NOT EXISTS {archive} LIKE {STAGING_SCHEMA}.{self.staging_table}",
+            f"ALTER TABLE {archive} CLUSTER BY ({BATCH_ID_COL})"
+        ]
+        for statement in statements:
+            self.executor.execute(statement)
+        return statements
+
+    def compact(self, current_time: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        Archive and delete the processed rows older than the retention window.
+
+        Args:
+            current_time: Time the retention window ends at, defaults to now
+
+        Returns:
+            Dictionary containing:
+                - cutoff: Rows processed before this time were eligible
+                - batches_archived: Number of batches archived
+                - rows_archived: Number of rows deleted from staging
+                - chunks: Number of archive transactions
+        """
+        cutoff = (current_time or datetime.now()) - timedelta(days=self.retention_days)
+        batches = self._get_candidate_batches(cutoff)
+        result = {'cutoff': cutoff, 'batches_archived': 0, 'rows_archived': 0, 'chunks': 0}
+
+        for chunk in self._get_chunks(batches):
+            result['rows_archived'] += self._archive_chunk(chunk)
+            result['batches_archived'] += len(chunk)
+            result['chunks'] += 1
+
+        logger.info(
+            'Compacted %s: archived %d rows of %d batches processed before %s',
+            self.staging_table,
+            result['rows_archived'],
+            result['batches_archived'],
+            cutoff
+        )
+        return result
+
+    def restore(self, batch_ids: Sequence[str], milestoner: BitemporalMilestoner) -> int:
+        """
+        Move archived batches back into staging as unprocessed rows for replay.
+
+        Only available with an archive table. Replayed records are older than
+        the versions merged since, and the standard MERGE would close the open
+        versions and reopen their stale data, so the milestoner replaying them
+        must split history. Restored rows keep their ROW_ADDED_DATETIME, which
+        a watermark queue has passed, so with a pending queue they are queued
+        in the same transaction.
+
+        Args:
+            batch_ids: IDs of the archived batches
+            milestoner: Milestoner that replays the batches
+
+        Returns:
+            Number of rows restored
+        """
+        if self.archive_stage is not None:
+            raise ValueError("Batches unloaded to a stage cannot be restored")
+        if milestoner.history_splitter is None:
+            raise ValueError("Restored batches must be replayed by a milestoner with split_history")
+        if not batch_ids:
+            return 0
+        staging = f"{STAGING_SCHEMA}.{self.staging_table}"
+        archive = f"{STAGING_SCHEMA}.{self.archive_table}"
+        batches, params = self._get_batch_filter(batch_ids)
+        statements = [
+            ('BEGIN', None),
+            (name_result('rows_restored', f"INSERT INTO {staging} SELECT * FROM {archive} WHERE {batches}"), params)
+        ]
+        if milestoner.pending_queue is not None:
+            requeue = milestoner.pending_queue.get_requeue_query(self.staging_table, archive, batches)
+            statements.append((requeue, params))
+        statements += [
+            (
+                f"""
+            UPDATE {staging}
+            SET {PROCESSED_DATETIME_COL} = NULL,
+                {MILESTONING_FLAG_COL} = NULL,
+                {LOCKED_COL} = NULL,
+                {BATCH_ID_COL} = NULL
+            WHERE {batches}""",
+                params
+            ),
+            (f"DELETE FROM {archive} WHERE {batches}", params),
+            ('COMMIT', None)
+        ]
+        results = named_results([sql for sql, _ in statements], self.executor.execute_statements(statements))
+        restored = results['rows_restored'].rowcount
+        logger.info('Restored %d rows of %d batches into %s', restored, len(batch_ids), staging)
+        return restored
+
+    def _get_candidate_batches(self, cutoff: datetime) -> List[Tuple[str, int]]:
+        """
+        Find the batches whose rows are eligible for archival.
+
+        Args:
+            cutoff: Rows processed before this time are eligible
+
+        Returns:
+            List of (batch ID, row count), oldest batch first
+        """
+        result = self.executor.execute(
+            f"""
+        SELECT {BATCH_ID_COL}, COUNT(*) AS {ROW_COUNT_COL}
+        FROM {STAGING_SCHEMA}.{self.staging_table}
+        WHERE {PROCESSED_DATETIME_COL} < ?
+        AND {BATCH_ID_COL} IS NOT NULL
+        GROUP BY {BATCH_ID_COL}
+        ORDER BY MIN({PROCESSED_DATETIME_COL}) ASC""",
+            [str(cutoff)]
+        )
+        return [(row[0], int(row[1])) for row in result.rows]
+
+    def _get_chunks(self, batches: List[Tuple[str, int]]) -> List[List[str]]:
+        """
+        Group batches into chunks of about chunk_rows rows.
+
+        Args:
+            batches: List of (batch ID, row count)
+
+        Returns:
+            Batch IDs per chunk
+        """
+        chunks: List[List[str]] = []
+        rows = 0
+        for batch_id, count in batches:
+            if not chunks or rows + count > self.chunk_rows:
+                chunks.append([])
+                rows = 0
+            chunks[-1].append(batch_id)
+            rows += count
+        return chunks
+
+    def _archive_chunk(self, batch_ids: List[str]) -> int:
+        """
+        Archive and delete the rows of a chunk of batches.
+
+        With an archive table both statements run in one transaction. Files
+        are unloaded before the transaction that deletes the rows, so a failed
+        delete leaves the rows in staging and in the archive files, and the
+        next compaction unloads them again (archival is at least once).
+
+        Args:
+            batch_ids: IDs of the batches in the chunk
+
+        Returns:
+            Number of rows deleted from staging
+        """
+        staging = f"{STAGING_SCHEMA}.{self.staging_table}"
+        batches, params = self._get_batch_filter(batch_ids)
+        processed = f"{batches} AND {PROCESSED_DATETIME_COL} IS NOT NULL"
+        if self.archive_stage is None:
+            archive = (
+                f"INSERT INTO {STAGING_SCHEMA}.{self.archive_table} SELECT * FROM {staging} WHERE {processed}"
+            )
+        else:
+            archive = f"""
+            COPY INTO {self.archive_stage}/
+            FROM (SELECT * FROM {staging} WHERE {processed})
+            PARTITION BY ('{BATCH_ID_COL}=' || {BATCH_ID_COL})
+            FILE_FORMAT = (TYPE = PARQUET COMPRESSION = SNAPPY)
+            HEADER = TRUE"""
+        archive_statement = (name_result('rows_archived', archive), params)
+        statements = [
+            ('BEGIN', None),
+            (name_result('rows_deleted', f"DELETE FROM {staging} WHERE {processed}"), params),
+            ('COMMIT', None)
+        ]
+        # Unloading files is not transactional, so it runs before the delete's transaction
+        statements.insert(1 if self.archive_stage is None else 0, archive_statement)
+        results = named_results([sql for sql, _ in statements], self.executor.execute_statements(statements))
+        deleted = results['rows_deleted'].rowcount
+        logger.debug(
+            'Archived %d rows (%d deleted) of batches %s',
+            results['rows_archived'].rowcount,
+            deleted,
+            batch_ids
+        )
+        return deleted
+
+    def _get_batch_filter(self, batch_ids: Sequence[str]) -> Tuple[str, List[str]]:
+        """
+        Generate a predicate selecting the rows of some batches.
+
+        Args:
+            batch_ids: IDs of the batches
+
+        Returns:
+            Tuple of (SQL predicate with bind placeholders, parameters)
+        """
+        placeholders = ', '.join('?' for _ in batch_ids)
+        return f"{BATCH_ID_COL} IN ({placeholders})", list(batch_ids)
@@ -0,0 +1,712 @@
+import hashlib
+import logging
+import re
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .bitemporal_milestoner import STAGING_SCHEMA
+from .executor import QueryResult, SQLiteExecutor
+
+logger = logging.getLogger(__name__)
+
+# Result columns reported by an emulated MERGE, as Snowflake names them
+MERGE_RESULT_COLUMNS = ('number of rows inserted', 'number of rows updated', 'number of rows deleted')
+
+# Temporary tables used to apply one MERGE statement
+MERGE_SOURCE_TABLE = 'temp.MILESTONE_MERGE_SOURCE'
+MERGE_MATCH_TABLE = 'temp.MILESTONE_MERGE_MATCHES'
+MERGE_CLAUSE_TABLE = 'temp.MILESTONE_MERGE_CLAUSE'
+
+# Column numbering the materialized source rows of a MERGE
+SOURCE_ROW_COL = 'MILESTONE_SOURCE_ROW'
+
+# Column holding the QUALIFY condition of a rewritten query
+QUALIFY_COL = 'MILESTONE_QUALIFY'
+
+# Seconds per unit of DATEADD and DATEDIFF
+DATE_PART_SECONDS = {
+    'millisecond': 0.001,
+    'second': 1,
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400
+}
+
+# Variant path extract, e.g. DATA:firstName::STRING
+VARIANT_EXTRACT = re.compile(r'\b(\w+):([A-Za-z_]\w*(?:\.\w+)*)::(\w+)(?:\(\d+(?:,\s*\d+)?\))?')
+
+# Cast suffix, e.g. '2024-01-01'::TIMESTAMP_NTZ
+CAST_SUFFIX = re.compile(r'::\w+(?:\(\d+(?:,\s*\d+)?\))?')
+
+# Snowflake types extracted from a variant as numbers
+NUMERIC_TYPES = {'NUMBER', 'NUMERIC', 'DECIMAL', 'INT', 'INTEGER', 'BIGINT', 'FLOAT', 'DOUBLE', 'REAL'}
+
+# Code-level rewrites of Snowflake functions and keywords SQLite spells differently
+REWRITES = [
+    (re.compile(r'\bCREATE\s+TEMPORARY\s+TABLE\b', re.IGNORECASE), 'CREATE TABLE'),
+    (re.compile(r'\bIFF\s*\(', re.IGNORECASE), 'IIF('),
+    (re.compile(r'\bCURRENT_TIMESTAMP\b(\s*\(\s*\))?', re.IGNORECASE), 'SNOWFLAKE_NOW()')
+]
+
+
+class SnowflakeEmulator(SQLiteExecutor):
+    """
+    SQLiteExecutor that runs the milestoner's Snowflake SQL for offline tests.
+
+    Statements are translated to SQLite before they run: MERGE is applied as
+    a match table followed by UPDATE/DELETE and INSERT statements, QUALIFY
+    becomes a filter over a subquery, DELETE ... USING becomes a correlated
+    EXISTS, variant extracts read the JSON text with json_extract, casts are
+    dropped and HASH, MOD, GREATEST, LEAST, DATEADD, DATEDIFF and UUID_STRING
+    are provided as functions. Session variables set with SET are kept per
+    connection. Every schema besides the default one (STAGING, by default)
+    is attached as its own database.
+
+    The emulation covers the statements of the standard pipeline, version
+    chaining, history splitting, the watermark queue, leases and the
+    maintenance jobs. Snowflake Scripting blocks (the fused pipeline),
+    streams and RESULT_SCAN are not emulated.
+    """
+
+    def __init__(self, database: str = ':memory:', schemas: Sequence[str] = (STAGING_SCHEMA,), **kwargs: Any):
+        """
+        Initialize the SnowflakeEmulator.
+
+        Args:
+            database: Path of the database file, or ':memory:' for a private
+                in-memory database shared by all pooled connections
+            schemas: Schemas attached next to the default one
+            **kwargs: Pool and retry options forwarded to QueryExecutor
+        """
+        self.schemas = list(schemas)
+        self._variables: Dict[int, Dict[str, Any]] = {}
+        super().__init__(database, **kwargs)
+
+    def _connect(self) -> Any:
+        conn = super()._connect()
+        for schema in self.schemas:
+            if 'mode=memory' in self.database:
+                attached = self.database.replace('?', f'-{schema.lower()}?', 1)
+            else:
+                attached = f"{self.database}.{schema.lower()}"
+            conn.execute(f"ATTACH DATABASE '{attached}' AS {schema}")
+        conn.create_function('HASH', -1, _hash, deterministic=True)
+        conn.create_function('MOD', 2, _mod, deterministic=True)
+        conn.create_function('GREATEST', -1, _greatest, deterministic=True)
+        conn.create_function('LEAST', -1, _least, deterministic=True)
+        conn.create_function('DATEADD', 3, _dateadd, deterministic=True)
+        conn.create_function('DATEDIFF', 3, _datediff, deterministic=True)
+        conn.create_function('UUID_STRING', 0, lambda: str(uuid.uuid4()))
+        conn.create_function('SNOWFLAKE_NOW', 0, lambda: str(datetime.now()))
+        return conn
+
+    def _run(self, conn: Any, sql: str, params: Optional[Sequence[Any]] = None) -> QueryResult:
+        statement = sql.strip().rstrip(';').strip()
+        masked = _mask(statement)
+        statement = statement[len(masked) - len(masked.lstrip()):]
+        head = _mask(statement).upper().split(None, 4)
+        if head[:2] == ['EXECUTE', 'IMMEDIATE'] or 'RESULT_SCAN' in _mask(statement).upper():
+            raise NotImplementedError('Snowflake Scripting blocks are not emulated')
+        if head[:2] == ['CREATE', 'STREAM'] or head[:4] == ['CREATE', 'OR', 'REPLACE', 'STREAM']:
+            raise NotImplementedError('Streams are not emulated')
+
+        statement = self._substitute_variables(conn, translate(statement))
+        if head and head[0] == 'SET':
+            return self._set_variables(conn, statement, params)
+        if head and head[0] == 'MERGE':
+            return self._merge(conn, statement, params)
+        return super()._run(conn, statement, params)
+
+    def _substitute_variables(self, conn: Any, sql: str) -> str:
+        """
+        Replace $NAME references with the values of the connection's session variables.
+
+        Args:
+            conn: Connection the statement runs on
+            sql: Translated statement
+
+        Returns:
+            Statement with the variables inlined as literals
+        """
+        variables = self._variables.get(id(conn), {})
+
+        def substitute(match: 're.Match') -> str:
+            name = match.group(1).upper()
+            if name not in variables:
+                raise ValueError(f"Session variable {name} is not set")
+            return _literal(variables[name])
+
+        return _replace_code(sql, re.compile(r'\$([A-Za-z_]\w*)'), substitute)
+
+    def _set_variables(self, conn: Any, sql: str, params: Optional[Sequence[Any]]) -> QueryResult:
+        """
+        Emulate SET of one or more session variables.
+
+        Args:
+            conn: Connection the statement runs on
+            sql: Translated SET statement
+            params: Bind parameters of the statement
+
+        Returns:
+            Empty QueryResult
+        """
+        match = re.match(r'SET\s*(\((?P<names>[^)]*)\)|(?P<name>\w+))\s*=\s*(?P<value>.*)$', sql, re.IGNORECASE | re.DOTALL)
+        if match is None:
+            raise NotImplementedError(f"Unsupported SET statement: {sql}")
+        names = [
+            name.strip().upper()
+            for name in (match.group('names') or match.group('name')).split(',')
+        ]
+        value = match.group('value').strip()
+        if names and match.group('names') is not None and value.startswith('('):
+            value = value[1:-1]
+        if not re.match(r'\s*SELECT\b', value, re.IGNORECASE):
+            value = f"SELECT {value}"
+        row = super()._run(conn, value, params).rows[0]
+        self._variables.setdefault(id(conn), {}).update(zip(names, row))
+        return QueryResult()
+
+    def _merge(self, conn: Any, sql: str, params: Optional[Sequence[Any]]) -> QueryResult:
+        """
+        Emulate a MERGE statement.
+
+        The source rows are materialized and matched against the target
+        before any row changes, like Snowflake evaluates the ON clause once.
+        Every matched row is handled by the first WHEN MATCHED clause whose
+        condition holds and every unmatched source row by the first WHEN NOT
+        MATCHED clause whose condition holds.
+
+        Args:
+            conn: Connection the statement runs on
+            sql: Translated MERGE statement
+            params: Bind parameters of the statement
+
+        Returns:
+            QueryResult with the inserted, updated and deleted row counts
+        """
+        merge = _parse_merge(sql, list(params or []))
+        target, alias = merge['target'], merge['alias']
+        source, source_alias = merge['source'], merge['source_alias']
+        counts = dict.fromkeys(MERGE_RESULT_COLUMNS, 0)
+        self._drop_merge_tables(conn)
+        try:
+            conn.execute(
+                f"CREATE TABLE {MERGE_SOURCE_TABLE} AS SELECT ROW_NUMBER() OVER () AS {SOURCE_ROW_COL}, * FROM {source[0]}",
+                source[1]
+            )
+            on, on_params = merge['on']
+            conn.execute(
+                f"""
+            CREATE TABLE {MERGE_MATCH_TABLE} AS
+            SELECT {source_alias}.{SOURCE_ROW_COL} AS SOURCE_ROW, {alias}.rowid AS TARGET_ROW
+            FROM {MERGE_SOURCE_TABLE} AS {source_alias}
+            JOIN {target} AS {alias} ON {on}""",
+                on_params
+            )
+
+            # Decide every matched row's clause before any row changes
+            matched = [clause for clause in merge['clauses'] if clause['matched']]
+            for position, clause in enumerate(matched):
+                condition, condition_params = clause['condition'] or ('TRUE', [])
+                conn.execute(
+                    f"""
+            CREATE TABLE {MERGE_CLAUSE_TABLE}_{position} AS
+            SELECT m.SOURCE_ROW, m.TARGET_ROW
+            FROM {MERGE_MATCH_TABLE} m
+            JOIN {MERGE_SOURCE_TABLE} AS {source_alias} ON {source_alias}.{SOURCE_ROW_COL} = m.SOURCE_ROW
+            JOIN {target} AS {alias} ON {alias}.rowid = m.TARGET_ROW
+            WHERE ({condition})
+            {''.join(
+                f" AND m.TARGET_ROW NOT IN (SELECT TARGET_ROW FROM {MERGE_CLAUSE_TABLE}_{earlier})"
+                for earlier in range(position)
+            )}""",
+                    condition_params
+                )
+            for position, clause in enumerate(matched):
+                action, action_params = clause['action']
+                if action.upper().startswith('DELETE'):
+                    counts['number of rows deleted'] += conn.execute(
+                        f"DELETE FROM {target} WHERE rowid IN (SELECT TARGET_ROW FROM {MERGE_CLAUSE_TABLE}_{position})"
+                    ).rowcount
+                    continue
+                assignments = re.sub(r'^UPDATE\s+SET\s+', '', action, flags=re.IGNORECASE)
+                counts['number of rows updated'] += conn.execute(
+                    f"""
+            UPDATE {target} AS {alias}
+            SET {assignments}
+            FROM {MERGE_SOURCE_TABLE} AS {source_alias}, {MERGE_CLAUSE_TABLE}_{position} c
+            WHERE c.TARGET_ROW = {alias}.rowid AND c.SOURCE_ROW = {source_alias}.{SOURCE_ROW_COL}""",
+                    action_params
+                ).rowcount
+
+            earlier: List[Tuple[str, List[Any]]] = []
+            for clause in merge['clauses']:
+                if clause['matched']:
+                    continue
+                condition, condition_params = clause['condition'] or ('TRUE', [])
+                insert = re.match(
+                    r'INSERT\s*\((?P<columns>.*?)\)\s*VALUES\s*\((?P<values>.*)\)$',
+                    clause['action'][0],
+                    re.IGNORECASE | re.DOTALL
+                )
+                if insert is None:
+                    raise NotImplementedError(f"Unsupported MERGE action: {clause['action'][0]}")
+                counts['number of rows inserted'] += conn.execute(
+                    f"""
+            INSERT INTO {target} ({insert.group('columns')})
+            SELECT {insert.group('values')}
+            FROM {MERGE_SOURCE_TABLE} AS {source_alias}
+            WHERE {source_alias}.{SOURCE_ROW_COL} NOT IN (SELECT SOURCE_ROW FROM {MERGE_MATCH_TABLE})
+            AND ({condition}){''.join(f" AND NOT ({previous})" for previous, _ in earlier)}""",
+                    clause['action'][1] + condition_params + [
+                        param for _, previous_params in earlier for param in previous_params
+                    ]
+                ).rowcount
+                earlier.append((condition, condition_params))
+        finally:
+            self._drop_merge_tables(conn)
+
+        columns = list(MERGE_RESULT_COLUMNS[:2])
+        if any(clause['action'][0].upper().startswith('DELETE') for clause in merge['clauses']):
+            columns.append(MERGE_RESULT_COLUMNS[2])
+        return QueryResult(
+            rowcount=sum(counts.values()),
+            columns=columns,
+            rows=[tuple(counts[column] for column in columns)]
+        )
+
+    def _drop_merge_tables(self, conn: Any) -> None:
+        """
+        Drop the temporary tables of an emulated MERGE.
+
+        Args:
+            conn: Connection the MERGE runs on
+        """
+        tables = [
+            name for (name,) in conn.execute(
+                "SELECT name FROM temp.sqlite_master WHERE type = 'table' AND name LIKE 'MILESTONE_MERGE_%'"
+            ).fetchall()
+        ]
+        for name in tables:
+            conn.execute(f"DROP TABLE IF EXISTS temp.{name}")
+
+
+def translate(sql: str) -> str:
+    """
+    Translate one Snowflake statement to SQLite.
+
+    Args:
+        sql: Snowflake statement without a trailing semicolon
+
+    Returns:
+        Equivalent SQLite statement (MERGE and SET are left for the executor)
+    """
+    def extract(match: 're.Match') -> str:
+        column, path, cast = match.groups()
+        expression = f"json_extract({column}, '$.{path}')"
+        if cast.upper() in NUMERIC_TYPES:
+            return f"CAST({expression} AS NUMERIC)"
+        return expression
+
+    sql = _replace_code(sql, VARIANT_EXTRACT, extract)
+    sql = _replace_code(sql, CAST_SUFFIX, '')
+    for pattern, replacement in REWRITES:
+        sql = _replace_code(sql, pattern, replacement)
+
+    like = re.match(r'CREATE\s+TABLE\s+(IF\s+NOT\s+EXISTS\s+)?([\w.]+)\s+LIKE\s+([\w.]+)$', sql, re.IGNORECASE)
+    if like:
+        return f"CREATE TABLE {like.group(1) or ''}{like.group(2)} AS SELECT * FROM {like.group(3)} WHERE 0"
+    sql = re.sub(
+        r'^UPDATE\s+([\w.]+)\s+(?!SET\b)(?!AS\b)(\w+)\s+SET\b',
+        r'UPDATE \1 AS \2 SET',
+        sql,
+        flags=re.IGNORECASE
+    )
+    sql = _rewrite_delete_using(sql)
+    return _rewrite_qualify(sql)
+
+
+def _mask(sql: str) -> str:
+    """
+    Blank out string literals, quoted identifiers and comments, keeping positions.
+
+    Args:
+        sql: SQL text
+
+    Returns:
+        Text of the same length where only code is left
+    """
+    masked = []
+    i = 0
+    while i < len(sql):
+        char = sql[i]
+        if char in ("'", '"'):
+            end = sql.find(char, i + 1)
+            while end != -1 and sql.startswith(char * 2, end):
+                end = sql.find(char, end + 2)
+            end = len(sql) if end == -1 else end + 1
+            masked.append(char + '_' * (end - i - 2) + char if end - i >= 2 else char)
+            i = end
+        elif sql.startswith('--', i):
+            end = sql.find('\n', i)
+            end = len(sql) if end == -1 else end
+            masked.append(' ' * (end - i))
+            i = end
+        else:
+            masked.append(char)
+            i += 1
+    return ''.join(masked)
+
+
+def _depths(masked: str) -> List[int]:
+    """
+    Compute the parenthesis depth before every position of masked SQL.
+
+    Args:
+        masked: Output of _mask
+
+    Returns:
+        Depth per position
+    """
+    depths = []
+    depth = 0
+    for char in masked:
+        depths.append(depth)
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+    return depths
+
+
+def _replace_code(sql: str, pattern: 're.Pattern', replacement: Any) -> str:
+    """
+    Apply a regex substitution to the code of a statement, leaving literals alone.
+
+    Args:
+        sql: SQL text
+        pattern: Compiled pattern
+        replacement: Replacement string or function
+
+    Returns:
+        SQL text with the matches in code replaced
+    """
+    masked = _mask(sql)
+    result = []
+    last = 0
+    for match in pattern.finditer(masked):
+        original = pattern.match(sql, match.start(), match.end())
+        if original is None or original.end() != match.end():
+            continue
+        result.append(sql[last:match.start()])
+        result.append(replacement(original) if callable(replacement) else original.expand(replacement))
+        last = match.end()
+    result.append(sql[last:])
+    return ''.join(result)
+
+
+def _find_top_level(sql: str, pattern: str, start: int = 0, end: Optional[int] = None, depth: int = 0) -> List[int]:
+    """
+    Find the positions of a keyword at one parenthesis depth.
+
+    Args:
+        sql: SQL text
+        pattern: Regex of the keyword
+        start: First position searched
+        end: Position the search stops at
+        depth: Parenthesis depth the keyword must be at
+
+    Returns:
+        Start positions of the matches
+    """
+    masked = _mask(sql)
+    depths = _depths(masked)
+    end = len(sql) if end is None else end
+    return [
+        match.start()
+        for match in re.finditer(pattern, masked[:end], re.IGNORECASE)
+        if match.start() >= start and depths[match.start()] == depth
+    ]
+
+
+def _split_top_level(text: str, separator: str = ',') -> List[str]:
+    """
+    Split SQL text on a separator outside parentheses and literals.
+
+    Args:
+        text: SQL text
+        separator: Single-character separator
+
+    Returns:
+        Stripped parts
+    """
+    masked = _mask(text)
+    depths = _depths(masked)
+    parts = []
+    last = 0
+    for i, char in enumerate(masked):
+        if char == separator and depths[i] == 0:
+            parts.append(text[last:i].strip())
+            last = i + 1
+    parts.append(text[last:].strip())
+    return parts
+
+
+def _count_markers(text: str) -> int:
+    """
+    Count the bind markers in SQL text.
+
+    Args:
+        text: SQL text
+
+    Returns:
+        Number of ? markers outside literals
+    """
+    return _mask(text).count('?')
+
+
+def _rewrite_delete_using(sql: str) -> str:
+    """
+    Rewrite DELETE ... USING as a DELETE with a correlated EXISTS.
+
+    Args:
+        sql: SQL statement
+
+    Returns:
+        Rewritten statement
+    """
+    match = re.match(
+        r'DELETE\s+FROM\s+([\w.]+)(?:\s+(?!USING\b)(\w+))?\s+USING\s+',
+        sql,
+        re.IGNORECASE
+    )
+    if match is None:
+        return sql
+    where = _find_top_level(sql, r'\bWHERE\b', match.end())
+    if not where:
+        raise NotImplementedError('DELETE ... USING without WHERE is not emulated')
+    target, alias = match.groups()
+    source = sql[match.end():where[0]].strip()
+    condition = sql[where[0] + len('WHERE'):].strip()
+    target_alias = f" AS {alias}" if alias else ''
+    return f"DELETE FROM {target}{target_alias} WHERE EXISTS (SELECT 1 FROM {source} WHERE {condition})"
+
+
+def _rewrite_qualify(sql: str) -> str:
+    """
+    Rewrite every QUALIFY clause as a filter over a subquery.
+
+    SELECT <list> <rest> QUALIFY <condition> becomes
+    SELECT <names> FROM (SELECT <list>, (<condition>) AS MILESTONE_QUALIFY <rest>) WHERE MILESTONE_QUALIFY,
+    where <names> are the output names of <list>.
+
+    Args:
+        sql: SQL statement
+
+    Returns:
+        Statement without QUALIFY
+    """
+    while True:
+        masked = _mask(sql)
+        depths = _depths(masked)
+        match = re.search(r'\bQUALIFY\b', masked, re.IGNORECASE)
+        if match is None:
+            return sql
+        qualify = match.start()
+        depth = depths[qualify]
+
+        region_start = 0
+        for i in range(qualify - 1, -1, -1):
+            if masked[i] == '(' and depths[i] == depth - 1:
+                region_start = i + 1
+                break
+        region_end = len(sql)
+        for i in range(qualify, len(sql)):
+            if masked[i] == ')' and depths[i] == depth:
+                region_end = i
+                break
+
+        selects = [m.start() for m in re.finditer(r'\bSELECT\b', masked[region_start:qualify], re.IGNORECASE)
+                   if depths[region_start + m.start()] == depth]
+        if not selects:
+            raise NotImplementedError('QUALIFY without SELECT is not emulated')
+        select = region_start + selects[-1]
+        froms = [m.start() for m in re.finditer(r'\bFROM\b', masked[select:qualify], re.IGNORECASE)
+                 if depths[select + m.start()] == depth]
+        if not froms:
+            raise NotImplementedError('QUALIFY without FROM is not emulated')
+        from_clause = select + froms[0]
+
+        clause_end = region_end
+        for m in re.finditer(r'\b(UNION|EXCEPT|INTERSECT|ORDER\s+BY|LIMIT)\b', masked[qualify:region_end], re.IGNORECASE):
+            if depths[qualify + m.start()] == depth:
+                clause_end = qualify + m.start()
+                break
+
+        select_list = sql[select + len('SELECT'):from_clause].strip()
+        rest = sql[from_clause:qualify].rstrip()
+        condition = sql[qualify + len('QUALIFY'):clause_end].strip()
+        names = _get_output_names(select_list, rest)
+        replacement = (
+            f"SELECT {', '.join(names)} FROM (SELECT {select_list}, ({condition}) AS {QUALIFY_COL} {rest}) "
+            f"WHERE {QUALIFY_COL} "
+        )
+        sql = sql[:select] + replacement + sql[clause_end:]
+
+
+def _get_output_names(select_list: str, from_clause: str) -> List[str]:
+    """
+    Get the output column names of a select list.
+
+    Stars are expanded when the FROM clause reads a single subquery whose
+    own names can be resolved.
+
+    Args:
+        select_list: Text between SELECT and FROM
+        from_clause: Text from FROM to the end of the query
+
+    Returns:
+        Column names in order
+    """
+    select_list = re.sub(r'^DISTINCT\s+', '', select_list, flags=re.IGNORECASE)
+    names = []
+    for item in _split_top_level(select_list):
+        if item == '*' or re.fullmatch(r'\w+\.\*', item):
+            names.extend(_get_subquery_names(from_clause))
+            continue
+        aliases = _find_top_level(item, r'\bAS\b')
+        if aliases:
+            names.append(item[aliases[-1] + len('AS'):].strip())
+        elif re.fullmatch(r'\w+(\.\w+)*', item):
+            names.append(item.split('.')[-1])
+        else:
+            raise NotImplementedError(f"Select item without a name cannot be emulated: {item}")
+    return names
+
+
+def _get_subquery_names(from_clause: str) -> List[str]:
+    """
+    Get the output names of the single subquery a FROM clause reads.
+
+    Args:
+        from_clause: Text starting with FROM
+
+    Returns:
+        Column names of the subquery
+    """
+    masked = _mask(from_clause)
+    match = re.match(r'FROM\s*\(', masked, re.IGNORECASE)
+    if match is None:
+        raise NotImplementedError('Stars are only expanded over a subquery')
+    depths = _depths(masked)
+    opening = match.end() - 1
+    closing = next(i for i in range(opening + 1, len(masked)) if masked[i] == ')' and depths[i] == 1)
+    subquery = from_clause[opening + 1:closing]
+    selects = _find_top_level(subquery, r'\bSELECT\b')
+    select = selects[-1]
+    froms = _find_top_level(subquery, r'\bFROM\b', select)
+    return _get_output_names(subquery[select + len('SELECT'):froms[0]].strip(), subquery[froms[0]:])
+
+
+def _parse_merge(sql: str, params: List[Any]) -> Dict[str, Any]:
+    """
+    Split a MERGE statement into its parts, each with its own bind parameters.
+
+    Args:
+        sql: Translated MERGE statement
+        params: Bind parameters of the whole statement
+
+    Returns:
+        Dictionary with target, alias, source, source_alias, on and clauses
+    """
+    head = re.match(r'MERGE\s+INTO\s+([\w.]+)(?:\s+(?:AS\s+)?(?!USING\b)(\w+))?\s+USING\s+', sql, re.IGNORECASE)
+    if head is None:
+        raise NotImplementedError(f"Unsupported MERGE statement: {sql}")
+    target, alias = head.groups()
+    on = _find_top_level(sql, r'\bON\b', head.end())[0]
+    whens = _find_top_level(sql, r'\bWHEN\b', on)
+
+    def take(text: str) -> Tuple[str, List[Any]]:
+        count = _count_markers(text)
+        taken = params[:count]
+        del params[:count]
+        return text, taken
+
+    source_text = sql[head.end():on].strip()
+    source_match = re.match(r'(.*?)\s+(?:AS\s+)?(\w+)$', source_text, re.IGNORECASE | re.DOTALL)
+    source, source_alias = source_match.groups()
+    parsed = {
+        'target': target,
+        'alias': alias or target.split('.')[-1],
+        'source': take(source),
+        'source_alias': source_alias,
+        'on': take(sql[on + len('ON'):whens[0]].strip()),
+        'clauses': []
+    }
+    for position, start in enumerate(whens):
+        end = whens[position + 1] if position + 1 < len(whens) else len(sql)
+        clause = sql[start:end].strip()
+        then = _find_top_level(clause, r'\bTHEN\b')[0]
+        header = re.match(r'WHEN\s+(NOT\s+)?MATCHED(?:\s+AND\s+(.*))?$', clause[:then].strip(), re.IGNORECASE | re.DOTALL)
+        condition = take(header.group(2)) if header.group(2) else None
+        parsed['clauses'].append({
+            'matched': header.group(1) is None,
+            'condition': condition,
+            'action': take(clause[then + len('THEN'):].strip())
+        })
+    return parsed
+
+
+def _literal(value: Any) -> str:
+    """
+    Render a Python value as a SQL literal.
+
+    Args:
+        value: Value of a session variable
+
+    Returns:
+        SQL literal
+    """
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _hash(*values: Any) -> int:
+    digest = hashlib.blake2b(repr(values).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def _mod(dividend: Any, divisor: Any) -> Any:
+    if dividend is None or divisor is None:
+        return None
+    remainder = abs(dividend) % abs(divisor)
+    return -remainder if dividend < 0 else remainder
+
+
+def _greatest(*values: Any) -> Any:
+    return None if any(value is None for value in values) else max(values)
+
+
+def _least(*values: Any) -> Any:
+    return None if any(value is None for value in values) else min(values)
+
+
+def _to_datetime(value: Any) -> datetime:
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+
+def _dateadd(part: str, amount: Any, value: Any) -> Optional[str]:
+    if value is None or amount is None:
+        return None
+    return str(_to_datetime(value) + timedelta(seconds=DATE_PART_SECONDS[part.lower()] * amount))
+
+
+def _datediff(part: str, start: Any, end: Any) -> Optional[int]:
+    if start is None or end is None:
+        return None
+    seconds = (_to_datetime(end) - _to_datetime(start)).total_seconds()
+    return int(seconds / DATE_PART_SECONDS[part.lower()])
@@ -0,0 +1,621 @@
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Type, Union
+
+logger = logging.getLogger(__name__)
+
+# Snowflake error numbers that are safe to retry (session expiry, throttling,
+# warehouse resume and dropped network connections).
+SNOWFLAKE_TRANSIENT_ERRNOS = {
+    604,     # statement aborted (e.g. warehouse suspended mid-query)
+    608,     # warehouse resizing / resuming
+    250001,  # could not connect
+    250003,  # failed to get the response
+    390114,  # authentication token expired
+}
+
+# Transient errors after which the statement may already have been applied
+# (the request reached the warehouse but the response was lost).
+SNOWFLAKE_UNKNOWN_OUTCOME_ERRNOS = {
+    250003,
+}
+
+# Comment opening a statement that fences its transaction: when the statement
+# affects no rows, the transaction is rolled back and the statements fail
+FENCE_COMMENT = '-- Fence:'
+
+# Comment naming the result of a statement in a script (see named_results)
+RESULT_COMMENT = '-- Result:'
+_RESULT_NAME = re.compile(rf'^\s*{re.escape(RESULT_COMMENT)} (\w+)', re.MULTILINE)
+
+# Leading keywords of statements that can be re-run without changing data
+READ_ONLY_STATEMENT = re.compile(r'^\s*(SELECT|WITH|SHOW|DESCRIBE|DESC|EXPLAIN)\b', re.IGNORECASE)
+
+
+@dataclass
+class QueryResult:
+    """
+    Outcome of a single executed statement.
+
+    Attributes:
+        rowcount: Number of rows affected (or returned) as reported by the driver
+        columns: Column names of the result set, if any
+        rows: Fetched result rows, if any
+        query_id: Warehouse query ID, if the driver exposes one
+    """
+    rowcount: int = 0
+    columns: List[str] = field(default_factory=list)
+    rows: List[Tuple[Any, ...]] = field(default_factory=list)
+    query_id: Optional[str] = None
+
+    def first(self, column: str, default: Any = None) -> Any:
+        """
+        Return a column of the first result row, matched case-insensitively.
+
+        Args:
+            column: Name of the column to read
+            default: Value returned when the column or row is missing
+
+        Returns:
+            The column value of the first row, or default
+        """
+        if not self.rows:
+            return default
+        lowered = [c.lower() for c in self.columns]
+        if column.lower() not in lowered:
+            return default
+        return self.rows[0][lowered.index(column.lower())]
+
+
+def split_statements(script: str) -> List[str]:
+    """
+    Split a multi-statement SQL script on semicolons.
+
+    Semicolons inside quoted strings, quoted identifiers and comments are
+    ignored. Empty statements and comment-only statements are dropped.
+
+    Args:
+        script: SQL script containing one or more statements
+
+    Returns:
+        List of individual statements without trailing semicolons
+    """
+    statements = []
+    current = []
+    i = 0
+    quote = None
+    while i < len(script):
+        char = script[i]
+        if quote:
+            current.append(char)
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+            current.append(char)
+        elif script.startswith('--', i):
+            end = script.find('\n', i)
+            end = len(script) if end == -1 else end
+            current.append(script[i:end])
+            i = end
+            continue
+        elif script.startswith('$$', i):
+            end = script.find('$$', i + 2)
+            end = len(script) if end == -1 else end + 2
+            current.append(script[i:end])
+            i = end
+            continue
+        elif char == ';':
+            statements.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+        i += 1
+    statements.append(''.join(current))
+
+    def has_code(statement: str) -> bool:
+        return bool(re.sub(r'--[^\n]*', '', statement).strip())
+
+    return [s.strip() for s in statements if has_code(s)]
+
+
+def is_read_only(sql: str) -> bool:
+    """
+    Decide whether a statement only reads data.
+
+    Args:
+        sql: SQL statement
+
+    Returns:
+        True if the statement is a query
+    """
+    return bool(READ_ONLY_STATEMENT.match(re.sub(r'--[^\n]*', '', sql)))
+
+
+def name_result(name: str, sql: str) -> str:
+    """
+    Name the result of a statement, so it can be found whatever its position in a script.
+
+    Args:
+        name: Name of the result
+        sql: SQL statement
+
+    Returns:
+        The statement opened with RESULT_COMMENT
+    """
+    return f"\n        {RESULT_COMMENT} {name}\n        {sql.strip()}"
+
+
+def result_name(sql: str) -> Optional[str]:
+    """
+    Get the name given to the result of a statement.
+
+    Args:
+        sql: SQL statement
+
+    Returns:
+        Name given with name_result, or None
+    """
+    match = _RESULT_NAME.search(sql)
+    return match.group(1) if match is not None else None
+
+
+def named_results(statements: Union[str, Sequence[str]], results: Sequence['QueryResult']) -> Dict[str, 'QueryResult']:
+    """
+    Key the results of a script by the names given to its statements.
+
+    Args:
+        statements: Script that was run, or its statements in order
+        results: One result per statement, in order
+
+    Returns:
+        Result per name given with name_result; unnamed statements are left out
+    """
+    if isinstance(statements, str):
+        statements = split_statements(statements)
+    if len(statements) != len(results):
+        raise ValueError(f"Got {len(results)} results for {len(statements)} statements")
+    return {
+        result_name(sql): result
+        for sql, result in zip(statements, results)
+        if result_name(sql) is not None
+    }
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of reusable DB-API connections.
+
+    Connections are opened lazily up to max_size and handed back to the pool
+    after use, so consecutive batches reuse warm sessions instead of paying
+    the login cost every time. A connection that has been idle for longer
+    than ping_after seconds is validated before it is handed out.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        max_size: int = 4,
+        ping_after: float = 300.0,
+        ping_query: str = 'SELECT 1'
+    ):
+        """
+        Initialize the ConnectionPool.
+
+        Args:
+            connect: Zero-argument callable returning a new DB-API connection
+            max_size: Maximum number of open connections
+            ping_after: Idle seconds after which a connection is validated on checkout
+            ping_query: Statement used to validate an idle connection
+        """
+        self.connect = connect
+        self.max_size = max_size
+        self.ping_after = ping_after
+        self.ping_query = ping_query
+        self._idle: List[Tuple[Any, float]] = []
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+
+    def warm(self, count: Optional[int] = None) -> None:
+        """
+        Open connections ahead of time so the first batches do not pay for login.
+
+        Args:
+            count: Number of connections to open (defaults to max_size)
+        """
+        count = self.max_size if count is None else min(count, self.max_size)
+        while True:
+            with self._lock:
+                if self._opened >= count:
+                    return
+                self._opened += 1
+            try:
+                self.release(self.connect())
+            except Exception:
+                self._free_slot()
+                raise
+
+    def acquire(self, timeout: Optional[float] = None) -> Any:
+        """
+        Check out a connection, opening a new one if the pool is not full.
+
+        Waiters are woken both when a connection is released and when a
+        discarded connection frees its slot, so a broken connection never
+        leaves them waiting for a release that will not come.
+
+        Args:
+            timeout: Seconds to wait for a free connection (None waits forever)
+
+        Returns:
+            An open DB-API connection
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._available:
+                while not self._idle and self._opened >= self.max_size:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError('Timed out waiting for a pooled connection')
+                    self._available.wait(remaining)
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                else:
+                    self._opened += 1
+                    conn = None
+
+            if conn is None:
+                try:
+                    return self.connect()
+                except Exception:
+                    self._free_slot()
+                    raise
+            if time.monotonic() - last_used < self.ping_after or self._ping(conn):
+                return conn
+            self.discard(conn)
+
+    def release(self, conn: Any) -> None:
+        """
+        Return a healthy connection to the pool.
+
+        Args:
+            conn: Connection previously obtained from acquire()
+        """
+        with self._available:
+            self._idle.append((conn, time.monotonic()))
+            self._available.notify()
+
+    def discard(self, conn: Any) -> None:
+        """
+        Close a broken connection and free its slot in the pool.
+
+        Args:
+            conn: Connection previously obtained from acquire()
+        """
+        self._free_slot()
+        try:
+            conn.close()
+        except Exception:
+            logger.debug('Ignoring error while closing discarded connection', exc_info=True)
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """
+        Context manager that checks a connection out and returns it afterwards.
+
+        A connection whose block raised is discarded rather than reused.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            self.discard(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self) -> None:
+        """
+        Close every idle connection held by the pool.
+        """
+        while True:
+            with self._available:
+                if not self._idle:
+                    return
+                conn, _ = self._idle.pop()
+            self.discard(conn)
+
+    def _free_slot(self) -> None:
+        with self._available:
+            self._opened -= 1
+            self._available.notify()
+
+    def _ping(self, conn: Any) -> bool:
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(self.ping_query)
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            return True
+        except Exception:
+            logger.info('Pooled connection failed validation, reconnecting')
+            return False
+
+
+class QueryExecutor:
+    """
+    Executes milestoning SQL over a pool of DB-API connections.
+
+    Statements are retried with exponential backoff when they fail with an
+    error classified as transient. A transient error that may have struck
+    after the warehouse applied the statement (e.g. a lost response) is only
+    retried for read-only or explicitly idempotent work, so a lock UPDATE or
+    MERGE is never blindly applied twice. Backends plug in by supplying a
+    connection factory and, optionally, overriding is_transient() and
+    may_have_applied().
+    """
+
+    transient_errors: Tuple[Type[BaseException], ...] = ()
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        pool_size: int = 4,
+        max_retries: int = 3,
+        retry_backoff: float = 0.5,
+        ping_after: float = 300.0
+    ):
+        """
+        Initialize the QueryExecutor.
+
+        Args:
+            connect: Zero-argument callable returning a new DB-API connection
+            pool_size: Maximum number of pooled connections
+            max_retries: Number of retries for transient failures
+            retry_backoff: Initial backoff in seconds, doubled after every retry
+            ping_after: Idle seconds after which a pooled connection is validated
+        """
+        self.pool = ConnectionPool(connect, max_size=pool_size, ping_after=ping_after)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+    def is_transient(self, error: BaseException) -> bool:
+        """
+        Decide whether a failed statement may be retried.
+
+        Args:
+            error: Exception raised by the driver
+
+        Returns:
+            True if the statement should be retried
+        """
+        return isinstance(error, self.transient_errors)
+
+    def may_have_applied(self, error: BaseException) -> bool:
+        """
+        Decide whether a transient failure may have struck after the statement took effect.
+
+        Args:
+            error: Transient exception raised by the driver
+
+        Returns:
+            True if the outcome of the failed statement is unknown
+        """
+        return False
+
+    def execute(
+        self,
+        sql: str,
+        params: Optional[Sequence[Any]] = None,
+        idempotent: Optional[bool] = None
+    ) -> QueryResult:
+        """
+        Execute a single statement with retries.
+
+        Args:
+            sql: Statement to execute
+            params: Optional positional bind parameters
+            idempotent: Whether the statement may be re-run after an unknown
+                outcome; defaults to True for queries only
+
+        Returns:
+            QueryResult for the statement
+        """
+        if idempotent is None:
+            idempotent = is_read_only(sql)
+        return self._with_retries(lambda conn: self._run(conn, sql, params), idempotent)
+
+    def execute_script(self, script: str, idempotent: Optional[bool] = None) -> List[QueryResult]:
+        """
+        Execute a multi-statement script on a single connection.
+
+        The whole script is retried on transient failures; a ROLLBACK is issued
+        first so that a partially applied transaction is discarded.
+
+        Args:
+            script: SQL script with semicolon-separated statements
+            idempotent: Whether the script may be re-run after an unknown
+                outcome; defaults to True when every statement is a query
+
+        Returns:
+            One QueryResult per statement, in order
+        """
+        return self.execute_statements(
+            [(statement, None) for statement in split_statements(script)],
+            idempotent
+        )
+
+    def execute_statements(
+        self,
+        statements: Sequence[Tuple[str, Optional[Sequence[Any]]]],
+        idempotent: Optional[bool] = None
+    ) -> List[QueryResult]:
+        """
+        Execute statements with their bind parameters on a single connection.
+
+        Retried and rolled back like execute_script. A statement opened with
+        FENCE_COMMENT that affects no rows rolls the transaction back and
+        raises RuntimeError without a retry, e.g. when a batch no longer
+        holds its lease.
+
+        Args:
+            statements: List of (statement, parameters) pairs; parameters may be None
+            idempotent: Whether the statements may be re-run after an unknown
+                outcome; defaults to True when every statement is a query
+
+        Returns:
+            One QueryResult per statement, in order
+        """
+        def run(conn: Any) -> List[QueryResult]:
+            try:
+                results = []
+                for sql, params in statements:
+                    result = self._run(conn, sql, params)
+                    if result.rowcount == 0 and sql.lstrip().startswith(FENCE_COMMENT):
+                        raise RuntimeError(f"Fenced statement affected no rows: {sql.strip().splitlines()[0]}")
+                    results.append(result)
+                return results
+            except Exception:
+                self._rollback(conn)
+                raise
+
+        if idempotent is None:
+            idempotent = all(is_read_only(sql) for sql, _ in statements)
+        return self._with_retries(run, idempotent)
+
+    def close(self) -> None:
+        """
+        Close all pooled connections.
+        """
+        self.pool.close()
+
+    def _with_retries(self, work: Callable[[Any], Any], idempotent: bool) -> Any:
+        attempt = 0
+        while True:
+            try:
+                with self.pool.connection() as conn:
+                    return work(conn)
+            except Exception as e:
+                if attempt >= self.max_retries or not self.is_transient(e):
+                    raise
+                if not idempotent and self.may_have_applied(e):
+                    logger.error('Not retrying non-idempotent statement with unknown outcome (%s)', e)
+                    raise
+                delay = self.retry_backoff * (2 ** attempt)
+                attempt += 1
+                logger.warning(
+                    'Transient failure (%s), retry %d/%d in %.2fs',
+                    e, attempt, self.max_retries, delay
+                )
+                time.sleep(delay)
+
+    def _run(self, conn: Any, sql: str, params: Optional[Sequence[Any]] = None) -> QueryResult:
+        cursor = conn.cursor()
+        try:
+            if params is None:
+                cursor.execute(sql)
+            else:
+                cursor.execute(sql, params)
+            columns = [d[0] for d in cursor.description or []]
+            rows = [tuple(r) for r in cursor.fetchall()] if columns else []
+            rowcount = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else len(rows)
+            return QueryResult(
+                rowcount=rowcount,
+                columns=columns,
+                rows=rows,
+                query_id=getattr(cursor, 'sfqid', None)
+            )
+        finally:
+            cursor.close()
+
+    def _rollback(self, conn: Any) -> None:
+        try:
+            conn.rollback()
+        except Exception:
+            logger.debug('Rollback after failed script raised', exc_info=True)
+
+
+class SnowflakeExecutor(QueryExecutor):
+    """
+    QueryExecutor backed by snowflake-connector-python.
+
+    Sessions are opened with client_session_keep_alive so pooled connections
+    stay logged in between batches, and with qmark (server-side) binding.
+    """
+
+    def __init__(self, connection_params: dict, **kwargs: Any):
+        """
+        Initialize the SnowflakeExecutor.
+
+        Args:
+            connection_params: Keyword arguments for snowflake.connector.connect
+            **kwargs: Pool and retry options forwarded to QueryExecutor
+        """
+        import snowflake.connector
+        from snowflake.connector import errors
+
+        params = {'client_session_keep_alive': True, 'autocommit': True, 'paramstyle': 'qmark'}
+        params.update(connection_params)
+        self.transient_errors = (errors.OperationalError, errors.InterfaceError)
+        super().__init__(lambda: snowflake.connector.connect(**params), **kwargs)
+
+    def is_transient(self, error: BaseException) -> bool:
+        if super().is_transient(error):
+            return True
+        return getattr(error, 'errno', None) in SNOWFLAKE_TRANSIENT_ERRNOS
+
+    def may_have_applied(self, error: BaseException) -> bool:
+        errno = getattr(error, 'errno', None)
+        return errno in SNOWFLAKE_UNKNOWN_OUTCOME_ERRNOS or errno not in SNOWFLAKE_TRANSIENT_ERRNOS
+
+
+class SQLiteExecutor(QueryExecutor):
+    """
+    QueryExecutor backed by the standard library sqlite3 module.
+
+    Intended as a local stand-in for tests and offline development. Note that
+    it executes the SQL it is given verbatim, so Snowflake-specific syntax
+    (variant paths, MERGE) is not available.
+    """
+
+    def __init__(self, database: str = ':memory:', **kwargs: Any):
+        """
+        Initialize the SQLiteExecutor.
+
+        Args:
+            database: Path of the database file, or ':memory:' for a private
+                in-memory database shared by all pooled connections
+            **kwargs: Pool and retry options forwarded to QueryExecutor
+        """
+        import sqlite3
+
+        if database == ':memory:':
+            database = f'file:milestoner-{id(self)}?mode=memory&cache=shared'
+        self.database = database
+        self.transient_errors = (sqlite3.OperationalError,)
+        self._keeper = self._connect()
+        super().__init__(self._connect, **kwargs)
+
+    def _connect(self) -> Any:
+        """
+        Open a connection to the database in autocommit mode.
+
+        Returns:
+            sqlite3 connection usable from any thread
+        """
+        import sqlite3
+
+        return sqlite3.connect(self.database, uri=True, check_same_thread=False, isolation_level=None)
+
+    def is_transient(self, error: BaseException) -> bool:
+        return super().is_transient(error) and 'locked' in str(error).lower()
+
+    def close(self) -> None:
+        super().close()
+        self._keeper.close()
@@ -0,0 +1,236 @@
+from datetime import datetime
+from typing import TYPE_CHECKING, Optional, Tuple
+
+from .columns import (
+    BATCH_ID_COL,
+    NEXT_VALID_FROM_COL,
+    ROW_ADDED_DATETIME_COL,
+    ROW_CHECKSUM_COL,
+    STAGING_GUID_COL,
+    SYSTEM_FROM_COL,
+    SYSTEM_TO_COL,
+    VALID_FROM_COL,
+    VALID_TO_COL
+)
+
+if TYPE_CHECKING:
+    from .bitemporal_milestoner import BitemporalMilestoner
+
+# Columns of the timeline table of a history-splitting batch
+IS_NEW_VERSION_COL = 'IS_NEW_VERSION'
+PREVIOUS_VALID_TO_COL = 'PREVIOUS_VALID_TO'
+TIMELINE_SEQUENCE_COL = 'TIMELINE_SEQUENCE'
+
+
+class HistorySplitter:
+    """
+    Applies the version chain of a batch anywhere in the history of its keys.
+
+    Instead of appending after the open version, the records of a batch are
+    interleaved with the existing versions of their keys by the temporal
+    column, so late-arriving and out-of-order records split the version that
+    covers them. The existing versions around them are re-closed as a
+    system-time correction and the new versions are inserted closed at the
+    start of the next version on the timeline.
+    """
+
+    def __init__(self, milestoner: 'BitemporalMilestoner'):
+        """
+        Initialize the HistorySplitter.
+
+        Args:
+            milestoner: Milestoner whose batches are split into the history
+        """
+        self.milestoner = milestoner
+
+    def get_new_versions(self, chain_table: str) -> str:
+        """
+        Get the source of the versions a timeline inserts.
+
+        Args:
+            chain_table: Name of the timeline table
+
+        Returns:
+            Subquery over the new versions of the timeline, which also holds
+            the existing versions
+        """
+        return f"(SELECT * FROM {chain_table} WHERE {IS_NEW_VERSION_COL})"
+
+    def get_setup_query(
+        self,
+        conformed_table: str,
+        source_query: str,
+        chain_table: str,
+        key_bounds: Optional[Tuple[str, str]] = None
+    ) -> str:
+        """
+        Generate SQL query that merges a batch into the version timelines of its keys.
+
+        The existing versions of the batch's keys are read from the conformed
+        table and interleaved with the batch records by the temporal column.
+        Existing versions are ordered before batch records with the same
+        temporal value, and only the latest batch record per key and temporal
+        value is used. A batch record is kept only if its checksum differs
+        from the version before it on the timeline, wherever that falls.
+        LEAD then gives every existing and new version the VALID_TO at which
+        the next version takes over. Only the latest row of every existing
+        version is read (see BitemporalMilestoner.get_latest_versions_query), and versions emptied
+        by an earlier correction (VALID_TO equal to VALID_FROM) are left out.
+
+        Args:
+            conformed_table: Name of the conformed table
+            source_query: Query producing the unique staging records of the batch
+            chain_table: Name of the temporary table to create
+            key_bounds: Optional bounds of the leading business key for pruning
+
+        Returns:
+            SQL query creating the timeline table
+        """
+        milestoner = self.milestoner
+        keys = ', '.join(milestoner.business_keys)
+        order = f"{milestoner.temporal_column}, {IS_NEW_VERSION_COL}, {TIMELINE_SEQUENCE_COL}"
+        existing_columns = ', '.join(
+            f"c.{VALID_FROM_COL} AS {col}" if col == milestoner.temporal_column else f"c.{col}"
+            for col in milestoner.data_columns
+        )
+        affected = f"""
+            JOIN (SELECT DISTINCT {keys} FROM incoming) affected
+                ON {' AND '.join(f"v.{key} = affected.{key}" for key in milestoner.business_keys)}"""
+        key_range = []
+        if key_bounds is not None:
+            key_range.append(f"v.{milestoner.business_keys[0]} BETWEEN {key_bounds[0]} AND {key_bounds[1]}")
+        return f"""
+        CREATE TEMPORARY TABLE {chain_table} AS
+        WITH batch_records AS (
+            {source_query}
+        ),
+        incoming AS (
+            SELECT
+                {', '.join(milestoner.data_columns)},
+                {ROW_CHECKSUM_COL},
+                {STAGING_GUID_COL},
+                {ROW_ADDED_DATETIME_COL} AS {TIMELINE_SEQUENCE_COL},
+                NULL AS {PREVIOUS_VALID_TO_COL},
+                TRUE AS {IS_NEW_VERSION_COL}
+            FROM batch_records
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY {keys}, {milestoner.temporal_column}
+                ORDER BY {ROW_ADDED_DATETIME_COL} DESC
+            ) = 1
+        ),
+        existing AS (
+            SELECT
+                {existing_columns},
+                c.{ROW_CHECKSUM_COL},
+                c.{STAGING_GUID_COL},
+                c.{SYSTEM_FROM_COL} AS {TIMELINE_SEQUENCE_COL},
+                c.{VALID_TO_COL} AS {PREVIOUS_VALID_TO_COL},
+                FALSE AS {IS_NEW_VERSION_COL}
+            FROM (
+                {milestoner.get_latest_versions_query(conformed_table, key_range, affected)}
+            ) c
+            WHERE (c.{VALID_TO_COL} IS NULL OR c.{VALID_TO_COL} > c.{VALID_FROM_COL})
+        ),
+        timeline AS (
+            SELECT
+                versions.*,
+                LAG({ROW_CHECKSUM_COL}) OVER (
+                    PARTITION BY {keys}
+                    ORDER BY {order}
+                ) AS PREVIOUS_CHECKSUM
+            FROM (
+                SELECT * FROM existing
+                UNION ALL
+                SELECT * FROM incoming
+            ) versions
+        ),
+        changes AS (
+            SELECT *
+            FROM timeline
+            WHERE NOT {IS_NEW_VERSION_COL}
+            OR {ROW_CHECKSUM_COL} IS DISTINCT FROM PREVIOUS_CHECKSUM
+        )
+        SELECT
+            changes.*,
+            LEAD({milestoner.temporal_column}) OVER (
+                PARTITION BY {keys}
+                ORDER BY {order}
+            ) AS {NEXT_VALID_FROM_COL}
+        FROM changes
+        """
+
+    def get_close_query(
+        self,
+        conformed_table: str,
+        chain_table: str,
+        batch_id: str,
+        current_time: datetime,
+        key_bounds: Optional[Tuple[str, str]] = None
+    ) -> str:
+        """
+        Generate SQL query that re-closes the existing versions a timeline changed.
+
+        Every existing version whose VALID_TO differs from the start of the
+        next version on the timeline is re-closed at that VALID_TO as of the
+        time of the correction. An open version is closed in place, like
+        version chaining does; this also empties an open version replaced by
+        a record with the same temporal value. A closed version is never
+        rewritten, so snapshots of earlier system times keep their history:
+        a late record that splits it records a corrected copy, with
+        SYSTEM_FROM and SYSTEM_TO set to the time of the correction, which
+        supersedes it for later system times. A closed version replaced by a
+        record with the same temporal value needs no copy, as the new version
+        supersedes it. Versions are never reopened.
+
+        Args:
+            conformed_table: Name of the conformed table
+            chain_table: Name of the timeline table
+            batch_id: ID of the current batch
+            current_time: Current timestamp for system time
+            key_bounds: Optional bounds of the leading business key for pruning
+
+        Returns:
+            SQL MERGE statement updating open versions and inserting
+            corrected copies of closed ones
+        """
+        milestoner = self.milestoner
+        columns = milestoner.data_columns + [
+            VALID_FROM_COL,
+            VALID_TO_COL,
+            SYSTEM_FROM_COL,
+            SYSTEM_TO_COL,
+            ROW_CHECKSUM_COL,
+            STAGING_GUID_COL,
+            BATCH_ID_COL
+        ]
+        values = [f"s.{col}" for col in milestoner.data_columns] + [
+            f"s.{milestoner.temporal_column}",
+            f"s.{NEXT_VALID_FROM_COL}",
+            f"'{current_time}'",
+            f"'{current_time}'",
+            f"s.{ROW_CHECKSUM_COL}",
+            f"s.{STAGING_GUID_COL}",
+            f"'{batch_id}'"
+        ]
+        return f"""
+        MERGE INTO {conformed_table} t
+        USING (
+            SELECT *
+            FROM {chain_table}
+            WHERE NOT {IS_NEW_VERSION_COL}
+            AND {NEXT_VALID_FROM_COL} IS NOT NULL
+            AND {NEXT_VALID_FROM_COL} IS DISTINCT FROM {PREVIOUS_VALID_TO_COL}
+            AND ({PREVIOUS_VALID_TO_COL} IS NULL OR {NEXT_VALID_FROM_COL} > {milestoner.temporal_column})
+        ) s
+        ON {' AND '.join(f"t.{key} = s.{key}" for key in milestoner.business_keys)}
+        AND t.{STAGING_GUID_COL} = s.{STAGING_GUID_COL}
+        AND t.{VALID_FROM_COL} = s.{milestoner.temporal_column}
+        AND t.{VALID_TO_COL} IS NULL
+        {milestoner.get_key_range_predicate('t', key_bounds)}
+        WHEN MATCHED THEN
+            UPDATE SET
+                {VALID_TO_COL} = s.{NEXT_VALID_FROM_COL},
+                {SYSTEM_TO_COL} = '{current_time}'
+        WHEN NOT MATCHED AND s.{PREVIOUS_VALID_TO_COL} IS NOT NULL THEN
+            INSERT ({', '.join(columns)})
+            VALUES ({', '.join(values)})"""
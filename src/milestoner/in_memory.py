@@ -0,0 +1,329 @@
+import logging
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from .bitemporal_milestoner import (
+    BATCH_ID_COL,
+    ROW_ADDED_DATETIME_COL,
+    ROW_CHECKSUM_COL,
+    STAGING_GUID_COL,
+    SYSTEM_FROM_COL,
+    SYSTEM_TO_COL,
+    VALID_FROM_COL,
+    VALID_TO_COL,
+    BitemporalMilestoner
+)
+
+logger = logging.getLogger(__name__)
+
+# Columnar table: column name -> one-dimensional array
+Columns = Dict[str, np.ndarray]
+
+
+class InMemoryMilestoner:
+    """
+    Applies the milestoning rules to columnar data held in process memory.
+
+    Uses the same configuration as BitemporalMilestoner and follows the
+    semantics of its version chaining path: duplicates are removed by
+    checksum, records equal to the version before them are dropped, every
+    remaining change becomes a version closed at the start of the next one,
+    and the open conformed version of a key is closed at the start of the
+    key's first new version. All steps are sorts and group operations over
+    NumPy arrays, without per-row Python code.
+    """
+
+    def __init__(
+        self,
+        business_keys: List[str],
+        temporal_column: str,
+        data_columns: List[str]
+    ):
+        """
+        Initialize the InMemoryMilestoner.
+
+        Args:
+            business_keys: List of columns that uniquely identify a record
+            temporal_column: Name of the column containing the temporal value
+            data_columns: List of columns that contain the data
+        """
+        self.business_keys = business_keys
+        self.temporal_column = temporal_column
+        self.data_columns = data_columns
+
+    @classmethod
+    def from_milestoner(cls, milestoner: BitemporalMilestoner) -> 'InMemoryMilestoner':
+        """
+        Create an in-memory milestoner with the configuration of a SQL milestoner.
+
+        Args:
+            milestoner: Milestoner whose configuration is reused
+
+        Returns:
+            InMemoryMilestoner with the same keys and columns
+        """
+        return cls(milestoner.business_keys, milestoner.temporal_column, milestoner.data_columns)
+
+    def milestone(
+        self,
+        staging: Any,
+        conformed: Any = None,
+        current_time: Optional[datetime] = None,
+        batch_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Milestone a batch of staging records into a conformed table.
+
+        Tables may be given as a mapping of column name to sequence, a pyarrow
+        Table or a pandas DataFrame. Staging records carry the data columns
+        (already extracted from the variant), ROW_CHECKSUM, STAGING_GUID and
+        optionally ROW_ADDED_DATETIME; without it, row order is arrival order.
+
+        Args:
+            staging: Staging records of the batch
+            conformed: Current conformed table, or None when it is empty
+            current_time: Current timestamp for system time (defaults to now)
+            batch_id: ID of the batch (defaults to a new UUID)
+
+        Returns:
+            Dictionary containing:
+                - batch_id: ID of the batch
+                - conformed: New conformed table as a mapping of column to array
+                - records_processed: Number of staging records
+                - duplicates_found: Number of records dropped as duplicates
+                - unchanged_found: Number of records equal to the version before them
+                - records_inserted: Number of versions inserted
+                - records_closed: Number of open conformed versions closed
+        """
+        staging = to_columns(staging)
+        conformed = to_columns(conformed) if conformed is not None else {}
+        current_time = current_time or datetime.now()
+        batch_id = batch_id or str(uuid.uuid4())
+
+        records = len(staging[ROW_CHECKSUM_COL])
+        added = staging.get(ROW_ADDED_DATETIME_COL)
+        added_order = np.arange(records) if added is None else _sort_key(added)
+
+        # Keep the earliest record of every checksum
+        checksum_order = _sort_key(staging[ROW_CHECKSUM_COL])
+        order = np.lexsort((added_order, checksum_order))
+        unique_rows = np.sort(order[_group_starts(checksum_order[order])])
+        batch = {name: values[unique_rows] for name, values in staging.items()}
+        added_order = added_order[unique_rows]
+
+        if conformed and len(conformed[VALID_TO_COL]):
+            open_rows = np.flatnonzero(null_mask(conformed[VALID_TO_COL]))
+        else:
+            conformed = {}
+            open_rows = np.empty(0, dtype=np.int64)
+        open_versions = {
+            column: conformed[column][open_rows] if conformed else batch[column][:0]
+            for column in self.business_keys + [ROW_CHECKSUM_COL]
+        }
+        batch_keys, open_keys = self._get_key_ids(batch, open_versions)
+        checksum_ids, open_checksum_ids = get_ids(
+            [batch[ROW_CHECKSUM_COL], open_versions[ROW_CHECKSUM_COL]]
+        )
+
+        # Order every key's records by validity and compare each with the one before it
+        order = np.lexsort((added_order, _sort_key(batch[self.temporal_column]), batch_keys))
+        sorted_keys = batch_keys[order]
+        checksums = checksum_ids[order]
+        starts = _group_starts(sorted_keys)
+        previous = np.empty(len(checksums), dtype=np.int64)
+        previous[1:] = checksums[:-1]
+        previous[starts] = -1
+        open_index, has_open = _match(open_keys, sorted_keys[starts])
+        previous[np.flatnonzero(starts)[has_open]] = open_checksum_ids[open_index[has_open]]
+        changed = checksums != previous
+
+        chain = order[changed]
+        chain_keys = sorted_keys[changed]
+        valid_from = batch[self.temporal_column][chain]
+        last = np.ones(len(chain), dtype=bool)
+        last[:-1] = chain_keys[1:] != chain_keys[:-1]
+        next_valid_from = nullable(valid_from)
+        next_valid_from[:-1] = valid_from[1:]
+        next_valid_from[last] = null_value(next_valid_from)
+
+        new_versions = {column: batch[column][chain] for column in self.data_columns}
+        new_versions[VALID_FROM_COL] = valid_from
+        new_versions[VALID_TO_COL] = next_valid_from
+        new_versions[SYSTEM_FROM_COL] = np.full(len(chain), current_time, dtype=object)
+        system_to = np.full(len(chain), current_time, dtype=object)
+        system_to[last] = None
+        new_versions[SYSTEM_TO_COL] = system_to
+        new_versions[ROW_CHECKSUM_COL] = batch[ROW_CHECKSUM_COL][chain]
+        new_versions[STAGING_GUID_COL] = batch[STAGING_GUID_COL][chain]
+        new_versions[BATCH_ID_COL] = np.full(len(chain), batch_id, dtype=object)
+
+        # Close open versions at the start of their key's first new version
+        first = _group_starts(chain_keys)
+        close_index, closes = _match(open_keys, chain_keys[first])
+        closed_rows = open_rows[close_index[closes]]
+        if conformed:
+            conformed = dict(conformed)
+            valid_to = nullable(conformed[VALID_TO_COL])
+            valid_to[closed_rows] = valid_from[first][closes]
+            system_to = nullable(conformed[SYSTEM_TO_COL])
+            system_to[closed_rows] = current_time
+            conformed[VALID_TO_COL] = valid_to
+            conformed[SYSTEM_TO_COL] = system_to
+            result_table = {
+                column: np.concatenate([conformed[column], new_versions[column]])
+                for column in new_versions
+            }
+        else:
+            result_table = new_versions
+
+        result = {
+            'batch_id': batch_id,
+            'conformed': result_table,
+            'records_processed': records,
+            'duplicates_found': records - len(unique_rows),
+            'unchanged_found': len(unique_rows) - len(chain),
+            'records_inserted': len(chain),
+            'records_closed': len(closed_rows)
+        }
+        logger.debug(
+            'In-memory batch %s: %d records, %d inserted, %d closed',
+            batch_id, records, result['records_inserted'], result['records_closed']
+        )
+        return result
+
+    def _get_key_ids(self, *tables: Columns) -> List[np.ndarray]:
+        """
+        Assign one integer ID per distinct business key across several tables.
+
+        Args:
+            *tables: Tables holding the business key columns
+
+        Returns:
+            Array of key IDs per table, in the order of the tables
+        """
+        sizes = [len(table[self.business_keys[0]]) for table in tables]
+        codes = [
+            np.concatenate(get_ids([table[key] for table in tables]))
+            for key in self.business_keys
+        ]
+        if len(codes) == 1:
+            ids = codes[0]
+        else:
+            _, ids = np.unique(np.stack(codes, axis=1), axis=0, return_inverse=True)
+        return np.split(ids.ravel(), np.cumsum(sizes)[:-1])
+
+
+def to_columns(table: Any) -> Columns:
+    """
+    Convert a mapping, pyarrow Table or pandas DataFrame to NumPy columns.
+
+    Args:
+        table: Table to convert
+
+    Returns:
+        Mapping of column name to array
+    """
+    if hasattr(table, 'column_names'):
+        return {name: table.column(name).to_numpy() for name in table.column_names}
+    if hasattr(table, 'columns') and hasattr(table, 'to_numpy'):
+        return {name: table[name].to_numpy() for name in table.columns}
+    if isinstance(table, Mapping):
+        return {name: np.asarray(values) for name, values in table.items()}
+    raise TypeError(f"Unsupported table type: {type(table).__name__}")
+
+
+def get_ids(columns: List[np.ndarray]) -> List[np.ndarray]:
+    """
+    Replace the values of several columns with integer IDs shared between them.
+
+    Args:
+        columns: Columns holding values of the same kind
+
+    Returns:
+        Array of IDs per column; equal values get equal IDs
+    """
+    values = np.concatenate(columns)
+    ids = np.unique(values, return_inverse=True)[1].ravel()
+    return np.split(ids, np.cumsum([len(c) for c in columns])[:-1])
+
+
+def _sort_key(values: np.ndarray) -> np.ndarray:
+    # Numeric and datetime columns sort as they are, others by their dense rank
+    if values.dtype.kind in 'biufmM':
+        return values
+    return np.unique(values, return_inverse=True)[1].ravel()
+
+
+def _group_starts(sorted_values: np.ndarray) -> np.ndarray:
+    starts = np.ones(len(sorted_values), dtype=bool)
+    starts[1:] = sorted_values[1:] != sorted_values[:-1]
+    return starts
+
+
+def _match(keys: np.ndarray, targets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the position of every target in an array of unique keys.
+
+    Args:
+        keys: Unique keys to search
+        targets: Keys to look up
+
+    Returns:
+        Tuple of (positions in keys, mask of targets that were found)
+    """
+    if len(keys) == 0:
+        return np.zeros(len(targets), dtype=np.int64), np.zeros(len(targets), dtype=bool)
+    order = np.argsort(keys, kind='stable')
+    positions = np.minimum(np.searchsorted(keys[order], targets), len(keys) - 1)
+    found = keys[order][positions] == targets
+    return order[positions], found
+
+
+def null_mask(values: np.ndarray) -> np.ndarray:
+    """
+    Find the null values of a column.
+
+    Args:
+        values: Column to check
+
+    Returns:
+        Boolean mask of the NaT, NaN and None values
+    """
+    if values.dtype.kind in 'mM':
+        return np.isnat(values)
+    if values.dtype.kind == 'f':
+        return np.isnan(values)
+    return np.equal(values, None)
+
+
+def nullable(values: np.ndarray) -> np.ndarray:
+    """
+    Copy a column into a dtype that can hold nulls.
+
+    Args:
+        values: Column to copy
+
+    Returns:
+        Datetime columns as they are, others as an object array
+    """
+    if values.dtype.kind in 'mM':
+        return values.copy()
+    return values.astype(object)
+
+
+def null_value(values: np.ndarray) -> Any:
+    """
+    Get the null value matching the dtype of a column.
+
+    Args:
+        values: Column the value is meant for
+
+    Returns:
+        NaT for datetime and timedelta columns, None otherwise
+    """
+    if values.dtype.kind in 'mM':
+        return np.datetime64('NaT') if values.dtype.kind == 'M' else np.timedelta64('NaT')
+    return None
@@ -0,0 +1,285 @@
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import TYPE_CHECKING, Iterator, List, Optional
+
+from .columns import (
+    BATCH_ID_COL,
+    LOCKED_COL,
+    MILESTONING_FLAG_COL,
+    PROCESSED_DATETIME_COL,
+    ROW_ADDED_DATETIME_COL,
+    STAGING_GUID_COL,
+    STAGING_SCHEMA
+)
+from .executor import FENCE_COMMENT, name_result
+
+if TYPE_CHECKING:
+    from .bitemporal_milestoner import BitemporalMilestoner
+
+logger = logging.getLogger(__name__)
+
+# Suffix and columns of the lease table of a staging table
+LEASE_TABLE_SUFFIX = '_LEASES'
+LOCKED_DATETIME_COL = 'LOCKED_DATETIME'
+HEARTBEAT_DATETIME_COL = 'HEARTBEAT_DATETIME'
+
+
+class BatchLeases:
+    """
+    Turns the batch locks of a milestoner into leases that expire.
+
+    Every batch registers a lease before locking its records and renews it
+    from a background thread while it runs. A batch whose worker died stops
+    renewing, and the next batch on the staging table revokes its lease and
+    releases its records. The transaction applying a batch is fenced on its
+    lease, so a worker whose lease was revoked never applies its records.
+    """
+
+    def __init__(
+        self,
+        milestoner: 'BitemporalMilestoner',
+        lease_seconds: float,
+        heartbeat_interval: Optional[float] = None
+    ):
+        """
+        Initialize the BatchLeases.
+
+        Args:
+            milestoner: Milestoner whose batches hold the leases
+            lease_seconds: Seconds after the last heartbeat a lease expires
+            heartbeat_interval: Seconds between heartbeats while a batch runs,
+                defaults to a third of lease_seconds
+        """
+        if lease_seconds <= 0:
+            raise ValueError("lease_seconds must be positive")
+
+        self.milestoner = milestoner
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval or lease_seconds / 3
+
+    def get_table(self, staging_table: str) -> str:
+        """
+        Get the name of the lease table of a staging table.
+
+        Args:
+            staging_table: Name of the staging table
+
+        Returns:
+            Qualified table name
+        """
+        return f"{STAGING_SCHEMA}.{staging_table}{LEASE_TABLE_SUFFIX}"
+
+    def create_table(self, staging_table: str) -> List[str]:
+        """
+        Create the lease table of a staging table.
+
+        Every batch holds one lease row with the time it locked its records
+        and the time of its last heartbeat. A reclaim revokes an expired
+        lease by clearing its heartbeat before releasing its records.
+
+        Args:
+            staging_table: Name of the staging table
+
+        Returns:
+            The executed statements (only generated when no executor is set)
+        """
+        statements = [
+            f"""
+            CREATE TABLE IF NOT EXISTS {self.get_table(staging_table)} (
+                {BATCH_ID_COL} STRING,
+                {LOCKED_DATETIME_COL} TIMESTAMP_NTZ,
+                {HEARTBEAT_DATETIME_COL} TIMESTAMP_NTZ
+            )"""
+        ]
+        executor = self.milestoner.executor
+        if executor is not None:
+            for statement in statements:
+                executor.execute(statement)
+        return statements
+
+    def get_acquire_query(self, staging_table: str, batch_id: str, current_time: datetime) -> str:
+        """
+        Generate SQL query registering the lease of a batch.
+
+        The lease is registered before the records are locked, so locked
+        records always belong to a lease that can expire.
+
+        Args:
+            staging_table: Name of the staging table
+            batch_id: ID of the current batch
+            current_time: Current timestamp
+
+        Returns:
+            SQL query inserting the lease row
+        """
+        return f"""
+        INSERT INTO {self.get_table(staging_table)} (
+            {BATCH_ID_COL},
+            {LOCKED_DATETIME_COL},
+            {HEARTBEAT_DATETIME_COL}
+        ) VALUES ('{batch_id}', '{current_time}', '{current_time}')"""
+
+    def get_release_query(self, staging_table: str, batch_id: str) -> str:
+        """
+        Generate SQL query dropping the lease of a finished batch.
+
+        Args:
+            staging_table: Name of the staging table
+            batch_id: ID of the current batch
+
+        Returns:
+            SQL query deleting the lease row
+        """
+        return f"""
+        DELETE FROM {self.get_table(staging_table)}
+        WHERE {BATCH_ID_COL} = '{batch_id}'"""
+
+    def get_fence_query(self, staging_table: str, batch_id: str) -> str:
+        """
+        Generate SQL query fencing the transaction that applies a batch.
+
+        Run first in the transaction, it drops the lease of the batch unless a
+        reclaim revoked it. The delete holds the lease table until the
+        transaction ends, so a reclaim cannot revoke the lease half-way. When
+        the lease was revoked (or already reclaimed) it affects no rows and
+        the executor rolls the transaction back, so a stale worker never
+        applies records another worker may have claimed.
+
+        Args:
+            staging_table: Name of the staging table
+            batch_id: ID of the current batch
+
+        Returns:
+            SQL query opened with FENCE_COMMENT
+        """
+        return f"""
+        {FENCE_COMMENT} the batch must still hold its lease
+        DELETE FROM {self.get_table(staging_table)}
+        WHERE {BATCH_ID_COL} = '{batch_id}'
+        AND {HEARTBEAT_DATETIME_COL} IS NOT NULL"""
+
+    def get_reclaim_statements(self, staging_table: str, current_time: datetime) -> List[str]:
+        """
+        Generate SQL statements releasing the records of expired leases.
+
+        A lease expires when its last heartbeat is older than lease_seconds.
+        Expired leases are first revoked (their heartbeat is cleared), which
+        waits for any batch transaction that is fencing on them. The locked,
+        unprocessed records of revoked leases are then unlocked (and their
+        pending queue rows unclaimed) before the leases are deleted, so a
+        reclaim that fails half-way is completed by the next one.
+
+        Args:
+            staging_table: Name of the staging table
+            current_time: Current timestamp
+
+        Returns:
+            List of statements; the staging unlock is named records_reclaimed
+        """
+        milestoner = self.milestoner
+        lease_table = self.get_table(staging_table)
+        expired = f"""{HEARTBEAT_DATETIME_COL} < DATEADD(
+                'millisecond', -{int(self.lease_seconds * 1000)}, '{current_time}'::TIMESTAMP
+            )"""
+        expired_batches = f"SELECT {BATCH_ID_COL} FROM {lease_table} WHERE {HEARTBEAT_DATETIME_COL} IS NULL"
+        staging_filter = ''
+        statements = [f"""
+        UPDATE {lease_table}
+        SET {HEARTBEAT_DATETIME_COL} = NULL
+        WHERE {expired}"""]
+        if milestoner.pending_queue is not None:
+            # Bound the staging update by the queue rows of the expired batches
+            queue_table = milestoner.pending_queue.get_table(staging_table)
+            staging_filter = f"""
+        AND {STAGING_GUID_COL} IN (
+            SELECT {STAGING_GUID_COL} FROM {queue_table} WHERE {LOCKED_COL} IN ({expired_batches})
+        )
+        AND {ROW_ADDED_DATETIME_COL} >= (
+            SELECT MIN({ROW_ADDED_DATETIME_COL}) FROM {queue_table} WHERE {LOCKED_COL} IN ({expired_batches})
+        )"""
+        statements.append(name_result('records_reclaimed', f"""
+        UPDATE {STAGING_SCHEMA}.{staging_table}
+        SET {LOCKED_COL} = NULL,
+            {MILESTONING_FLAG_COL} = NULL
+        WHERE {LOCKED_COL} IN ({expired_batches})
+        AND {PROCESSED_DATETIME_COL} IS NULL{staging_filter}"""))
+        if milestoner.pending_queue is not None:
+            statements.append(f"""
+        UPDATE {milestoner.pending_queue.get_table(staging_table)}
+        SET {LOCKED_COL} = NULL
+        WHERE {LOCKED_COL} IN ({expired_batches})""")
+        statements.append(f"""
+        DELETE FROM {lease_table}
+        WHERE {HEARTBEAT_DATETIME_COL} IS NULL""")
+        return statements
+
+    def get_reclaim_query(self, staging_table: str, current_time: datetime) -> str:
+        """
+        Generate SQL script releasing the records of expired leases.
+
+        Args:
+            staging_table: Name of the staging table
+            current_time: Current timestamp
+
+        Returns:
+            SQL script; see get_reclaim_statements
+        """
+        return ';\n'.join(self.get_reclaim_statements(staging_table, current_time))
+
+    @contextmanager
+    def heartbeat(self, staging_table: str, batch_id: str) -> Iterator[threading.Event]:
+        """
+        Renew the lease of a batch from a background thread for the duration of the block.
+
+        Heartbeats stop at the first one that fails or finds the lease revoked;
+        the batch must then stop before its next stage (see check_lease).
+
+        Args:
+            staging_table: Name of the staging table
+            batch_id: ID of the current batch
+
+        Yields:
+            Event set once the lease can no longer be renewed
+        """
+        lost = threading.Event()
+        stopped = threading.Event()
+        executor = self.milestoner.executor
+        query = f"""
+        UPDATE {self.get_table(staging_table)}
+        SET {HEARTBEAT_DATETIME_COL} = ?
+        WHERE {BATCH_ID_COL} = ?
+        AND {HEARTBEAT_DATETIME_COL} IS NOT NULL"""
+
+        def beat() -> None:
+            while not stopped.wait(self.heartbeat_interval):
+                try:
+                    renewed = executor.execute(query, [str(datetime.now()), batch_id]).rowcount
+                except Exception as e:
+                    logger.warning('Heartbeat of batch %s failed: %s', batch_id, e)
+                    lost.set()
+                    return
+                if renewed == 0:
+                    lost.set()
+                    return
+
+        thread = threading.Thread(target=beat, name=f"lease-{batch_id}", daemon=True)
+        thread.start()
+        try:
+            yield lost
+        finally:
+            stopped.set()
+            thread.join()
+
+
+def check_lease(lost: threading.Event, batch_id: str) -> None:
+    """
+    Stop a batch whose lease could not be renewed.
+
+    Args:
+        lost: Event yielded by BatchLeases.heartbeat
+        batch_id: ID of the current batch
+    """
+    if lost.is_set():
+        raise RuntimeError(f"Batch {batch_id} stopped: its lease could not be renewed")
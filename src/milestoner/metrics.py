@@ -0,0 +1,337 @@
+import abc
+import logging
+import math
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .bitemporal_milestoner import BATCH_COUNT_KEYS
+
+logger = logging.getLogger(__name__)
+
+# Content type of the OpenMetrics text exposition format
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# Default histogram buckets for stage latencies, in seconds
+DEFAULT_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+LabelValues = Tuple[str, ...]
+
+
+class _Metric(abc.ABC):
+    """
+    Base class of metrics holding one sample set per label combination.
+    """
+
+    metric_type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {sorted(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, values: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, values))
+        if extra is not None:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def render(self) -> List[str]:
+        lines = [f"# TYPE {self.name} {self.metric_type}", f"# HELP {self.name} {self.documentation}"]
+        return lines + self._render_samples()
+
+    @abc.abstractmethod
+    def _render_samples(self) -> List[str]:
+        """
+        Render the sample lines of every label combination.
+        """
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count, exposed with a _total suffix.
+    """
+
+    metric_type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        """
+        Increase the counter.
+
+        Args:
+            amount: Non-negative amount to add
+            **labels: Label values
+        """
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            return [
+                f"{self.name}_total{self._format_labels(key)} {_format_value(value)}"
+                for key, value in sorted(self._values.items())
+            ]
+
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down.
+    """
+
+    metric_type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        """
+        Set the gauge.
+
+        Args:
+            value: New value
+            **labels: Label values
+        """
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels: Any) -> Optional[float]:
+        return self._values.get(self._label_values(labels))
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            return [
+                f"{self.name}{self._format_labels(key)} {_format_value(value)}"
+                for key, value in sorted(self._values.items())
+            ]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values over cumulative buckets.
+    """
+
+    metric_type = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._samples: Dict[LabelValues, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        """
+        Record one observation.
+
+        Args:
+            value: Observed value
+            **labels: Label values
+        """
+        key = self._label_values(labels)
+        with self._lock:
+            counts, total = self._samples.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._samples[key] = (counts, total + value)
+
+    def count(self, **labels: Any) -> int:
+        counts, _ = self._samples.get(self._label_values(labels), ([0] * len(self.buckets), 0.0))
+        return counts[-1]
+
+    def _render_samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._samples.items()):
+                for bound, count in zip(self.buckets, counts):
+                    le = '+Inf' if bound == math.inf else _format_value(bound)
+                    lines.append(f"{self.name}_bucket{self._format_labels(key, ('le', le))} {count}")
+                lines.append(f"{self.name}_count{self._format_labels(key)} {counts[-1]}")
+                lines.append(f"{self.name}_sum{self._format_labels(key)} {_format_value(total)}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics rendered together in the OpenMetrics text format.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        Render all metrics in the OpenMetrics text exposition format.
+
+        Returns:
+            Exposition text terminated by # EOF
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = [line for metric in metrics for line in metric.render()]
+        return '\n'.join(lines + ['# EOF']) + '\n'
+
+    def write(self, path: str) -> None:
+        """
+        Write the exposition to a file, e.g. for a node exporter textfile collector.
+
+        Args:
+            path: Path of the file, replaced atomically
+        """
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(temp_path, path)
+
+    def serve(self, port: int = 9464, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+        """
+        Serve the exposition over HTTP from a daemon thread.
+
+        Args:
+            port: Port to listen on (0 picks a free port)
+            host: Address to bind to
+
+        Returns:
+            The running server; call shutdown() to stop it
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', OPENMETRICS_CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug('Metrics request: ' + format, *args)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info('Serving metrics on http://%s:%d/metrics', host, server.server_address[1])
+        return server
+
+    def _register(self, metric: _Metric) -> Any:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+
+class BatchMetrics:
+    """
+    Milestoning metrics fed from the results of process_batch.
+    """
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None, prefix: str = 'milestoner'):
+        """
+        Initialize the BatchMetrics.
+
+        Args:
+            registry: Registry to register the metrics in (a new one by default)
+            prefix: Prefix of all metric names
+        """
+        self.registry = registry or MetricsRegistry()
+        self.batches = self.registry.counter(f"{prefix}_batches", 'Batches processed', ['staging_table'])
+        self.records = self.registry.counter(
+            f"{prefix}_records",
+            'Records by outcome',
+            ['staging_table', 'outcome']
+        )
+        self.stage_seconds = self.registry.histogram(
+            f"{prefix}_stage_seconds",
+            'Wall-clock seconds per batch stage',
+            ['staging_table', 'stage']
+        )
+        self.stage_rows = self.registry.counter(
+            f"{prefix}_stage_rows",
+            'Rows affected per batch stage',
+            ['staging_table', 'stage']
+        )
+        self.queue_depth = self.registry.gauge(
+            f"{prefix}_queue_depth",
+            'Unprocessed and unlocked staging rows',
+            ['staging_table']
+        )
+        self.oldest_pending_seconds = self.registry.gauge(
+            f"{prefix}_oldest_pending_seconds",
+            'Seconds the oldest unprocessed and unlocked staging row has been waiting',
+            ['staging_table']
+        )
+
+    def observe(self, staging_table: str, result: Dict[str, Any]) -> None:
+        """
+        Record the outcome of one batch.
+
+        Args:
+            staging_table: Name of the staging table the batch was read from
+            result: Dictionary returned by process_batch
+        """
+        self.batches.inc(staging_table=staging_table)
+        for key in BATCH_COUNT_KEYS:
+            self.records.inc(result[key], staging_table=staging_table, outcome=key)
+        if result.get('records_reclaimed'):
+            self.records.inc(result['records_reclaimed'], staging_table=staging_table, outcome='records_reclaimed')
+        for stage, timing in result['stages'].items():
+            self.stage_seconds.observe(timing['seconds'], staging_table=staging_table, stage=stage)
+            self.stage_rows.inc(timing['rows'], staging_table=staging_table, stage=stage)
+        if result.get('queue_depth') is not None:
+            self.queue_depth.set(result['queue_depth'], staging_table=staging_table)
+        if result.get('oldest_pending_seconds') is not None:
+            self.oldest_pending_seconds.set(result['oldest_pending_seconds'], staging_table=staging_table)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
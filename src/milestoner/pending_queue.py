@@ -0,0 +1,292 @@
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from .columns import (
+    LOCKED_COL,
+    MILESTONING_FLAG_COL,
+    PROCESSED_DATETIME_COL,
+    ROW_ADDED_DATETIME_COL,
+    STAGING_GUID_COL,
+    STAGING_SCHEMA
+)
+from .executor import name_result
+
+if TYPE_CHECKING:
+    from .bitemporal_milestoner import BitemporalMilestoner
+
+# Sources feeding the pending-work queue
+QUEUE_STREAM = 'stream'
+QUEUE_WATERMARK = 'watermark'
+
+# Suffixes of the pending-work queue objects of a staging table
+QUEUE_TABLE_SUFFIX = '_QUEUE'
+QUEUE_STREAM_SUFFIX = '_STREAM'
+QUEUE_MARK_SUFFIX = '_QUEUE_MARK'
+
+# Default seconds a load may take to commit after stamping ROW_ADDED_DATETIME
+QUEUE_WATERMARK_LAG_SECONDS = 300
+
+# Columns of the pending-work queue objects
+KEY_HASH_COL = 'KEY_HASH'
+HIGH_WATER_MARK_COL = 'HIGH_WATER_MARK'
+
+
+class PendingQueue:
+    """
+    Queue of the staging records a milestoner has not merged yet.
+
+    Batches claim work from a queue table holding the GUID, load time and
+    business key hash of every pending record instead of scanning staging,
+    whose processed rows are never removed. New rows are queued at the start
+    of every lock and leave the queue when their batch is marked processed.
+    """
+
+    def __init__(
+        self,
+        milestoner: 'BitemporalMilestoner',
+        source: str,
+        lag_seconds: float = QUEUE_WATERMARK_LAG_SECONDS
+    ):
+        """
+        Initialize the PendingQueue.
+
+        Args:
+            milestoner: Milestoner whose batches claim from the queue
+            source: QUEUE_STREAM to feed the queue from an append-only stream
+                on the staging table, or QUEUE_WATERMARK from the rows added
+                after a high-water mark of ROW_ADDED_DATETIME
+            lag_seconds: With QUEUE_WATERMARK, rows added up to this many
+                seconds before the high-water mark are scanned again, so
+                loads that commit late with an older ROW_ADDED_DATETIME are
+                still queued. Must exceed the longest load transaction.
+        """
+        if source not in (QUEUE_STREAM, QUEUE_WATERMARK):
+            raise ValueError(f"Unknown pending queue source: {source}")
+        if lag_seconds < 0:
+            raise ValueError("queue_lag_seconds cannot be negative")
+
+        self.milestoner = milestoner
+        self.source = source
+        self.lag_seconds = lag_seconds
+
+    def get_table(self, staging_table: str, suffix: str = QUEUE_TABLE_SUFFIX) -> str:
+        """
+        Get the name of a pending-work queue object of a staging table.
+
+        Args:
+            staging_table: Name of the staging table
+            suffix: QUEUE_TABLE_SUFFIX, QUEUE_STREAM_SUFFIX or QUEUE_MARK_SUFFIX
+
+        Returns:
+            Qualified object name
+        """
+        return f"{STAGING_SCHEMA}.{staging_table}{suffix}"
+
+    def create(self, staging_table: str) -> List[str]:
+        """
+        Create the pending-work queue of a staging table.
+
+        The queue table holds the GUID, load time and business key hash of
+        every record that has not been merged yet. With QUEUE_STREAM an
+        append-only stream on the staging table tracks new rows; with
+        QUEUE_WATERMARK a one-row table holds the ROW_ADDED_DATETIME up to
+        which rows have been queued. Unprocessed rows already in staging are
+        queued once. Existing objects are left alone.
+
+        Args:
+            staging_table: Name of the staging table
+
+        Returns:
+            The executed statements (only generated when no executor is set)
+        """
+        queue_table = self.get_table(staging_table)
+        statements = [
+            f"""
+            CREATE TABLE IF NOT EXISTS {queue_table} (
+                {STAGING_GUID_COL} STRING,
+                {ROW_ADDED_DATETIME_COL} TIMESTAMP_NTZ,
+                {KEY_HASH_COL} NUMBER,
+                {LOCKED_COL} STRING
+            )"""
+        ]
+        if self.source == QUEUE_STREAM:
+            statements.append(
+                f"""
+            CREATE STREAM IF NOT EXISTS {self.get_table(staging_table, QUEUE_STREAM_SUFFIX)}
+            ON TABLE {STAGING_SCHEMA}.{staging_table}
+            APPEND_ONLY = TRUE
+            SHOW_INITIAL_ROWS = TRUE"""
+            )
+        else:
+            mark_table = self.get_table(staging_table, QUEUE_MARK_SUFFIX)
+            statements.extend([
+                f"CREATE TABLE IF NOT EXISTS {mark_table} ({HIGH_WATER_MARK_COL} TIMESTAMP_NTZ)",
+                f"""
+            INSERT INTO {mark_table}
+            SELECT '1970-01-01'::TIMESTAMP_NTZ
+            WHERE NOT EXISTS (SELECT 1 FROM {mark_table})"""
+            ])
+        executor = self.milestoner.executor
+        if executor is not None:
+            for statement in statements:
+                executor.execute(statement)
+        return statements
+
+    def get_enqueue_query(self, staging_table: str) -> str:
+        """
+        Generate SQL query moving newly loaded records into the pending-work queue.
+
+        Only rows that are still unprocessed and unlocked are queued, and GUIDs
+        already in the queue are skipped, so concurrent workers never queue a
+        record twice. The watermark scan reaches lag_seconds behind the
+        high-water mark: ROW_ADDED_DATETIME is stamped before the load
+        commits, so a slow load can become visible after newer rows moved the
+        mark past it. Rows of the overlap that were queued before are skipped
+        by the GUID match.
+
+        Args:
+            staging_table: Name of the staging table
+
+        Returns:
+            SQL script queuing new records (and advancing the high-water mark)
+        """
+        queue_table = self.get_table(staging_table)
+        if self.source == QUEUE_STREAM:
+            source = self.get_table(staging_table, QUEUE_STREAM_SUFFIX)
+            new_rows = f"{PROCESSED_DATETIME_COL} IS NULL"
+        else:
+            source = f"{STAGING_SCHEMA}.{staging_table}"
+            mark_table = self.get_table(staging_table, QUEUE_MARK_SUFFIX)
+            new_rows = f"""{ROW_ADDED_DATETIME_COL} > DATEADD(
+                    'millisecond', -{int(self.lag_seconds * 1000)}, (SELECT {HIGH_WATER_MARK_COL} FROM {mark_table})
+                )
+                AND {PROCESSED_DATETIME_COL} IS NULL
+                AND {LOCKED_COL} IS NULL"""
+        query = self._get_merge_query(queue_table, source, new_rows)
+        if self.source == QUEUE_WATERMARK:
+            query += f""";
+
+        UPDATE {mark_table}
+        SET {HIGH_WATER_MARK_COL} = GREATEST(
+            {HIGH_WATER_MARK_COL},
+            COALESCE((SELECT MAX({ROW_ADDED_DATETIME_COL}) FROM {queue_table}), {HIGH_WATER_MARK_COL})
+        )"""
+        return query
+
+    def get_requeue_query(self, staging_table: str, source: str, rows: str) -> str:
+        """
+        Generate SQL query queuing rows that the enqueue scan would not see.
+
+        Rows moved back into staging (see StagingCompactor.restore) keep their
+        original ROW_ADDED_DATETIME, which the watermark scan has passed long
+        ago, so they are queued from their source explicitly. GUIDs already in
+        the queue are skipped.
+
+        Args:
+            staging_table: Name of the staging table
+            source: Qualified table holding the rows, with the staging table's columns
+            rows: Predicate selecting the rows of source to queue
+
+        Returns:
+            SQL MERGE statement
+        """
+        return self._get_merge_query(self.get_table(staging_table), source, rows)
+
+    def get_lock_query(
+        self,
+        staging_table: str,
+        batch_id: str,
+        batch_size: int,
+        partition: Optional[Tuple[int, int]] = None
+    ) -> str:
+        """
+        Generate SQL script locking a batch through the pending-work queue.
+
+        New records are queued, the oldest unclaimed queue rows are claimed
+        for the batch and the matching staging rows are locked. The staging
+        update is bounded by the earliest load time of the claim, so the
+        warehouse only reads the micro-partitions holding pending rows. The
+        staging lock is named records_processed.
+
+        Args:
+            staging_table: Name of the staging table
+            batch_id: ID of the current batch
+            batch_size: Maximum number of records to process
+            partition: Optional (index, count) pair restricting the claim to
+                the records whose business keys hash into the given partition
+
+        Returns:
+            SQL script to lock records
+        """
+        queue_table = self.get_table(staging_table)
+        partition_filter = ''
+        if partition is not None:
+            partition_filter = f"AND {self.milestoner.get_partition_predicate(partition, KEY_HASH_COL)}"
+        claim = f"""
+        {self.get_enqueue_query(staging_table)};
+
+        UPDATE {queue_table}
+        SET {LOCKED_COL} = '{batch_id}'
+        WHERE {STAGING_GUID_COL} IN (
+            SELECT {STAGING_GUID_COL}
+            FROM {queue_table}
+            WHERE {LOCKED_COL} IS NULL
+            {partition_filter}
+            ORDER BY {ROW_ADDED_DATETIME_COL} ASC
+            LIMIT {batch_size}
+        );"""
+        return claim + name_result('records_processed', f"""
+        UPDATE {STAGING_SCHEMA}.{staging_table}
+        SET {LOCKED_COL} = '{batch_id}',
+            {MILESTONING_FLAG_COL} = NULL
+        WHERE {STAGING_GUID_COL} IN (
+            SELECT {STAGING_GUID_COL} FROM {queue_table} WHERE {LOCKED_COL} = '{batch_id}'
+        )
+        AND {ROW_ADDED_DATETIME_COL} >= (
+            SELECT MIN({ROW_ADDED_DATETIME_COL}) FROM {queue_table} WHERE {LOCKED_COL} = '{batch_id}'
+        )
+        AND {LOCKED_COL} IS NULL""")
+
+    def get_remove_query(self, staging_table: str, batch_id: str) -> str:
+        """
+        Generate SQL query removing the records of a processed batch from the queue.
+
+        Args:
+            staging_table: Name of the staging table
+            batch_id: ID of the processed batch
+
+        Returns:
+            SQL DELETE statement
+        """
+        return f"""
+        DELETE FROM {self.get_table(staging_table)}
+        WHERE {LOCKED_COL} = '{batch_id}'"""
+
+    def _get_merge_query(self, queue_table: str, source: str, rows: str) -> str:
+        """
+        Generate SQL query adding the rows of a table to the queue, skipping queued GUIDs.
+
+        Args:
+            queue_table: Qualified queue table
+            source: Qualified table or stream holding the rows
+            rows: Predicate selecting the rows of source to queue
+
+        Returns:
+            SQL MERGE statement
+        """
+        return f"""
+        MERGE INTO {queue_table} q
+        USING (
+            SELECT {STAGING_GUID_COL}, {ROW_ADDED_DATETIME_COL}, {self.milestoner.get_key_hash()} AS {KEY_HASH_COL}
+            FROM {source}
+            WHERE {rows}
+        ) s
+        ON q.{STAGING_GUID_COL} = s.{STAGING_GUID_COL}
+        WHEN NOT MATCHED THEN INSERT (
+            {STAGING_GUID_COL},
+            {ROW_ADDED_DATETIME_COL},
+            {KEY_HASH_COL}
+        ) VALUES (
+            s.{STAGING_GUID_COL},
+            s.{ROW_ADDED_DATETIME_COL},
+            s.{KEY_HASH_COL}
+        )"""
@@ -0,0 +1,372 @@
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .bitemporal_milestoner import (
+    BitemporalMilestoner,
+    SYSTEM_FROM_COL,
+    SYSTEM_TO_COL,
+    VALID_FROM_COL,
+    VALID_TO_COL
+)
+from .executor import QueryExecutor, QueryResult
+
+logger = logging.getLogger(__name__)
+
+# Business key values of one record
+Key = Tuple[Any, ...]
+
+# Cached rows of one snapshot per key; None marks keys without a version
+Snapshot = Dict[Key, Optional[Tuple[Any, ...]]]
+
+
+class PointInTimeReader:
+    """
+    Reads conformed tables as of a point in valid time and system time.
+
+    A version is part of the snapshot (valid_time, system_time) when it was
+    recorded by system_time and covers valid_time as known then:
+
+        SYSTEM_FROM <= system_time
+        AND VALID_FROM <= valid_time
+        AND (VALID_TO IS NULL OR valid_time < VALID_TO OR SYSTEM_TO > system_time)
+
+    The last alternative keeps versions that were only closed after
+    system_time. It is applied to the latest row of every version recorded
+    by system_time, since history splitting records corrected copies of
+    closed versions instead of rewriting them. Every other predicate
+    compares a bare column with a bound value and is applied before the
+    versions are ranked, so the warehouse can prune micro-partitions on
+    SYSTEM_FROM, VALID_FROM and the leading business key. Omitting
+    valid_time selects the open version and omitting system_time uses the
+    latest knowledge.
+
+    Lookups of many keys are sent as few statements, each restricted to an
+    IN list and the range of the leading business key. A snapshot stops
+    changing once its system time is settled. Batches stamp SYSTEM_FROM when
+    they start, and partitioned or backfill workers may commit them after
+    batches that started later, so a system time is only settled once it is
+    older than the longest a batch may run (max_batch_seconds). Only settled
+    snapshots are cached, per key, and repeated lookups then only query the
+    keys not seen before. Snapshots of recent or future system times are
+    read from the table every time.
+    """
+
+    def __init__(
+        self,
+        milestoner: BitemporalMilestoner,
+        conformed_table: str,
+        executor: Optional[QueryExecutor] = None,
+        max_keys_per_query: int = 1000,
+        cache_snapshots: int = 0,
+        max_batch_seconds: Optional[float] = None
+    ):
+        """
+        Initialize the PointInTimeReader.
+
+        Args:
+            milestoner: Milestoner whose configuration describes the conformed table
+            conformed_table: Name of the conformed table
+            executor: Executor used to run the queries, defaults to the milestoner's
+            max_keys_per_query: Maximum number of keys looked up per statement
+            cache_snapshots: Number of snapshots with a settled system_time
+                whose rows are cached per key; 0 disables the cache
+            max_batch_seconds: Longest a batch may take from stamping its
+                system time to committing; required with cache_snapshots
+        """
+        if max_keys_per_query < 1:
+            raise ValueError("max_keys_per_query must be at least 1")
+        if cache_snapshots < 0:
+            raise ValueError("cache_snapshots must not be negative")
+        if cache_snapshots > 0 and (max_batch_seconds is None or max_batch_seconds <= 0):
+            raise ValueError("cache_snapshots requires a positive max_batch_seconds")
+
+        self.milestoner = milestoner
+        self.conformed_table = conformed_table
+        self.executor = executor or milestoner.executor
+        self.max_keys_per_query = max_keys_per_query
+        self.cache_snapshots = cache_snapshots
+        self.max_batch_seconds = max_batch_seconds
+        self.columns = list(milestoner.business_keys) + [
+            col for col in milestoner.data_columns if col not in milestoner.business_keys
+        ] + [VALID_FROM_COL, VALID_TO_COL, SYSTEM_FROM_COL, SYSTEM_TO_COL]
+        self._cache: 'OrderedDict[Tuple[str, str], Snapshot]' = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def as_of_query(
+        self,
+        valid_time: Any = None,
+        system_time: Any = None,
+        keys: Optional[Sequence[Any]] = None
+    ) -> List[Tuple[str, List[Any]]]:
+        """
+        Generate the statements reading a snapshot.
+
+        Args:
+            valid_time: Point in valid time, or None for the open version
+            system_time: Point in system time, or None for the latest knowledge
+            keys: Business keys to look up (values for a single business key,
+                tuples otherwise), or None for every key
+
+        Returns:
+            List of (SQL query, bind parameters); one per chunk of keys
+        """
+        if keys is None:
+            return [self._get_select(valid_time, system_time, [], [])]
+
+        statements = []
+        normalized = [self._normalize_key(key) for key in keys]
+        for start in range(0, len(normalized), self.max_keys_per_query):
+            chunk = normalized[start:start + self.max_keys_per_query]
+            statements.append(self._get_select(valid_time, system_time, *self._get_key_predicates(chunk)))
+        return statements
+
+    def as_of(
+        self,
+        valid_time: Any = None,
+        system_time: Any = None,
+        keys: Optional[Sequence[Any]] = None
+    ) -> QueryResult:
+        """
+        Read a snapshot of the conformed table.
+
+        Args:
+            valid_time: Point in valid time, or None for the open version
+            system_time: Point in system time, or None for the latest knowledge
+            keys: Business keys to look up (values for a single business key,
+                tuples otherwise), or None for every key
+
+        Returns:
+            QueryResult whose columns are the business keys, the other data
+            columns and the four temporal columns. With keys, rows follow the
+            order of the keys and keys without a version are left out.
+        """
+        if self.executor is None:
+            raise ValueError("as_of requires an executor")
+        snapshot_key = (str(valid_time), str(system_time))
+        if (
+            keys is None
+            or system_time is None
+            or self.cache_snapshots == 0
+            or not self._is_settled(snapshot_key, system_time)
+        ):
+            rows = []
+            for sql, params in self.as_of_query(valid_time, system_time, keys):
+                rows.extend(self.executor.execute(sql, params).rows)
+            if keys is not None:
+                rows = self._order_by_keys(rows, [self._normalize_key(key) for key in keys])
+            return QueryResult(rowcount=len(rows), columns=list(self.columns), rows=rows)
+
+        normalized = [self._normalize_key(key) for key in keys]
+        snapshot = self._get_cached_snapshot(snapshot_key)
+        with self._cache_lock:
+            missing = list(dict.fromkeys(key for key in normalized if key not in snapshot))
+        if missing:
+            found: Snapshot = {key: None for key in missing}
+            for sql, params in self.as_of_query(valid_time, system_time, missing):
+                for row in self.executor.execute(sql, params).rows:
+                    found[self._get_row_key(row)] = tuple(row)
+            with self._cache_lock:
+                snapshot.update(found)
+        logger.debug(
+            'As-of %s/%s: %d keys, %d from cache', valid_time, system_time, len(normalized), len(normalized) - len(missing)
+        )
+
+        with self._cache_lock:
+            rows = [snapshot[key] for key in normalized if snapshot.get(key) is not None]
+        return QueryResult(rowcount=len(rows), columns=list(self.columns), rows=rows)
+
+    def clear_cache(self) -> None:
+        """
+        Drop every cached snapshot.
+        """
+        with self._cache_lock:
+            self._cache.clear()
+
+    def _get_time_predicates(
+        self,
+        valid_time: Any,
+        system_time: Any
+    ) -> Tuple[List[str], List[Any], str, List[Any]]:
+        """
+        Generate the bitemporal predicates of a snapshot.
+
+        Args:
+            valid_time: Point in valid time, or None for the open version
+            system_time: Point in system time, or None for the latest knowledge
+
+        Returns:
+            Tuple of (SQL predicates applied before ranking the versions,
+            their bind parameters, SQL predicate applied to the latest row of
+            every version, its bind parameters)
+        """
+        predicates: List[str] = []
+        params: List[Any] = []
+        if system_time is not None:
+            predicates.append(f"{SYSTEM_FROM_COL} <= ?")
+            params.append(system_time)
+        if valid_time is not None:
+            predicates.append(f"{VALID_FROM_COL} <= ?")
+            params.append(valid_time)
+
+        alternatives = [f"{VALID_TO_COL} IS NULL"]
+        interval_params = []
+        if valid_time is not None:
+            alternatives.append(f"? < {VALID_TO_COL}")
+            interval_params.append(valid_time)
+        if system_time is not None:
+            alternatives.append(f"{SYSTEM_TO_COL} > ?")
+            interval_params.append(system_time)
+        return predicates, params, f"({' OR '.join(alternatives)})", interval_params
+
+    def _get_key_predicates(self, keys: List[Key]) -> Tuple[List[str], List[Any]]:
+        """
+        Generate the predicates restricting a snapshot to some business keys.
+
+        Args:
+            keys: Normalized business keys
+
+        Returns:
+            Tuple of (SQL predicates, bind parameters)
+        """
+        business_keys = self.milestoner.business_keys
+        leading = [key[0] for key in keys]
+        predicates = [f"{business_keys[0]} BETWEEN ? AND ?"]
+        params: List[Any] = [min(leading), max(leading)]
+        if len(business_keys) == 1:
+            predicates.append(f"{business_keys[0]} IN ({', '.join('?' for _ in keys)})")
+            params.extend(leading)
+        else:
+            row = f"({', '.join('?' for _ in business_keys)})"
+            predicates.append(
+                f"({', '.join(business_keys)}) IN (SELECT * FROM (VALUES {', '.join(row for _ in keys)}))"
+            )
+            params.extend(value for key in keys for value in key)
+        return predicates, params
+
+    def _get_select(
+        self,
+        valid_time: Any,
+        system_time: Any,
+        key_predicates: List[str],
+        key_params: List[Any]
+    ) -> Tuple[str, List[Any]]:
+        """
+        Generate the query selecting the snapshot columns.
+
+        The open versions are read directly (from the current-state table if
+        one is maintained); every other snapshot ranks the rows of each
+        version first.
+
+        Args:
+            valid_time: Point in valid time, or None for the open version
+            system_time: Point in system time, or None for the latest knowledge
+            key_predicates: SQL predicates restricting the business keys
+            key_params: Bind parameters of the key predicates
+
+        Returns:
+            Tuple of (SQL query, bind parameters)
+        """
+        if valid_time is None and system_time is None:
+            table = self.milestoner.get_open_versions_table(self.conformed_table)
+            conditions = '\n        AND '.join([f"{VALID_TO_COL} IS NULL"] + key_predicates)
+            return f"""
+        SELECT {', '.join(self.columns)}
+        FROM {table}
+        WHERE {conditions}""", list(key_params)
+
+        predicates, params, interval, interval_params = self._get_time_predicates(valid_time, system_time)
+        latest = self.milestoner.get_latest_versions_query(self.conformed_table, predicates + key_predicates)
+        return f"""
+        SELECT {', '.join(self.columns)}
+        FROM (
+            {latest}
+        ) v
+        WHERE {interval}""", params + list(key_params) + interval_params
+
+    def _normalize_key(self, key: Any) -> Key:
+        """
+        Turn a looked up key into a tuple of business key values.
+
+        Args:
+            key: Value of a single business key, or a sequence of values
+
+        Returns:
+            Tuple of business key values
+        """
+        if isinstance(key, (tuple, list)):
+            key = tuple(key)
+        else:
+            key = (key,)
+        if len(key) != len(self.milestoner.business_keys):
+            raise ValueError(f"Key {key} does not match business keys {self.milestoner.business_keys}")
+        return key
+
+    def _get_row_key(self, row: Sequence[Any]) -> Key:
+        """
+        Get the business key of a result row.
+
+        Args:
+            row: Result row
+
+        Returns:
+            Tuple of business key values
+        """
+        return tuple(row[:len(self.milestoner.business_keys)])
+
+    def _order_by_keys(self, rows: List[Tuple[Any, ...]], keys: List[Key]) -> List[Tuple[Any, ...]]:
+        """
+        Order result rows like the looked up keys.
+
+        Args:
+            rows: Result rows
+            keys: Normalized business keys in lookup order
+
+        Returns:
+            Rows ordered by the first position of their key
+        """
+        positions: Dict[Key, int] = {}
+        for position, key in enumerate(keys):
+            positions.setdefault(key, position)
+        return sorted(rows, key=lambda row: positions.get(self._get_row_key(row), len(keys)))
+
+    def _is_settled(self, snapshot_key: Tuple[str, str], system_time: Any) -> bool:
+        """
+        Decide whether a snapshot can be cached.
+
+        Args:
+            snapshot_key: (valid time, system time) of the snapshot
+            system_time: Point in system time of the snapshot
+
+        Returns:
+            True if the snapshot is cached already or its system time is
+            older than max_batch_seconds, so every batch stamped at or
+            before it has committed
+        """
+        with self._cache_lock:
+            if snapshot_key in self._cache:
+                return True
+        if not isinstance(system_time, datetime):
+            system_time = datetime.fromisoformat(str(system_time))
+        return system_time < datetime.now() - timedelta(seconds=self.max_batch_seconds)
+
+    def _get_cached_snapshot(self, snapshot_key: Tuple[str, str]) -> Snapshot:
+        """
+        Get the cached rows of a snapshot, evicting the least recently used snapshot if needed.
+
+        Args:
+            snapshot_key: (valid time, system time) of the snapshot
+
+        Returns:
+            Mutable mapping of key to cached row
+        """
+        with self._cache_lock:
+            if snapshot_key in self._cache:
+                self._cache.move_to_end(snapshot_key)
+            else:
+                self._cache[snapshot_key] = {}
+                while len(self._cache) > self.cache_snapshots:
+                    self._cache.popitem(last=False)
+            return self._cache[snapshot_key]
@@ -0,0 +1,198 @@
+import logging
+import math
+import os
+import threading
+import time
+from typing import Callable, List, Sequence, Tuple
+
+import numpy as np
+
+from .checksum import fnv1a_64
+
+logger = logging.getLogger(__name__)
+
+# Constants of the 64-bit MurmurHash3 finalizer, used to derive the second hash
+MIX_MULTIPLIER_1 = np.uint64(0xff51afd7ed558ccd)
+MIX_MULTIPLIER_2 = np.uint64(0xc4ceb9fe1a85ec53)
+
+
+class SeenChecksumFilter:
+    """
+    Bounded-memory Bloom filter of recently merged ROW_CHECKSUM values.
+
+    The filter keeps a fixed number of generations, each a Bloom filter sized
+    for capacity checksums at the given false positive rate. New checksums go
+    into the newest generation; a lookup matches if any generation contains
+    the checksum. The newest generation is rotated out of the write path once
+    it is full or older than rotate_after seconds, and the oldest generation
+    is dropped, so memory stays at generations * bits_per_generation and
+    checksums are forgotten after roughly generations * rotate_after seconds.
+
+    A positive lookup may be a false positive, so the filter must only be used
+    to skip rows that are expected to be resends.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 1000000,
+        error_rate: float = 0.001,
+        generations: int = 2,
+        rotate_after: float = 86400.0,
+        clock: Callable[[], float] = time.time
+    ):
+        """
+        Initialize the SeenChecksumFilter.
+
+        Args:
+            capacity: Number of checksums one generation holds at error_rate
+            error_rate: Target false positive rate of one generation
+            generations: Number of generations kept
+            rotate_after: Seconds after which the newest generation is rotated
+            clock: Callable returning the current time in seconds
+        """
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be in (0, 1)")
+        if generations < 1:
+            raise ValueError("generations must be at least 1")
+
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.generations = generations
+        self.rotate_after = rotate_after
+        self.clock = clock
+        bits = -capacity * math.log(error_rate) / math.log(2) ** 2
+        self.bits_per_generation = int(math.ceil(bits / 8)) * 8
+        self.hash_count = max(1, round(self.bits_per_generation / capacity * math.log(2)))
+        self._bits: List[np.ndarray] = []
+        self._created: List[float] = []
+        self._counts: List[int] = []
+        self._lock = threading.Lock()
+        self._new_generation()
+
+    @property
+    def memory_bytes(self) -> int:
+        """
+        Memory used by the bit arrays once all generations exist.
+        """
+        return self.generations * self.bits_per_generation // 8
+
+    def add(self, checksums: Sequence[str]) -> None:
+        """
+        Record checksums as seen.
+
+        Args:
+            checksums: ROW_CHECKSUM values
+        """
+        if len(checksums) == 0:
+            return
+        byte_index, masks = self._get_positions(checksums)
+        with self._lock:
+            self._rotate_if_due()
+            np.bitwise_or.at(self._bits[0], byte_index.ravel(), masks.ravel())
+            self._counts[0] += len(checksums)
+
+    def contains(self, checksums: Sequence[str]) -> np.ndarray:
+        """
+        Check which checksums have probably been seen.
+
+        Args:
+            checksums: ROW_CHECKSUM values
+
+        Returns:
+            Boolean array, True where the checksum was (probably) seen
+        """
+        found = np.zeros(len(checksums), dtype=bool)
+        if len(checksums) == 0:
+            return found
+        byte_index, masks = self._get_positions(checksums)
+        with self._lock:
+            for bits in self._bits:
+                found |= ((bits[byte_index] & masks) != 0).all(axis=1)
+        return found
+
+    def rotate(self) -> None:
+        """
+        Start a new generation, dropping the oldest one if all are in use.
+        """
+        with self._lock:
+            self._new_generation()
+
+    def save(self, path: str) -> None:
+        """
+        Write the filter to a file, replacing it atomically.
+
+        Args:
+            path: Path of the .npz file to write
+        """
+        with self._lock:
+            bits = np.stack(self._bits)
+            created = np.array(self._created)
+            counts = np.array(self._counts)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                bits=bits,
+                created=created,
+                counts=counts,
+                config=np.array([self.capacity, self.error_rate, self.generations, self.rotate_after])
+            )
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str, clock: Callable[[], float] = time.time) -> 'SeenChecksumFilter':
+        """
+        Read a filter written by save().
+
+        Args:
+            path: Path of the .npz file
+            clock: Callable returning the current time in seconds
+
+        Returns:
+            SeenChecksumFilter with the saved configuration and contents
+        """
+        with np.load(path) as saved:
+            capacity, error_rate, generations, rotate_after = saved['config'].tolist()
+            seen_filter = cls(int(capacity), error_rate, int(generations), rotate_after, clock)
+            seen_filter._bits = list(saved['bits'])
+            seen_filter._created = saved['created'].tolist()
+            seen_filter._counts = [int(c) for c in saved['counts']]
+        return seen_filter
+
+    def _new_generation(self) -> None:
+        self._bits.insert(0, np.zeros(self.bits_per_generation // 8, dtype=np.uint8))
+        self._created.insert(0, self.clock())
+        self._counts.insert(0, 0)
+        del self._bits[self.generations:]
+        del self._created[self.generations:]
+        del self._counts[self.generations:]
+
+    def _rotate_if_due(self) -> None:
+        if self._counts[0] >= self.capacity or self.clock() - self._created[0] >= self.rotate_after:
+            logger.debug('Rotating seen-checksum filter after %d checksums', self._counts[0])
+            self._new_generation()
+
+    def _get_positions(self, checksums: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Compute the bit positions of checksums with double hashing.
+
+        Args:
+            checksums: ROW_CHECKSUM values
+
+        Returns:
+            Tuple of (byte indexes, bit masks), each of shape (len(checksums), hash_count)
+        """
+        first = fnv1a_64([str(c).encode('utf-8') for c in checksums])
+        second = first ^ (first >> np.uint64(33))
+        second *= MIX_MULTIPLIER_1
+        second ^= second >> np.uint64(33)
+        second *= MIX_MULTIPLIER_2
+        second ^= second >> np.uint64(33)
+        second |= np.uint64(1)
+        steps = np.arange(self.hash_count, dtype=np.uint64)
+        positions = (first[:, None] + steps[None, :] * second[:, None]) % np.uint64(self.bits_per_generation)
+        byte_index = (positions >> np.uint64(3)).astype(np.int64)
+        masks = np.left_shift(np.uint8(1), (positions & np.uint64(7)).astype(np.uint8))
+        return byte_index, masks
@@ -0,0 +1,241 @@
+import hashlib
+import re
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from .executor import split_statements
+
+# Prefix and suffix of the markers standing in for per-batch values
+BIND_MARKER_PREFIX = '__milestone_'
+BIND_MARKER_SUFFIX = '__'
+
+# Kinds of per-batch values, declared by the query generator. Parameters are
+# string literals sent as bind parameters; constants are inlined because
+# clauses such as LIMIT only accept literals; identifiers are inlined into
+# object names (with dashes removed), so every batch keeps its own
+# temporary tables even when pooled sessions are reused.
+PARAMETER = 'param'
+CONSTANT = 'const'
+IDENTIFIER = 'ident'
+
+# Positional bind placeholder (qmark paramstyle)
+QMARK = '?'
+
+_NAME = r"[a-z]+(?:_[a-z]+)*"
+_MARKER = re.compile(
+    rf"{BIND_MARKER_PREFIX}({PARAMETER}|{CONSTANT}|{IDENTIFIER})_({_NAME}){BIND_MARKER_SUFFIX}"
+)
+_PARAMETER_MARKER = re.compile(rf"{BIND_MARKER_PREFIX}{PARAMETER}_({_NAME}){BIND_MARKER_SUFFIX}")
+_WHITESPACE = re.compile(r"\s+")
+
+# Statements bound to their positional parameters
+BoundStatements = List[Tuple[str, List[Any]]]
+
+# Text before a marker, the marker's kind and its value name
+Segment = Tuple[str, str, str]
+
+
+def bind_parameter(name: str) -> str:
+    """
+    Create the marker of a per-batch value used as a string literal.
+
+    The generator quotes the marker like the literal it stands for
+    ('<marker>'); bound statements replace the quoted marker by a placeholder.
+
+    Args:
+        name: Name of the value (lowercase words separated by underscores)
+
+    Returns:
+        Marker text
+    """
+    return f"{BIND_MARKER_PREFIX}{PARAMETER}_{name}{BIND_MARKER_SUFFIX}"
+
+
+def bind_constant(name: str) -> str:
+    """
+    Create the marker of a per-batch value that is always inlined, e.g. a LIMIT.
+
+    Args:
+        name: Name of the value (lowercase words separated by underscores)
+
+    Returns:
+        Marker text
+    """
+    return f"{BIND_MARKER_PREFIX}{CONSTANT}_{name}{BIND_MARKER_SUFFIX}"
+
+
+def as_identifier(value: str) -> str:
+    """
+    Turn a per-batch value into a suffix of object names.
+
+    Args:
+        value: Literal value, or the marker of a parameter
+
+    Returns:
+        The value without dashes, or the identifier marker of the same
+        parameter, which is inlined (without dashes) when rendering and binding
+    """
+    match = _PARAMETER_MARKER.fullmatch(value)
+    if match is not None:
+        return f"{BIND_MARKER_PREFIX}{IDENTIFIER}_{match.group(1)}{BIND_MARKER_SUFFIX}"
+    return value.replace('-', '')
+
+
+def _parse(sql: str) -> Tuple[List[Segment], str]:
+    """
+    Split SQL into the text around its markers.
+
+    Args:
+        sql: SQL containing bind markers
+
+    Returns:
+        Tuple of (segments, text after the last marker); the quotes around
+        parameter markers are not part of the segments
+    """
+    segments = []
+    position = 0
+    for match in _MARKER.finditer(sql):
+        kind, name = match.groups()
+        start, end = match.span()
+        if kind == PARAMETER:
+            if sql[start - 1:start] != "'" or sql[end:end + 1] != "'":
+                raise ValueError(f"Parameter {name} must be used as a quoted literal")
+            start, end = start - 1, end + 1
+        segments.append((sql[position:start], kind, name))
+        position = end
+    return segments, sql[position:]
+
+
+def _render_value(kind: str, value: Any) -> str:
+    if kind == PARAMETER:
+        return f"'{value}'"
+    if kind == IDENTIFIER:
+        return str(value).replace('-', '')
+    return str(value)
+
+
+class QueryTemplate:
+    """
+    Generated SQL with markers in place of per-batch values.
+
+    A template is parsed once and can then be rendered with literal values
+    (producing exactly the text the generator would have produced for those
+    values) or bound, producing qmark statements with their positional
+    parameters. The kind of every marker is declared by the generator
+    (bind_parameter, bind_constant, as_identifier), so statements without
+    constants or identifiers have the same text for every batch.
+
+    The template text, with whitespace collapsed and markers in place of the
+    values, is the same for every batch, and its fingerprint keys the
+    statements of all batches rendered from it (e.g. in the audit log).
+    """
+
+    def __init__(self, sql: str):
+        """
+        Initialize the QueryTemplate.
+
+        Args:
+            sql: Generated SQL containing bind markers
+        """
+        self.sql = sql
+        self._segments, self._tail = _parse(sql)
+        # Scripting blocks cannot reference client-side bind variables
+        self.bindable = '$$' not in sql
+        self.text = _WHITESPACE.sub(' ', sql).strip()
+        self.fingerprint = hashlib.sha1(self.text.encode('utf-8')).hexdigest()[:16]
+        self._statements: Optional[List[Tuple[List[Segment], str]]] = None
+
+    def render(self, values: Mapping[str, Any]) -> str:
+        """
+        Substitute literal values for the markers.
+
+        Args:
+            values: Value per marker name
+
+        Returns:
+            SQL text with inlined values
+        """
+        parts = []
+        for before, kind, name in self._segments:
+            parts.append(before)
+            parts.append(_render_value(kind, values[name]))
+        parts.append(self._tail)
+        return ''.join(parts)
+
+    def bind(self, values: Mapping[str, Any]) -> BoundStatements:
+        """
+        Produce qmark statements and their positional parameters.
+
+        Args:
+            values: Value per marker name
+
+        Returns:
+            List of (statement, parameters) pairs, one per statement of the template
+        """
+        if not self.bindable:
+            raise ValueError("Scripting blocks cannot be run with bind parameters")
+        if self._statements is None:
+            self._statements = [_parse(statement) for statement in split_statements(self.sql)]
+        bound = []
+        for segments, tail in self._statements:
+            parts = []
+            params = []
+            for before, kind, name in segments:
+                parts.append(before)
+                if kind == PARAMETER:
+                    parts.append(QMARK)
+                    params.append(values[name])
+                else:
+                    parts.append(_render_value(kind, values[name]))
+            parts.append(tail)
+            bound.append((''.join(parts), params))
+        return bound
+
+
+def compile_templates(queries: Dict[str, str]) -> Dict[str, QueryTemplate]:
+    """
+    Parse generated queries into templates.
+
+    Args:
+        queries: Generated SQL with bind markers keyed by name
+
+    Returns:
+        QueryTemplate per name
+    """
+    return {name: QueryTemplate(sql) for name, sql in queries.items()}
+
+
+def render_all(templates: Dict[str, QueryTemplate], values: Mapping[str, Any]) -> Dict[str, str]:
+    """
+    Render every template with the same values.
+
+    Args:
+        templates: Templates keyed by name
+        values: Value per marker name
+
+    Returns:
+        Rendered SQL keyed by name
+    """
+    return {name: template.render(values) for name, template in templates.items()}
+
+
+def bind_all(
+    templates: Dict[str, QueryTemplate],
+    values: Mapping[str, Any],
+    names: Optional[Sequence[str]] = None
+) -> Dict[str, BoundStatements]:
+    """
+    Bind every bindable template with the same values.
+
+    Args:
+        templates: Templates keyed by name
+        values: Value per marker name
+        names: Restrict binding to these names
+
+    Returns:
+        Bound statements keyed by name; templates that cannot be bound are left out
+    """
+    return {
+        name: template.bind(values)
+        for name, template in templates.items()
+        if template.bindable and (names is None or name in names)
+    }
@@ -0,0 +1,390 @@
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .bitemporal_milestoner import (
+    BitemporalMilestoner,
+    SYSTEM_FROM_COL,
+    SYSTEM_TO_COL,
+    VALID_FROM_COL,
+    VALID_TO_COL
+)
+from .in_memory import Columns, get_ids, null_mask, nullable, null_value, to_columns
+
+logger = logging.getLogger(__name__)
+
+# Prefix of right-hand columns whose name is already taken by a left-hand column
+RIGHT_COLUMN_PREFIX = 'RIGHT_'
+
+# Column holding the time bucket a version is joined in
+VALID_BUCKET_COL = 'VALID_BUCKET'
+
+
+class TemporalJoin:
+    """
+    Joins two milestoned tables on a key and on overlapping validity.
+
+    Every pair of versions whose keys match and whose valid-time intervals
+    intersect produces one row holding the columns of both versions and the
+    intersection as VALID_FROM and VALID_TO. Open versions (VALID_TO NULL)
+    extend indefinitely and empty versions are skipped. Only the latest row
+    recorded for every version is joined, as history splitting records
+    corrected copies of closed versions.
+
+    The generated SQL joins on the key with plain range predicates, which the
+    warehouse runs as a hash or sort-merge join on the key. When keys carry
+    long histories on both sides, bucket_seconds adds time buckets to the
+    join key: every version is repeated for each bucket its interval touches,
+    and a pair is only kept in the bucket where its intersection starts.
+
+    join() produces the same rows for local columnar data with sorts and
+    binary searches over NumPy arrays. It relies on the versions of a key not
+    overlapping within each table, which milestoning guarantees.
+    """
+
+    def __init__(
+        self,
+        left: BitemporalMilestoner,
+        right: BitemporalMilestoner,
+        on: Optional[Dict[str, str]] = None,
+        left_columns: Optional[List[str]] = None,
+        right_columns: Optional[List[str]] = None,
+        bucket_seconds: Optional[int] = None
+    ):
+        """
+        Initialize the TemporalJoin.
+
+        Args:
+            left: Milestoner whose configuration describes the left table
+            right: Milestoner whose configuration describes the right table
+            on: Left column per right column it is joined with, e.g.
+                {'DEPARTMENT_ID': 'DEPARTMENT_ID'}. Defaults to the right
+                table's business keys, which the left table must also have.
+            left_columns: Left columns in the result, defaults to its data columns
+            right_columns: Right columns in the result, defaults to its data
+                columns other than the join columns. Names already used by a
+                left column get RIGHT_COLUMN_PREFIX.
+            bucket_seconds: Width of the time buckets added to the join key in
+                SQL. The validity columns must then be dates or timestamps.
+        """
+        on = on or {key: key for key in right.business_keys}
+        for left_column, right_column in on.items():
+            if left_column not in left.business_keys + left.data_columns:
+                raise ValueError(f"Unknown left join column: {left_column}")
+            if right_column not in right.business_keys + right.data_columns:
+                raise ValueError(f"Unknown right join column: {right_column}")
+        if bucket_seconds is not None and bucket_seconds <= 0:
+            raise ValueError("bucket_seconds must be positive")
+
+        self.left = left
+        self.right = right
+        self.on = dict(on)
+        self.left_columns = list(left_columns or left.data_columns)
+        self.right_columns = list(
+            right_columns or [col for col in right.data_columns if col not in self.on.values()]
+        )
+        self.bucket_seconds = bucket_seconds
+
+    @property
+    def columns(self) -> List[str]:
+        """
+        Names of the result columns.
+        """
+        return self.left_columns + [
+            self._get_right_name(col) for col in self.right_columns
+        ] + [VALID_FROM_COL, VALID_TO_COL]
+
+    def get_join_query(
+        self,
+        left_table: str,
+        right_table: str,
+        system_time: Any = None
+    ) -> Tuple[str, List[Any]]:
+        """
+        Generate the interval-intersection join of two conformed tables.
+
+        Args:
+            left_table: Name of the left conformed table
+            right_table: Name of the right conformed table
+            system_time: Join the versions as known at this system time,
+                or None for the latest knowledge
+
+        Returns:
+            Tuple of (SQL query, bind parameters)
+        """
+        left_versions, left_params = self._get_versions_query(
+            self.left, left_table, self.left_columns + list(self.on), system_time
+        )
+        right_versions, right_params = self._get_versions_query(
+            self.right, right_table, self.right_columns + list(self.on.values()), system_time
+        )
+        select = ', '.join(
+            [f"l.{col}" for col in self.left_columns]
+            + [f"r.{col} AS {self._get_right_name(col)}" for col in self.right_columns]
+        )
+        conditions = [f"l.{left_col} = r.{right_col}" for left_col, right_col in self.on.items()]
+        conditions += [
+            f"(r.{VALID_TO_COL} IS NULL OR l.{VALID_FROM_COL} < r.{VALID_TO_COL})",
+            f"(l.{VALID_TO_COL} IS NULL OR r.{VALID_FROM_COL} < l.{VALID_TO_COL})"
+        ]
+        valid_from = f"""CASE WHEN r.{VALID_FROM_COL} > l.{VALID_FROM_COL}
+                THEN r.{VALID_FROM_COL} ELSE l.{VALID_FROM_COL} END"""
+
+        if self.bucket_seconds is not None:
+            left_versions = self._get_bucketed_query(left_versions)
+            right_versions = self._get_bucketed_query(right_versions)
+            conditions += [
+                f"l.{VALID_BUCKET_COL} = r.{VALID_BUCKET_COL}",
+                f"l.{VALID_BUCKET_COL} = {self._get_bucket(valid_from)}"
+            ]
+
+        return f"""
+        WITH left_versions AS (
+            {left_versions}
+        ),
+        right_versions AS (
+            {right_versions}
+        )
+        SELECT
+            {select},
+            {valid_from} AS {VALID_FROM_COL},
+            CASE
+                WHEN l.{VALID_TO_COL} IS NULL THEN r.{VALID_TO_COL}
+                WHEN r.{VALID_TO_COL} IS NULL OR l.{VALID_TO_COL} < r.{VALID_TO_COL} THEN l.{VALID_TO_COL}
+                ELSE r.{VALID_TO_COL}
+            END AS {VALID_TO_COL}
+        FROM left_versions l
+        JOIN right_versions r
+            ON {' AND '.join(conditions)}""", left_params + right_params
+
+    def join(self, left: Any, right: Any, system_time: Any = None) -> Columns:
+        """
+        Join two conformed tables held in memory.
+
+        Tables may be given as a mapping of column name to sequence, a pyarrow
+        Table or a pandas DataFrame.
+
+        Args:
+            left: Left conformed table
+            right: Right conformed table
+            system_time: Join the versions as known at this system time,
+                or None for the latest knowledge
+
+        Returns:
+            Result table as a mapping of column name to array
+        """
+        left = self._get_versions(to_columns(left), self.left.business_keys, system_time)
+        right = self._get_versions(to_columns(right), self.right.business_keys, system_time)
+
+        # Shared integer IDs for the join key and dense ranks for all validity bounds
+        key_ids = self._get_join_key_ids(left, right)
+        bounds = [left[VALID_FROM_COL], left[VALID_TO_COL], right[VALID_FROM_COL], right[VALID_TO_COL]]
+        nulls = [null_mask(values) for values in bounds]
+        present = get_ids([values[~mask] for values, mask in zip(bounds, nulls)])
+        open_rank = max((int(ranks.max()) + 1 for ranks in present if len(ranks)), default=0)
+        ranks = []
+        for values, mask, values_present in zip(bounds, nulls, present):
+            rank = np.full(len(values), open_rank, dtype=np.int64)
+            rank[~mask] = values_present
+            ranks.append(rank)
+        left_from, left_to, right_from, right_to = ranks
+
+        # Right versions sorted by key and start; starts and ends of a key ascend together
+        stride = open_rank + 1
+        order = np.lexsort((right_from, key_ids[1]))
+        right_start = key_ids[1][order] * stride + right_from[order]
+        right_end = key_ids[1][order] * stride + right_to[order]
+
+        # Every left version overlaps a contiguous run of its key's right versions
+        first = np.searchsorted(right_end, key_ids[0] * stride + left_from, side='right')
+        stop = np.searchsorted(right_start, key_ids[0] * stride + left_to, side='left')
+        counts = np.maximum(stop - first, 0)
+        left_rows = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.arange(len(left_rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        right_rows = order[np.repeat(first, counts) + offsets]
+
+        result = {col: left[col][left_rows] for col in self.left_columns}
+        for col in self.right_columns:
+            result[self._get_right_name(col)] = right[col][right_rows]
+        later_start = right_from[right_rows] > left_from[left_rows]
+        valid_from = nullable(left[VALID_FROM_COL][left_rows])
+        valid_from[later_start] = right[VALID_FROM_COL][right_rows][later_start]
+        result[VALID_FROM_COL] = valid_from
+        earlier_end = right_to[right_rows] < left_to[left_rows]
+        valid_to = nullable(left[VALID_TO_COL][left_rows])
+        valid_to[earlier_end] = right[VALID_TO_COL][right_rows][earlier_end]
+        result[VALID_TO_COL] = valid_to
+
+        logger.debug(
+            'Temporal join of %d and %d versions produced %d rows',
+            len(key_ids[0]), len(key_ids[1]), len(left_rows)
+        )
+        return result
+
+    def _get_right_name(self, column: str) -> str:
+        """
+        Get the result name of a right column.
+
+        Args:
+            column: Name of the right column
+
+        Returns:
+            The name, prefixed if a left column has it
+        """
+        if column in self.left_columns:
+            return f"{RIGHT_COLUMN_PREFIX}{column}"
+        return column
+
+    def _get_versions_query(
+        self,
+        milestoner: BitemporalMilestoner,
+        table: str,
+        columns: List[str],
+        system_time: Any
+    ) -> Tuple[str, List[Any]]:
+        """
+        Generate the query selecting the non-empty versions of one side.
+
+        As of a system time, versions recorded later are left out and
+        versions closed later are still open.
+
+        Args:
+            milestoner: Milestoner whose configuration describes the table
+            table: Name of the conformed table
+            columns: Columns to select besides the validity bounds
+            system_time: Point in system time, or None for the latest knowledge
+
+        Returns:
+            Tuple of (SQL query, bind parameters)
+        """
+        select = ', '.join(dict.fromkeys(columns))
+        non_empty = f"({VALID_TO_COL} IS NULL OR {VALID_FROM_COL} < {VALID_TO_COL})"
+        if system_time is None:
+            return f"""SELECT {select}, {VALID_FROM_COL}, {VALID_TO_COL}
+            FROM ({milestoner.get_latest_versions_query(table)}) v
+            WHERE {non_empty}""", []
+        latest = milestoner.get_latest_versions_query(table, [f"{SYSTEM_FROM_COL} <= ?"])
+        return f"""SELECT {select}, {VALID_FROM_COL},
+                CASE WHEN {SYSTEM_TO_COL} IS NULL OR {SYSTEM_TO_COL} > ? THEN NULL
+                ELSE {VALID_TO_COL} END AS {VALID_TO_COL}
+            FROM ({latest}) v
+            WHERE {non_empty}""", [system_time, system_time]
+
+    def _get_bucket(self, expression: str) -> str:
+        """
+        Generate the time bucket of a date or timestamp expression.
+
+        Buckets after the current one collapse into it, so open versions only
+        span the buckets up to now.
+
+        Args:
+            expression: SQL date or timestamp expression
+
+        Returns:
+            SQL integer expression
+        """
+        def bucket(value: str) -> str:
+            return f"FLOOR(DATEDIFF('second', '1970-01-01'::TIMESTAMP_NTZ, {value}) / {self.bucket_seconds})"
+        return f"LEAST({bucket(expression)}, {bucket('CURRENT_TIMESTAMP()')})"
+
+    def _get_bucketed_query(self, versions_query: str) -> str:
+        """
+        Generate the query repeating every version for each bucket it touches.
+
+        Args:
+            versions_query: Query selecting the versions of one side
+
+        Returns:
+            SQL query with a VALID_BUCKET column
+        """
+        return f"""SELECT v.*, b.VALUE::INTEGER AS {VALID_BUCKET_COL}
+            FROM ({versions_query}) v,
+            LATERAL FLATTEN(ARRAY_GENERATE_RANGE(
+                {self._get_bucket(f'v.{VALID_FROM_COL}')},
+                COALESCE({self._get_bucket(f'v.{VALID_TO_COL}')}, {self._get_bucket('CURRENT_TIMESTAMP()')}) + 1
+            )) b"""
+
+    def _get_versions(self, table: Columns, business_keys: List[str], system_time: Any) -> Columns:
+        """
+        Select the non-empty versions of an in-memory table.
+
+        Args:
+            table: Conformed table
+            business_keys: Business keys of the table
+            system_time: Point in system time, or None for the latest knowledge
+
+        Returns:
+            Versions with their validity as known at system_time
+        """
+        valid_to = table[VALID_TO_COL]
+        open_versions = null_mask(valid_to)
+        if system_time is not None:
+            recorded = np.zeros(len(valid_to), dtype=bool)
+            system_from = table[SYSTEM_FROM_COL]
+            known_from = ~null_mask(system_from)
+            recorded[known_from] = system_from[known_from] <= system_time
+            system_to = table[SYSTEM_TO_COL]
+            closed_later = null_mask(system_to)
+            closed = ~closed_later
+            closed_later[closed] = system_to[closed] > system_time
+            valid_to = nullable(valid_to)
+            valid_to[closed_later] = null_value(valid_to)
+            open_versions = open_versions | closed_later
+        else:
+            recorded = np.ones(len(valid_to), dtype=bool)
+        recorded &= self._get_latest_rows(table, business_keys, recorded)
+        non_empty = open_versions.copy()
+        non_empty[~open_versions] = table[VALID_FROM_COL][~open_versions] < valid_to[~open_versions]
+        rows = np.flatnonzero(recorded & non_empty)
+        versions = {name: values[rows] for name, values in table.items()}
+        versions[VALID_TO_COL] = valid_to[rows]
+        return versions
+
+    def _get_latest_rows(self, table: Columns, business_keys: List[str], recorded: np.ndarray) -> np.ndarray:
+        """
+        Find the latest recorded row of every version of an in-memory table.
+
+        Args:
+            table: Conformed table
+            business_keys: Business keys of the table
+            recorded: Mask of the rows recorded as of the join's system time
+
+        Returns:
+            Mask of the recorded rows with the latest SYSTEM_FROM of their
+            business keys and VALID_FROM
+        """
+        latest = np.zeros(len(recorded), dtype=bool)
+        rows = np.flatnonzero(recorded)
+        if len(rows) == 0:
+            return latest
+        codes = [get_ids([table[col][rows]])[0] for col in business_keys + [VALID_FROM_COL]]
+        _, versions = np.unique(np.stack(codes, axis=1), axis=0, return_inverse=True)
+        versions = versions.ravel()
+        system_from = table[SYSTEM_FROM_COL][rows]
+        known = ~null_mask(system_from)
+        ranks = np.full(len(rows), -1, dtype=np.int64)
+        ranks[known] = get_ids([system_from[known]])[0]
+        last = np.full(versions.max() + 1, -1, dtype=np.int64)
+        np.maximum.at(last, versions, ranks)
+        latest[rows] = ranks == last[versions]
+        return latest
+
+    def _get_join_key_ids(self, left: Columns, right: Columns) -> List[np.ndarray]:
+        """
+        Assign one integer ID per distinct join key across both tables.
+
+        Args:
+            left: Left versions
+            right: Right versions
+
+        Returns:
+            Array of key IDs of the left and of the right versions
+        """
+        codes = [get_ids([left[left_col], right[right_col]]) for left_col, right_col in self.on.items()]
+        if len(codes) == 1:
+            return codes[0]
+        sizes = [len(codes[0][0]), len(codes[0][1])]
+        stacked = np.stack([np.concatenate(code) for code in codes], axis=1)
+        _, ids = np.unique(stacked, axis=0, return_inverse=True)
+        return np.split(ids.ravel(), np.cumsum(sizes)[:-1])
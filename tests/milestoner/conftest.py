@@ -59,6 +59,24 @@ def snowflake_conn():
 
     conn.close()
 
+@pytest.fixture(scope="session")
+def snowflake_executor():
+    """Create a pooled executor on the Snowflake test account, skipping without credentials."""
+    from src.milestoner.executor import SnowflakeExecutor
+
+    credentials = load_credentials()
+    if credentials is None:
+        pytest.skip("Snowflake credentials are not available")
+    
+    executor = SnowflakeExecutor(
+        {key: credentials.get(key) for key in ('user', 'password', 'account', 'warehouse', 'database', 'role')},
+        pool_size=1
+    )
+
+    yield executor
+
+    executor.close()
+
 @pytest.fixture(scope="session")
 def setup_test_tables(snowflake_conn):
     """Set up test tables in Snowflake."""
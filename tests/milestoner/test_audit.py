@@ -0,0 +1,101 @@
+import logging
+import threading
+
+import pytest
+from src.milestoner.audit import QueryAuditLog, fingerprint, get_template
+from src.milestoner.templates import QueryTemplate, bind_parameter
+
+class ListHandler(logging.Handler):
+    """Handler collecting formatted messages."""
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+        self.thread = threading.current_thread()
+
+@pytest.fixture
+def audit_logger():
+    """Dedicated logger for audit records, enabled for INFO."""
+    audit_logger = logging.getLogger('test.milestoner.audit')
+    audit_logger.setLevel(logging.INFO)
+    audit_logger.propagate = False
+    yield audit_logger
+    audit_logger.handlers.clear()
+
+def test_fingerprint_ignores_batch_literals():
+    """Test that runs of the same template share a fingerprint."""
+    first = "UPDATE STAGING.T SET LOCKED = 'batch-1' WHERE ROWNUM <= 100 AND X IN (SELECT * FROM STAGING.T_BATCH_0123456789abcdef0123456789abcdef)"
+    second = "UPDATE STAGING.T  SET LOCKED = 'batch-2'\n WHERE ROWNUM <= 500 AND X IN (SELECT * FROM STAGING.T_BATCH_fedcba9876543210fedcba9876543210)"
+    assert fingerprint(first) == fingerprint(second)
+    assert fingerprint(first) != fingerprint("DELETE FROM STAGING.T WHERE LOCKED = 'batch-1'")
+    assert get_template("SELECT 'it''s', 42") == 'SELECT ?, ?'
+
+def test_record_is_compact_and_template_logged_once(audit_logger):
+    """Test that statements are recorded by fingerprint, without their text."""
+    handler = ListHandler()
+    audit_logger.addHandler(handler)
+    audit = QueryAuditLog(audit_logger=audit_logger)
+
+    audit.record('lock', "UPDATE T SET LOCKED = 'b1'", 'b1', 0.5, 10, ['q1'])
+    audit.record('lock', "UPDATE T SET LOCKED = 'b2'", 'b2', 0.25, 5, ['q2'])
+    audit.flush()
+
+    assert len(handler.messages) == 3
+    assert handler.messages[0].startswith(f"template {fingerprint('UPDATE T SET LOCKED = ?')}")
+    assert handler.messages[2] == (
+        f"query {fingerprint('UPDATE T SET LOCKED = ?')} stage=lock batch=b2 seconds=0.250 rows=5 query_ids=q2"
+    )
+
+def test_full_text_is_recorded_when_sampled_or_failed(audit_logger):
+    """Test that statement text is only written for sampled or failed statements."""
+    handler = ListHandler()
+    audit_logger.addHandler(handler)
+    audit = QueryAuditLog(audit_logger=audit_logger, sample_rate=1.0)
+
+    audit.record('merge', "MERGE INTO C USING S ON 'x'", 'b1', 1.0, 2)
+    audit.record('merge', "MERGE INTO C USING S ON 'y'", 'b2', error=RuntimeError('boom'))
+    audit.flush()
+
+    assert handler.messages[-2].endswith("MERGE INTO C USING S ON 'x'")
+    assert 'failed: boom' in handler.messages[-1]
+    assert handler.messages[-1].endswith("MERGE INTO C USING S ON 'y'")
+
+def test_records_are_written_asynchronously_by_default(audit_logger):
+    """Test that records are written from the background writer without calling start()."""
+    handler = ListHandler()
+    audit = QueryAuditLog(handlers=[handler], audit_logger=audit_logger)
+    audit.record('lock', "UPDATE T SET LOCKED = 'b1'", 'b1', 0.1, 1)
+    audit.stop()
+
+    assert len(handler.messages) == 2
+    assert handler.thread is not threading.current_thread()
+    assert handler not in audit_logger.handlers
+
+def test_statements_of_a_template_share_its_fingerprint(audit_logger, mocker):
+    """Test that rendered statements are keyed by their template without normalizing them."""
+    handler = ListHandler()
+    audit_logger.addHandler(handler)
+    normalize = mocker.patch('src.milestoner.audit.get_template')
+    template = QueryTemplate(f"UPDATE T SET LOCKED = '{bind_parameter('batch_id')}'")
+    audit = QueryAuditLog(audit_logger=audit_logger)
+    for batch_id in ('b1', 'b2'):
+        audit.record('lock', template.render({'batch_id': batch_id}), batch_id, 0.1, 1, template=template)
+    audit.stop()
+
+    normalize.assert_not_called()
+    assert handler.messages[0] == f"template {template.fingerprint} stage=lock: {template.text}"
+    assert [m.split()[1] for m in handler.messages[1:]] == [template.fingerprint] * 2
+
+def test_disabled_audit_logger_skips_work(audit_logger, mocker):
+    """Test that nothing is normalized when the audit logger is disabled."""
+    audit_logger.setLevel(logging.WARNING)
+    template = mocker.patch('src.milestoner.audit.get_template')
+    QueryAuditLog(audit_logger=audit_logger).record('lock', 'SELECT 1', 'b1', 0.1, 1)
+    template.assert_not_called()
+
+def test_importing_the_milestoner_adds_no_handlers():
+    """Test that the package leaves handler configuration to the application."""
+    import src.milestoner.bitemporal_milestoner as module
+    assert not any(type(h) is logging.StreamHandler for h in module.logger.handlers)
@@ -0,0 +1,124 @@
+import json
+from datetime import datetime
+
+import pytest
+from src.milestoner.backfill import BackfillRunner
+from src.milestoner.bitemporal_milestoner import BitemporalMilestoner
+from src.milestoner.executor import QueryResult, result_name
+
+@pytest.fixture
+def milestoner():
+    """Create a BitemporalMilestoner describing the backfilled tables."""
+    return BitemporalMilestoner(
+        business_keys=['USER_ID'],
+        temporal_column='EFFECTIVE_DATE',
+        data_columns=['USER_ID', 'EMAIL', 'EFFECTIVE_DATE'],
+        column_types={'EFFECTIVE_DATE': 'DATE'}
+    )
+
+@pytest.fixture
+def executor(mocker):
+    """Create a mock executor reporting two records and one version per window."""
+    counts = {'records_locked': 2, 'records_inserted': 1, 'versions_closed': 1}
+    executor = mocker.Mock()
+    executor.execute.return_value = QueryResult(rows=[(0,)])
+    executor.execute_statements.side_effect = lambda statements: [
+        QueryResult(rowcount=counts.get(result_name(sql), 0)) for sql, _ in statements
+    ]
+    return executor
+
+def _statements(executor):
+    """Return the statement lists passed to execute_statements."""
+    return [[sql for sql, _ in call.args[0]] for call in executor.execute_statements.call_args_list]
+
+def test_get_windows_covers_every_temporal_value():
+    """Test that boundaries become consecutive windows unbounded at both ends."""
+    assert BackfillRunner.get_windows(['2020-01-01', '2021-01-01']) == [
+        (None, '2020-01-01'), ('2020-01-01', '2021-01-01'), ('2021-01-01', None)
+    ]
+    assert BackfillRunner.get_windows([]) == [(None, None)]
+
+def test_plan_windows_uses_distinct_tile_starts(milestoner, executor):
+    """Test that window boundaries are the distinct starts of all tiles but the first."""
+    executor.execute.return_value = QueryResult(rows=[('2020-01-01',), ('2020-06-01',), ('2020-06-01',)])
+    runner = BackfillRunner(milestoner, 'USERS_STAGING', 'USERS', executor=executor)
+    
+    assert runner.plan_windows(3) == ['2020-06-01']
+    assert 'NTILE(3) OVER (ORDER BY DATA:effectiveDate::DATE)' in executor.execute.call_args.args[0]
+
+def test_window_inserts_chain_without_merge(milestoner, executor):
+    """Test that a window locks its temporal range and bulk inserts its versions in one transaction."""
+    runner = BackfillRunner(milestoner, 'USERS_STAGING', 'USERS', executor=executor)
+    statements = runner._get_window_statements('bf-w00001', ('2020-01-01', '2021-01-01'), '2024-02-01 00:00:00')
+    
+    assert statements[0] == 'BEGIN' and statements[-1] == 'COMMIT'
+    assert "DATA:effectiveDate::DATE >= '2020-01-01' AND DATA:effectiveDate::DATE < '2021-01-01'" in statements[1]
+    assert [result_name(sql) for sql in statements[1:3]] == ['records_locked', 'records_inserted']
+    assert 'INSERT INTO USERS (' in statements[2]
+    assert 'MERGE' not in ''.join(statements)
+    assert 'LEAD(EFFECTIVE_DATE) OVER' in statements[2]
+    assert "WHERE LOCKED = 'bf-w00001'" in statements[3]
+
+def test_window_bounds_are_quoted(milestoner, executor):
+    """Test that quotes in a window bound cannot end its string literal."""
+    runner = BackfillRunner(milestoner, 'USERS_STAGING', 'USERS', executor=executor)
+    
+    assert runner._get_window_predicate(("2020' OR '1'='1", None)).endswith(
+        "DATA:effectiveDate::DATE >= '2020'' OR ''1''=''1'"
+    )
+
+def test_run_refuses_keys_already_in_conformed_table(milestoner, executor):
+    """Test that a new backfill fails before any window when pending keys have versions."""
+    executor.execute.return_value = QueryResult(rows=[(3,)])
+    runner = BackfillRunner(milestoner, 'USERS_STAGING', 'USERS', executor=executor)
+    
+    with pytest.raises(ValueError, match='3 versions'):
+        runner.run(boundaries=['2020-01-01'])
+    assert 't.USER_ID = DATA:userId::' in executor.execute.call_args.args[0]
+    executor.execute_statements.assert_not_called()
+
+def test_run_milestones_windows_and_stitches(milestoner, executor):
+    """Test that every window runs once before the single stitch pass."""
+    runner = BackfillRunner(milestoner, 'USERS_STAGING', 'USERS', executor=executor, workers=2)
+    result = runner.run(boundaries=['2020-01-01', '2021-01-01'], current_time=datetime(2024, 2, 1))
+    
+    assert result['windows'] == 3
+    assert result['windows_run'] == 3
+    assert result['records_locked'] == 6
+    assert result['records_inserted'] == 3
+    stitch = _statements(executor)[-1]
+    assert stitch[0].lstrip().startswith('CREATE TEMPORARY TABLE')
+    assert f"LIKE '{result['backfill_id']}-w%'" in stitch[0]
+    assert 'DELETE FROM USERS t' in stitch[2]
+    assert 'SET VALID_TO = s.STITCHED_VALID_TO' in stitch[3]
+
+def test_run_resumes_from_checkpoint(milestoner, executor, tmp_path):
+    """Test that a resumed backfill only runs the unfinished windows with the saved plan."""
+    path = tmp_path / 'backfill.json'
+    path.write_text(json.dumps({
+        'backfill_id': 'bf',
+        'staging_table': 'USERS_STAGING',
+        'conformed_table': 'USERS',
+        'current_time': '2024-02-01 00:00:00',
+        'boundaries': ['2020-01-01'],
+        'completed': [0],
+        'stitched': False
+    }))
+    runner = BackfillRunner(milestoner, 'USERS_STAGING', 'USERS', executor=executor, checkpoint_path=str(path))
+    result = runner.run(boundaries=['1999-01-01'])
+    
+    assert result['backfill_id'] == 'bf'
+    assert result['windows_run'] == 1
+    assert "LOCKED = 'bf-w00001'" in _statements(executor)[0][1]
+    checkpoint = json.loads(path.read_text())
+    assert sorted(checkpoint['completed']) == [0, 1]
+    assert checkpoint['stitched']
+
+def test_checkpoint_of_other_tables_is_rejected(milestoner, executor, tmp_path):
+    """Test that a checkpoint written for other tables is not resumed."""
+    path = tmp_path / 'backfill.json'
+    path.write_text(json.dumps({'staging_table': 'ORDERS_STAGING', 'conformed_table': 'ORDERS', 'stitched': False}))
+    runner = BackfillRunner(milestoner, 'USERS_STAGING', 'USERS', executor=executor, checkpoint_path=str(path))
+    
+    with pytest.raises(ValueError):
+        runner.run()
@@ -0,0 +1,65 @@
+import pytest
+from src.milestoner.batch_sizing import AdaptiveBatchSizer
+
+def _result(rows, lock=0.0, dedupe=0.0, merge=0.0):
+    """Build a process_batch result with the given stage timings."""
+    return {
+        'records_processed': rows,
+        'stages': {
+            'lock': {'seconds': lock, 'rows': rows},
+            'dedupe': {'seconds': dedupe, 'rows': 0},
+            'merge': {'seconds': merge, 'rows': rows}
+        }
+    }
+
+def test_requires_exactly_one_target():
+    """Test that a single latency or throughput goal must be configured."""
+    with pytest.raises(ValueError):
+        AdaptiveBatchSizer()
+    with pytest.raises(ValueError):
+        AdaptiveBatchSizer(target_latency=1.0, target_rows_per_second=1000)
+
+def test_grows_when_batches_are_faster_than_target():
+    """Test that fast batches grow the batch size, limited by max_step."""
+    sizer = AdaptiveBatchSizer(initial_size=1000, target_latency=10.0, max_step=2.0, smoothing=1.0)
+    assert sizer.observe(1000, _result(1000, lock=0.5, dedupe=0.5, merge=1.0)) == 2000
+
+def test_shrinks_when_batches_are_slower_than_target():
+    """Test that slow batches shrink the batch size towards the target latency."""
+    sizer = AdaptiveBatchSizer(initial_size=1000, target_latency=3.0, smoothing=1.0)
+    assert sizer.observe(1000, _result(1000, lock=1.0, dedupe=1.0, merge=2.0)) == 750
+
+def test_respects_floor_and_ceiling():
+    """Test that the batch size never leaves the configured limits."""
+    sizer = AdaptiveBatchSizer(initial_size=900, min_size=500, max_size=1000, target_latency=1.0, smoothing=1.0)
+    assert sizer.observe(900, _result(900, merge=0.1)) == 1000
+    assert sizer.observe(1000, _result(1000, merge=100.0)) == 500
+
+def test_short_batches_do_not_grow_size():
+    """Test that a partially filled batch cannot grow the next batch."""
+    sizer = AdaptiveBatchSizer(initial_size=1000, target_latency=10.0, smoothing=1.0)
+    assert sizer.observe(1000, _result(10, merge=0.1)) == 1000
+
+def test_targets_throughput():
+    """Test that throughput below the goal grows the batch size."""
+    sizer = AdaptiveBatchSizer(initial_size=1000, target_rows_per_second=1500, smoothing=1.0)
+    assert sizer.observe(1000, _result(1000, merge=1.0)) == 1500
+
+def test_tracks_stage_latency():
+    """Test that per-stage latencies are tracked as moving averages."""
+    sizer = AdaptiveBatchSizer(target_latency=1.0, smoothing=0.5)
+    sizer.observe(1000, _result(1000, lock=1.0, merge=2.0))
+    sizer.observe(1000, _result(1000, lock=3.0, merge=2.0))
+    assert sizer.stage_seconds['lock'] == 2.0
+    assert sizer.stage_seconds['merge'] == 2.0
+
+def test_sizes_from_smoothed_stage_latency():
+    """Test that the size follows the moving average of the stage timings, not the last batch alone."""
+    sizer = AdaptiveBatchSizer(initial_size=1000, target_latency=2.0, smoothing=0.5)
+    assert sizer.observe(1000, _result(1000, lock=1.0, merge=3.0)) == 500
+    assert sizer.observe(500, _result(500, lock=0.5, merge=0.5)) == 400
+
+def test_throughput_above_target_keeps_size():
+    """Test that exceeding the throughput goal does not shrink the batch size."""
+    sizer = AdaptiveBatchSizer(initial_size=1000, target_rows_per_second=500, smoothing=1.0)
+    assert sizer.observe(1000, _result(1000, merge=1.0)) == 1000
@@ -0,0 +1,46 @@
+import pytest
+from src.milestoner.bitemporal_milestoner import BitemporalMilestoner
+from src.milestoner import checksum
+from src.milestoner.checksum import RowChecksum, canonicalize, fnv1a_64
+
+def _reference_fnv1a(data):
+    """Scalar 64-bit FNV-1a used as the reference."""
+    h = 0xcbf29ce484222325
+    for byte in data:
+        h = ((h ^ byte) * 0x100000001b3) % 2 ** 64
+    return h
+
+def test_fnv1a_matches_reference():
+    """Test the vectorized hash against a scalar implementation for mixed lengths."""
+    buffers = [b'', b'a', b'foobar', b'x' * 300, 'café'.encode('utf-8'), b'foobar']
+    assert fnv1a_64(buffers, block_bytes=16).tolist() == [_reference_fnv1a(b) for b in buffers]
+    assert fnv1a_64([b'a'])[0] == 0xaf63dc4c8601ec8c
+
+def test_fnv1a_blocks_are_bounded_by_bytes(mocker):
+    """Test that one long payload is hashed apart instead of widening the matrix of the short ones."""
+    block = mocker.spy(checksum, '_fnv1a_block')
+    buffers = [b'x' * 1000] + [b'ab'] * 100
+    assert fnv1a_64(buffers, block_bytes=1000).tolist() == [_reference_fnv1a(b) for b in buffers]
+    assert [len(call.args[0]) for call in block.call_args_list] == [1, 100]
+
+def test_canonicalize_uses_field_subset():
+    """Test that only the listed fields contribute, independent of key order."""
+    fields = ['userId', 'email']
+    first = {'userId': '1', 'email': 'a@example.com', 'ignored': 1}
+    second = {'email': 'a@example.com', 'userId': '1'}
+    assert canonicalize(first, fields) == canonicalize(second, fields)
+    assert canonicalize({'userId': '1'}, fields) != canonicalize({'userId': '1', 'email': ''}, fields)
+
+def test_from_milestoner_maps_columns_to_camel_case():
+    """Test that the checksum covers the camelCase keys of the data columns."""
+    milestoner = BitemporalMilestoner(['USER_ID'], 'EFFECTIVE_DATE', ['USER_ID', 'EFFECTIVE_DATE'])
+    assert RowChecksum.from_milestoner(milestoner).fields == ['userId', 'effectiveDate']
+
+def test_parallel_and_serial_checksums_agree():
+    """Test that hashing across a process pool gives the same checksums."""
+    payloads = [{'userId': str(i), 'score': i * 1.5} for i in range(50)]
+    serial = RowChecksum(['userId', 'score'], processes=1).compute(payloads)
+    parallel = RowChecksum(['userId', 'score'], processes=2, parallel_threshold=10, chunk_rows=7).compute(payloads)
+    assert parallel == serial
+    assert serial[0] == format(fnv1a_64([canonicalize(payloads[0], ['userId', 'score'])])[0], '016x')
+    assert len(set(serial)) == 50
@@ -0,0 +1,59 @@
+import pytest
+from src.milestoner.bitemporal_milestoner import BitemporalMilestoner
+from src.milestoner.clustering import check_clustering, get_clustering_ddl, recommend_clustering_key
+from src.milestoner.executor import QueryResult
+
+@pytest.fixture
+def milestoner():
+    """Create a BitemporalMilestoner instance for testing."""
+    return BitemporalMilestoner(
+        business_keys=['USER_ID', 'EMAIL'],
+        temporal_column='EFFECTIVE_DATE',
+        data_columns=['USER_ID', 'EMAIL', 'FIRST_NAME', 'LAST_NAME', 'EFFECTIVE_DATE']
+    )
+
+def test_recommend_clustering_key(milestoner):
+    """Test that the key groups open versions first, then the leading business key."""
+    assert recommend_clustering_key(milestoner) == ['IFF(VALID_TO IS NULL, 0, 1)', 'USER_ID', 'VALID_FROM']
+
+def test_get_clustering_ddl(milestoner):
+    """Test generation of the ALTER TABLE statement."""
+    assert get_clustering_ddl(milestoner, 'TEST_CONFORMED') == (
+        'ALTER TABLE TEST_CONFORMED CLUSTER BY (IFF(VALID_TO IS NULL, 0, 1), USER_ID, VALID_FROM)'
+    )
+
+def test_check_clustering_reports_well_clustered_table(milestoner, mocker):
+    """Test that a table with the recommended key and low depth passes the check."""
+    executor = mocker.Mock()
+    executor.execute.side_effect = [
+        QueryResult(rows=[('{"average_depth": 1.5, "total_partition_count": 40}',)]),
+        QueryResult(rows=[('LINEAR(IFF(VALID_TO IS NULL, 0, 1), USER_ID, VALID_FROM)',)])
+    ]
+    report = check_clustering(executor, milestoner, 'TEST_CONFORMED')
+    assert report['well_clustered'] is True
+    assert report['total_partition_count'] == 40
+
+def test_check_clustering_flags_unclustered_table(milestoner, mocker):
+    """Test that a table without a clustering key fails the check."""
+    executor = mocker.Mock()
+    executor.execute.side_effect = [
+        QueryResult(rows=[('{"average_depth": 35.0, "total_partition_count": 40}',)]),
+        QueryResult(rows=[(None,)])
+    ]
+    report = check_clustering(executor, milestoner, 'TEST_CONFORMED')
+    assert report['well_clustered'] is False
+    assert report['current_key'] is None
+    assert report['ddl'].startswith('ALTER TABLE TEST_CONFORMED CLUSTER BY')
+
+def test_current_clustering_key_is_looked_up_in_the_table_schema(milestoner, mocker):
+    """Test that a schema-qualified table is matched on schema and name."""
+    executor = mocker.Mock()
+    executor.execute.side_effect = [
+        QueryResult(rows=[('{"average_depth": 1.0, "total_partition_count": 4}',)]),
+        QueryResult(rows=[(None,)])
+    ]
+    check_clustering(executor, milestoner, 'db.conformed.users')
+    
+    sql, params = executor.execute.call_args.args
+    assert 'AND TABLE_SCHEMA = ?' in sql
+    assert params == ['USERS', 'CONFORMED']
@@ -0,0 +1,76 @@
+import pytest
+from src.milestoner.bitemporal_milestoner import BitemporalMilestoner
+from src.milestoner.coalescing import VersionCoalescer
+from src.milestoner.executor import QueryResult, result_name
+
+@pytest.fixture
+def executor(mocker):
+    """Create a mock executor for a table of 1000 rows in 64000 bytes."""
+    executor = mocker.Mock()
+    executor.execute.return_value = QueryResult(rows=[(64000, 1000)])
+    executor.execute_statements.return_value = [
+        QueryResult(),
+        QueryResult(),
+        QueryResult(rowcount=2),
+        QueryResult(rowcount=5),
+        QueryResult(rows=[('2024-02-01 00:00:00',)]),
+        QueryResult(),
+        QueryResult()
+    ]
+    return executor
+
+@pytest.fixture
+def coalescer(executor):
+    """Create a VersionCoalescer for a users table."""
+    milestoner = BitemporalMilestoner(
+        business_keys=['USER_ID'],
+        temporal_column='EFFECTIVE_DATE',
+        data_columns=['USER_ID', 'EMAIL', 'EFFECTIVE_DATE']
+    )
+    return VersionCoalescer(milestoner, 'CONFORMED.USERS', executor=executor)
+
+def test_continuation_compares_data_and_both_timelines(coalescer):
+    """Test that a version continues its predecessor only if it is adjacent in both timelines with equal data."""
+    query = coalescer._get_coalesce_setup_query('STAGING.COALESCE', incremental=False)
+    
+    assert coalescer.compared_columns == ['EMAIL']
+    assert 'PREVIOUS_VALID_TO = VALID_FROM' in query
+    assert 'PREVIOUS_SYSTEM_TO = SYSTEM_FROM' in query
+    assert 'PREVIOUS_EMAIL IS NOT DISTINCT FROM EMAIL' in query
+    assert 'PREVIOUS_EFFECTIVE_DATE' not in query
+    assert 'COUNT(*) OVER (PARTITION BY USER_ID, ISLAND) AS ISLAND_SIZE' in query
+    assert 'QUALIFY COUNT(*) OVER (PARTITION BY USER_ID, ISLAND) > 1\n        OR SYSTEM_FROM = ANALYSED_SYSTEM_FROM' in query
+    assert 'touched' not in query
+
+def test_incremental_run_only_reads_touched_keys(coalescer):
+    """Test that an incremental run restricts the scan to keys recorded after the watermark."""
+    query = coalescer._get_coalesce_setup_query('STAGING.COALESCE', incremental=True)
+    
+    assert 'WHERE SYSTEM_FROM > ?' in query
+    assert 'JOIN touched USING (USER_ID)' in query
+
+def test_updates_are_guarded_against_stale_runs(coalescer):
+    """Test that widening and deleting require the run's last and first versions to be as analysed."""
+    update = coalescer._get_coalesce_update_query('STAGING.COALESCE')
+    delete = coalescer._get_coalesce_delete_query('STAGING.COALESCE')
+    
+    assert 'last_version.VALID_TO IS NOT DISTINCT FROM s.COALESCED_VALID_TO' in update
+    assert 'SYSTEM_TO = s.COALESCED_SYSTEM_TO' in update
+    assert 'head.VALID_TO IS NOT DISTINCT FROM s.COALESCED_VALID_TO' in delete
+    for query in (update, delete):
+        assert 'newer.SYSTEM_FROM > s.KEY_SYSTEM_FROM' in query
+
+def test_coalesce_reports_removed_versions_and_space(coalescer, executor):
+    """Test that a run reports its counts, estimated space and next watermark."""
+    result = coalescer.coalesce(since='2024-01-01 00:00:00')
+    
+    assert result['versions_coalesced'] == 2
+    assert result['versions_removed'] == 5
+    assert result['bytes_reclaimed'] == 320
+    assert result['watermark'] == '2024-02-01 00:00:00'
+    statements = executor.execute_statements.call_args.args[0]
+    assert statements[0][1] == ['2024-01-01 00:00:00']
+    assert [sql for sql, _ in statements[1:6:4]] == ['BEGIN', 'COMMIT']
+    assert result_name(statements[4][0]) == 'watermark'
+    assert 'SELECT MAX(ANALYSED_SYSTEM_FROM) FROM STAGING.MILESTONE_COALESCE_' in statements[4][0]
+    assert executor.execute.call_args.args[1] == ['USERS', 'CONFORMED']
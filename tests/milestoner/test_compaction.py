@@ -0,0 +1,89 @@
+from datetime import datetime
+
+import pytest
+from src.milestoner.bitemporal_milestoner import BitemporalMilestoner
+from src.milestoner.compaction import StagingCompactor
+from src.milestoner.executor import QueryResult, SQLiteExecutor, result_name
+
+COLUMNS = "STAGING_GUID TEXT, BATCH_ID TEXT, PROCESSED_DATETIME TEXT, LOCKED TEXT, MILESTONING_FLAG TEXT"
+
+@pytest.fixture
+def executor():
+    """Create a SQLite executor with a STAGING schema holding staging and archive tables."""
+    executor = SQLiteExecutor(pool_size=1, retry_backoff=0)
+    executor.execute("ATTACH DATABASE ':memory:' AS STAGING")
+    executor.execute(f"CREATE TABLE STAGING.USERS ({COLUMNS})")
+    executor.execute(f"CREATE TABLE STAGING.USERS_ARCHIVE ({COLUMNS})")
+    executor.execute("""
+    INSERT INTO STAGING.USERS VALUES
+        ('g1', 'old-1', '2024-01-01 00:00:00', NULL, NULL),
+        ('g2', 'old-1', '2024-01-01 00:00:00', NULL, NULL),
+        ('g3', 'old-2', '2024-01-02 00:00:00', NULL, NULL),
+        ('g4', 'new', '2024-01-09 00:00:00', NULL, NULL),
+        ('g5', NULL, NULL, NULL, NULL),
+        ('g6', NULL, NULL, 'running-batch', NULL)
+    """)
+    yield executor
+    executor.close()
+
+def _milestoner(**options):
+    """Create a milestoner replaying the USERS staging table."""
+    return BitemporalMilestoner(
+        business_keys=['USER_ID'],
+        temporal_column='EFFECTIVE_DATE',
+        data_columns=['USER_ID', 'EFFECTIVE_DATE'],
+        **options
+    )
+
+def _guids(executor, table):
+    """Return the sorted GUIDs of a table."""
+    return [row[0] for row in executor.execute(f"SELECT STAGING_GUID FROM STAGING.{table} ORDER BY 1").rows]
+
+def test_compact_archives_processed_rows_past_retention(executor):
+    """Test that only processed rows older than the window move to the archive, in batch-sized chunks."""
+    compactor = StagingCompactor(executor, 'USERS', retention_days=7, chunk_rows=2)
+    result = compactor.compact(current_time=datetime(2024, 1, 10))
+    
+    assert result['rows_archived'] == 3
+    assert result['batches_archived'] == 2
+    assert result['chunks'] == 2
+    assert _guids(executor, 'USERS') == ['g4', 'g5', 'g6']
+    assert _guids(executor, 'USERS_ARCHIVE') == ['g1', 'g2', 'g3']
+
+def test_restore_moves_batches_back_as_unprocessed(executor):
+    """Test that restored batches become pending work again."""
+    compactor = StagingCompactor(executor, 'USERS', retention_days=7)
+    compactor.compact(current_time=datetime(2024, 1, 10))
+    
+    assert compactor.restore(['old-1'], _milestoner(split_history=True)) == 2
+    restored = executor.execute(
+        "SELECT COUNT(*) FROM STAGING.USERS WHERE STAGING_GUID IN ('g1', 'g2') AND PROCESSED_DATETIME IS NULL"
+    )
+    assert restored.rows[0][0] == 2
+    assert _guids(executor, 'USERS_ARCHIVE') == ['g3']
+
+def test_restore_requires_history_splitting(executor):
+    """Test that batches are only restored for a milestoner that splits history."""
+    compactor = StagingCompactor(executor, 'USERS', retention_days=7)
+    compactor.compact(current_time=datetime(2024, 1, 10))
+    
+    with pytest.raises(ValueError):
+        compactor.restore(['old-1'], _milestoner())
+    assert _guids(executor, 'USERS_ARCHIVE') == ['g1', 'g2', 'g3']
+
+def test_stage_archive_unloads_parquet_partitioned_by_batch(mocker):
+    """Test that archiving to a stage unloads files partitioned by BATCH_ID."""
+    executor = mocker.Mock()
+    executor.execute.return_value = QueryResult(rows=[('b1', 10)])
+    executor.execute_statements.return_value = [QueryResult(rowcount=10)] * 4
+    compactor = StagingCompactor(executor, 'USERS', archive_stage='@ARCHIVE/users/')
+    compactor.compact()
+    
+    statements = executor.execute_statements.call_args.args[0]
+    assert result_name(statements[0][0]) == 'rows_archived'
+    assert 'COPY INTO @ARCHIVE/users/' in statements[0][0]
+    assert "PARTITION BY ('BATCH_ID=' || BATCH_ID)" in statements[0][0]
+    assert (statements[1][0], statements[3][0]) == ('BEGIN', 'COMMIT')
+    assert statements[2][1] == ['b1']
+    with pytest.raises(ValueError):
+        compactor.restore(['b1'], _milestoner(split_history=True))
@@ -0,0 +1,305 @@
+import json
+import time
+from datetime import datetime
+
+import pytest
+from src.milestoner.bitemporal_milestoner import BitemporalMilestoner, PIPELINE_FUSED
+from src.milestoner.coalescing import VersionCoalescer
+from src.milestoner.compaction import StagingCompactor
+from src.milestoner.emulator import SnowflakeEmulator, translate
+from src.milestoner.point_in_time import PointInTimeReader
+
+@pytest.fixture
+def executor():
+    """Create an emulated warehouse with an empty staging and conformed table."""
+    executor = SnowflakeEmulator(pool_size=1, retry_backoff=0, schemas=['STAGING', 'INFORMATION_SCHEMA'])
+    executor.execute("CREATE TABLE INFORMATION_SCHEMA.TABLES (TABLE_SCHEMA, TABLE_NAME, BYTES, ROW_COUNT)")
+    executor.execute("""
+    CREATE TABLE STAGING.USERS_STAGING (
+        DATA VARIANT, ROW_CHECKSUM STRING, STAGING_GUID STRING, BATCH_ID STRING,
+        PROCESSED_DATETIME TIMESTAMP, ROW_ADDED_DATETIME TIMESTAMP, LOCKED STRING, MILESTONING_FLAG STRING
+    )""")
+    executor.execute("""
+    CREATE TABLE USERS (
+        USER_ID STRING, EMAIL STRING, EFFECTIVE_DATE DATE, VALID_FROM DATE, VALID_TO DATE,
+        SYSTEM_FROM TIMESTAMP, SYSTEM_TO TIMESTAMP, ROW_CHECKSUM STRING, STAGING_GUID STRING, BATCH_ID STRING
+    )""")
+    yield executor
+    executor.close()
+
+def _milestoner(executor, **options):
+    """Create a milestoner for the USERS table."""
+    return BitemporalMilestoner(
+        business_keys=['USER_ID'],
+        temporal_column='EFFECTIVE_DATE',
+        data_columns=['USER_ID', 'EMAIL', 'EFFECTIVE_DATE'],
+        executor=executor,
+        **options
+    )
+
+def _load(executor, records, added):
+    """Append (user, email, effective date) records to staging, loaded at one time."""
+    for position, (user, email, effective_date) in enumerate(records):
+        executor.execute(
+            "INSERT INTO STAGING.USERS_STAGING (DATA, ROW_CHECKSUM, STAGING_GUID, ROW_ADDED_DATETIME) VALUES (?, ?, ?, ?)",
+            [
+                json.dumps({'userId': user, 'email': email, 'effectiveDate': effective_date}),
+                f"{user}|{email}",
+                f"{user}-{effective_date}-{added}-{position}",
+                f"{added}.{position:06d}"
+            ]
+        )
+
+def _versions(executor):
+    """Return (user, email, VALID_FROM, VALID_TO, open) of every conformed version."""
+    return executor.execute("""
+    SELECT USER_ID, EMAIL, VALID_FROM, VALID_TO, SYSTEM_TO IS NULL
+    FROM USERS
+    ORDER BY USER_ID, VALID_FROM, SYSTEM_FROM""").rows
+
+def test_translate_rewrites_snowflake_constructs():
+    """Test that variant extracts, casts, IFF and DELETE ... USING become SQLite."""
+    assert translate("SELECT DATA:firstName::STRING as FIRST_NAME, '2024-01-01'::TIMESTAMP_NTZ") == (
+        "SELECT json_extract(DATA, '$.firstName') as FIRST_NAME, '2024-01-01'"
+    )
+    assert translate("SELECT IFF(A, 'x::y', B) FROM T") == "SELECT IIF(A, 'x::y', B) FROM T"
+    assert translate("DELETE FROM T t USING S s WHERE t.A = s.A") == (
+        "DELETE FROM T AS t WHERE EXISTS (SELECT 1 FROM S s WHERE t.A = s.A)"
+    )
+
+def test_translate_rewrites_qualify_as_subquery_filter(executor):
+    """Test that QUALIFY filters rows after the window functions are computed."""
+    executor.execute("CREATE TABLE T (K, V)")
+    executor.execute("INSERT INTO T VALUES ('a', 1), ('a', 2), ('b', 3)")
+    rows = executor.execute("""
+    SELECT T.* FROM (SELECT K, V FROM T) T
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY K ORDER BY V DESC) = 1""").rows
+    
+    assert sorted(rows) == [('a', 2), ('b', 3)]
+
+def test_merge_reports_inserted_and_updated_rows(executor):
+    """Test that MERGE matches once and reports its counts like Snowflake."""
+    executor.execute("CREATE TABLE T (K, V)")
+    executor.execute("INSERT INTO T VALUES ('a', 1)")
+    result = executor.execute("""
+    MERGE INTO T t
+    USING (SELECT 'a' AS K, 2 AS V UNION ALL SELECT 'b', ?) s
+    ON t.K = s.K
+    WHEN MATCHED THEN UPDATE SET V = s.V
+    WHEN NOT MATCHED THEN INSERT (K, V) VALUES (s.K, s.V)""", [3])
+    
+    assert result.columns == ['number of rows inserted', 'number of rows updated']
+    assert result.rows == [(1, 1)]
+    assert sorted(executor.execute("SELECT K, V FROM T").rows) == [('a', 2), ('b', 3)]
+
+def test_standard_pipeline_closes_and_inserts_versions(executor):
+    """Test that process_batch deduplicates, closes changed versions and inserts new ones."""
+    milestoner = _milestoner(executor)
+    _load(executor, [('u1', 'a@x', '2024-01-01'), ('u2', 'b@x', '2024-01-01'), ('u1', 'a@x', '2024-01-01')], '2024-01-02')
+    first = milestoner.process_batch('USERS_STAGING', 'USERS')
+    _load(executor, [('u1', 'c@x', '2024-03-01')], '2024-03-02')
+    second = milestoner.process_batch('USERS_STAGING', 'USERS')
+    
+    assert (first['records_processed'], first['duplicates_found'], first['records_inserted']) == (3, 1, 2)
+    assert (second['records_closed'], second['records_inserted']) == (1, 0)
+    assert _versions(executor) == [
+        ('u1', 'a@x', '2024-01-01', '2024-03-01', 0),
+        ('u2', 'b@x', '2024-01-01', None, 1)
+    ]
+    assert executor.execute(
+        "SELECT COUNT(*) FROM STAGING.USERS_STAGING WHERE PROCESSED_DATETIME IS NULL"
+    ).rows[0][0] == 0
+
+@pytest.mark.parametrize('options', [
+    {'version_chaining': True},
+    {'version_chaining': True, 'prune_merge': True, 'skip_unchanged': True, 'materialize_batch': True},
+    {'version_chaining': True, 'prepared_statements': True},
+    {'version_chaining': True, 'pending_queue': 'watermark', 'lease_seconds': 60}
+])
+def test_chained_pipeline_inserts_every_version_of_a_batch(executor, options):
+    """Test that every version of a batch is chained behind the version it follows."""
+    milestoner = _milestoner(executor, **options)
+    if milestoner.pending_queue is not None:
+        milestoner.create_pending_queue('USERS_STAGING')
+    if milestoner.leases is not None:
+        milestoner.create_lease_table('USERS_STAGING')
+    _load(executor, [('u1', 'a@x', '2024-01-01')], '2024-01-02')
+    milestoner.process_batch('USERS_STAGING', 'USERS')
+    _load(executor, [('u1', 'c@x', '2024-03-01'), ('u1', 'a@x', '2024-02-01'), ('u1', 'd@x', '2024-05-01')], '2024-05-02')
+    result = milestoner.process_batch('USERS_STAGING', 'USERS')
+    
+    assert (result['records_inserted'], result['records_closed']) == (2, 1)
+    assert _versions(executor) == [
+        ('u1', 'a@x', '2024-01-01', '2024-03-01', 0),
+        ('u1', 'c@x', '2024-03-01', '2024-05-01', 0),
+        ('u1', 'd@x', '2024-05-01', None, 1)
+    ]
+
+def test_fused_pipeline_is_not_emulated(executor):
+    """Test that Snowflake Scripting blocks are rejected instead of misread."""
+    milestoner = _milestoner(executor, pipeline_mode=PIPELINE_FUSED)
+    with pytest.raises(NotImplementedError):
+        milestoner.process_batch('USERS_STAGING', 'USERS')
+
+@pytest.mark.parametrize('queue_lag_seconds, merged', [(0, 1), (300, 2)])
+def test_watermark_queue_rescans_lag_window_for_late_commits(executor, queue_lag_seconds, merged):
+    """Test that a load committed after the mark passed its load time is queued within the lag window."""
+    milestoner = _milestoner(executor, pending_queue='watermark', queue_lag_seconds=queue_lag_seconds)
+    milestoner.create_pending_queue('USERS_STAGING')
+    _load(executor, [('u1', 'a@x', '2024-01-01')], '2024-01-02 10:00:00')
+    milestoner.process_batch('USERS_STAGING', 'USERS')
+    _load(executor, [('u2', 'b@x', '2024-01-01')], '2024-01-02 09:59:00')
+    milestoner.process_batch('USERS_STAGING', 'USERS')
+    
+    assert len(_versions(executor)) == merged
+
+def test_watermark_queue_rescan_does_not_queue_a_record_twice(executor):
+    """Test that records in the overlap that are already queued are skipped by their GUID."""
+    milestoner = _milestoner(executor, pending_queue='watermark')
+    milestoner.create_pending_queue('USERS_STAGING')
+    _load(executor, [('u1', 'a@x', '2024-01-01'), ('u2', 'b@x', '2024-01-01')], '2024-01-02 10:00:00')
+    enqueue = milestoner.pending_queue.get_enqueue_query('USERS_STAGING')
+    executor.execute_script(enqueue)
+    executor.execute_script(enqueue)
+    
+    assert executor.execute("SELECT COUNT(*) FROM STAGING.USERS_STAGING_QUEUE").rows[0][0] == 2
+    assert executor.execute("SELECT HIGH_WATER_MARK FROM STAGING.USERS_STAGING_QUEUE_MARK").rows[0][0] == (
+        '2024-01-02 10:00:00.000001'
+    )
+
+def _queued(executor):
+    """Return (GUID, LOCKED) of every queue row."""
+    return executor.execute("SELECT STAGING_GUID, LOCKED FROM STAGING.USERS_STAGING_QUEUE ORDER BY STAGING_GUID").rows
+
+def test_queue_claims_oldest_records_and_drops_processed_ones(executor):
+    """Test that a lock claims queued records in load order and marking them processed removes them."""
+    milestoner = _milestoner(executor, pending_queue='watermark')
+    milestoner.create_pending_queue('USERS_STAGING')
+    _load(executor, [('u1', 'a@x', '2024-01-01')], '2024-01-02 10:00:00')
+    _load(executor, [('u2', 'b@x', '2024-01-01')], '2024-01-02 09:00:00')
+    _load(executor, [('u3', 'c@x', '2024-01-01')], '2024-01-02 11:00:00')
+    
+    executor.execute_script(milestoner._get_lock_batch_query('USERS_STAGING', 'b1', 2))
+    locked = executor.execute("SELECT STAGING_GUID FROM STAGING.USERS_STAGING WHERE LOCKED = 'b1'").rows
+    assert sorted(guid for guid, in locked) == [
+        'u1-2024-01-01-2024-01-02 10:00:00-0',
+        'u2-2024-01-01-2024-01-02 09:00:00-0'
+    ]
+    assert [locked for _, locked in _queued(executor)] == ['b1', 'b1', None]
+    
+    executor.execute_script(milestoner.get_mark_processed_query('USERS_STAGING', 'b1', datetime(2024, 1, 3)))
+    assert _queued(executor) == [('u3-2024-01-01-2024-01-02 11:00:00-0', None)]
+
+def test_partitioned_queue_claims_only_its_keys(executor):
+    """Test that partitioned batches claim disjoint queue rows by the stored key hash."""
+    milestoner = _milestoner(executor, pending_queue='watermark')
+    milestoner.create_pending_queue('USERS_STAGING')
+    _load(executor, [(f"u{user}", 'a@x', '2024-01-01') for user in range(8)], '2024-01-02 10:00:00')
+    
+    for index in range(2):
+        executor.execute_script(milestoner._get_lock_batch_query('USERS_STAGING', f"b{index}", 100, (index, 2)))
+    claims = executor.execute("SELECT LOCKED, COUNT(*) FROM STAGING.USERS_STAGING GROUP BY LOCKED").rows
+    
+    assert sum(count for _, count in claims) == 8
+    assert None not in [batch for batch, _ in claims]
+
+def test_restored_batch_is_queued_and_replayed_without_changing_history(executor):
+    """Test that a batch restored behind the watermark is claimed again and replays into split history."""
+    milestoner = _milestoner(executor, pending_queue='watermark', split_history=True)
+    milestoner.create_pending_queue('USERS_STAGING')
+    executor.execute("CREATE TABLE STAGING.USERS_STAGING_ARCHIVE LIKE STAGING.USERS_STAGING")
+    compactor = StagingCompactor(executor, 'USERS_STAGING', retention_days=0)
+    _load(executor, [('u1', 'a@x', '2024-01-01')], '2024-01-02 10:00:00')
+    archived = milestoner.process_batch('USERS_STAGING', 'USERS')['batch_id']
+    compactor.compact()
+    _load(executor, [('u1', 'b@x', '2024-03-01')], '2024-03-02 10:00:00')
+    milestoner.process_batch('USERS_STAGING', 'USERS')
+    history = _versions(executor)
+    
+    assert compactor.restore([archived], milestoner) == 1
+    assert len(_queued(executor)) == 1
+    assert milestoner.process_batch('USERS_STAGING', 'USERS')['records_processed'] == 1
+    assert _versions(executor) == history
+    assert _queued(executor) == []
+
+def test_batch_whose_lease_was_revoked_is_rolled_back(executor, mocker):
+    """Test that the merge transaction aborts, leaving the conformed table unchanged, once a reclaim revoked the lease."""
+    milestoner = _milestoner(executor, lease_seconds=60)
+    milestoner.create_lease_table('USERS_STAGING')
+    _load(executor, [('u1', 'a@x', '2024-01-01')], '2024-01-02')
+    original = milestoner._run_stage
+
+    def revoking_stage(result, stage, *args, **kwargs):
+        if stage == 'merge':
+            executor.execute("UPDATE STAGING.USERS_STAGING_LEASES SET HEARTBEAT_DATETIME = NULL")
+        return original(result, stage, *args, **kwargs)
+
+    mocker.patch.object(milestoner, '_run_stage', side_effect=revoking_stage)
+    
+    with pytest.raises(RuntimeError, match='Fenced statement affected no rows'):
+        milestoner.process_batch('USERS_STAGING', 'USERS')
+    assert _versions(executor) == []
+    assert executor.execute(
+        "SELECT COUNT(*) FROM STAGING.USERS_STAGING WHERE PROCESSED_DATETIME IS NULL"
+    ).rows[0][0] == 1
+
+def test_split_history_keeps_snapshots_of_earlier_system_times(executor):
+    """Test that a late record re-closes a closed version without changing what earlier snapshots read."""
+    milestoner = _milestoner(executor, split_history=True)
+    reader = PointInTimeReader(milestoner, 'USERS', executor=executor)
+    _load(executor, [('u1', 'a@x', '2024-01-01')], '2024-01-02')
+    milestoner.process_batch('USERS_STAGING', 'USERS')
+    _load(executor, [('u1', 'b@x', '2024-03-01')], '2024-03-02')
+    milestoner.process_batch('USERS_STAGING', 'USERS')
+    before = str(datetime.now())
+    valid_times = ['2024-01-15', '2024-02-15', '2024-03-15']
+    snapshots = [reader.as_of(valid_time, before).rows for valid_time in valid_times]
+    time.sleep(0.001)
+    _load(executor, [('u1', 'c@x', '2024-02-01')], '2024-04-02')
+    result = milestoner.process_batch('USERS_STAGING', 'USERS')
+    
+    assert (result['records_inserted'], result['records_closed']) == (1, 1)
+    assert [reader.as_of(valid_time, before).rows for valid_time in valid_times] == snapshots
+    assert [row[1] for row in snapshots[1]] == ['a@x']
+    assert [[row[1] for row in reader.as_of(valid_time).rows] for valid_time in valid_times] == [
+        ['a@x'], ['c@x'], ['b@x']
+    ]
+    assert _versions(executor) == [
+        ('u1', 'a@x', '2024-01-01', '2024-03-01', 0),
+        ('u1', 'a@x', '2024-01-01', '2024-02-01', 0),
+        ('u1', 'c@x', '2024-02-01', '2024-03-01', 0),
+        ('u1', 'b@x', '2024-03-01', None, 1)
+    ]
+
+def test_coalescing_keeps_every_point_in_time_read(executor):
+    """Test that coalescing removes redundant versions without changing any snapshot."""
+    executor.execute("""
+    INSERT INTO USERS (USER_ID, EMAIL, EFFECTIVE_DATE, VALID_FROM, VALID_TO, SYSTEM_FROM, SYSTEM_TO, STAGING_GUID) VALUES
+        ('u1', 'a@x', '2024-01-01', '2024-01-01', '2024-02-01', '2024-01-02', '2024-02-02', 'g1'),
+        ('u1', 'a@x', '2024-02-01', '2024-02-01', '2024-03-01', '2024-02-02', '2024-03-02', 'g2'),
+        ('u1', 'b@x', '2024-03-01', '2024-03-01', NULL, '2024-03-02', NULL, 'g3'),
+        ('u2', 'c@x', '2024-01-01', '2024-01-01', NULL, '2024-01-02', NULL, 'g4')""")
+    executor.execute("INSERT INTO INFORMATION_SCHEMA.TABLES VALUES ('PUBLIC', 'USERS', 4000, 4)")
+    milestoner = _milestoner(executor)
+    reader = PointInTimeReader(milestoner, 'USERS', executor=executor)
+    points = [
+        (valid_time, system_time)
+        for valid_time in ['2024-01-15', '2024-02-15', '2024-03-15', None]
+        for system_time in ['2024-01-10', '2024-02-10', '2024-03-10', None]
+    ]
+    
+    def snapshots():
+        return [sorted((row[0], row[1]) for row in reader.as_of(*point).rows) for point in points]
+    
+    before = snapshots()
+    result = VersionCoalescer(milestoner, 'USERS').coalesce()
+    
+    assert (result['versions_coalesced'], result['versions_removed'], result['bytes_reclaimed']) == (1, 1, 1000)
+    assert result['watermark'] == '2024-03-02'
+    assert snapshots() == before
+    assert _versions(executor) == [
+        ('u1', 'a@x', '2024-01-01', '2024-03-01', 0),
+        ('u1', 'b@x', '2024-03-01', None, 1),
+        ('u2', 'c@x', '2024-01-01', None, 1)
+    ]
+    assert VersionCoalescer(milestoner, 'USERS').coalesce(since=result['watermark'])['watermark'] == '2024-03-02'
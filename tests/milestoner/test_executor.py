@@ -0,0 +1,174 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+from src.milestoner.executor import (
+    ConnectionPool,
+    QueryResult,
+    SQLiteExecutor,
+    name_result,
+    named_results,
+    split_statements
+)
+
+@pytest.fixture
+def executor():
+    """Create an in-memory SQLite executor with a small staging table."""
+    executor = SQLiteExecutor(pool_size=2, retry_backoff=0)
+    executor.execute("CREATE TABLE STAGING_ROWS (STAGING_GUID TEXT, LOCKED TEXT)")
+    executor.execute("INSERT INTO STAGING_ROWS VALUES ('guid1', NULL), ('guid2', NULL), ('guid3', 'other')")
+    yield executor
+    executor.close()
+
+def test_split_statements():
+    """Test splitting of scripts while respecting quotes and comments."""
+    script = """
+    BEGIN;
+    -- comment; with a semicolon
+    UPDATE t SET a = 'x;y';
+    COMMIT;
+    """
+    assert split_statements(script) == [
+        'BEGIN',
+        "-- comment; with a semicolon\n    UPDATE t SET a = 'x;y'",
+        'COMMIT'
+    ]
+
+def test_named_results_follow_statement_names(executor):
+    """Test that script results are keyed by statement name wherever the statements end up."""
+    script = f"""
+    BEGIN;
+    {name_result('records_locked', "UPDATE STAGING_ROWS SET LOCKED = 'b1' WHERE LOCKED IS NULL")};
+    {name_result('records_pending', 'SELECT COUNT(*) FROM STAGING_ROWS WHERE LOCKED IS NULL')};
+    COMMIT;
+    """
+    results = named_results(script, executor.execute_script(script))
+    
+    assert set(results) == {'records_locked', 'records_pending'}
+    assert results['records_locked'].rowcount == 2
+    assert results['records_pending'].rows == [(0,)]
+    with pytest.raises(ValueError):
+        named_results(script, [QueryResult()])
+
+def test_execute_reports_affected_rows(executor):
+    """Test that UPDATE row counts are reported."""
+    result = executor.execute("UPDATE STAGING_ROWS SET LOCKED = 'b1' WHERE LOCKED IS NULL")
+    assert result.rowcount == 2
+
+def test_execute_returns_rows(executor):
+    """Test that SELECT results are fetched with their column names."""
+    result = executor.execute("SELECT COUNT(*) AS PENDING FROM STAGING_ROWS WHERE LOCKED IS NULL")
+    assert result.first('pending') == 2
+    assert result.first('missing', 'default') == 'default'
+
+def test_execute_script_returns_one_result_per_statement(executor):
+    """Test that scripts run in one transaction and report each statement."""
+    results = executor.execute_script("""
+    BEGIN;
+    UPDATE STAGING_ROWS SET LOCKED = 'b1' WHERE LOCKED IS NULL;
+    DELETE FROM STAGING_ROWS WHERE LOCKED = 'other';
+    COMMIT;
+    """)
+    assert [r.rowcount for r in results[1:3]] == [2, 1]
+
+def test_execute_script_rolls_back_on_failure(executor):
+    """Test that a failing script leaves no partial changes behind."""
+    with pytest.raises(sqlite3.Error):
+        executor.execute_script("""
+        BEGIN;
+        UPDATE STAGING_ROWS SET LOCKED = 'b1' WHERE LOCKED IS NULL;
+        SELECT * FROM MISSING_TABLE;
+        COMMIT;
+        """)
+    assert executor.execute("SELECT COUNT(*) FROM STAGING_ROWS WHERE LOCKED IS NULL").rows[0][0] == 2
+
+def test_execute_statements_binds_parameters_per_statement(executor):
+    """Test that each statement runs with its own parameters on one connection."""
+    results = executor.execute_statements([
+        ("UPDATE STAGING_ROWS SET LOCKED = ? WHERE LOCKED IS NULL", ['b1']),
+        ("SELECT COUNT(*) FROM STAGING_ROWS WHERE LOCKED = ?", ['b1']),
+        ("SELECT COUNT(*) FROM STAGING_ROWS", None)
+    ])
+    assert results[0].rowcount == 2
+    assert results[1].rows[0][0] == 2
+    assert results[2].rows[0][0] == 3
+
+def test_transient_errors_are_retried(executor, mocker):
+    """Test that transient failures are retried and then succeed."""
+    run = mocker.patch.object(
+        executor,
+        '_run',
+        side_effect=[sqlite3.OperationalError('database is locked'), QueryResult(rowcount=1)]
+    )
+    assert executor.execute('SELECT 1').rowcount == 1
+    assert run.call_count == 2
+
+def test_unknown_outcome_dml_is_not_retried(executor, mocker):
+    """Test that DML failing with an unknown outcome is raised while queries are retried."""
+    mocker.patch.object(executor, 'may_have_applied', return_value=True)
+    run = mocker.patch.object(executor, '_run', side_effect=sqlite3.OperationalError('database is locked'))
+    with pytest.raises(sqlite3.OperationalError):
+        executor.execute("UPDATE STAGING_ROWS SET LOCKED = 'b1'")
+    assert run.call_count == 1
+    
+    run.side_effect = [sqlite3.OperationalError('database is locked'), QueryResult(rowcount=1)]
+    assert executor.execute('-- count\nSELECT 1').rowcount == 1
+    
+    run.side_effect = [sqlite3.OperationalError('database is locked'), QueryResult(rowcount=1)]
+    assert executor.execute("DROP TABLE IF EXISTS T", idempotent=True).rowcount == 1
+    assert run.call_count == 5
+
+def test_permanent_errors_are_not_retried(executor, mocker):
+    """Test that non-transient failures are raised immediately."""
+    run = mocker.patch.object(executor, '_run', side_effect=sqlite3.OperationalError('no such table'))
+    with pytest.raises(sqlite3.OperationalError):
+        executor.execute('SELECT * FROM MISSING_TABLE')
+    assert run.call_count == 1
+
+def test_pool_reuses_connections():
+    """Test that released connections are handed out again instead of reconnecting."""
+    connect = lambda: sqlite3.connect(':memory:')
+    pool = ConnectionPool(connect, max_size=1)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert first is second
+    pool.close()
+
+def test_pool_replaces_broken_idle_connections():
+    """Test that idle connections failing validation are replaced."""
+    pool = ConnectionPool(lambda: sqlite3.connect(':memory:'), max_size=1, ping_after=0)
+    conn = pool.acquire()
+    pool.release(conn)
+    conn.close()
+    replacement = pool.acquire()
+    assert replacement is not conn
+    replacement.execute('SELECT 1')
+    pool.release(replacement)
+    pool.close()
+
+def test_pool_times_out_when_exhausted():
+    """Test that checkout fails after the timeout when all connections are in use."""
+    pool = ConnectionPool(lambda: sqlite3.connect(':memory:'), max_size=1)
+    conn = pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.01)
+    pool.release(conn)
+    pool.close()
+
+def test_pool_wakes_waiter_when_connection_is_discarded():
+    """Test that a discarded connection frees its slot for a waiting checkout."""
+    pool = ConnectionPool(lambda: sqlite3.connect(':memory:', check_same_thread=False), max_size=1)
+    conn = pool.acquire()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire(timeout=5)))
+    waiter.start()
+    time.sleep(0.05)
+    pool.discard(conn)
+    waiter.join(timeout=5)
+    
+    assert len(acquired) == 1 and acquired[0] is not conn
+    pool.release(acquired[0])
+    pool.close()
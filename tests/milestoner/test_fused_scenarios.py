@@ -0,0 +1,105 @@
+import json
+import uuid
+
+import pytest
+from src.milestoner.bitemporal_milestoner import BitemporalMilestoner, PIPELINE_FUSED
+
+@pytest.fixture
+def tables(snowflake_executor):
+    """Create a staging and a conformed table of their own for one fused scenario."""
+    suffix = uuid.uuid4().hex[:8].upper()
+    staging = f"FUSED_STAGING_{suffix}"
+    conformed = f"CONFORMED.FUSED_CONFORMED_{suffix}"
+    snowflake_executor.execute(f"""
+    CREATE TABLE STAGING.{staging} (
+        DATA VARIANT, ROW_CHECKSUM STRING, STAGING_GUID STRING, BATCH_ID STRING,
+        PROCESSED_DATETIME TIMESTAMP, ROW_ADDED_DATETIME TIMESTAMP, LOCKED STRING, MILESTONING_FLAG STRING
+    )""")
+    snowflake_executor.execute(f"""
+    CREATE TABLE {conformed} (
+        USER_ID STRING, EMAIL STRING, EFFECTIVE_DATE DATE, VALID_FROM DATE, VALID_TO DATE,
+        SYSTEM_FROM TIMESTAMP, SYSTEM_TO TIMESTAMP, ROW_CHECKSUM STRING, STAGING_GUID STRING, BATCH_ID STRING
+    )""")
+    yield staging, conformed
+    for table in (f"STAGING.{staging}", f"STAGING.{staging}_LEASES", conformed):
+        snowflake_executor.execute(f"DROP TABLE IF EXISTS {table}")
+
+def _milestoner(executor, **options):
+    """Create a fused-pipeline milestoner for the scenario tables."""
+    return BitemporalMilestoner(
+        business_keys=['USER_ID'],
+        temporal_column='EFFECTIVE_DATE',
+        data_columns=['USER_ID', 'EMAIL', 'EFFECTIVE_DATE'],
+        executor=executor,
+        pipeline_mode=PIPELINE_FUSED,
+        **options
+    )
+
+def _load(executor, staging, records, added, locked=None):
+    """Append (user, email, effective date) records to staging, loaded at one time."""
+    for position, (user, email, effective_date) in enumerate(records):
+        executor.execute(
+            f"""
+            INSERT INTO STAGING.{staging} (DATA, ROW_CHECKSUM, STAGING_GUID, ROW_ADDED_DATETIME, LOCKED)
+            SELECT PARSE_JSON(?), ?, ?, ?::TIMESTAMP, ?""",
+            [
+                json.dumps({'userId': user, 'email': email, 'effectiveDate': effective_date}),
+                f"{user}|{email}",
+                f"{user}-{effective_date}-{added}-{position}",
+                added,
+                locked
+            ]
+        )
+
+def _versions(executor, conformed):
+    """Return (user, email, open) of every conformed version."""
+    return executor.execute(f"""
+    SELECT USER_ID, EMAIL, SYSTEM_TO IS NULL
+    FROM {conformed}
+    ORDER BY USER_ID, VALID_FROM, SYSTEM_FROM""").rows
+
+@pytest.mark.parametrize('options', [{}, {'version_chaining': True, 'prune_merge': True}])
+def test_fused_batch_reports_counts(snowflake_executor, tables, options):
+    """Test that the fused block captures the merge counts it returns."""
+    staging, conformed = tables
+    milestoner = _milestoner(snowflake_executor, **options)
+    _load(snowflake_executor, staging, [('u1', 'a@x', '2024-01-01'), ('u1', 'a@x', '2024-01-01')], '2024-01-02')
+    first = milestoner.process_batch(staging, conformed)
+    _load(snowflake_executor, staging, [('u1', 'b@x', '2024-03-01')], '2024-03-02')
+    second = milestoner.process_batch(staging, conformed)
+    
+    assert (first['records_processed'], first['duplicates_found'], first['records_inserted']) == (2, 1, 1)
+    assert (second['records_closed'], second['records_inserted']) == (1, 1)
+    assert [email for _, email, _ in _versions(snowflake_executor, conformed)] == ['a@x', 'b@x']
+
+def test_fused_batch_reclaims_expired_leases(snowflake_executor, tables):
+    """Test that the fused block releases the records of an expired lease and counts them."""
+    staging, conformed = tables
+    milestoner = _milestoner(snowflake_executor, lease_seconds=60)
+    milestoner.create_lease_table(staging)
+    snowflake_executor.execute(
+        f"INSERT INTO STAGING.{staging}_LEASES VALUES ('dead', '2024-01-01'::TIMESTAMP, '2024-01-01'::TIMESTAMP)"
+    )
+    _load(snowflake_executor, staging, [('u1', 'a@x', '2024-01-01')], '2024-01-02', locked='dead')
+    result = milestoner.process_batch(staging, conformed)
+    
+    assert (result['records_reclaimed'], result['records_processed'], result['records_inserted']) == (1, 1, 1)
+    assert snowflake_executor.execute(f"SELECT COUNT(*) FROM STAGING.{staging}_LEASES").rows[0][0] == 0
+
+def test_fused_batch_whose_lease_was_revoked_is_rolled_back(snowflake_executor, tables, mocker):
+    """Test that the fused block rolls back and raises once its lease is revoked."""
+    staging, conformed = tables
+    milestoner = _milestoner(snowflake_executor, lease_seconds=60)
+    milestoner.create_lease_table(staging)
+    acquire = milestoner.leases.get_acquire_query
+
+    def acquire_then_revoke(staging_table, batch_id, current_time):
+        return f"""{acquire(staging_table, batch_id, current_time)};
+        UPDATE STAGING.{staging}_LEASES SET HEARTBEAT_DATETIME = NULL WHERE BATCH_ID = '{batch_id}'"""
+
+    mocker.patch.object(milestoner.leases, 'get_acquire_query', side_effect=acquire_then_revoke)
+    _load(snowflake_executor, staging, [('u1', 'a@x', '2024-01-01')], '2024-01-02')
+    
+    with pytest.raises(Exception, match='no longer holds its lease'):
+        milestoner.process_batch(staging, conformed)
+    assert _versions(snowflake_executor, conformed) == []
@@ -0,0 +1,108 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+from src.milestoner.bitemporal_milestoner import BitemporalMilestoner
+from src.milestoner.in_memory import InMemoryMilestoner
+
+NOW = datetime(2024, 2, 1, 12, 0, 0)
+
+@pytest.fixture
+def milestoner():
+    """Create an in-memory milestoner for testing."""
+    return InMemoryMilestoner(
+        business_keys=['POLICY_ID'],
+        temporal_column='EFFECTIVE_DATE',
+        data_columns=['POLICY_ID', 'EFFECTIVE_DATE', 'PREMIUM']
+    )
+
+def _staging(rows):
+    """Build staging columns from (policy_id, effective_date, premium, checksum) tuples."""
+    return {
+        'POLICY_ID': [r[0] for r in rows],
+        'EFFECTIVE_DATE': [r[1] for r in rows],
+        'PREMIUM': [r[2] for r in rows],
+        'ROW_CHECKSUM': [r[3] for r in rows],
+        'STAGING_GUID': [f'guid{i}' for i in range(len(rows))],
+        'ROW_ADDED_DATETIME': list(range(len(rows)))
+    }
+
+def _rows(conformed):
+    """Return conformed rows as sorted tuples of key, validity and checksum."""
+    return sorted(zip(
+        conformed['POLICY_ID'],
+        conformed['VALID_FROM'],
+        conformed['VALID_TO'],
+        conformed['SYSTEM_TO'],
+        conformed['ROW_CHECKSUM']
+    ), key=lambda r: (r[0], r[1]))
+
+def test_from_milestoner_reuses_configuration():
+    """Test that the configuration of a SQL milestoner is reused."""
+    sql_milestoner = BitemporalMilestoner(['POLICY_ID'], 'EFFECTIVE_DATE', ['POLICY_ID', 'PREMIUM'])
+    milestoner = InMemoryMilestoner.from_milestoner(sql_milestoner)
+    assert milestoner.business_keys == ['POLICY_ID']
+    assert milestoner.data_columns == ['POLICY_ID', 'PREMIUM']
+
+def test_first_load_chains_versions(milestoner):
+    """Test that several versions of a key become a closed chain with one open version."""
+    result = milestoner.milestone(_staging([
+        ('P1', '2024-01-02', 110, 'b'),
+        ('P1', '2024-01-01', 100, 'a'),
+        ('P2', '2024-01-01', 200, 'c')
+    ]), current_time=NOW)
+    assert result['records_inserted'] == 3
+    assert result['records_closed'] == 0
+    assert _rows(result['conformed']) == [
+        ('P1', '2024-01-01', '2024-01-02', NOW, 'a'),
+        ('P1', '2024-01-02', None, None, 'b'),
+        ('P2', '2024-01-01', None, None, 'c')
+    ]
+
+def test_duplicates_are_dropped(milestoner):
+    """Test that only the earliest record of a checksum is milestoned."""
+    result = milestoner.milestone(_staging([
+        ('P1', '2024-01-01', 100, 'a'),
+        ('P1', '2024-01-01', 100, 'a'),
+        ('P1', '2024-01-02', 100, 'a2'),
+        ('P1', '2024-01-02', 100, 'a2')
+    ]), current_time=NOW)
+    assert result['duplicates_found'] == 2
+    assert list(result['conformed']['STAGING_GUID']) == ['guid0', 'guid2']
+    assert [r[1] for r in _rows(result['conformed'])] == ['2024-01-01', '2024-01-02']
+
+def test_open_versions_are_closed(milestoner):
+    """Test that a later batch closes the open version and skips unchanged keys."""
+    first = milestoner.milestone(_staging([
+        ('P1', '2024-01-01', 100, 'a'),
+        ('P2', '2024-01-01', 200, 'c')
+    ]), current_time=NOW, batch_id='b1')
+    later = datetime(2024, 3, 1)
+    second = milestoner.milestone(_staging([
+        ('P1', '2024-02-01', 120, 'b'),
+        ('P2', '2024-02-01', 200, 'c')
+    ]), conformed=first['conformed'], current_time=later, batch_id='b2')
+    assert second['records_closed'] == 1
+    assert second['unchanged_found'] == 1
+    assert _rows(second['conformed']) == [
+        ('P1', '2024-01-01', '2024-02-01', later, 'a'),
+        ('P1', '2024-02-01', None, None, 'b'),
+        ('P2', '2024-01-01', None, None, 'c')
+    ]
+    assert list(second['conformed']['BATCH_ID']) == ['b1', 'b1', 'b2']
+
+def test_composite_keys_and_datetime_columns():
+    """Test composite business keys with a datetime64 temporal column."""
+    milestoner = InMemoryMilestoner(['POLICY_ID', 'REGION'], 'EFFECTIVE_DATE', ['POLICY_ID', 'REGION'])
+    dates = np.array(['2024-01-01', '2024-01-02', '2024-01-01'], dtype='datetime64[D]')
+    result = milestoner.milestone({
+        'POLICY_ID': ['P1', 'P1', 'P1'],
+        'REGION': ['EU', 'EU', 'US'],
+        'EFFECTIVE_DATE': dates,
+        'ROW_CHECKSUM': np.array([1, 2, 3], dtype=np.uint64),
+        'STAGING_GUID': ['g1', 'g2', 'g3']
+    }, current_time=NOW)
+    valid_to = result['conformed']['VALID_TO']
+    assert valid_to.dtype.kind == 'M'
+    assert valid_to[0] == dates[1]
+    assert np.isnat(valid_to[1:]).all()
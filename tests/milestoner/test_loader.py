@@ -0,0 +1,75 @@
+import gzip
+import json
+
+import pytest
+from src.milestoner.executor import QueryResult
+from src.milestoner.checksum import RowChecksum
+from src.milestoner.loader import FORMAT_NDJSON, StagingLoader
+from src.milestoner.seen_filter import SeenChecksumFilter
+
+@pytest.fixture
+def uploaded(mocker):
+    """Capture the rows of every chunk file at the time it is uploaded."""
+    files = []
+
+    def execute(sql, params=None):
+        if sql.startswith('PUT'):
+            path = sql.split("'")[1][len('file://'):]
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                files.append([json.loads(line) for line in f])
+            return QueryResult()
+        rows = [(f'chunk_{i}', 'LOADED', len(chunk)) for i, chunk in enumerate(files)]
+        return QueryResult(rowcount=len(rows), columns=['file', 'status', 'rows_loaded'], rows=rows)
+
+    executor = mocker.Mock()
+    executor.execute.side_effect = execute
+    return executor, files
+
+def test_load_writes_chunks_and_copies_once(uploaded):
+    """Test that records are uploaded in chunks and loaded with a single COPY."""
+    executor, files = uploaded
+    loader = StagingLoader(executor, 'TEST_STAGING', chunk_rows=2)
+    payloads = [{'userId': str(i)} for i in range(5)]
+
+    result = loader.load(iter(payloads))
+
+    assert result['files'] == 3
+    assert result['records_loaded'] == 5
+    assert [len(rows) for rows in files] == [2, 2, 1]
+    statements = [call.args[0] for call in executor.execute.call_args_list]
+    assert [s.split()[0] for s in statements] == ['PUT', 'PUT', 'PUT', 'COPY']
+    assert f"@STAGING.%TEST_STAGING/milestoner/{result['load_id']}" in statements[0]
+    assert 'FILE_FORMAT = (TYPE = JSON COMPRESSION = GZIP)' in result['queries']['copy']
+
+def test_load_fills_staging_columns(uploaded):
+    """Test that checksum, GUID and arrival order are filled in by the loader."""
+    executor, files = uploaded
+    checksum = RowChecksum(['userId'])
+    loader = StagingLoader(executor, 'TEST_STAGING', file_format=FORMAT_NDJSON, checksum=checksum)
+    loader.load([{'userId': '1'}, {'userId': '2'}])
+
+    rows = files[0]
+    assert [row['DATA'] for row in rows] == [{'userId': '1'}, {'userId': '2'}]
+    assert [row['ROW_CHECKSUM'] for row in rows] == checksum.compute([{'userId': '1'}, {'userId': '2'}])
+    assert rows[0]['STAGING_GUID'] != rows[1]['STAGING_GUID']
+    assert rows[0]['ROW_ADDED_DATETIME'] < rows[1]['ROW_ADDED_DATETIME']
+
+def test_empty_load_runs_no_copy(uploaded):
+    """Test that loading no records issues no statements."""
+    executor, _ = uploaded
+    result = StagingLoader(executor, 'TEST_STAGING').load([])
+    assert result['records_loaded'] == 0
+    executor.execute.assert_not_called()
+
+def test_load_skips_seen_checksums(uploaded):
+    """Test that payloads already in the seen-checksum filter are not staged."""
+    executor, files = uploaded
+    checksum = RowChecksum(['userId'])
+    seen_filter = SeenChecksumFilter(capacity=100)
+    seen_filter.add(checksum.compute([{'userId': '1'}]))
+    loader = StagingLoader(executor, 'TEST_STAGING', checksum=checksum, seen_filter=seen_filter)
+
+    result = loader.load([{'userId': '1'}, {'userId': '2'}])
+
+    assert result['records_skipped'] == 1
+    assert [row['DATA'] for row in files[0]] == [{'userId': '2'}]
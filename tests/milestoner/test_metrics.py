@@ -0,0 +1,82 @@
+import urllib.request
+
+import pytest
+from src.milestoner.metrics import OPENMETRICS_CONTENT_TYPE, BatchMetrics, MetricsRegistry, _Metric
+
+@pytest.fixture
+def batch_result():
+    """Result of a processed batch as returned by process_batch."""
+    return {
+        'batch_id': 'b1',
+        'records_processed': 10,
+        'duplicates_found': 2,
+        'unchanged_found': 0,
+        'records_inserted': 8,
+        'records_closed': 3,
+        'queue_depth': 120,
+        'oldest_pending_seconds': 4.5,
+        'queries': {},
+        'stages': {
+            'lock': {'seconds': 0.2, 'rows': 10, 'query_ids': ['q1']},
+            'merge': {'seconds': 1.5, 'rows': 11, 'query_ids': ['q2', 'q3']}
+        }
+    }
+
+def test_render_counter_gauge_and_histogram():
+    """Test the OpenMetrics text of each metric type."""
+    registry = MetricsRegistry()
+    registry.counter('jobs', 'Jobs run', ['kind']).inc(2, kind='a"b')
+    registry.gauge('depth', 'Queue depth').set(7)
+    histogram = registry.histogram('latency_seconds', 'Latency', buckets=[0.5, 1])
+    histogram.observe(0.7)
+
+    lines = registry.render().splitlines()
+
+    assert 'jobs_total{kind="a\\"b"} 2' in lines
+    assert 'depth 7' in lines
+    assert 'latency_seconds_bucket{le="0.5"} 0' in lines
+    assert 'latency_seconds_bucket{le="1"} 1' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 1' in lines
+    assert 'latency_seconds_sum 0.7' in lines
+    assert lines[-1] == '# EOF'
+
+def test_metric_base_class_is_abstract():
+    """Test that only metric types implementing their samples can be created."""
+    with pytest.raises(TypeError):
+        _Metric('jobs', 'Jobs run')
+
+def test_duplicate_metric_names_are_rejected():
+    """Test that a metric name can only be registered once."""
+    registry = MetricsRegistry()
+    registry.counter('jobs', 'Jobs run')
+    with pytest.raises(ValueError):
+        registry.gauge('jobs', 'Jobs')
+
+def test_batch_metrics_observe(batch_result):
+    """Test that batch counts, stage timings and queue stats are recorded."""
+    metrics = BatchMetrics()
+    metrics.observe('USERS', batch_result)
+
+    assert metrics.batches.value(staging_table='USERS') == 1
+    assert metrics.records.value(staging_table='USERS', outcome='records_inserted') == 8
+    assert metrics.stage_seconds.count(staging_table='USERS', stage='merge') == 1
+    assert metrics.stage_rows.value(staging_table='USERS', stage='merge') == 11
+    assert metrics.queue_depth.value(staging_table='USERS') == 120
+    assert metrics.oldest_pending_seconds.value(staging_table='USERS') == 4.5
+
+def test_write_and_serve(batch_result, tmp_path):
+    """Test exposing the metrics as a file and over HTTP."""
+    metrics = BatchMetrics()
+    metrics.observe('USERS', batch_result)
+    path = tmp_path / 'milestoner.prom'
+    metrics.registry.write(str(path))
+    assert 'milestoner_batches_total{staging_table="USERS"} 1' in path.read_text()
+
+    server = metrics.registry.serve(port=0)
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{server.server_address[1]}/metrics') as response:
+            assert response.headers['Content-Type'] == OPENMETRICS_CONTENT_TYPE
+            assert response.read().decode('utf-8') == metrics.registry.render()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,114 @@
+import pytest
+from datetime import datetime, timedelta
+from src.milestoner.bitemporal_milestoner import BitemporalMilestoner
+from src.milestoner.executor import SQLiteExecutor
+from src.milestoner.point_in_time import PointInTimeReader
+
+@pytest.fixture
+def milestoner():
+    """Create a BitemporalMilestoner describing the conformed table."""
+    return BitemporalMilestoner(
+        business_keys=['USER_ID'],
+        temporal_column='EFFECTIVE_DATE',
+        data_columns=['USER_ID', 'EMAIL', 'EFFECTIVE_DATE']
+    )
+
+@pytest.fixture
+def executor():
+    """Create a SQLite executor with a conformed history of two users."""
+    executor = SQLiteExecutor(pool_size=1, retry_backoff=0)
+    executor.execute("""
+    CREATE TABLE USERS (
+        USER_ID TEXT, EMAIL TEXT, EFFECTIVE_DATE TEXT,
+        VALID_FROM TEXT, VALID_TO TEXT, SYSTEM_FROM TEXT, SYSTEM_TO TEXT
+    )""")
+    # u1 changed email on 2024-03-01, which was recorded on 2024-03-05
+    executor.execute("""
+    INSERT INTO USERS VALUES
+        ('u1', 'a@x', '2024-01-01', '2024-01-01', '2024-03-01', '2024-01-02', '2024-03-05'),
+        ('u1', 'b@x', '2024-03-01', '2024-03-01', NULL, '2024-03-05', NULL),
+        ('u2', 'c@x', '2024-02-01', '2024-02-01', NULL, '2024-02-02', NULL)
+    """)
+    yield executor
+    executor.close()
+
+def _emails(result):
+    """Return the emails of a snapshot."""
+    return [row[1] for row in result.rows]
+
+def test_as_of_applies_both_timelines(milestoner, executor):
+    """Test that a snapshot reflects what was valid at valid_time as known at system_time."""
+    reader = PointInTimeReader(milestoner, 'USERS', executor=executor)
+    
+    assert _emails(reader.as_of('2024-03-10', '2024-03-10', keys=['u1'])) == ['b@x']
+    assert _emails(reader.as_of('2024-03-10', '2024-03-02', keys=['u1'])) == ['a@x']
+    assert _emails(reader.as_of('2024-02-15', '2024-03-10', keys=['u1'])) == ['a@x']
+    assert _emails(reader.as_of('2024-01-15', '2024-01-01', keys=['u1'])) == []
+
+def test_as_of_without_times_reads_open_versions(milestoner, executor):
+    """Test that omitting both times selects the open versions."""
+    reader = PointInTimeReader(milestoner, 'USERS', executor=executor)
+    result = reader.as_of()
+    
+    assert sorted(_emails(result)) == ['b@x', 'c@x']
+    assert result.columns[:3] == ['USER_ID', 'EMAIL', 'EFFECTIVE_DATE']
+
+def test_as_of_query_is_prune_friendly_and_chunked(milestoner):
+    """Test that key lookups are split into bounded IN lists over bare column predicates."""
+    reader = PointInTimeReader(milestoner, 'USERS', max_keys_per_query=2)
+    statements = reader.as_of_query('2024-03-10', '2024-03-10', keys=['u3', 'u1', 'u2'])
+    
+    assert len(statements) == 2
+    sql, params = statements[0]
+    assert 'SYSTEM_FROM <= ?' in sql
+    assert '(VALID_TO IS NULL OR ? < VALID_TO OR SYSTEM_TO > ?)' in sql
+    assert 'USER_ID BETWEEN ? AND ?' in sql
+    assert 'COALESCE' not in sql
+    assert sql.index('USER_ID IN (?, ?)') < sql.index('WHERE VERSION_RANK = 1')
+    assert params[2:6] == ['u1', 'u3', 'u3', 'u1']
+
+def test_composite_keys_use_row_value_lookup(executor):
+    """Test that composite business keys are looked up as rows of values."""
+    milestoner = BitemporalMilestoner(
+        business_keys=['USER_ID', 'EMAIL'],
+        temporal_column='EFFECTIVE_DATE',
+        data_columns=['USER_ID', 'EMAIL', 'EFFECTIVE_DATE']
+    )
+    reader = PointInTimeReader(milestoner, 'USERS', executor=executor)
+    result = reader.as_of('2024-03-10', keys=[('u2', 'c@x'), ('u1', 'b@x')])
+    
+    assert [row[:2] for row in result.rows] == [('u2', 'c@x'), ('u1', 'b@x')]
+
+def test_snapshot_cache_only_queries_new_keys(milestoner, executor, mocker):
+    """Test that repeated lookups of a cached snapshot only query keys not seen before."""
+    reader = PointInTimeReader(milestoner, 'USERS', executor=executor, cache_snapshots=1, max_batch_seconds=3600)
+    execute = mocker.spy(executor, 'execute')
+    
+    assert _emails(reader.as_of('2024-03-10', '2024-03-02', keys=['u1', 'u9'])) == ['a@x']
+    assert _emails(reader.as_of('2024-03-10', '2024-03-02', keys=['u2', 'u1', 'u9'])) == ['c@x', 'a@x']
+    assert execute.call_count == 2
+    assert 'u2' in execute.call_args.args[1]
+    assert 'u1' not in execute.call_args.args[1]
+    
+    reader.as_of('2024-03-10', '2024-03-03', keys=['u1'])
+    reader.as_of('2024-03-10', '2024-03-02', keys=['u1'])
+    assert execute.call_count == 4
+
+def test_snapshot_cache_skips_unsettled_system_times(milestoner, executor):
+    """Test that snapshots of system times a running batch may still commit to are read again every time."""
+    reader = PointInTimeReader(milestoner, 'USERS', executor=executor, cache_snapshots=4, max_batch_seconds=3600)
+    system_time = datetime.now() - timedelta(minutes=5)
+    
+    assert _emails(reader.as_of('2024-03-10', system_time, keys=['u2'])) == ['c@x']
+    # A later batch has committed, then one stamped before system_time commits
+    stamped = str(system_time - timedelta(minutes=1))
+    executor.execute("INSERT INTO USERS VALUES ('u3', 'x@x', '2024-03-08', '2024-03-08', NULL, ?, NULL)", [str(datetime.now())])
+    executor.execute("UPDATE USERS SET VALID_TO = '2024-03-08', SYSTEM_TO = ? WHERE USER_ID = 'u2'", [stamped])
+    executor.execute("INSERT INTO USERS VALUES ('u2', 'd@x', '2024-03-08', '2024-03-08', NULL, ?, NULL)", [stamped])
+    assert _emails(reader.as_of('2024-03-10', system_time, keys=['u2'])) == ['d@x']
+    assert reader._cache == {}
+
+def test_snapshot_cache_requires_max_batch_seconds(milestoner, executor):
+    """Test that a cache without a bound on batch duration is rejected."""
+    with pytest.raises(ValueError):
+        PointInTimeReader(milestoner, 'USERS', executor=executor, cache_snapshots=4)
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from src.milestoner.seen_filter import SeenChecksumFilter
+
+class FakeClock:
+    """Manually advanced clock."""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_added_checksums_are_found():
+    """Test that every added checksum is reported as seen."""
+    seen_filter = SeenChecksumFilter(capacity=1000, error_rate=0.01)
+    checksums = [f'checksum{i}' for i in range(500)]
+    seen_filter.add(checksums)
+    assert seen_filter.contains(checksums).all()
+
+def test_false_positive_rate_is_bounded():
+    """Test that unseen checksums are rarely reported at full capacity."""
+    seen_filter = SeenChecksumFilter(capacity=10000, error_rate=0.01, generations=1)
+    seen_filter.add([f'seen{i}' for i in range(10000)])
+    false_positives = seen_filter.contains([f'unseen{i}' for i in range(10000)]).mean()
+    assert false_positives < 0.03
+
+def test_memory_is_bounded_by_generations():
+    """Test that rotating never keeps more than the configured generations."""
+    seen_filter = SeenChecksumFilter(capacity=100, generations=2)
+    seen_filter.add(['first'])
+    seen_filter.rotate()
+    seen_filter.add(['second'])
+    seen_filter.rotate()
+    assert seen_filter.contains(['first', 'second']).tolist() == [False, True]
+    assert len(seen_filter._bits) == 2
+    assert seen_filter.memory_bytes == 2 * seen_filter.bits_per_generation // 8
+
+def test_generations_rotate_after_time():
+    """Test that checksums expire after the rotation window of every generation."""
+    clock = FakeClock()
+    seen_filter = SeenChecksumFilter(capacity=100, generations=2, rotate_after=60, clock=clock)
+    seen_filter.add(['old'])
+    clock.now = 61
+    seen_filter.add(['recent'])
+    assert seen_filter.contains(['old', 'recent']).all()
+    clock.now = 122
+    seen_filter.add(['new'])
+    assert seen_filter.contains(['old', 'recent', 'new']).tolist() == [False, True, True]
+
+def test_save_and_load_round_trip(tmp_path):
+    """Test that a saved filter is restored with its contents."""
+    seen_filter = SeenChecksumFilter(capacity=100)
+    seen_filter.add(['abc123'])
+    path = str(tmp_path / 'seen.npz')
+    seen_filter.save(path)
+    restored = SeenChecksumFilter.load(path)
+    assert restored.contains(['abc123'])[0]
+    assert restored.capacity == 100
@@ -0,0 +1,55 @@
+import pytest
+from src.milestoner.templates import QueryTemplate, as_identifier, bind_constant, bind_parameter
+
+@pytest.fixture
+def template():
+    """Create a template using every kind of marker."""
+    return QueryTemplate(f"""
+    CREATE TEMPORARY TABLE STAGING.T_{as_identifier(bind_parameter('batch_id'))} AS SELECT 1;
+    UPDATE STAGING.S SET LOCKED = '{bind_parameter('batch_id')}', PROCESSED = '{bind_parameter('current_time')}'
+    WHERE GUID IN (SELECT GUID FROM STAGING.S LIMIT {bind_constant('batch_size')});
+    """)
+
+VALUES = {'batch_id': 'ab-cd', 'current_time': '2024-01-01 00:00:00', 'batch_size': 500}
+
+def test_render_inlines_values(template):
+    """Test that rendering reproduces the literal SQL a generator would produce."""
+    sql = template.render(VALUES)
+    assert 'STAGING.T_abcd AS' in sql
+    assert "LOCKED = 'ab-cd', PROCESSED = '2024-01-01 00:00:00'" in sql
+    assert 'LIMIT 500)' in sql
+
+def test_bind_produces_qmark_statements(template):
+    """Test that parameters are bound and constants and identifiers inlined."""
+    statements = template.bind(VALUES)
+    assert statements[0] == ("CREATE TEMPORARY TABLE STAGING.T_abcd AS SELECT 1", [])
+    sql, params = statements[1]
+    assert "LOCKED = ?, PROCESSED = ?" in sql
+    assert 'LIMIT 500)' in sql
+    assert params == ['ab-cd', '2024-01-01 00:00:00']
+    assert template.bind({**VALUES, 'batch_id': 'other'})[1][0] == sql
+
+def test_bound_temporary_tables_are_unique_per_batch(template):
+    """Test that two batches bound from one template never share a temporary table."""
+    first = template.bind(VALUES)[0][0]
+    second = template.bind({**VALUES, 'batch_id': 'ef-01'})[0][0]
+    
+    assert first != second
+    assert second.endswith('STAGING.T_ef01 AS SELECT 1')
+
+def test_literal_values_are_identifiers_without_dashes():
+    """Test that as_identifier keeps generators usable with literal batch IDs."""
+    assert as_identifier('ab-cd') == 'abcd'
+
+def test_unquoted_parameters_are_rejected():
+    """Test that a parameter marker must stand for a quoted literal."""
+    with pytest.raises(ValueError):
+        QueryTemplate(f"SELECT * FROM T WHERE ID = {bind_parameter('batch_id')}")
+
+def test_scripting_blocks_are_not_bindable():
+    """Test that EXECUTE IMMEDIATE blocks can only be rendered."""
+    template = QueryTemplate(f"EXECUTE IMMEDIATE $$ BEGIN SELECT '{bind_parameter('batch_id')}'; END; $$")
+    assert not template.bindable
+    with pytest.raises(ValueError):
+        template.bind(VALUES)
+    assert "SELECT 'ab-cd'" in template.render(VALUES)
@@ -0,0 +1,118 @@
+import pytest
+from src.milestoner.bitemporal_milestoner import BitemporalMilestoner
+from src.milestoner.executor import SQLiteExecutor
+from src.milestoner.temporal_join import TemporalJoin
+
+USERS = {
+    'USER_ID': ['u1', 'u1', 'u2', 'u3'],
+    'DEPARTMENT_ID': ['d1', 'd2', 'd1', 'd9'],
+    'NAME': ['Ann', 'Ann', 'Bob', 'Cid'],
+    'VALID_FROM': ['2024-01-01', '2024-03-01', '2024-02-15', '2024-01-01'],
+    'VALID_TO': ['2024-03-01', None, None, None],
+    'SYSTEM_FROM': ['2024-01-01', '2024-03-01', '2024-02-15', '2024-01-01'],
+    'SYSTEM_TO': ['2024-03-01', None, None, None]
+}
+
+DEPARTMENTS = {
+    'DEPARTMENT_ID': ['d1', 'd1', 'd1', 'd2'],
+    'NAME': ['Sales', 'Sales', 'Revenue', 'Legal'],
+    'VALID_FROM': ['2023-01-01', '2024-02-01', '2024-02-01', '2024-01-01'],
+    'VALID_TO': ['2024-02-01', '2024-02-01', None, None],
+    'SYSTEM_FROM': ['2023-01-01', '2024-02-01', '2024-02-01', '2024-01-01'],
+    'SYSTEM_TO': ['2024-02-01', '2024-02-01', None, None]
+}
+
+EXPECTED = [
+    ('Ann', 'Legal', '2024-03-01', None),
+    ('Ann', 'Revenue', '2024-02-01', '2024-03-01'),
+    ('Ann', 'Sales', '2024-01-01', '2024-02-01'),
+    ('Bob', 'Revenue', '2024-02-15', None)
+]
+
+@pytest.fixture
+def temporal_join():
+    """Create a join of users with their department over time."""
+    users = BitemporalMilestoner(
+        business_keys=['USER_ID'],
+        temporal_column='EFFECTIVE_DATE',
+        data_columns=['USER_ID', 'DEPARTMENT_ID', 'NAME']
+    )
+    departments = BitemporalMilestoner(
+        business_keys=['DEPARTMENT_ID'],
+        temporal_column='EFFECTIVE_DATE',
+        data_columns=['DEPARTMENT_ID', 'NAME']
+    )
+    return TemporalJoin(users, departments)
+
+def _rows(columns, names):
+    """Return sorted result rows of some columns."""
+    return sorted(zip(*(list(columns[name]) for name in names)), key=lambda row: (row[0], row[2]))
+
+def test_columns_prefix_right_name_collisions(temporal_join):
+    """Test that right columns colliding with left ones are prefixed and join columns are not repeated."""
+    assert temporal_join.columns == ['USER_ID', 'DEPARTMENT_ID', 'NAME', 'RIGHT_NAME', 'VALID_FROM', 'VALID_TO']
+
+def test_join_intersects_validity(temporal_join):
+    """Test that every overlapping pair yields the intersection of its intervals."""
+    result = temporal_join.join(USERS, DEPARTMENTS)
+    
+    assert _rows(result, ['NAME', 'RIGHT_NAME', 'VALID_FROM', 'VALID_TO']) == sorted(
+        EXPECTED, key=lambda row: (row[0], row[2])
+    )
+
+def test_join_as_of_system_time(temporal_join):
+    """Test that versions closed after the system time are joined as open."""
+    result = temporal_join.join(USERS, DEPARTMENTS, system_time='2024-02-20')
+    
+    assert _rows(result, ['NAME', 'RIGHT_NAME', 'VALID_FROM', 'VALID_TO']) == [
+        ('Ann', 'Sales', '2024-01-01', '2024-02-01'),
+        ('Ann', 'Revenue', '2024-02-01', None),
+        ('Bob', 'Revenue', '2024-02-15', None)
+    ]
+
+@pytest.mark.parametrize('system_time', [None, '2024-02-20'])
+def test_sql_join_matches_in_memory_join(temporal_join, system_time):
+    """Test that the generated SQL returns the same rows as the in-memory join."""
+    executor = SQLiteExecutor(pool_size=1, retry_backoff=0)
+    for table, data in (('USERS', USERS), ('DEPARTMENTS', DEPARTMENTS)):
+        executor.execute(f"CREATE TABLE {table} ({', '.join(data)})")
+        for row in zip(*data.values()):
+            executor.execute(f"INSERT INTO {table} VALUES ({', '.join('?' for _ in row)})", list(row))
+    sql, params = temporal_join.get_join_query('USERS', 'DEPARTMENTS', system_time)
+    rows = executor.execute(sql, params).rows
+    executor.close()
+    
+    expected = temporal_join.join(USERS, DEPARTMENTS, system_time)
+    assert sorted(rows, key=str) == sorted(zip(*expected.values()), key=str)
+
+def test_bucketed_join_keeps_each_pair_in_one_bucket(temporal_join):
+    """Test that bucketing adds the bucket to the join key and keeps pairs where their intersection starts."""
+    temporal_join.bucket_seconds = 86400 * 30
+    sql, _ = temporal_join.get_join_query('USERS', 'DEPARTMENTS')
+    
+    assert sql.count('LATERAL FLATTEN(ARRAY_GENERATE_RANGE(') == 2
+    assert 'l.VALID_BUCKET = r.VALID_BUCKET' in sql
+    assert 'l.VALID_BUCKET = LEAST(FLOOR(DATEDIFF(' in sql
+
+@pytest.mark.parametrize('system_time, ann_revenue_to', [(None, '2024-02-15'), ('2024-03-10', '2024-03-01')])
+def test_join_uses_latest_row_of_corrected_versions(temporal_join, system_time, ann_revenue_to):
+    """Test that a corrected copy of a closed version supersedes it from its system time on, in memory and in SQL."""
+    correction = ['u1', 'd1', 'Ann', '2024-01-01', '2024-02-15', '2024-04-01', '2024-04-01']
+    users = {name: values + [value] for (name, values), value in zip(USERS.items(), correction)}
+    result = temporal_join.join(users, DEPARTMENTS, system_time)
+    
+    assert _rows(result, ['NAME', 'RIGHT_NAME', 'VALID_FROM', 'VALID_TO']) == [
+        ('Ann', 'Sales', '2024-01-01', '2024-02-01'),
+        ('Ann', 'Revenue', '2024-02-01', ann_revenue_to),
+        ('Ann', 'Legal', '2024-03-01', None),
+        ('Bob', 'Revenue', '2024-02-15', None)
+    ]
+    executor = SQLiteExecutor(pool_size=1, retry_backoff=0)
+    for table, data in (('USERS', users), ('DEPARTMENTS', DEPARTMENTS)):
+        executor.execute(f"CREATE TABLE {table} ({', '.join(data)})")
+        for row in zip(*data.values()):
+            executor.execute(f"INSERT INTO {table} VALUES ({', '.join('?' for _ in row)})", list(row))
+    sql, params = temporal_join.get_join_query('USERS', 'DEPARTMENTS', system_time)
+    rows = executor.execute(sql, params).rows
+    executor.close()
+    assert sorted(rows, key=str) == sorted(zip(*result.values()), key=str)
@@ -1,5 +1,13 @@
+import time
+
 import pytest
-from src.milestoner.bitemporal_milestoner import BitemporalMilestoner
+from datetime import datetime
+from src.milestoner.bitemporal_milestoner import BitemporalMilestoner, PIPELINE_FUSED, QUEUE_STREAM, QUEUE_WATERMARK
+from src.milestoner.batch_sizing import AdaptiveBatchSizer
+from src.milestoner.executor import QueryResult, result_name, split_statements
+from src.milestoner.leases import BatchLeases
+from src.milestoner.pending_queue import PendingQueue
+from src.milestoner.seen_filter import SeenChecksumFilter
 
 @pytest.fixture
 def milestoner():
@@ -21,7 +29,7 @@ def test_snake_to_camel(milestoner):
     ]
     
     for input_str, expected in test_cases:
-        assert milestoner._snake_to_camel(input_str) == expected
+        assert milestoner.snake_to_camel(input_str) == expected
 
 def test_get_data_fields_select(milestoner):
     """Test generation of data field selection clause."""
@@ -32,4 +40,673 @@ def test_get_data_fields_select(milestoner):
         "DATA:lastName::STRING as LAST_NAME, "
         "DATA:effectiveDate::STRING as EFFECTIVE_DATE"
     )
-    assert milestoner._get_data_fields_select() == expected 
\ No newline at end of file
+    assert milestoner._get_data_fields_select() == expected 
+
+def test_process_batch_without_executor_only_builds_queries(milestoner):
+    """Test that process_batch returns the generated queries when no executor is set."""
+    result = milestoner.process_batch('TEST_STAGING', 'TEST_CONFORMED')
+    assert result['records_processed'] == 0
+    assert set(result['queries']) == {'lock', 'duplicates', 'merge'}
+
+def test_process_batch_reports_counts(milestoner, mocker):
+    """Test that process_batch fills in counts from the executed statements."""
+    executor = mocker.Mock()
+    executor.execute.side_effect = [QueryResult(rowcount=3), QueryResult(rowcount=1)]
+    executor.execute_script.side_effect = _results_by_name(records_merged=QueryResult(
+        rowcount=2,
+        columns=['number of rows inserted', 'number of rows updated'],
+        rows=[(1, 1)]
+    ))
+    milestoner.executor = executor
+    
+    result = milestoner.process_batch('TEST_STAGING', 'TEST_CONFORMED')
+    
+    assert result['records_processed'] == 3
+    assert result['duplicates_found'] == 1
+    assert result['records_inserted'] == 1
+    assert result['records_closed'] == 1
+
+def test_process_batch_stops_when_nothing_locked(milestoner, mocker):
+    """Test that no further statements run when the lock finds no records."""
+    executor = mocker.Mock()
+    executor.execute.return_value = QueryResult(rowcount=0)
+    milestoner.executor = executor
+    
+    result = milestoner.process_batch('TEST_STAGING', 'TEST_CONFORMED')
+    
+    assert result['records_processed'] == 0
+    executor.execute.assert_called_once()
+    executor.execute_script.assert_not_called()
+
+def test_unknown_pipeline_mode_is_rejected():
+    """Test that an unsupported pipeline mode raises an error."""
+    with pytest.raises(ValueError):
+        BitemporalMilestoner(['USER_ID'], 'EFFECTIVE_DATE', ['USER_ID'], pipeline_mode='bogus')
+
+def test_fused_batch_query_reads_batch_table_once(milestoner):
+    """Test that the fused block materializes the batch and merges from it."""
+    query = milestoner._get_fused_batch_query(
+        'TEST_STAGING', 'TEST_CONFORMED', 'batch-1', 500, datetime(2024, 2, 1)
+    )
+    assert query.strip().startswith('EXECUTE IMMEDIATE $$')
+    assert 'CREATE TEMPORARY TABLE STAGING.TEST_STAGING_BATCH_batch1 AS' in query
+    assert 'LIMIT 500' in query
+    assert 'FROM STAGING.TEST_STAGING_BATCH_batch1\n            WHERE DUPLICATE_RANK = 1' in query
+    assert query.count('MERGE INTO TEST_CONFORMED') == 1
+
+def test_process_fused_batch_reports_counts(mocker):
+    """Test that the fused pipeline runs one statement and reads its counts."""
+    executor = mocker.Mock()
+    executor.execute.return_value = QueryResult(
+        rowcount=1,
+        columns=['anonymous block'],
+        rows=[('{"records_processed": 4, "duplicates_found": 1, '
+               '"records_inserted": 2, "records_closed": 1}',)]
+    )
+    milestoner = BitemporalMilestoner(
+        business_keys=['USER_ID', 'EMAIL'],
+        temporal_column='EFFECTIVE_DATE',
+        data_columns=['USER_ID', 'EMAIL', 'FIRST_NAME', 'LAST_NAME', 'EFFECTIVE_DATE'],
+        executor=executor,
+        pipeline_mode=PIPELINE_FUSED
+    )
+    
+    result = milestoner.process_batch('TEST_STAGING', 'TEST_CONFORMED')
+    
+    executor.execute.assert_called_once()
+    assert list(result['queries']) == ['fused']
+    assert (result['records_processed'], result['duplicates_found']) == (4, 1)
+    assert (result['records_inserted'], result['records_closed']) == (2, 1)
+
+def _results_by_name(**named):
+    """Build an execute_script/execute_statements stub returning the given results of the named statements."""
+    def execute(statements):
+        if isinstance(statements, str):
+            statements = [(sql, None) for sql in split_statements(statements)]
+        return [named.get(result_name(sql), QueryResult()) for sql, _ in statements]
+    return execute
+
+def _batch_result(records_processed):
+    """Build a process_batch result with the given number of processed records."""
+    return {
+        'batch_id': 'batch',
+        'records_processed': records_processed,
+        'duplicates_found': 0,
+        'unchanged_found': 0,
+        'records_inserted': records_processed,
+        'records_closed': 0,
+        'queries': {}
+    }
+
+def test_drain_requires_executor(milestoner):
+    """Test that drain refuses to run without an executor."""
+    with pytest.raises(ValueError):
+        milestoner.drain('TEST_STAGING', 'TEST_CONFORMED')
+
+def test_drain_stops_when_staging_is_empty(milestoner, mocker):
+    """Test that drain keeps processing full batches and stops after a short one."""
+    milestoner.executor = mocker.Mock()
+    process = mocker.patch.object(
+        milestoner, 'process_batch', side_effect=[_batch_result(10), _batch_result(10), _batch_result(3)]
+    )
+    
+    totals = milestoner.drain('TEST_STAGING', 'TEST_CONFORMED', batch_size=10, handle_signals=False)
+    
+    assert process.call_count == 3
+    assert totals['batches'] == 3
+    assert totals['records_processed'] == 23
+    assert totals['stopped'] is False
+
+def test_drain_backs_off_while_idle(milestoner, mocker):
+    """Test that daemon mode doubles the poll interval while idle and resets it on work."""
+    milestoner.executor = mocker.Mock()
+    mocker.patch.object(
+        milestoner,
+        'process_batch',
+        side_effect=[_batch_result(0), _batch_result(0), _batch_result(0), _batch_result(2), _batch_result(0)]
+    )
+    waits = []
+    
+    def fake_wait(seconds):
+        waits.append(seconds)
+        if len(waits) == 5:
+            milestoner.stop()
+    
+    milestoner._stop_event.wait = fake_wait
+    
+    totals = milestoner.drain(
+        'TEST_STAGING', 'TEST_CONFORMED', batch_size=10, stop_when_empty=False,
+        poll_interval=1, max_poll_interval=3, handle_signals=False
+    )
+    
+    assert waits == [1, 2, 3, 1, 2]
+    assert totals['records_processed'] == 2
+    assert totals['stopped'] is True
+
+def test_process_batch_times_each_stage(milestoner, mocker):
+    """Test that process_batch records timings and row counts per stage."""
+    executor = mocker.Mock()
+    executor.execute.side_effect = [QueryResult(rowcount=3), QueryResult(rowcount=1)]
+    executor.execute_script.side_effect = _results_by_name(records_merged=QueryResult(rowcount=2))
+    milestoner.executor = executor
+    
+    result = milestoner.process_batch('TEST_STAGING', 'TEST_CONFORMED')
+    
+    assert set(result['stages']) == {'lock', 'dedupe', 'merge'}
+    assert result['stages']['lock']['rows'] == 3
+    assert result['stages']['dedupe']['rows'] == 1
+    assert all(stage['seconds'] >= 0 for stage in result['stages'].values())
+
+def test_drain_uses_adaptive_batch_size(milestoner, mocker):
+    """Test that drain asks the sizer for every batch size and reports back to it."""
+    milestoner.executor = mocker.Mock()
+    sizer = AdaptiveBatchSizer(initial_size=10, min_size=1, target_latency=1.0)
+    observe = mocker.patch.object(sizer, 'observe')
+    process = mocker.patch.object(milestoner, 'process_batch', side_effect=[_batch_result(10), _batch_result(4)])
+    
+    milestoner.drain('TEST_STAGING', 'TEST_CONFORMED', batch_size=sizer, handle_signals=False)
+    
+    assert [c.args[2] for c in process.call_args_list] == [10, 10]
+    assert observe.call_count == 2
+
+def test_lock_query_filters_partition(milestoner):
+    """Test that a partitioned lock only picks records hashing into the partition."""
+    query = milestoner._get_lock_batch_query('TEST_STAGING', 'batch-1', 100, partition=(2, 4))
+    assert "AND MOD(ABS(HASH(DATA:userId::STRING, DATA:email::STRING)), 4) = 2" in query
+    assert 'HASH' not in milestoner._get_lock_batch_query('TEST_STAGING', 'batch-1', 100)
+
+def test_invalid_partition_is_rejected(milestoner):
+    """Test that a partition index outside the partition count raises an error."""
+    with pytest.raises(ValueError):
+        milestoner.get_partition_predicate((4, 4))
+
+def test_run_partitioned_drains_every_partition(milestoner, mocker):
+    """Test that every worker drains its own partition and totals are summed."""
+    milestoner.executor = mocker.Mock()
+    process = mocker.patch.object(milestoner, 'process_batch', return_value=_batch_result(3))
+    
+    totals = milestoner.run_partitioned(
+        'TEST_STAGING', 'TEST_CONFORMED', workers=3, batch_size=10, handle_signals=False
+    )
+    
+    assert sorted(c.args[3] for c in process.call_args_list) == [(0, 3), (1, 3), (2, 3)]
+    assert totals['records_processed'] == 9
+    assert totals['batches'] == 3
+    assert len(totals['workers']) == 3
+
+@pytest.fixture
+def chaining_milestoner():
+    """Create a BitemporalMilestoner that chains versions within a batch."""
+    return BitemporalMilestoner(
+        business_keys=['USER_ID', 'EMAIL'],
+        temporal_column='EFFECTIVE_DATE',
+        data_columns=['USER_ID', 'EMAIL', 'FIRST_NAME', 'LAST_NAME', 'EFFECTIVE_DATE'],
+        version_chaining=True
+    )
+
+def test_chain_setup_orders_versions_per_key(chaining_milestoner):
+    """Test that the chain is built per key in temporal order with LAG and LEAD."""
+    query = chaining_milestoner._get_chain_setup_query('TEST_CONFORMED', 'SELECT 1', 'STAGING.CHAIN')
+    assert 'LAG(ROW_CHECKSUM) OVER (' in query
+    assert 'LEAD(EFFECTIVE_DATE) OVER (' in query
+    assert query.count('PARTITION BY USER_ID, EMAIL\n') == 2
+    assert query.count('ORDER BY EFFECTIVE_DATE, ROW_ADDED_DATETIME') == 2
+
+def test_chained_merge_query_replaces_merge(chaining_milestoner):
+    """Test that version chaining closes and inserts instead of using MERGE."""
+    query = chaining_milestoner._get_merge_query(
+        'TEST_STAGING', 'TEST_CONFORMED', 'batch-1', datetime(2024, 2, 1)
+    )
+    assert 'MERGE INTO' not in query
+    assert query.index('CREATE TEMPORARY TABLE') < query.index('BEGIN;')
+    assert query.index('UPDATE TEST_CONFORMED t') < query.index('INSERT INTO TEST_CONFORMED')
+    assert 'IFF(NEXT_VALID_FROM IS NULL, NULL' in query
+
+def _chained_merge_counts(milestoner):
+    """Return the counts read from a merge script whose close affected 2 rows and insert 5."""
+    query = milestoner._get_merge_query('TEST_STAGING', 'TEST_CONFORMED', 'b', datetime(2024, 2, 1))
+    results = _results_by_name(records_closed=QueryResult(rowcount=2), records_inserted=QueryResult(rowcount=5))
+    return milestoner._get_merge_counts(query, results(query))
+
+def test_chained_merge_counts(chaining_milestoner):
+    """Test that inserted and closed counts come from the insert and close statements."""
+    assert _chained_merge_counts(chaining_milestoner) == (5, 2)
+
+def test_fused_chaining_creates_tables_outside_transaction(chaining_milestoner):
+    """Test that the fused block creates its temporary tables before the transaction."""
+    chaining_milestoner.pipeline_mode = PIPELINE_FUSED
+    query = chaining_milestoner._get_fused_batch_query(
+        'TEST_STAGING', 'TEST_CONFORMED', 'batch-1', 500, datetime(2024, 2, 1)
+    )
+    assert query.rindex('CREATE TEMPORARY TABLE') < query.index('BEGIN TRANSACTION')
+    assert 'records_closed := SQLROWCOUNT' in query
+    assert 'records_inserted := SQLROWCOUNT' in query
+
+@pytest.fixture
+def splitting_milestoner():
+    """Create a BitemporalMilestoner that splits history for late-arriving records."""
+    return BitemporalMilestoner(
+        business_keys=['USER_ID', 'EMAIL'],
+        temporal_column='EFFECTIVE_DATE',
+        data_columns=['USER_ID', 'EMAIL', 'FIRST_NAME', 'LAST_NAME', 'EFFECTIVE_DATE'],
+        split_history=True
+    )
+
+def test_split_history_implies_chaining(splitting_milestoner):
+    """Test that history splitting builds on version chaining and rejects skip_unchanged."""
+    assert splitting_milestoner.version_chaining
+    with pytest.raises(ValueError):
+        BitemporalMilestoner(
+            business_keys=['USER_ID'],
+            temporal_column='EFFECTIVE_DATE',
+            data_columns=['USER_ID', 'EFFECTIVE_DATE'],
+            split_history=True,
+            skip_unchanged=True
+        )
+
+def test_timeline_includes_existing_versions_of_affected_keys(splitting_milestoner):
+    """Test that the timeline merges incoming records with all versions of their keys."""
+    query = splitting_milestoner._get_chain_setup_query('TEST_CONFORMED', 'SELECT 1', 'STAGING.CHAIN')
+    assert 'JOIN (SELECT DISTINCT USER_ID, EMAIL FROM incoming) affected' in query
+    assert 'c.VALID_FROM AS EFFECTIVE_DATE' in query
+    assert 'WHERE (c.VALID_TO IS NULL OR c.VALID_TO > c.VALID_FROM)' in query
+    assert 'PARTITION BY v.USER_ID, v.EMAIL, v.VALID_FROM\n                    ORDER BY v.SYSTEM_FROM DESC' in query
+    assert query.count('ORDER BY EFFECTIVE_DATE, IS_NEW_VERSION, TIMELINE_SEQUENCE') == 2
+    assert 'WHERE NOT IS_NEW_VERSION\n            OR ROW_CHECKSUM IS DISTINCT FROM PREVIOUS_CHECKSUM' in query
+
+def test_split_history_recloses_existing_and_inserts_new_versions(splitting_milestoner):
+    """Test that open versions are re-closed in place, closed ones by a corrected copy, and incoming versions inserted."""
+    query = splitting_milestoner._get_merge_query(
+        'TEST_STAGING', 'TEST_CONFORMED', 'batch-1', datetime(2024, 2, 1)
+    )
+    assert 'MERGE INTO TEST_CONFORMED t' in query
+    assert 'AND t.VALID_TO IS NULL' in query
+    assert 'VALID_TO = s.NEXT_VALID_FROM,' in query
+    assert 'WHERE NOT IS_NEW_VERSION' in query
+    assert 'NEXT_VALID_FROM IS DISTINCT FROM PREVIOUS_VALID_TO' in query
+    assert 'WHEN NOT MATCHED AND s.PREVIOUS_VALID_TO IS NOT NULL THEN' in query
+    assert "s.EFFECTIVE_DATE, s.NEXT_VALID_FROM, '2024-02-01 00:00:00', '2024-02-01 00:00:00'" in query
+    assert 'FROM (SELECT * FROM STAGING.MILESTONE_CHAIN_batch1 WHERE IS_NEW_VERSION)' in query
+    assert _chained_merge_counts(splitting_milestoner) == (5, 2)
+
+def test_fused_split_history_uses_timeline(splitting_milestoner):
+    """Test that the fused block builds the timeline and re-closes existing versions."""
+    splitting_milestoner.pipeline_mode = PIPELINE_FUSED
+    query = splitting_milestoner._get_fused_batch_query(
+        'TEST_STAGING', 'TEST_CONFORMED', 'batch-1', 500, datetime(2024, 2, 1)
+    )
+    assert 'affected' in query
+    assert 'records_closed := SQLROWCOUNT' in query
+    assert 'WHERE IS_NEW_VERSION' in query
+
+def test_unchanged_detection_flags_records_matching_open_version(milestoner):
+    """Test that records with the open version's checksum are flagged as unchanged."""
+    query = milestoner._get_unchanged_detection_query('TEST_STAGING', 'TEST_CONFORMED', 'batch-1')
+    assert "SET MILESTONING_FLAG = 'UNCHANGED'" in query
+    assert 'c.ROW_CHECKSUM = b.ROW_CHECKSUM' in query
+    assert 'c.VALID_TO IS NULL' in query
+    assert 'KEY_RANK = 1' not in query
+
+def test_unchanged_detection_with_chaining_checks_first_version_only(chaining_milestoner):
+    """Test that chaining only compares the first record of each key with the open version."""
+    query = chaining_milestoner._get_unchanged_detection_query('TEST_STAGING', 'TEST_CONFORMED', 'batch-1')
+    assert 'WHERE b.KEY_RANK = 1' in query
+
+def test_process_batch_skips_unchanged_records(mocker):
+    """Test that skip_unchanged runs the pre-filter between dedupe and merge."""
+    executor = mocker.Mock()
+    executor.execute.side_effect = [QueryResult(rowcount=5), QueryResult(rowcount=1), QueryResult(rowcount=3)]
+    executor.execute_script.side_effect = _results_by_name()
+    milestoner = BitemporalMilestoner(
+        business_keys=['USER_ID', 'EMAIL'],
+        temporal_column='EFFECTIVE_DATE',
+        data_columns=['USER_ID', 'EMAIL', 'FIRST_NAME', 'LAST_NAME', 'EFFECTIVE_DATE'],
+        executor=executor,
+        skip_unchanged=True
+    )
+    
+    result = milestoner.process_batch('TEST_STAGING', 'TEST_CONFORMED')
+    
+    assert list(result['queries']) == ['lock', 'duplicates', 'unchanged', 'merge']
+    assert result['unchanged_found'] == 3
+    assert 'unchanged' in result['stages']
+
+def test_fused_batch_drops_unchanged_records(milestoner):
+    """Test that the fused block removes unchanged records from the batch table."""
+    milestoner.skip_unchanged = True
+    query = milestoner._get_fused_batch_query(
+        'TEST_STAGING', 'TEST_CONFORMED', 'batch-1', 500, datetime(2024, 2, 1)
+    )
+    assert 'DELETE FROM STAGING.TEST_STAGING_BATCH_batch1' in query
+    assert 'unchanged_found := SQLROWCOUNT' in query
+
+@pytest.fixture
+def current_table_milestoner():
+    """Create a BitemporalMilestoner that maintains a current-state table."""
+    return BitemporalMilestoner(
+        business_keys=['USER_ID', 'EMAIL'],
+        temporal_column='EFFECTIVE_DATE',
+        data_columns=['USER_ID', 'EMAIL', 'FIRST_NAME', 'LAST_NAME', 'EFFECTIVE_DATE'],
+        current_table_suffix='_CURRENT'
+    )
+
+def test_current_table_implies_version_chaining(current_table_milestoner):
+    """Test that maintaining a current-state table applies batches as chains."""
+    assert current_table_milestoner.version_chaining is True
+
+def test_current_table_is_used_for_change_detection(current_table_milestoner):
+    """Test that open versions are read from the current-state table."""
+    query = current_table_milestoner._get_chain_setup_query('TEST_CONFORMED', 'SELECT 1', 'STAGING.CHAIN')
+    assert 'LEFT JOIN TEST_CONFORMED_CURRENT c' in query
+    unchanged = current_table_milestoner._get_unchanged_detection_query('TEST_STAGING', 'TEST_CONFORMED', 'b')
+    assert 'JOIN TEST_CONFORMED_CURRENT c' in unchanged
+
+def test_current_table_closes_history_by_staging_guid(current_table_milestoner):
+    """Test that history rows are closed through the current-state table's pointer."""
+    query = current_table_milestoner._get_chain_close_query('TEST_CONFORMED', 'STAGING.CHAIN', 'batch-1', datetime(2024, 2, 1))
+    assert 'FROM TEST_CONFORMED_CURRENT cur' in query
+    assert 'AND t.STAGING_GUID = f.STAGING_GUID' in query
+
+def test_current_table_is_upserted_in_merge_transaction(current_table_milestoner):
+    """Test that the current-state table is updated inside the merge transaction."""
+    query = current_table_milestoner._get_merge_query(
+        'TEST_STAGING', 'TEST_CONFORMED', 'batch-1', datetime(2024, 2, 1)
+    )
+    assert query.index('BEGIN;') < query.index('MERGE INTO TEST_CONFORMED_CURRENT t') < query.index('COMMIT;')
+    assert 'WHERE NEXT_VALID_FROM IS NULL' in query
+
+def test_create_current_table(current_table_milestoner):
+    """Test generation of the current-state table DDL and seed statement."""
+    create, seed = current_table_milestoner.create_current_table('TEST_CONFORMED')
+    assert create == 'CREATE TABLE IF NOT EXISTS TEST_CONFORMED_CURRENT LIKE TEST_CONFORMED'
+    assert 'WHERE VALID_TO IS NULL' in seed
+
+def test_create_current_table_requires_suffix(milestoner):
+    """Test that creating a current-state table without a suffix raises an error."""
+    with pytest.raises(ValueError):
+        milestoner.create_current_table('TEST_CONFORMED')
+
+def test_pruned_merge_pushes_predicates_into_on_clause(milestoner):
+    """Test that pruning adds the open-version and key range predicates to the MERGE."""
+    milestoner.prune_merge = True
+    query = milestoner._get_merge_query('TEST_STAGING', 'TEST_CONFORMED', 'batch-1', datetime(2024, 2, 1))
+    assert 'SET (MILESTONE_KEY_MIN, MILESTONE_KEY_MAX) = (' in query
+    assert query.index('SET (MILESTONE_KEY_MIN') < query.index('BEGIN;')
+    assert (
+        'AND t.VALID_TO IS NULL AND t.USER_ID BETWEEN $MILESTONE_KEY_MIN AND $MILESTONE_KEY_MAX\n'
+        '        WHEN MATCHED'
+    ) in query
+
+def test_pruned_chained_merge_counts_skip_key_range_statement(chaining_milestoner):
+    """Test that chained counts are not shifted by the key range statement."""
+    chaining_milestoner.prune_merge = True
+    query = chaining_milestoner._get_merge_query('TEST_STAGING', 'TEST_CONFORMED', 'b', datetime(2024, 2, 1))
+    assert query.count('BETWEEN $MILESTONE_KEY_MIN AND $MILESTONE_KEY_MAX') == 2
+    assert _chained_merge_counts(chaining_milestoner) == (5, 2)
+
+def test_pruned_current_table_statements_use_key_range(current_table_milestoner):
+    """Test that the close and upsert through the current-state table only touch the batch's key range."""
+    current_table_milestoner.prune_merge = True
+    query = current_table_milestoner._get_merge_query('TEST_STAGING', 'TEST_CONFORMED', 'b', datetime(2024, 2, 1))
+    
+    assert 'AND cur.USER_ID BETWEEN $MILESTONE_KEY_MIN AND $MILESTONE_KEY_MAX' in query
+    assert 'AND t.VALID_TO IS NULL AND t.USER_ID BETWEEN $MILESTONE_KEY_MIN AND $MILESTONE_KEY_MAX' in query
+    upsert = query[query.index('MERGE INTO TEST_CONFORMED_CURRENT t'):]
+    assert 'AND t.USER_ID BETWEEN $MILESTONE_KEY_MIN AND $MILESTONE_KEY_MAX' in upsert
+
+def test_pruned_fused_batch_uses_block_variables(milestoner):
+    """Test that the fused block keeps the key range in scripting variables."""
+    milestoner.prune_merge = True
+    query = milestoner._get_fused_batch_query('TEST_STAGING', 'TEST_CONFORMED', 'b', 10, datetime(2024, 2, 1))
+    assert 'INTO :key_min, :key_max' in query
+    assert 'BETWEEN :key_min AND :key_max' in query
+
+def test_get_data_fields_select_uses_column_types():
+    """Test that configured column types produce native typed extracts."""
+    milestoner = BitemporalMilestoner(
+        business_keys=['USER_ID'],
+        temporal_column='EFFECTIVE_DATE',
+        data_columns=['USER_ID', 'EFFECTIVE_DATE'],
+        column_types={'EFFECTIVE_DATE': 'DATE'}
+    )
+    assert milestoner._get_data_fields_select() == (
+        "DATA:userId::STRING as USER_ID, "
+        "DATA:effectiveDate::DATE as EFFECTIVE_DATE"
+    )
+
+def test_load_column_types_from_metadata(milestoner, mocker):
+    """Test that column types are inferred from INFORMATION_SCHEMA."""
+    executor = mocker.Mock()
+    executor.execute.return_value = QueryResult(rows=[
+        ('USER_ID', 'NUMBER', 38, 0),
+        ('EMAIL', 'TEXT', None, None),
+        ('EFFECTIVE_DATE', 'DATE', None, None),
+        ('VALID_FROM', 'DATE', None, None)
+    ])
+    milestoner.executor = executor
+    
+    types = milestoner.load_column_types('CONFORMED.TEST_CONFORMED')
+    
+    assert types == {'USER_ID': 'NUMBER(38, 0)', 'EMAIL': 'STRING', 'EFFECTIVE_DATE': 'DATE'}
+    assert executor.execute.call_args.args[1] == ['TEST_CONFORMED', 'CONFORMED']
+    assert 'DATA:effectiveDate::DATE as EFFECTIVE_DATE' in milestoner._get_data_fields_select()
+
+def test_load_column_types_requires_executor(milestoner):
+    """Test that inferring types without an executor raises an error."""
+    with pytest.raises(ValueError):
+        milestoner.load_column_types('TEST_CONFORMED')
+
+def test_materialized_batch_is_parsed_once(milestoner):
+    """Test that the merge reads parsed fields from a temporary table."""
+    milestoner.materialize_batch = True
+    query = milestoner._get_merge_query('TEST_STAGING', 'TEST_CONFORMED', 'batch-1', datetime(2024, 2, 1))
+    assert query.count('DATA:userId') == 1
+    assert query.index('CREATE TEMPORARY TABLE STAGING.MILESTONE_PARSED_batch1') < query.index('BEGIN;')
+    assert 'SELECT * FROM STAGING.MILESTONE_PARSED_batch1' in query
+    assert query.rstrip().endswith('DROP TABLE IF EXISTS STAGING.MILESTONE_PARSED_batch1;')
+
+def test_materialized_chained_merge_counts(chaining_milestoner):
+    """Test that chained counts are not shifted by the materialization statement."""
+    chaining_milestoner.materialize_batch = True
+    assert _chained_merge_counts(chaining_milestoner) == (5, 2)
+
+def test_process_batch_updates_seen_filter(milestoner, mocker):
+    """Test that the checksums of a merged batch are added to the seen-checksum filter."""
+    executor = mocker.Mock()
+    executor.execute.side_effect = [
+        QueryResult(rowcount=2),
+        QueryResult(rowcount=0),
+        QueryResult(rowcount=2, columns=['ROW_CHECKSUM'], rows=[('abc123',), ('def456',)])
+    ]
+    executor.execute_script.side_effect = _results_by_name()
+    milestoner.executor = executor
+    milestoner.seen_filter = SeenChecksumFilter(capacity=100)
+    
+    result = milestoner.process_batch('TEST_STAGING', 'TEST_CONFORMED')
+    
+    assert f"BATCH_ID = '{result['batch_id']}'" in result['queries']['seen']
+    assert result['stages']['seen']['rows'] == 2
+    assert milestoner.seen_filter.contains(['abc123', 'def456', 'ghi789']).tolist() == [True, True, False]
+
+def test_process_batch_reports_queue_stats_and_metrics(milestoner, mocker):
+    """Test that queue statistics, query IDs and metrics are reported per batch."""
+    executor = mocker.Mock()
+    executor.execute.side_effect = [
+        QueryResult(rowcount=3, query_id='lock-id'),
+        QueryResult(rowcount=0, query_id='dedupe-id'),
+        QueryResult(rowcount=1, columns=['QUEUE_DEPTH', 'OLDEST_PENDING_SECONDS'], rows=[(42, 1.25)])
+    ]
+    executor.execute_script.side_effect = _results_by_name(records_merged=QueryResult(query_id='m1'))
+    milestoner.executor = executor
+    milestoner.collect_queue_stats = True
+    milestoner.metrics = mocker.Mock()
+    
+    result = milestoner.process_batch('TEST_STAGING', 'TEST_CONFORMED')
+    
+    assert result['queue_depth'] == 42
+    assert result['oldest_pending_seconds'] == 1.25
+    assert result['stages']['lock']['query_ids'] == ['lock-id']
+    assert result['stages']['merge']['query_ids'] == ['m1']
+    milestoner.metrics.observe.assert_called_once_with('TEST_STAGING', result)
+
+def test_failed_stage_is_audited_with_full_text(milestoner, mocker):
+    """Test that a failing statement is recorded with its text before the error propagates."""
+    executor = mocker.Mock()
+    executor.execute.side_effect = RuntimeError('warehouse unavailable')
+    milestoner.executor = executor
+    milestoner.audit_log = mocker.Mock()
+    
+    with pytest.raises(RuntimeError):
+        milestoner.process_batch('TEST_STAGING', 'TEST_CONFORMED')
+    
+    stage, query, _ = milestoner.audit_log.record.call_args.args
+    assert stage == 'lock'
+    assert 'UPDATE STAGING.TEST_STAGING' in query
+    assert isinstance(milestoner.audit_log.record.call_args.kwargs['error'], RuntimeError)
+
+def test_batch_queries_are_generated_once(milestoner, mocker):
+    """Test that later batches reuse the cached templates and match the generators."""
+    generate = mocker.spy(milestoner, '_get_merge_query')
+    first = milestoner.process_batch('TEST_STAGING', 'TEST_CONFORMED')
+    second = milestoner.process_batch('TEST_STAGING', 'TEST_CONFORMED')
+    
+    assert generate.call_count == 1
+    assert first['queries']['lock'] != second['queries']['lock']
+    assert f"LOCKED = '{second['batch_id']}'" in second['queries']['lock']
+    expected = milestoner._get_duplicate_detection_query('TEST_STAGING', second['batch_id'])
+    assert second['queries']['duplicates'] == expected
+    
+    milestoner.skip_unchanged = True
+    assert 'unchanged' in milestoner.process_batch('TEST_STAGING', 'TEST_CONFORMED')['queries']
+
+def test_prepared_statements_bind_batch_values(milestoner, mocker):
+    """Test that prepared batches send fixed statement text with bind parameters."""
+    executor = mocker.Mock()
+    executor.execute.side_effect = [QueryResult(rowcount=2), QueryResult(rowcount=0)]
+    executor.execute_statements.side_effect = _results_by_name()
+    milestoner.executor = executor
+    milestoner.prepared_statements = True
+    
+    result = milestoner.process_batch('TEST_STAGING', 'TEST_CONFORMED', batch_size=10)
+    
+    lock_sql, lock_params = executor.execute.call_args_list[0].args
+    assert "SET LOCKED = ?" in lock_sql
+    assert 'LIMIT 10' in lock_sql
+    assert lock_params == [result['batch_id']]
+    merge_statements = executor.execute_statements.call_args.args[0]
+    assert all(result['batch_id'] not in sql for sql, _ in merge_statements)
+    assert any(result['batch_id'] in params for _, params in merge_statements)
+    executor.execute_script.assert_not_called()
+
+def test_queue_stats_are_throttled_per_staging_table(milestoner):
+    """Test that statistics are collected at most once per interval and staging table."""
+    milestoner.collect_queue_stats = True
+    
+    assert milestoner._queue_stats_due('TEST_STAGING')
+    assert not milestoner._queue_stats_due('TEST_STAGING')
+    assert milestoner._queue_stats_due('OTHER_STAGING')
+    milestoner.queue_stats_interval = 0
+    assert milestoner._queue_stats_due('TEST_STAGING')
+
+def test_queue_stats_read_the_queue_table(milestoner):
+    """Test that the statistics query reads the queue table instead of staging with a pending queue."""
+    milestoner.pending_queue = PendingQueue(milestoner, QUEUE_STREAM)
+    query = milestoner._get_queue_stats_query('TEST_STAGING', '2024-01-01 00:00:00')
+    
+    assert 'FROM STAGING.TEST_STAGING_QUEUE\n' in query
+    assert 'PROCESSED_DATETIME' not in query
+
+def test_pending_queue_lock_claims_from_queue_table(milestoner):
+    """Test that locking queues new rows and claims from the queue instead of scanning staging."""
+    milestoner.pending_queue = PendingQueue(milestoner, QUEUE_STREAM)
+    query = milestoner._get_lock_batch_query('TEST_STAGING', 'batch-1', 50, (1, 4))
+    
+    assert 'FROM STAGING.TEST_STAGING_STREAM' in query
+    assert 'MOD(ABS(KEY_HASH), 4) = 1' in query
+    assert 'PROCESSED_DATETIME IS NULL\n            AND LOCKED IS NULL' not in query
+    assert "SELECT STAGING_GUID FROM STAGING.TEST_STAGING_QUEUE WHERE LOCKED = 'batch-1'" in query
+    mark = milestoner.get_mark_processed_query('TEST_STAGING', 'batch-1', datetime(2024, 1, 1))
+    assert "DELETE FROM STAGING.TEST_STAGING_QUEUE\n        WHERE LOCKED = 'batch-1'" in mark
+
+def test_watermark_queue_advances_high_water_mark(milestoner):
+    """Test that the watermark source queues rows past the mark and advances it."""
+    milestoner.pending_queue = PendingQueue(milestoner, QUEUE_WATERMARK)
+    query = milestoner.pending_queue.get_enqueue_query('TEST_STAGING')
+    
+    assert "'millisecond', -300000, (SELECT HIGH_WATER_MARK FROM STAGING.TEST_STAGING_QUEUE_MARK)" in query
+    assert 'UPDATE STAGING.TEST_STAGING_QUEUE_MARK' in query
+    assert len(milestoner.create_pending_queue('TEST_STAGING')) == 3
+
+def test_process_batch_counts_records_locked_through_queue(milestoner, mocker):
+    """Test that the staging lock of the lock script reports the locked records."""
+    executor = mocker.Mock()
+    executor.execute_script.side_effect = _results_by_name(records_processed=QueryResult(rowcount=3))
+    executor.execute.return_value = QueryResult(rowcount=0)
+    milestoner.executor = executor
+    milestoner.pending_queue = PendingQueue(milestoner, QUEUE_STREAM)
+    
+    result = milestoner.process_batch('TEST_STAGING', 'TEST_CONFORMED')
+    
+    assert result['records_processed'] == 3
+    assert 'DELETE FROM STAGING.TEST_STAGING_QUEUE' in result['queries']['merge']
+
+def test_lease_reclaim_runs_before_lock(milestoner, mocker):
+    """Test that expired leases are released before locking and the lease is dropped when idle."""
+    executor = mocker.Mock()
+    executor.execute_script.side_effect = _results_by_name(records_reclaimed=QueryResult(rowcount=7))
+    executor.execute.return_value = QueryResult(rowcount=1)
+    milestoner.executor = executor
+    milestoner.leases = BatchLeases(milestoner, 60)
+    
+    result = milestoner.process_batch('TEST_STAGING', 'TEST_CONFORMED')
+    
+    reclaim, lock = [c.args[0] for c in executor.execute_script.call_args_list]
+    assert 'WHERE LOCKED IN (SELECT BATCH_ID FROM STAGING.TEST_STAGING_LEASES WHERE HEARTBEAT_DATETIME IS NULL)' in reclaim
+    assert reclaim.index('SET HEARTBEAT_DATETIME = NULL') < reclaim.index('UPDATE STAGING.TEST_STAGING\n')
+    assert "'millisecond', -60000" in reclaim
+    assert lock.index('INSERT INTO STAGING.TEST_STAGING_LEASES') < lock.index('UPDATE STAGING.TEST_STAGING')
+    assert result['records_reclaimed'] == 7
+    assert list(result['stages']) == ['reclaim', 'lock', 'release']
+    assert f"WHERE BATCH_ID = '{result['batch_id']}'" in executor.execute.call_args.args[0]
+
+def test_lease_is_renewed_while_running_and_fences_the_merge(milestoner, mocker):
+    """Test that a running batch heartbeats its lease and drops it first in the merge transaction."""
+    milestoner.executor = mocker.Mock()
+    milestoner.leases = BatchLeases(milestoner, 60, heartbeat_interval=0.01)
+    
+    with milestoner._lease_heartbeat('TEST_STAGING', 'batch-1'):
+        time.sleep(0.05)
+    
+    sql, params = milestoner.executor.execute.call_args.args
+    assert 'SET HEARTBEAT_DATETIME = ?' in sql
+    assert params[1] == 'batch-1'
+    merge = milestoner._get_merge_query('TEST_STAGING', 'TEST_CONFORMED', 'batch-1', datetime(2024, 1, 1))
+    begin = merge.index('BEGIN;')
+    assert merge.index('-- Fence:') > begin
+    assert merge.index("DELETE FROM STAGING.TEST_STAGING_LEASES\n        WHERE BATCH_ID = 'batch-1'") < merge.index('MERGE INTO')
+
+def test_failed_heartbeat_stops_the_batch(milestoner, mocker):
+    """Test that a batch whose heartbeat fails stops before merging."""
+    executor = mocker.Mock()
+    executor.execute.side_effect = [
+        QueryResult(rowcount=3),
+        QueryResult(rowcount=0)
+    ]
+    executor.execute_script.side_effect = _results_by_name(records_processed=QueryResult(rowcount=3))
+    milestoner.executor = executor
+    milestoner.leases = BatchLeases(milestoner, 60, heartbeat_interval=0.01)
+    milestoner.skip_unchanged = True
+    original = milestoner._run_stage
+
+    def slow_stage(result, stage, *args, **kwargs):
+        if stage == 'unchanged':
+            executor.execute.side_effect = RuntimeError('connection lost')
+            time.sleep(0.05)
+            return QueryResult(rowcount=0)
+        return original(result, stage, *args, **kwargs)
+
+    mocker.patch.object(milestoner, '_run_stage', side_effect=slow_stage)
+    
+    with pytest.raises(RuntimeError, match='lease could not be renewed'):
+        milestoner.process_batch('TEST_STAGING', 'TEST_CONFORMED')
+    assert 'merge' not in [c.args[1] for c in milestoner._run_stage.call_args_list]